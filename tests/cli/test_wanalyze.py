@@ -0,0 +1,48 @@
+"""Test the `wanalyze` packet analysis stage.
+"""
+from argparse import Namespace
+from time import perf_counter, sleep
+
+from whad.common.analyzer import TrafficAnalyzer
+from whad.common.pipeline import PipelineStage
+from whad.tools.wanalyze import WhadAnalyzeApp
+
+
+class SlowAnalyzer(TrafficAnalyzer):
+    """Analyzer completing after 10 packets, taking 5ms per packet.
+    """
+
+    def reset(self):
+        super().reset()
+        self.count = 0
+
+    def process_packet(self, packet):
+        sleep(0.005)
+        self.count += 1
+        self.trigger()
+        if self.count == 10:
+            self.complete()
+
+    @property
+    def output(self):
+        return {"count": self.count}
+
+
+def test_slow_analyzer(capsys, monkeypatch):
+    """Packets are received without waiting for analyzers.
+    """
+    args = Namespace(trigger=False, json=True, packets=False, label=False, raw=False,
+                     delimiter="\n")
+    monkeypatch.setattr(WhadAnalyzeApp, "args", property(lambda self: args))
+    app = WhadAnalyzeApp()
+    app.selected_analyzers = {"slow": SlowAnalyzer()}
+    app.selected_analyzers["slow"]._displayed = False
+    app.analysis_stage = PipelineStage(app.analyze_packet)
+
+    start = perf_counter()
+    for i in range(50):
+        assert app.on_packet(i) is None
+    assert perf_counter() - start < 0.1
+
+    assert app.analysis_stage.join(timeout=5.0)
+    assert capsys.readouterr().out.splitlines() == ['{"count": 10}'] * 5
@@ -0,0 +1,112 @@
+"""PCAP reader and index tests.
+"""
+import os
+import shutil
+
+import pytest
+from scapy.utils import rdpcap
+from scapy.layers.bluetooth4LE import BTLE
+from scapy.layers.dot15d4 import Dot15d4
+
+from whad.common.pcap import PCAPReader, PcapIndex, PcapRecordReader, \
+    extract_pcap_metadata, patch_pcap_metadata
+
+PCAPS = os.path.join(os.path.dirname(__file__), "..", "..", "whad", "resources", "pcaps")
+
+@pytest.fixture
+def capture(tmp_path):
+    """Copy a capture file into a temporary directory.
+    """
+    def copy(name: str) -> str:
+        path = str(tmp_path / name)
+        shutil.copy(os.path.join(PCAPS, name), path)
+        return path
+    return copy
+
+def test_metadata(capture):
+    path = capture("ble_pairing.pcap")
+    patch_pcap_metadata(path, "ble")
+    assert extract_pcap_metadata(path) == "ble"
+
+def test_index_entries(capture):
+    """Index entries match capture records, keyed by access address.
+    """
+    path = capture("ble_pairing.pcap")
+    index = PcapIndex.open(path)
+    with PcapRecordReader(path) as reader:
+        records = list(reader.records())
+    packets = rdpcap(path)
+
+    assert len(index) == len(records) == len(packets)
+    for i, record in enumerate(records):
+        assert index[i] == (record.offset, record.timestamp, len(record.data),
+                            packets[i][BTLE].access_addr)
+    index.close()
+
+def test_index_pan_id_key(capture):
+    """802.15.4 records are keyed by PAN ID.
+    """
+    path = capture("zigbee_philips_hue_association.pcap")
+    index = PcapIndex.open(path)
+    for i, packet in enumerate(rdpcap(path)):
+        frame = packet[Dot15d4]
+        if frame.fcf_destaddrmode != 0:
+            assert index[i][3] == frame.dest_panid
+    index.close()
+
+def test_index_cache(capture, monkeypatch):
+    """Index is saved next to the capture file, and rebuilt once outdated.
+    """
+    path = capture("ble_pairing.pcap")
+    PcapIndex.open(path).close()
+    assert os.path.exists(PcapIndex.get_index_path(path))
+
+    # Cached index is used
+    def fail(reader):
+        raise AssertionError("index rebuilt")
+    with monkeypatch.context() as patch:
+        patch.setattr(PcapIndex, "build", classmethod(lambda cls, reader: fail(reader)))
+        PcapIndex.open(path).close()
+
+    # Capture file has been modified, index is rebuilt
+    with open(path, "rb") as capture_file:
+        header = capture_file.read(24)
+    with open(path, "wb") as capture_file:
+        capture_file.write(header)
+    assert len(PcapIndex.open(path)) == 0
+
+def test_index_find_timestamp(capture):
+    path = capture("ble_pairing.pcap")
+    index = PcapIndex.open(path, cache=False)
+    assert not os.path.exists(PcapIndex.get_index_path(path))
+
+    for position in (0, 1, 100, len(index) - 1):
+        assert index.find_timestamp(index.timestamp(position)) <= position
+        assert index.timestamp(index.find_timestamp(index.timestamp(position))) == \
+            index.timestamp(position)
+    assert index.find_timestamp(index.timestamp(len(index) - 1) + 1) == len(index)
+    index.close()
+
+def test_reader_packets(capture):
+    """Packets are read from any position, without loading the whole capture.
+    """
+    path = capture("zigbee_philips_hue_association.pcap")
+    packets = rdpcap(path)
+    reader = PCAPReader(path)
+
+    assert len(reader) == len(packets)
+    selected = list(reader.packets(start=10, count=5, accurate=False))
+    assert [bytes(p) for p in selected] == [bytes(p) for p in packets[10:15]]
+    assert [p.time for p in selected] == [p.time for p in packets[10:15]]
+
+    # Exclusion positions are relative to the start position
+    selected = list(reader.packets(start=10, count=5, accurate=False, exclude=[2]))
+    assert [bytes(p) for p in selected] == [bytes(p) for p in packets[10:11] + packets[12:15]]
+
+    # Seek by timestamp
+    offset = float(packets[20].time - packets[0].time)
+    position = reader.find(offset)
+    assert position <= 20 and packets[position].time == packets[20].time
+    selected = next(reader.packets(start_time=offset, accurate=False))
+    assert bytes(selected) == bytes(packets[position])
+    reader.close()
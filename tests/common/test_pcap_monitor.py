@@ -0,0 +1,99 @@
+"""PCAP writer monitor tests.
+"""
+import os
+from types import SimpleNamespace
+
+from scapy.utils import rdpcap
+from scapy.layers.bluetooth4LE import BTLE, BTLE_RF, BTLE_ADV
+
+from whad.common.monitors import PcapWriterMonitor
+from whad.common.pcap import extract_pcap_metadata, patch_pcap_metadata
+
+def make_monitor(path, **kwargs):
+    monitor = PcapWriterMonitor(path, **kwargs)
+    monitor._connector = SimpleNamespace(domain="ble")
+    return monitor
+
+def make_packets(count):
+    return [BTLE_RF(rf_channel=37)/BTLE(access_addr=0x8e89bed6)/BTLE_ADV(TxAdd=i & 1)
+            for i in range(count)]
+
+def test_monitor_writes_domain(tmp_path):
+    """Packets are written by the writer thread, with the domain in the header.
+    """
+    path = str(tmp_path / "capture.pcap")
+    monitor = make_monitor(path, queue_size=16)
+    monitor.start()
+    packets = make_packets(500)
+    for packet in packets:
+        monitor.process_packet(packet)
+    monitor.close()
+
+    assert monitor.packets_written == 500
+    assert extract_pcap_metadata(path) == "ble"
+    assert [bytes(p) for p in rdpcap(path)] == [bytes(p) for p in packets]
+
+def test_monitor_periodic_flush(tmp_path):
+    """Written packets reach the file without closing the monitor.
+    """
+    path = str(tmp_path / "capture.pcap")
+    monitor = make_monitor(path, flush_interval=0.01)
+    monitor.start()
+    monitor.process_packet(make_packets(1)[0])
+    for _ in range(100):
+        if os.path.getsize(path) > 24:
+            break
+        monitor._writer_thread.join(0.01)
+    assert os.path.getsize(path) > 24
+    monitor.close()
+
+def test_monitor_packets_after_sentinel(tmp_path):
+    """Packets queued after the stop sentinel are dropped by the writer thread.
+    """
+    path = str(tmp_path / "capture.pcap")
+    monitor = make_monitor(path)
+    packets = make_packets(3)
+    for packet in (packets[0], packets[1], None, packets[2]):
+        monitor._queue.put(packet)
+    monitor.start()
+    monitor._writer_thread.join(2.0)
+    assert not monitor._writer_thread.is_alive()
+    monitor.close()
+
+    assert monitor.packets_written == 2
+    assert [bytes(p) for p in rdpcap(path)] == [bytes(p) for p in packets[:2]]
+
+def test_monitor_append(tmp_path):
+    """Packets are appended to an existing capture, header is patched in place.
+    """
+    path = str(tmp_path / "capture.pcap")
+    monitor = make_monitor(path)
+    monitor.start()
+    for packet in make_packets(10):
+        monitor.process_packet(packet)
+    monitor.close()
+
+    patch_pcap_metadata(path, "zigbee")
+    monitor = make_monitor(path)
+    monitor.start()
+    for packet in make_packets(5):
+        monitor.process_packet(packet)
+    monitor.close()
+
+    assert extract_pcap_metadata(path) == "ble"
+    assert len(rdpcap(path)) == 15
+
+def test_patch_metadata_in_place(tmp_path):
+    path = str(tmp_path / "capture.pcap")
+    monitor = make_monitor(path)
+    monitor.start()
+    for packet in make_packets(10):
+        monitor.process_packet(packet)
+    monitor.close()
+    with open(path, "rb") as capture:
+        content = capture.read()
+
+    patch_pcap_metadata(path, "esb")
+    with open(path, "rb") as capture:
+        patched = capture.read()
+    assert patched == content[:8] + b"esb" + b"\x00"*5 + content[16:]
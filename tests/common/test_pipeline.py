@@ -0,0 +1,93 @@
+"""Staged packet processing tests.
+"""
+from threading import Event
+from time import perf_counter, sleep
+
+import pytest
+
+from whad.common.pipeline import PipelineStage
+
+def test_stages_chaining():
+    """Items are processed in order, results being passed to the next stage.
+    """
+    results = []
+    second = PipelineStage(lambda item: results.append(item * 2))
+    first = PipelineStage(lambda item: None if item % 3 == 0 else item + 1,
+                          output=second.put)
+    for i in range(100):
+        assert first.put(i)
+    assert first.join(timeout=2.0) and second.join(timeout=2.0)
+    assert results == [(i + 1)*2 for i in range(100) if i % 3 != 0]
+    assert (first.processed, second.processed) == (100, 66)
+    assert first.dropped == second.dropped == 0
+
+def test_drop_when_full():
+    """Submission does not wait for a slow stage, extra items are dropped.
+    """
+    release = Event()
+    stage = PipelineStage(lambda item: release.wait(), maxsize=10)
+    start = perf_counter()
+    accepted = sum(stage.put(i) for i in range(100))
+    assert perf_counter() - start < 0.5
+    release.set()
+    assert stage.join(timeout=2.0)
+
+    # First item may already be in process when others are submitted
+    assert accepted in (10, 11)
+    assert stage.dropped == 100 - accepted
+    assert stage.processed == accepted
+
+def test_backpressure():
+    """Submission waits for room in the queue if blocking is enabled.
+    """
+    stage = PipelineStage(lambda item: sleep(0.001), maxsize=4, block=True)
+    assert all(stage.put(i) for i in range(50))
+    assert stage.join(timeout=2.0)
+    assert (stage.processed, stage.dropped) == (50, 0)
+
+    slow = PipelineStage(lambda item: sleep(0.2), maxsize=1, block=True, timeout=0.05)
+    results = [slow.put(i) for i in range(3)]
+    assert results[-1] is False and slow.dropped >= 1
+    slow.stop()
+
+def test_errors():
+    """A failing item does not stop the stage.
+    """
+    results = []
+    stage = PipelineStage(lambda item: 1 // item, output=results.append)
+    for i in (1, 0, 1):
+        stage.put(i)
+    assert stage.join(timeout=2.0)
+    assert results == [1, 1]
+    assert (stage.processed, stage.errors) == (3, 1)
+
+def test_stop():
+    release = Event()
+    stage = PipelineStage(lambda item: release.wait())
+    for i in range(5):
+        stage.put(i)
+    stage.stop()
+    release.set()
+    assert not stage.put(5)
+    assert stage.dropped >= 5
+
+def test_clear():
+    """Pending items are dropped, the stage keeps processing new ones.
+    """
+    release = Event()
+    results = []
+    stage = PipelineStage(lambda item: release.wait() and item, output=results.append)
+    for i in range(5):
+        stage.put(i)
+    sleep(0.05)
+    stage.clear()
+    release.set()
+    assert stage.join(timeout=2.0)
+    assert results == [0] and stage.dropped == 4
+
+    assert stage.put(5) and stage.join(timeout=2.0)
+    assert results == [0, 5]
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        PipelineStage(print, maxsize=0)
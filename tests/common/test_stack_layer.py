@@ -0,0 +1,156 @@
+"""Stack layer message routing tests.
+"""
+from time import perf_counter
+
+import pytest
+
+from whad.common.stack import Layer, ContextualLayer, alias, source, instance
+
+
+@alias('upper')
+class UpperLayer(ContextualLayer):
+
+    def __init__(self, parent=None, layer_name=None, options={}):
+        super().__init__(parent=parent, layer_name=layer_name, options=options)
+        self.received = []
+
+    @source('lower')
+    def on_lower(self, data):
+        self.received.append(data)
+
+    @source('lower', tag='urgent')
+    @source('other', tag='urgent')
+    def on_urgent(self, data, priority=0):
+        self.received.append(('urgent', data, priority))
+
+@alias('lower')
+class LowerLayer(Layer):
+
+    def __init__(self, parent=None, layer_name=None, options={}):
+        super().__init__(parent=parent, layer_name=layer_name, options=options)
+        self.received = []
+
+    @instance('upper')
+    def on_upper(self, instance_name, data):
+        self.received.append((instance_name, data))
+
+LowerLayer.add(UpperLayer)
+
+
+@pytest.fixture
+def lower():
+    return LowerLayer()
+
+def test_handlers_table():
+    """Handlers are indexed once per class, for every source and tag.
+    """
+    assert UpperLayer.handlers_table() == {
+        ('lower', 'default'): 'on_lower',
+        ('lower', 'urgent'): 'on_urgent',
+        ('other', 'urgent'): 'on_urgent',
+    }
+    assert LowerLayer.handlers_table() == {('upper', 'default'): 'on_upper'}
+    assert UpperLayer.list_emitters() == ['lower', 'other']
+
+def test_routing(lower: LowerLayer):
+    upper = lower.instantiate(UpperLayer)
+    lower.send(upper.name, 'foo')
+    lower.send(upper.name, 'bar', tag='urgent', priority=2)
+    lower.send(upper.name, 'baz', tag='unknown')
+    assert upper.received == ['foo', ('urgent', 'bar', 2), 'baz']
+
+    # Contextual handlers receive the instance name
+    upper.send('lower', 'foo')
+    assert lower.received == [(upper.name, 'foo')]
+
+def test_routes_invalidation(lower: LowerLayer):
+    """Cached routes are updated when layers are created or destroyed.
+    """
+    first = lower.instantiate(UpperLayer)
+    first.send('lower', 'foo')
+    lower.send(first.name, 'foo')
+    lower.destroy(first)
+    lower.send(first.name, 'bar')
+    assert first.received == ['foo']
+
+    second = lower.instantiate(UpperLayer)
+    lower.send(second.name, 'bar')
+    second.send('lower', 'baz')
+    assert second.received == ['bar']
+    assert lower.received == [(first.name, 'foo'), (second.name, 'baz')]
+
+def test_monitor(lower: LowerLayer):
+    upper = lower.instantiate(UpperLayer)
+    messages = []
+    def monitor(source, destination, data, tag='default', **kwargs):
+        messages.append((source, destination, data, tag, kwargs))
+    lower.register_monitor_callback(monitor)
+    lower.send(upper.name, 'foo', tag='urgent', priority=1)
+    lower.unregister_monitor_callback(monitor)
+    lower.send(upper.name, 'bar')
+    assert messages == [('lower', upper.name, 'foo', 'urgent', {'priority': 1})]
+    assert len(upper.received) == 2
+
+def ble_stack(monkeypatch):
+    """Create a BLE stack attached to a minimal connector.
+    """
+    from whad.ble.stack import BleStack
+    from whad.ble.stack.att import ATTLayer
+    from whad.ble.stack.l2cap import L2CAPLayer
+
+    # Other tests may have removed the ATT layer from the BLE stack
+    monkeypatch.setitem(L2CAPLayer.LAYERS, 'att', ATTLayer)
+
+    class Connector(object):
+        def __init__(self):
+            self.connection = None
+            self.mtu_updates = 0
+        def on_new_connection(self, connection):
+            self.connection = connection
+        def on_mtu_changed(self, conn_handle, mtu):
+            self.mtu_updates += 1
+
+    connector = Connector()
+    return connector, BleStack(connector)
+
+def connect(stack, conn_handle):
+    from whad.hub.ble.bdaddr import BDAddress
+    stack.on_connection(conn_handle, BDAddress('00:11:22:33:44:55'),
+                        BDAddress('66:55:44:33:22:11'))
+
+def test_ble_stack_routing(monkeypatch):
+    """Messages are routed through the BLE stack, from ATT to PHY.
+    """
+    connector, stack = ble_stack(monkeypatch)
+
+    # Contextual L2CAP/ATT/SMP layers are created on each connection
+    for conn_handle in range(3):
+        connect(stack, conn_handle)
+    assert connector.connection.conn_handle == 2
+
+    att = connector.connection.l2cap.get_layer('att')
+    for _ in range(10):
+        # att -> l2cap -> ll -> phy
+        att.send('l2cap', 23, tag='ATT_MTU')
+    assert connector.mtu_updates == 10
+
+@pytest.mark.benchmark
+def test_ble_stack_routing_benchmark(monkeypatch):
+    """Benchmark messages routed through the BLE stack, from ATT to PHY.
+    """
+    connector, stack = ble_stack(monkeypatch)
+
+    start = perf_counter()
+    for conn_handle in range(100):
+        connect(stack, conn_handle)
+    duration = perf_counter() - start
+    print(f"{100/duration:.0f} connections/s")
+
+    att = connector.connection.l2cap.get_layer('att')
+    nb_messages = 20000
+    start = perf_counter()
+    for _ in range(nb_messages):
+        att.send('l2cap', 23, tag='ATT_MTU')
+    duration = perf_counter() - start
+    print(f"{3*nb_messages/duration:.0f} messages routed/s")
+    assert connector.mtu_updates == nb_messages
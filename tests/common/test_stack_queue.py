@@ -0,0 +1,57 @@
+"""Stack message queue tests.
+"""
+from queue import Empty
+from threading import Thread, Timer
+from time import perf_counter, thread_time, sleep
+
+import pytest
+
+from whad.common.stack import MessageQueue, MessageQueueClosed
+
+def test_get_filters_messages():
+    """Messages not matching the predicate are dropped.
+    """
+    queue = MessageQueue()
+    for i in range(5):
+        queue.put(i)
+    assert queue.get(lambda msg: msg >= 3, timeout=0) == 3
+    assert len(queue) == 1
+    assert queue.get() == 4
+
+def test_get_timeout():
+    queue = MessageQueue()
+    queue.put(1)
+    start = perf_counter()
+    with pytest.raises(Empty):
+        queue.get(lambda msg: msg == 2, timeout=0.05)
+    assert perf_counter() - start >= 0.05
+    assert len(queue) == 0
+
+def test_get_wakes_on_arrival():
+    """Waiter wakes up as soon as a message is added, without spinning.
+    """
+    queue = MessageQueue()
+    received = []
+    def wait():
+        start = thread_time()
+        received.append((queue.get(timeout=5.0), perf_counter(), thread_time() - start))
+    waiter = Thread(target=wait)
+    waiter.start()
+    sleep(0.2)
+    sent = perf_counter()
+    queue.put("response")
+    waiter.join()
+
+    message, woken, cpu_time = received[0]
+    assert message == "response"
+    assert woken - sent < 0.05
+    assert cpu_time < 0.05
+
+def test_close_wakes_waiters():
+    queue = MessageQueue()
+    Timer(0.05, queue.close).start()
+    start = perf_counter()
+    with pytest.raises(MessageQueueClosed):
+        queue.get(timeout=5.0)
+    assert perf_counter() - start < 1.0
+    assert queue.closed
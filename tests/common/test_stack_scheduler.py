@@ -0,0 +1,69 @@
+"""Stack scheduler tests.
+"""
+import threading
+from threading import Event
+from time import perf_counter
+
+from whad.common.stack import Scheduler
+
+def test_tasks_order():
+    """Tasks are run by deadline, then in submission order.
+    """
+    scheduler = Scheduler()
+    done = Event()
+    calls = []
+    scheduler.call_later(0.1, done.set)
+    scheduler.call_later(0.05, calls.append, "late")
+    for i in range(3):
+        scheduler.call_soon(calls.append, i)
+    assert done.wait(2.0)
+    assert calls == [0, 1, 2, "late"]
+    assert len(scheduler) == 0
+
+def test_cancel():
+    scheduler = Scheduler()
+    done = Event()
+    calls = []
+    task = scheduler.call_later(0.02, calls.append, "cancelled")
+    scheduler.call_later(0.05, done.set)
+    task.cancel()
+    assert done.wait(2.0)
+    assert calls == []
+
+def test_task_exception():
+    """An exception raised by a task does not stop the scheduler.
+    """
+    scheduler = Scheduler()
+    done = Event()
+    scheduler.call_soon(lambda: 1/0)
+    scheduler.call_soon(done.set)
+    assert done.wait(2.0)
+
+def test_single_thread():
+    """Timers are run by a single thread, with a bounded latency.
+    """
+    scheduler = Scheduler()
+    nb_threads = threading.active_count()
+    delays = []
+    done = Event()
+    def callback(deadline):
+        delays.append(perf_counter() - deadline)
+        if len(delays) == 1000:
+            done.set()
+    start = perf_counter()
+    for i in range(1000):
+        scheduler.call_later(i/10000, callback, start + i/10000)
+    assert threading.active_count() == nb_threads + 1
+    assert done.wait(5.0)
+    assert min(delays) >= 0
+    assert sorted(delays)[len(delays)//2] < 0.05
+
+def test_close():
+    scheduler = Scheduler()
+    calls = []
+    scheduler.call_later(0.05, calls.append, 1)
+    scheduler.close()
+    assert scheduler.closed and len(scheduler) == 0
+    assert scheduler.call_soon(calls.append, 2).cancelled
+    Event().wait(0.1)
+    assert calls == []
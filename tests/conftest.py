@@ -0,0 +1,18 @@
+"""Shared pytest configuration.
+
+Tests marked with `benchmark` measure performance and are skipped unless
+`--run-benchmarks` is given.
+"""
+import pytest
+
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmarks", action="store_true", default=False,
+                     help="run performance benchmarks")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-benchmarks"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="benchmark, use --run-benchmarks to run it")
+    for item in items:
+        if item.get_closest_marker("benchmark") is not None:
+            item.add_marker(skip_benchmark)
@@ -0,0 +1,207 @@
+"""Asyncio device layer tests.
+
+These tests run a fake WHAD firmware behind a Unix socket, a TCP socket or a
+pseudo-terminal, and drive it through the asynchronous device classes.
+"""
+import os
+import asyncio
+
+import pytest
+from scapy.layers.dot15d4 import Dot15d4
+
+from whad.device.aio import AsyncWhadDevice, AsyncWhadDeviceConnector, \
+    AsyncUnixSocketDevice, AsyncTCPSocketDevice, AsyncUartDevice
+from whad.device.framing import WhadFrameDecoder, frame_message
+from whad.exceptions import WhadDeviceDisconnected, WhadDeviceTimeout, WhadDeviceNotFound
+from whad.hub import ProtocolHub
+from whad.hub.discovery import Domain, InfoQuery, DomainInfoQuery, ResetQuery
+from whad.hub.dot15d4 import SendPdu, Dot15d4Metadata
+from whad.hub.generic.cmdresult import Success
+
+class FakeFirmware:
+    """Fake WHAD firmware answering discovery queries and commands, sending
+    back each transmitted 802.15.4 PDU as a received one.
+    """
+
+    def __init__(self, mute: bool = False):
+        self.hub = ProtocolHub(2)
+        self.decoder = WhadFrameDecoder()
+        self.mute = mute
+        self.commands = 0
+
+    def process(self, data: bytes) -> bytes:
+        output = b""
+        for raw_message in self.decoder.feed(data):
+            message = self.hub.parse(raw_message)
+            self.commands += 1
+            if self.mute:
+                continue
+            if isinstance(message, InfoQuery):
+                responses = [self.hub.discovery.create_info_resp(
+                    1, b"fake", 2, 115200, b"whad", b"https://whad.io", 1, 0, 0,
+                    [Domain.Dot15d4 | 0x01]
+                )]
+            elif isinstance(message, DomainInfoQuery):
+                responses = [self.hub.discovery.create_domain_resp(message.domain, 0x0f)]
+            elif isinstance(message, ResetQuery):
+                responses = [self.hub.discovery.create_device_ready()]
+            elif isinstance(message, SendPdu):
+                responses = [
+                    self.hub.generic.create_success(),
+                    self.hub.dot15d4.create_pdu_received(message.channel, message.pdu)
+                ]
+            else:
+                responses = [self.hub.generic.create_success()]
+            output += b"".join(frame_message(resp.serialize()) for resp in responses)
+        return output
+
+    async def serve(self, reader, writer):
+        while True:
+            data = await reader.read(4096)
+            if len(data) == 0:
+                break
+            writer.write(self.process(data))
+            await writer.drain()
+        writer.close()
+
+def make_packet(seqnum: int):
+    packet = Dot15d4(fcf_frametype=1, seqnum=seqnum)
+    packet.metadata = Dot15d4Metadata(channel=11)
+    return packet
+
+async def exchange(device, firmware):
+    """Discover device, send two packets and collect them back.
+    """
+    async with device:
+        await device.discover()
+        assert device.info.device_id == "fake"
+        assert device.info.has_domain(Domain.Dot15d4)
+
+        connector = AsyncWhadDeviceConnector(device)
+        assert await connector.send_packet(make_packet(1))
+        assert await connector.send_packet(make_packet(2))
+
+        packets = []
+        async for packet in connector.packets(timeout=1.0):
+            packets.append(packet)
+            if len(packets) == 2:
+                break
+        return packets
+
+def test_unix_socket_device(tmp_path):
+    """Discover and exchange packets over a Unix socket.
+    """
+    async def run():
+        firmware = FakeFirmware()
+        path = str(tmp_path / "whad_test.sock")
+        server = await asyncio.start_unix_server(firmware.serve, path)
+        async with server:
+            return await exchange(AsyncWhadDevice.create("unix:" + path), firmware)
+
+    packets = asyncio.run(run())
+    assert [packet.seqnum for packet in packets] == [1, 2]
+
+def test_tcp_socket_device():
+    """Discover and exchange packets over a TCP socket.
+    """
+    async def run():
+        firmware = FakeFirmware()
+        server = await asyncio.start_server(firmware.serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            device = AsyncWhadDevice.create(f"tcp:127.0.0.1:{port}")
+            assert isinstance(device, AsyncTCPSocketDevice)
+            return await exchange(device, firmware)
+
+    packets = asyncio.run(run())
+    assert [packet.seqnum for packet in packets] == [1, 2]
+
+def test_uart_device():
+    """Discover and exchange packets over a pseudo-terminal.
+    """
+    async def run():
+        firmware = FakeFirmware()
+        master, slave = os.openpty()
+        loop = asyncio.get_running_loop()
+        os.set_blocking(master, False)
+
+        def on_readable():
+            try:
+                os.write(master, firmware.process(os.read(master, 4096)))
+            except BlockingIOError:
+                pass
+
+        loop.add_reader(master, on_readable)
+        try:
+            device = AsyncWhadDevice.create("uart:" + os.ttyname(slave))
+            assert isinstance(device, AsyncUartDevice)
+            return await exchange(device, firmware)
+        finally:
+            loop.remove_reader(master)
+            os.close(master)
+            os.close(slave)
+
+    packets = asyncio.run(run())
+    assert [packet.seqnum for packet in packets] == [1, 2]
+
+def test_concurrent_commands(tmp_path):
+    """Commands sent concurrently by several tasks are all answered.
+    """
+    async def run():
+        firmware = FakeFirmware()
+        path = str(tmp_path / "whad_test.sock")
+        server = await asyncio.start_unix_server(firmware.serve, path)
+        async with server:
+            async with AsyncUnixSocketDevice(path) as device:
+                results = await asyncio.gather(*[
+                    device.send_command(device.hub.dot15d4.create_start())
+                    for _ in range(32)
+                ], device.reset())
+        return firmware, results
+
+    firmware, results = asyncio.run(run())
+    assert firmware.commands == 33
+    assert all(isinstance(result, Success) for result in results[:-1])
+
+def test_command_timeout(tmp_path):
+    """A command that is not answered raises a timeout error.
+    """
+    async def run():
+        firmware = FakeFirmware(mute=True)
+        path = str(tmp_path / "whad_test.sock")
+        server = await asyncio.start_unix_server(firmware.serve, path)
+        async with server:
+            async with AsyncUnixSocketDevice(path) as device:
+                await device.send_command(device.hub.generic.create_success(), timeout=.1)
+
+    with pytest.raises(WhadDeviceTimeout):
+        asyncio.run(run())
+
+def test_disconnection(tmp_path):
+    """Pending commands and packet iterators end when device disconnects.
+    """
+    async def run():
+        firmware = FakeFirmware(mute=True)
+        path = str(tmp_path / "whad_test.sock")
+        server = await asyncio.start_unix_server(firmware.serve, path)
+        async with server:
+            device = AsyncUnixSocketDevice(path)
+            await device.open()
+            connector = AsyncWhadDeviceConnector(device)
+            command = asyncio.ensure_future(device.send_command(
+                device.hub.generic.create_success()
+            ))
+            await asyncio.sleep(.05)
+            await device.close()
+            packets = [packet async for packet in connector.packets()]
+            with pytest.raises(WhadDeviceDisconnected):
+                await command
+            return packets
+
+    assert asyncio.run(run()) == []
+
+def test_unknown_interface():
+    """Unknown interface strings are rejected.
+    """
+    with pytest.raises(WhadDeviceNotFound):
+        AsyncWhadDevice.create("foo:bar")
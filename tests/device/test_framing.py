@@ -0,0 +1,138 @@
+"""WHAD transport frame decoder tests.
+"""
+import random
+from time import perf_counter
+
+import pytest
+
+from whad.device.framing import WhadFrameDecoder, frame_message
+
+def frame(payload: bytes) -> bytes:
+    """Build a WHAD transport frame from a payload.
+    """
+    return bytes([0xAC, 0xBE, len(payload) & 0xff, len(payload) >> 8]) + payload
+
+def legacy_reassembler(inpipe: bytearray, data: bytes):
+    """Reference implementation previously used by WhadDevice.on_data_received().
+    """
+    frames = []
+    inpipe.extend(data)
+    while len(inpipe) > 2:
+        if inpipe[0] == 0xAC and inpipe[1] == 0xBE:
+            if len(inpipe) > 4:
+                msg_size = inpipe[2] | (inpipe[3] << 8)
+                if len(inpipe) >= (msg_size+4):
+                    frames.append(bytes(inpipe[4:4+msg_size]))
+                    inpipe = inpipe[msg_size + 4:]
+                else:
+                    break
+            else:
+                break
+        else:
+            while len(inpipe) >= 2:
+                if (inpipe[0] != 0xAC) or (inpipe[1] != 0xBE):
+                    inpipe = inpipe[1:]
+                else:
+                    break
+    return inpipe, frames
+
+def garbage_stream(count: int, seed: int = 42):
+    """Generate a stream of frames interleaved with random garbage.
+    """
+    rng = random.Random(seed)
+    payloads = []
+    stream = bytearray()
+    for _ in range(count):
+        # Insert garbage without any magic sequence
+        garbage = bytes(rng.randrange(0, 0xAC) for _ in range(rng.randrange(0, 32)))
+        payload = bytes(rng.randrange(0, 256) for _ in range(rng.randrange(1, 64)))
+        stream.extend(garbage)
+        stream.extend(frame(payload))
+        payloads.append(payload)
+    return bytes(stream), payloads
+
+@pytest.fixture
+def decoder():
+    return WhadFrameDecoder()
+
+def test_single_frame(decoder):
+    assert decoder.feed(frame(b"hello")) == [b"hello"]
+    assert decoder.pending == 0
+
+def test_empty_frame(decoder):
+    assert decoder.feed(frame(b"")) == [b""]
+
+def test_multiple_frames(decoder):
+    assert decoder.feed(frame(b"a") + frame(b"bc") + frame(b"def")) == [b"a", b"bc", b"def"]
+
+def test_split_frame(decoder):
+    data = frame(b"fragmented")
+    assert decoder.feed(data[:1]) == []
+    assert decoder.feed(data[1:3]) == []
+    assert decoder.feed(data[3:7]) == []
+    assert decoder.feed(data[7:]) == [b"fragmented"]
+    assert decoder.pending == 0
+
+def test_resync_on_garbage(decoder):
+    assert decoder.feed(b"\x00\x01\xac\x02" + frame(b"ok") + b"\xff") == [b"ok"]
+    assert decoder.dropped == 4
+    assert decoder.pending == 1
+
+def test_split_magic(decoder):
+    data = frame(b"split")
+    assert decoder.feed(b"\x11\x22" + data[:1]) == []
+    assert decoder.pending == 1
+    assert decoder.feed(data[1:]) == [b"split"]
+
+def test_reset(decoder):
+    decoder.feed(frame(b"abc")[:5])
+    decoder.reset()
+    assert decoder.pending == 0
+    assert decoder.feed(frame(b"abc")) == [b"abc"]
+
+def test_matches_legacy_reassembler(decoder):
+    stream, payloads = garbage_stream(500)
+    rng = random.Random(1)
+    inpipe = bytearray()
+    legacy, frames = [], []
+    offset = 0
+    while offset < len(stream):
+        chunk = stream[offset:offset + rng.randrange(1, 300)]
+        offset += len(chunk)
+        inpipe, legacy_frames = legacy_reassembler(inpipe, chunk)
+        legacy.extend(legacy_frames)
+        frames.extend(decoder.feed(chunk))
+    assert frames == payloads
+    assert frames == legacy
+
+def test_decoder_large_read(decoder):
+    """A large garbage-interleaved read is decoded at once.
+    """
+    stream, payloads = garbage_stream(5000)
+    assert decoder.feed(stream) == payloads
+    _, legacy = legacy_reassembler(bytearray(), stream)
+    assert legacy == payloads
+
+@pytest.mark.benchmark
+def test_decoder_throughput(decoder):
+    """Benchmark decoder throughput on a large garbage-interleaved read.
+    """
+    stream, payloads = garbage_stream(5000)
+
+    start = perf_counter()
+    frames = decoder.feed(stream)
+    duration = perf_counter() - start
+    assert frames == payloads
+
+    start = perf_counter()
+    _, legacy = legacy_reassembler(bytearray(), stream)
+    legacy_duration = perf_counter() - start
+    assert legacy == payloads
+
+    print(f"frame decoder: {len(stream)/duration:.0f} bytes/s, "
+          f"legacy reassembler: {len(stream)/legacy_duration:.0f} bytes/s")
+
+def test_frame_message(decoder):
+    assert frame_message(b"hello") == b"\xac\xbe\x05\x00hello"
+    payload = bytes(range(256))*2
+    assert decoder.feed(frame_message(payload)) == [payload]
@@ -0,0 +1,183 @@
+"""PCAP replay engine tests.
+"""
+import os
+from struct import pack
+from time import perf_counter, sleep
+
+import pytest
+from scapy.utils import PcapReader
+
+from whad.device.virtual.pcap import PCAPDevice, parse_replay_options
+from whad.common.pcap import PcapRecordReader, PcapIndex
+from whad.device.virtual.pcap.replay import PcapReplay
+
+PCAPS = os.path.join(os.path.dirname(__file__), "..", "..", "whad", "resources", "pcaps")
+
+def resource(name: str) -> str:
+    return os.path.join(PCAPS, name)
+
+def write_pcap(path, timestamps, linktype=1, nanoseconds=False):
+    """Write a PCAP file with one small record per timestamp (in seconds).
+    """
+    magic = 0xa1b23c4d if nanoseconds else 0xa1b2c3d4
+    with open(path, "wb") as output:
+        output.write(pack("<IHHiIII", magic, 2, 4, 0, 0, 65535, linktype))
+        for i, timestamp in enumerate(timestamps):
+            sec = int(timestamp)
+            frac = round((timestamp - sec) * (1e9 if nanoseconds else 1e6))
+            data = bytes([i & 0xff]) * 4
+            output.write(pack("<IIII", sec, frac, len(data), len(data)) + data)
+
+def write_pcapng(path, records, linktype=256, tsresol=None):
+    """Write a PCAPng file with a single interface and one enhanced packet
+    block per (timestamp, data) record, timestamps being in interface units.
+    """
+    def block(block_type, body):
+        body += b"\x00" * (-len(body) % 4)
+        return pack("<II", block_type, len(body) + 12) + body + pack("<I", len(body) + 12)
+
+    options = b""
+    if tsresol is not None:
+        options = pack("<HHB3x", 9, 1, tsresol) + pack("<HH", 0, 0)
+    with open(path, "wb") as output:
+        output.write(block(0x0a0d0d0a, pack("<IHHq", 0x1a2b3c4d, 1, 0, -1)))
+        output.write(block(0x00000001, pack("<HHI", linktype, 0, 65535) + options))
+        for timestamp, data in records:
+            output.write(block(0x00000006, pack(
+                "<IIIII", 0, timestamp >> 32, timestamp & 0xffffffff, len(data), len(data)
+            ) + data))
+
+class CollectingPCAPDevice(PCAPDevice):
+    """PCAP device keeping messages instead of sending them to a connector.
+    """
+
+    INTERFACE_NAME = "pcap-collect"
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.messages = []
+
+    def _send_whad_message(self, message):
+        self.messages.append(message)
+
+@pytest.mark.parametrize("name", [
+    "ble_pairing.pcap", "zigbee_philips_hue_association.pcap", "logitech_mouse.pcap"
+])
+def test_records_match_scapy(name):
+    """Records data and timestamps match scapy's PCAP reader.
+    """
+    expected = [(bytes(pkt), int(100000 * pkt.time)) for pkt in PcapReader(resource(name))]
+    with PcapRecordReader(resource(name)) as reader:
+        records = [(record.data, record.timestamp // 10000) for record in reader.records()]
+    assert records == expected
+
+def test_pcapng_records(tmp_path):
+    """PCAPng enhanced packet blocks are parsed.
+    """
+    path = str(tmp_path / "capture.pcapng")
+    records = [(1700000000000000 + i*250000, bytes([i])*(i + 1)) for i in range(10)]
+    write_pcapng(path, records)
+
+    with PcapRecordReader(path) as reader:
+        assert reader.is_pcapng
+        assert reader.linktype == 256
+        parsed = list(reader.records())
+    assert [record.data for record in parsed] == [data for _, data in records]
+    assert [record.timestamp for record in parsed] == [ts*1000 for ts, _ in records]
+
+    # Same capture with a nanosecond resolution
+    write_pcapng(path, records, tsresol=9)
+    with PcapRecordReader(path) as reader:
+        assert [record.timestamp for record in reader.records()] == [ts for ts, _ in records]
+
+def test_nanosecond_pcap(tmp_path):
+    """Nanosecond-resolution PCAP timestamps are preserved.
+    """
+    path = str(tmp_path / "capture.pcap")
+    write_pcap(path, [10.000000001, 10.5], nanoseconds=True)
+    with PcapRecordReader(path) as reader:
+        assert [record.timestamp for record in reader.records()] == [
+            10000000001, 10500000000
+        ]
+
+@pytest.mark.parametrize("name", [
+    "ble_pairing.pcap", "zigbee_philips_hue_association.pcap",
+    "zigbee_touchlink_provisioning.pcap"
+])
+def test_messages_match_scapy_path(name):
+    """Messages built from raw bytes match messages built from dissected packets.
+    """
+    device = CollectingPCAPDevice("flush:" + resource(name))
+    device.open()
+    try:
+        with PcapRecordReader(resource(name)) as reader:
+            for record in reader.records():
+                device._send_record(record)
+        fast = [msg.serialize() for msg in device.messages]
+
+        device.messages.clear()
+        for packet in PcapReader(resource(name)):
+            device._send_packet(packet)
+        dissected = [msg.serialize() for msg in device.messages]
+    finally:
+        device.close()
+
+    assert len(fast) > 0
+    assert fast == dissected
+
+def test_replay_ranges(tmp_path):
+    """Records can be selected by index or by timestamp.
+    """
+    path = str(tmp_path / "capture.pcap")
+    write_pcap(path, [100 + i*0.1 for i in range(20)])
+    with PcapRecordReader(path) as reader:
+        indexes = [r.index for r in PcapReplay(reader, speed=0, first=5, last=8)]
+        assert indexes == [5, 6, 7, 8]
+        indexes = [r.index for r in PcapReplay(reader, speed=0, start=0.45, stop=0.85)]
+        assert indexes == [5, 6, 7, 8]
+
+def test_replay_seek_with_index(tmp_path):
+    """Seeking with a capture index selects the same records.
+    """
+    path = str(tmp_path / "capture.pcap")
+    write_pcap(path, [100 + i*0.1 for i in range(20)])
+    index = PcapIndex.open(path)
+    with PcapRecordReader(path) as reader:
+        for options in ({"first": 5, "last": 8}, {"start": 0.45, "stop": 0.85},
+                        {"first": 7, "start": 0.45}, {"first": 25}):
+            expected = [r.data for r in PcapReplay(reader, speed=0, **options)]
+            indexed = [r.data for r in PcapReplay(reader, speed=0, index=index, **options)]
+            assert indexed == expected
+    index.close()
+
+def test_replay_pacing_does_not_drift(tmp_path):
+    """Emission times are computed from an absolute reference, processing
+    time does not accumulate.
+    """
+    path = str(tmp_path / "capture.pcap")
+    count, period = 40, 0.005
+    write_pcap(path, [1000 + i*period for i in range(count)])
+
+    with PcapRecordReader(path) as reader:
+        start = perf_counter()
+        for record in PcapReplay(reader, speed=2.0):
+            # Emulate some processing time
+            sleep(period/4)
+            last = record
+        duration = perf_counter() - start
+
+    expected = (count - 1)*period/2.0
+    assert last.index == count - 1
+    assert expected <= duration < expected + 0.02
+
+def test_replay_options():
+    """Replay options are parsed from the interface string.
+    """
+    assert parse_replay_options("capture.pcap") == ("capture.pcap", {})
+    assert parse_replay_options("flush:capture.pcap") == ("capture.pcap", {"speed": 0.0})
+    assert parse_replay_options("speed=4:start=1.5:stop=3:range=10-:/tmp/a.pcap") == (
+        "/tmp/a.pcap",
+        {"speed": 4.0, "start": 1.5, "stop": 3.0, "first": 10, "last": None}
+    )
+    assert PCAPDevice.check_interface("range=1-5:capture.pcapng")
+    assert not PCAPDevice.check_interface("speed=fast:capture.pcap")
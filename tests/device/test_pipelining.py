@@ -0,0 +1,239 @@
+"""Pipelined packet transmission and concurrent commands tests.
+
+These tests rely on a local virtual device that answers every command after
+a fixed latency, emulating the round-trip time of a real WHAD adapter.
+"""
+import gc
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import perf_counter, sleep
+
+import pytest
+from scapy.layers.dot15d4 import Dot15d4
+
+from whad.device import WhadDevice, WhadDeviceConnector
+from whad.device.device import MessageWaiter
+from whad.device.framing import WhadFrameDecoder
+from whad.exceptions import WhadDeviceDisconnected
+from whad.hub.generic.cmdresult import Success
+from whad.hub.discovery import ResetQuery
+from whad.hub.dot15d4 import Dot15d4Metadata
+
+LATENCY = 0.005
+
+def frame(message) -> bytes:
+    raw_message = message.serialize()
+    return bytes([0xAC, 0xBE, len(raw_message) & 0xff, len(raw_message) >> 8]) + raw_message
+
+class LatencyDevice(WhadDevice):
+    """Virtual device answering commands after a fixed latency.
+    """
+
+    INTERFACE_NAME = "latency"
+
+    @classmethod
+    def list(cls):
+        return []
+
+    def __init__(self, latency: float = LATENCY, fail_every: int = 0, answer_limit: int = None):
+        super().__init__()
+        self.__latency = latency
+        self.__fail_every = fail_every
+        self.__answer_limit = answer_limit
+        self.__decoder = WhadFrameDecoder()
+        self.__responses = Queue()
+        self.__lock = Lock()
+        self.commands = 0
+        self.max_in_flight = 0
+        self.__in_flight = 0
+
+    def write(self, data):
+        for raw_message in self.__decoder.feed(data):
+            message = self.hub.parse(raw_message)
+            if isinstance(message, ResetQuery):
+                response = self.hub.discovery.create_device_ready()
+            else:
+                self.commands += 1
+                if self.__answer_limit is not None and self.commands > self.__answer_limit:
+                    continue
+                if self.__fail_every and (self.commands % self.__fail_every == 0):
+                    response = self.hub.generic.create_error()
+                else:
+                    response = self.hub.generic.create_success()
+            with self.__lock:
+                self.__in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.__in_flight)
+            self.__responses.put((perf_counter() + self.__latency, frame(response)))
+        return len(data)
+
+    def read(self):
+        try:
+            deadline, data = self.__responses.get(timeout=0.05)
+        except Empty:
+            return
+        delay = deadline - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        with self.__lock:
+            self.__in_flight -= 1
+        self.on_data_received(data)
+
+    def reset(self):
+        self.send_command(self.hub.discovery.create_reset_query(),
+                          lambda msg: msg.message_name == "ready_resp")
+
+class DummyConnector(WhadDeviceConnector):
+    """Connector ignoring incoming messages.
+    """
+    def on_generic_msg(self, message):
+        pass
+
+    def on_discovery_msg(self, message):
+        pass
+
+    def on_domain_msg(self, domain, message):
+        pass
+
+    def on_packet(self, packet):
+        pass
+
+    def on_event(self, event):
+        pass
+
+def make_packets(count: int):
+    packets = []
+    for i in range(count):
+        packet = Dot15d4(seqnum=i & 0xff)
+        packet.metadata = Dot15d4Metadata(channel=11, raw=True)
+        packets.append(packet)
+    return packets
+
+@pytest.fixture
+def connector():
+    device = LatencyDevice()
+    connector = DummyConnector(device)
+    device.open()
+    yield connector
+    device.close()
+
+def test_send_packets_results(connector):
+    report = connector.send_packets(make_packets(20), window=4)
+    assert report.results == [True]*20
+    assert report.sent == 20
+    assert connector.device.max_in_flight <= 4
+
+def test_send_packets_failures():
+    device = LatencyDevice(fail_every=3)
+    connector = DummyConnector(device)
+    device.open()
+    try:
+        report = connector.send_packets(make_packets(9), window=8)
+        assert report.results == [True, True, False]*3
+    finally:
+        device.close()
+
+def test_send_packets_unconvertible(connector):
+    packets = make_packets(2)
+    unknown = Dot15d4()
+    unknown.metadata = None
+    report = connector.send_packets([packets[0], unknown, packets[1]])
+    assert report.results == [True, False, True]
+
+def test_send_packets_lazy(connector):
+    """Packets are taken from a generator and monitored as they are sent.
+    """
+    device = connector.device
+    pulled = []
+    def packets():
+        for packet in make_packets(10):
+            pulled.append(device.commands)
+            yield packet
+
+    monitored = []
+    connector.attach_callback(lambda packet: monitored.append((packet.seqnum, device.commands)),
+                              on_reception=False, on_transmission=True)
+    report = connector.send_packets(packets(), window=2)
+    assert report.results == [True]*10
+    assert pulled == list(range(10))
+    assert [seqnum for seqnum, _ in monitored] == list(range(10))
+    assert all(commands > seqnum for seqnum, commands in monitored)
+
+def test_send_packets_partial_report():
+    """A failed transmission reports the packets sent so far.
+    """
+    device = LatencyDevice(answer_limit=3)
+    connector = DummyConnector(device)
+    device.open()
+    closer = Thread(target=lambda: (sleep(0.3), device.close()))
+    closer.start()
+    try:
+        with pytest.raises(WhadDeviceDisconnected) as error:
+            connector.send_packets(make_packets(10), window=4)
+    finally:
+        closer.join()
+    report = error.value.report
+    assert report.results == [True]*3 + [False]*4
+    assert report.sent == 3 and report.duration > 0
+
+def test_send_packets_pipelined(connector):
+    """Pipelined transmission keeps several packets in flight.
+    """
+    report = connector.send_packets(make_packets(50), window=8)
+    assert report.sent == 50
+    assert 1 < connector.device.max_in_flight <= 8
+
+@pytest.mark.benchmark
+def test_pipelining_speedup(connector):
+    """Compare pipelined transmission with packet-per-packet transmission.
+    """
+    packets = make_packets(50)
+
+    # Avoid a full garbage collection in the middle of our measurements
+    gc.collect()
+
+    start = perf_counter()
+    for packet in packets:
+        assert connector.send_packet(packet)
+    sequential = len(packets)/(perf_counter() - start)
+
+    gc.collect()
+    report = connector.send_packets(packets, window=8)
+    assert report.sent == len(packets)
+
+    print(f"sequential: {sequential:.0f} packets/s, pipelined: {report.rate:.0f} packets/s")
+
+def test_waiter_wakeup():
+    """A waiter is woken up as soon as a message is delivered.
+    """
+    waiter = MessageWaiter(lambda msg: True)
+    Thread(target=waiter.put, args=("message",)).start()
+    assert waiter.wait(timeout=5.0) == "message"
+    assert waiter.wait(timeout=0.01) is None
+
+def test_waiter_cancelled(connector):
+    """Closing the device wakes up waiting threads.
+    """
+    waiter = connector.device.add_waiter(lambda msg: False)
+    closer = Thread(target=connector.device.close)
+    closer.start()
+    with pytest.raises(WhadDeviceDisconnected):
+        connector.device.wait_for_waiter(waiter, timeout=5.0)
+    closer.join()
+
+def test_concurrent_commands(connector):
+    """Several threads can send commands concurrently.
+    """
+    results = []
+    def send_commands():
+        for _ in range(10):
+            results.append(connector.send_command(connector.hub.discovery.create_info_query(0x0100)))
+
+    threads = [Thread(target=send_commands) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 40
+    assert all(isinstance(result, Success) for result in results)
+    assert connector.device.max_in_flight > 1
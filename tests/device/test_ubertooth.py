@@ -0,0 +1,249 @@
+"""Ubertooth streaming receive engine tests, using a mocked USB device.
+"""
+from array import array
+from collections import deque
+from struct import pack
+from time import sleep, perf_counter
+
+import pytest
+from usb.core import USBError, USBTimeoutError
+
+import whad.device.virtual.ubertooth as ubertooth
+from whad.ble.utils.phy import crc
+from whad.device.virtual.ubertooth import UbertoothDevice
+from whad.device.virtual.ubertooth.constants import UbertoothCommands, UbertoothEndPoints, \
+    UbertoothPacketTypes, UbertoothTransfers
+from whad.device.virtual.ubertooth.stream import UbertoothStream, UBERTOOTH_HEADER, \
+    UBERTOOTH_FRAME_SIZE, split_le_packet, check_crcs
+from whad.exceptions import WhadDeviceDisconnected
+from whad.hub.ble import BDAddress
+
+# ADV_IND sent by 11:22:33:44:55:66, and CONNECT_IND from 00:11:22:33:44:55
+ADV_IND = bytes.fromhex("0015665544332211020106") + b"\x0b\x09Ubertooth!"
+CONNECT_IND = bytes.fromhex(
+    "0522" "554433221100" "665544332211" "aabbccdd" "123456" "01" "0200"
+    "0600" "0000" "c800" "ffffffff1f" "a5"
+)
+# Connection parameters, as dissected by scapy
+CONN_ACCESS_ADDRESS = 0xaabbccdd
+CONN_CRC_INIT = 0x123456
+
+
+def make_frame(access_address, pdu, packet_type=UbertoothPacketTypes.LE_PACKET, channel=0,
+               clk_100ns=1000, rssi_min=0, crc_init=0x555555, valid=True):
+    """Build a 64-byte Ubertooth frame, as received from the bulk endpoint.
+    """
+    pdu_crc = crc(pdu, crc_init)
+    if not valid:
+        pdu_crc = bytes([pdu_crc[0] ^ 0xff]) + pdu_crc[1:]
+    data = pack("<I", access_address) + pdu + pdu_crc
+    header = UBERTOOTH_HEADER.pack(packet_type, 0, channel, 0, clk_100ns, 0, rssi_min, 0, 0)
+    return (header + data).ljust(UBERTOOTH_FRAME_SIZE, b"\x00")
+
+
+class FakeUbertooth:
+    """Mocked `usb.core.Device`, replaying recorded frames on the bulk IN endpoint.
+    """
+    iSerialNumber = 1
+    iManufacturer = 2
+
+    def __init__(self, frames=()):
+        self.frames = deque(frames)
+        self.transfers = 0
+        self.commands = []
+
+    def set_configuration(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data=None, timeout=None):
+        if request_type == UbertoothTransfers.CTRL_IN:
+            if request == UbertoothCommands.UBERTOOTH_GET_REV_NUM:
+                return array("B", b"\x00\x002020-12-R1")
+            return array("B", b"\x00" * data)
+        self.commands.append((request, value))
+        return 0
+
+    def read(self, endpoint, buffer, timeout=None):
+        assert endpoint == UbertoothEndPoints.DATA_IN
+        if len(self.frames) == 0:
+            sleep(timeout/1000)
+            raise USBTimeoutError("timeout")
+        size = 0
+        while len(self.frames) > 0 and size + UBERTOOTH_FRAME_SIZE <= len(buffer):
+            buffer[size:size + UBERTOOTH_FRAME_SIZE] = array("B", self.frames.popleft())
+            size += UBERTOOTH_FRAME_SIZE
+        self.transfers += 1
+        return size
+
+
+class CollectingUbertoothDevice(UbertoothDevice):
+    """Ubertooth device keeping messages instead of sending them to a connector.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.messages = []
+        super().__init__(*args, **kwargs)
+
+    def _send_whad_message(self, message):
+        self.messages.append(message)
+
+    def wait_messages(self, count, timeout=2.0):
+        deadline = perf_counter() + timeout
+        while len(self.messages) < count and perf_counter() < deadline:
+            sleep(0.01)
+        return self.messages
+
+
+@pytest.fixture
+def usb_device(monkeypatch):
+    usb_device = FakeUbertooth()
+    monkeypatch.setattr(ubertooth, "find", lambda **kwargs: iter([usb_device]))
+    monkeypatch.setattr(ubertooth, "get_string", lambda device, index: "ubertooth")
+    return usb_device
+
+@pytest.fixture
+def device(usb_device):
+    device = CollectingUbertoothDevice()
+    device.open()
+    yield device
+    device.close()
+
+def start(device, message):
+    device.messages.clear()
+    device.send_message(message)
+    device.send_message(device.hub.ble.create_start())
+    device.messages.clear()
+
+def test_frames_parsing():
+    """Frames headers and LE packets are parsed, CRCs are checked by batch.
+    """
+    stream = UbertoothStream(FakeUbertooth(), ring_size=4)
+    frames = [
+        make_frame(0x8e89bed6, ADV_IND, channel=24, clk_100ns=123456, rssi_min=-20),
+        make_frame(0x8e89bed6, ADV_IND, valid=False),
+        make_frame(0x8e89bed6, ADV_IND, packet_type=UbertoothPacketTypes.KEEP_ALIVE),
+    ]
+    stream.push(b"".join(frames))
+    assert len(stream) == 3
+    frames = stream.read_frames()
+    assert len(stream) == 0 and stream.read_frames(timeout=0) == []
+
+    assert frames[0][:5] == (UbertoothPacketTypes.LE_PACKET, 0, 24, 123456, -20)
+    assert frames[2].packet_type == UbertoothPacketTypes.KEEP_ALIVE
+    packets = [split_le_packet(frame) for frame in frames[:2]] + [None]
+    assert packets[0] == (0x8e89bed6, ADV_IND, crc(ADV_IND))
+    assert check_crcs(packets, 0x555555) == [True, False, None]
+
+def test_ring_overflow():
+    stream = UbertoothStream(FakeUbertooth(), ring_size=4)
+    frames = [make_frame(0x8e89bed6, ADV_IND, clk_100ns=i) for i in range(7)]
+    stream.push(b"".join(frames[:3]))
+    assert [frame.clk_100ns for frame in stream.read_frames(max_frames=2)] == [0, 1]
+    stream.push(b"".join(frames[3:]))
+    assert stream.overflows == 1
+    assert [frame.clk_100ns for frame in stream.read_frames()] == [2, 3, 4, 5]
+
+def test_multiple_frames_per_transfer():
+    usb_device = FakeUbertooth(
+        [make_frame(0x8e89bed6, ADV_IND, clk_100ns=i) for i in range(10)]
+    )
+    stream = UbertoothStream(usb_device, frames_per_transfer=4, timeout=10)
+    stream.start()
+    frames = []
+    deadline = perf_counter() + 2.0
+    while len(frames) < 10 and perf_counter() < deadline:
+        frames += stream.read_frames(timeout=0.1)
+    stream.stop()
+    assert [frame.clk_100ns for frame in frames] == list(range(10))
+    assert usb_device.transfers == 3
+
+def test_stream_disconnection():
+    """A disconnected device stops the stream and wakes up the waiting reader.
+    """
+    usb_device = FakeUbertooth()
+    def unplugged(endpoint, buffer, timeout=None):
+        sleep(0.05)
+        raise USBError("no such device", errno=19)
+    usb_device.read = unplugged
+    stream = UbertoothStream(usb_device, timeout=10)
+    stream.start()
+    start = perf_counter()
+    assert stream.read_frames(timeout=5.0) == []
+    assert perf_counter() - start < 1.0
+    assert not stream.running and stream.disconnected
+    assert stream.errors == 1
+    stream.stop()
+
+def test_device_disconnection(device, usb_device):
+    """Reads fail once the dongle has been unplugged, the stream is not restarted.
+    """
+    start(device, device.hub.ble.create_sniff_adv(37))
+    def unplugged(endpoint, buffer, timeout=None):
+        raise USBError("no such device", errno=19)
+    usb_device.read = unplugged
+    sleep(0.3)
+    with pytest.raises(WhadDeviceDisconnected):
+        device.read()
+
+def test_sniff_advertisements(device, usb_device):
+    start(device, device.hub.ble.create_sniff_adv(38))
+    usb_device.frames.extend([
+        make_frame(0x8e89bed6, ADV_IND, channel=24, clk_100ns=123456, rssi_min=-20),
+        make_frame(0x8e89bed6, ADV_IND, channel=24, valid=False),
+        make_frame(0x8e89bed6, ADV_IND, packet_type=UbertoothPacketTypes.KEEP_ALIVE),
+        # Empty data PDU, filtered
+        make_frame(0x12345678, b"\x01\x00"),
+        make_frame(0x8e89bed6, ADV_IND, channel=78),
+    ])
+    messages = device.wait_messages(3)
+    sleep(0.1)
+    assert len(messages) == 3
+    assert [msg.pdu for msg in messages] == [ADV_IND] * 3
+    assert [msg.crc_validity for msg in messages] == [True, False, True]
+    assert [msg.channel for msg in messages] == [38, 38, 39]
+    assert messages[0].crc == int.from_bytes(crc(ADV_IND), "big")
+    assert (messages[0].access_address, messages[0].rssi, messages[0].timestamp) == \
+        (0x8e89bed6, -74, 12346)
+
+def test_address_filter(device, usb_device):
+    start(device, device.hub.ble.create_sniff_adv(37, BDAddress("11:22:33:44:55:66")))
+    other_adv = ADV_IND[:2] + bytes(6) + ADV_IND[8:]
+    usb_device.frames.extend([
+        make_frame(0x8e89bed6, other_adv),
+        make_frame(0x8e89bed6, ADV_IND),
+    ])
+    sleep(0.3)
+    assert [msg.pdu for msg in device.messages] == [ADV_IND]
+
+def test_sniff_new_connection(device, usb_device):
+    """Packets following a connection request are checked with its CRCInit.
+    """
+    start(device, device.hub.ble.create_sniff_connreq(37, show_adv=True))
+    usb_device.frames.extend([
+        make_frame(0x8e89bed6, CONNECT_IND),
+        make_frame(CONN_ACCESS_ADDRESS, b"\x01\x00", crc_init=CONN_CRC_INIT),
+        make_frame(CONN_ACCESS_ADDRESS, b"\x02\x01\x00", crc_init=CONN_CRC_INIT),
+    ])
+    messages = device.wait_messages(3)
+    sleep(0.1)
+    assert [msg.message_name for msg in messages] == ["raw_pdu", "synchronized", "raw_pdu"]
+    synchronized = messages[1]
+    assert (synchronized.access_address, synchronized.crc_init) == \
+        (CONN_ACCESS_ADDRESS, CONN_CRC_INIT)
+    assert (messages[2].access_address, messages[2].pdu, messages[2].crc_validity) == \
+        (CONN_ACCESS_ADDRESS, b"\x02\x01\x00", True)
+
+def test_sniff_access_addresses(device, usb_device):
+    start(device, device.hub.ble.create_sniff_access_address([37]))
+    usb_device.frames.extend([
+        make_frame(0x8e89bed6, ADV_IND, clk_100ns=50, rssi_min=-10),
+        make_frame(0x00000000, b"\x01\x00"),
+    ])
+    messages = device.wait_messages(1)
+    sleep(0.1)
+    assert [(msg.access_address, msg.rssi, msg.timestamp) for msg in messages] == [
+        (0x8e89bed6, -64, 5)
+    ]
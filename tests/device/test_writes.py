@@ -0,0 +1,120 @@
+"""WHAD device framed writes tests.
+"""
+from time import sleep
+
+import pytest
+
+from whad.device import WhadDevice, WhadDeviceConnector
+from whad.device.framing import WhadFrameDecoder
+from whad.exceptions import WhadDeviceError, WhadDeviceNotReady, WhadDeviceDisconnected
+
+class RecordingDevice(WhadDevice):
+    """Device recording every write, accepting at most `chunk` bytes per write.
+    """
+
+    INTERFACE_NAME = "recording"
+
+    @classmethod
+    def list(cls):
+        return []
+
+    def __init__(self, chunk: int = None):
+        super().__init__()
+        self.chunk = chunk
+        self.writes = []
+
+    def write(self, data):
+        if self.chunk is not None:
+            data = data[:self.chunk]
+        self.writes.append(bytes(data))
+        return len(data)
+
+class BrokenDevice(RecordingDevice):
+    """Device unable to write anything.
+    """
+
+    INTERFACE_NAME = "broken"
+
+    def write(self, data):
+        return 0
+
+@pytest.fixture
+def message():
+    device = RecordingDevice()
+    return device.hub.discovery.create_info_query(0x0100)
+
+def decode(writes):
+    return WhadFrameDecoder().feed(b"".join(writes))
+
+def test_single_write(message):
+    device = RecordingDevice()
+    device.send_message(message)
+    assert len(device.writes) == 1
+    assert decode(device.writes) == [message.serialize()]
+
+def test_partial_writes(message):
+    device = RecordingDevice(chunk=3)
+    device.send_message(message)
+    assert len(device.writes) > 1
+    assert decode(device.writes) == [message.serialize()]
+
+def test_failed_write(message):
+    device = BrokenDevice()
+    with pytest.raises(WhadDeviceError):
+        device.send_message(message)
+
+def test_coalescing_max_size(message):
+    frame_size = len(message.serialize()) + 4
+    device = RecordingDevice()
+    device.enable_write_coalescing(deadline=10.0, max_size=3*frame_size)
+    for _ in range(6):
+        device.send_message(message)
+    assert len(device.writes) == 2
+    assert decode(device.writes) == [message.serialize()]*6
+
+def test_coalescing_deadline(message):
+    device = RecordingDevice()
+    device.enable_write_coalescing(deadline=0.01)
+    for _ in range(5):
+        device.send_message(message)
+    assert len(device.writes) == 0
+    sleep(0.2)
+    assert len(device.writes) == 1
+    assert decode(device.writes) == [message.serialize()]*5
+
+def test_coalescing_disabled(message):
+    device = RecordingDevice()
+    device.enable_write_coalescing(deadline=10.0)
+    device.send_message(message)
+    device.disable_write_coalescing()
+    assert decode(device.writes) == [message.serialize()]
+    device.send_message(message)
+    assert len(device.writes) == 2
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnhandledThreadExceptionWarning")
+@pytest.mark.parametrize("error", [
+    None, WhadDeviceNotReady(), WhadDeviceDisconnected(), OSError(5, "Input/output error")
+])
+def test_coalescing_deadline_error(message, monkeypatch, error):
+    """Write errors raised from the coalescing timer are reported, and the device closed.
+    """
+    device = BrokenDevice()
+    if error is not None:
+        def failing_write(data):
+            raise error
+        monkeypatch.setattr(device, "write", failing_write)
+    connector = WhadDeviceConnector(device)
+    errors = []
+    connector.attach_error_callback(lambda error, context=None: errors.append(error))
+    closed = []
+    monkeypatch.setattr(device, "close", lambda: closed.append(True))
+
+    device.enable_write_coalescing(deadline=0.01)
+    device.send_message(message)
+    sleep(0.2)
+    assert len(errors) == 1
+    if error is None:
+        assert isinstance(errors[0], WhadDeviceError)
+    else:
+        assert errors[0] is error
+    assert closed == [True]
@@ -0,0 +1,219 @@
+"""YardStick One receive engine tests, using a mocked USB device.
+"""
+from collections import deque
+from struct import pack, unpack
+from threading import Condition
+from time import sleep, perf_counter
+
+import pytest
+from usb.core import USBError, USBTimeoutError
+
+import whad.device.virtual.yard as yard
+from whad.device.virtual.yard import YardStickOneDevice, SWAP_BITS_TABLE
+from whad.device.virtual.yard.constants import YardApplications, YardNICCommands, \
+    YardStickOneEndPoints, YardSystemCommands, YardRadioStructure
+from whad.device.virtual.yard.stream import YardStickOneStream
+from whad.exceptions import WhadDeviceDisconnected
+from whad.helpers import swap_bits
+
+
+def response(app, verb, data=b""):
+    """Build a response, as received from the IN endpoint.
+    """
+    return b"@" + bytes([app, verb]) + pack("<H", len(data)) + data
+
+
+class FakeYardStickOne:
+    """Mocked `usb.core.Device`, answering commands and streaming received packets
+    once the RECV command has been sent.
+    """
+    bus = 1
+    address = 2
+    iManufacturer = 1
+    serial_number = "0042"
+
+    def __init__(self):
+        self.memory = bytearray(YardRadioStructure.MEMORY_SIZE)
+        self.responses = deque()
+        self.packets = deque()
+        self.receiving = False
+        self.commands = []
+        self.condition = Condition()
+
+    def set_configuration(self):
+        pass
+
+    def write(self, endpoint, message, timeout=None):
+        assert endpoint == YardStickOneEndPoints.OUT_ENDPOINT
+        app, verb, size = unpack("<BBH", message[:4])
+        data = message[4:4 + size]
+        self.commands.append((app, verb))
+
+        answer = b""
+        if (app, verb) == (YardApplications.SYSTEM, YardSystemCommands.PEEK):
+            size, address = unpack("<HH", data)
+            offset = address - YardRadioStructure.BASE_ADDRESS
+            answer = bytes(self.memory[offset:offset + size]).ljust(size, b"\x00")
+        elif (app, verb) == (YardApplications.SYSTEM, YardSystemCommands.POKE):
+            offset = unpack("<H", data[:2])[0] - YardRadioStructure.BASE_ADDRESS
+            if 0 <= offset < len(self.memory):
+                self.memory[offset:offset + len(data) - 2] = data[2:]
+        elif (app, verb) == (YardApplications.SYSTEM, YardSystemCommands.BUILDTYPE):
+            answer = b"YARDSTICKONE r0543\x00"
+        elif (app, verb) == (YardApplications.NIC, YardNICCommands.RECV):
+            self.receiving = True
+            answer = b"\xC8"
+
+        with self.condition:
+            self.responses.append(response(app, verb, answer))
+            self.condition.notify_all()
+        return len(message)
+
+    def read(self, endpoint, size, timeout=None):
+        assert endpoint == YardStickOneEndPoints.IN_ENDPOINT
+        with self.condition:
+            if len(self.responses) > 0:
+                return self.responses.popleft()
+            if self.receiving and len(self.packets) > 0:
+                return response(YardApplications.NIC, YardNICCommands.RECV,
+                                self.packets.popleft())
+            self.condition.wait(timeout / 1000)
+        raise USBTimeoutError("timeout")
+
+
+class CollectingYardStickOneDevice(YardStickOneDevice):
+    """YardStick One device keeping messages instead of sending them to a connector.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.messages = []
+        super().__init__(*args, **kwargs)
+
+    def _send_whad_message(self, message):
+        self.messages.append(message)
+
+    def wait_messages(self, count, timeout=5.0):
+        deadline = perf_counter() + timeout
+        while len(self.messages) < count and perf_counter() < deadline:
+            sleep(0.01)
+        return self.messages
+
+
+@pytest.fixture
+def usb_device(monkeypatch):
+    usb_device = FakeYardStickOne()
+    monkeypatch.setattr(yard, "find", lambda **kwargs: iter([usb_device]))
+    monkeypatch.setattr(yard, "get_string", lambda device, index: "Great Scott Gadgets")
+    return usb_device
+
+@pytest.fixture
+def device(usb_device):
+    device = CollectingYardStickOneDevice()
+    device.open()
+    yield device
+    device.close()
+
+def sniff(device, little=False):
+    device.send_message(device.hub.phy.create_set_endianness(little))
+    device.send_message(device.hub.phy.create_sniff_mode())
+    device.send_message(device.hub.phy.create_start())
+    device.messages.clear()
+
+def test_swap_bits_table():
+    data = bytes(range(256))
+    assert data.translate(SWAP_BITS_TABLE) == bytes(swap_bits(i) for i in data)
+
+def test_stream_routing():
+    """Command responses are handed over to the waiting command, packets are queued.
+    """
+    responses = deque([
+        (YardApplications.NIC, YardNICCommands.RECV, b"\xC8"),
+        (YardApplications.NIC, YardNICCommands.RECV, b"foo"),
+        (YardApplications.SYSTEM, YardSystemCommands.PING, b"pong"),
+        (YardApplications.NIC, YardNICCommands.RECV, b"bar"),
+    ])
+    def read_response(timeout):
+        if len(responses) == 0:
+            sleep(timeout/1000)
+            return (None, None, None)
+        return responses.popleft()
+
+    stream = YardStickOneStream(read_response, timeout=10)
+    stream.expect(YardApplications.SYSTEM, YardSystemCommands.PING)
+    stream.start()
+    assert stream.wait_response(timeout=1.0) == b"pong"
+    sleep(0.05)
+    packets = stream.read_packets(timeout=1.0)
+    stream.stop()
+
+    assert [data for _, data in packets] == [b"foo", b"bar"]
+    assert packets[0][0] <= packets[1][0]
+    assert stream.received == 2 and stream.dropped == 0
+
+def test_stream_disconnection():
+    """A disconnected device stops the stream and wakes up the waiting command.
+    """
+    errors = deque([USBError("pipe error", errno=32)])
+    def read_response(timeout):
+        if len(errors) > 0:
+            raise errors.popleft()
+        sleep(0.05)
+        raise USBError("no such device", errno=19)
+
+    stream = YardStickOneStream(read_response, timeout=10)
+    stream.expect(YardApplications.SYSTEM, YardSystemCommands.PING)
+    stream.start()
+    start = perf_counter()
+    assert stream.wait_response(timeout=5.0) is None
+    assert perf_counter() - start < 1.0
+    assert not stream.running and stream.disconnected
+    assert stream.errors == 2
+    stream.stop()
+
+def test_device_disconnection(device, usb_device):
+    """Commands and reads fail once the dongle has been unplugged.
+    """
+    def unplugged(endpoint, size, timeout=None):
+        raise USBError("no such device", errno=19)
+    usb_device.read = unplugged
+    sleep(0.3)
+    assert device._yard_send_command(YardApplications.SYSTEM, YardSystemCommands.PING) is None
+    with pytest.raises(WhadDeviceDisconnected):
+        device.read()
+
+def test_sniff(device, usb_device):
+    sniff(device)
+    usb_device.packets.extend([b"\x01\x02\x03", b"\xAA" * 10])
+    messages = device.wait_messages(2)
+    assert [msg.packet for msg in messages] == [b"\x01\x02\x03", b"\xAA" * 10]
+    assert messages[0].timestamp <= messages[1].timestamp
+
+    # Bits are swapped if endianness is little
+    device.send_message(device.hub.phy.create_stop())
+    sniff(device, little=True)
+    usb_device.packets.extend([b"\x01\x02\x03"])
+    messages = device.wait_messages(1)
+    assert [msg.packet for msg in messages] == [b"\x80\x40\xc0"]
+
+def test_sustained_rate(device, usb_device):
+    """Packets are received continuously, without command round-trips.
+    """
+    nb_packets = 10000
+    packets = [i.to_bytes(4, "big") + bytes(28) for i in range(nb_packets)]
+    sniff(device)
+    usb_device.commands.clear()
+
+    # Packets are received by bursts of 500 packets
+    for i in range(0, nb_packets, 500):
+        with usb_device.condition:
+            usb_device.packets.extend(packets[i:i + 500])
+            usb_device.condition.notify_all()
+        device.wait_messages(i, timeout=10.0)
+    messages = device.wait_messages(nb_packets, timeout=10.0)
+
+    assert [msg.packet for msg in messages] == packets
+    timestamps = [msg.timestamp for msg in messages]
+    assert timestamps == sorted(timestamps)
+
+    # Radio configuration is read once, not for every packet
+    assert len(usb_device.commands) < 10
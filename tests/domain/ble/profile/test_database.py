@@ -0,0 +1,131 @@
+"""Test WHAD BLE GATT attribute database.
+"""
+import pytest
+
+from whad.ble.profile import GenericProfile
+from whad.ble.profile.attribute import Attribute, UUID
+from whad.ble.profile.database import AttributeDatabase
+from whad.ble.profile.service import PrimaryService
+from whad.ble.profile.characteristic import Characteristic, CharacteristicProperties, \
+    CharacteristicValue, ClientCharacteristicConfig
+
+
+def make_service(uuid: int, nb_characs: int) -> PrimaryService:
+    """Create a primary service with notifying characteristics.
+    """
+    service = PrimaryService(uuid=UUID(uuid), handle=0)
+    for i in range(nb_characs):
+        charac = Characteristic(
+            uuid=UUID(uuid + i + 1),
+            properties=CharacteristicProperties.READ | CharacteristicProperties.NOTIFY,
+            value=b"foo"
+        )
+        charac.add_descriptor(ClientCharacteristicConfig(characteristic=charac, notify=True))
+        service.add_characteristic(charac)
+    return service
+
+@pytest.fixture
+def database():
+    db = AttributeDatabase()
+    for handle in (5, 1, 3, 2, 4):
+        db.add(Attribute(uuid=UUID(0x2800 + handle % 2), handle=handle))
+    return db
+
+def test_database_sorted(database: AttributeDatabase):
+    """Attributes are enumerated by handle, whatever the registration order.
+    """
+    assert len(database) == 5
+    assert [attr.handle for attr in database] == [1, 2, 3, 4, 5]
+    assert 3 in database and 6 not in database
+    assert database[4].handle == 4
+
+def test_database_replace(database: AttributeDatabase):
+    """Registering an attribute with a used handle replaces the existing one.
+    """
+    attr = Attribute(uuid=UUID(0x2803), handle=3)
+    database.add(attr)
+    assert len(database) == 5
+    assert database[3] is attr
+    assert [a.handle for a in database.find_by_type(UUID(0x2801))] == [1, 5]
+    assert list(database.find_by_type(UUID(0x2803))) == [attr]
+
+def test_database_handle_update(database: AttributeDatabase):
+    """An attribute registered again after a handle change is reindexed.
+    """
+    attr = database[2]
+    attr.handle = 10
+    database.add(attr)
+    assert [a.handle for a in database] == [1, 3, 4, 5, 10]
+    assert [a.handle for a in database.find_by_type(UUID(0x2800))] == [4, 10]
+
+    # Attribute is removed based on its registration, not its current handle
+    attr.handle = 20
+    assert database.remove(attr)
+    assert not database.remove(attr)
+    assert [a.handle for a in database] == [1, 3, 4, 5]
+
+def test_database_ranges(database: AttributeDatabase):
+    assert [a.handle for a in database.find_range(2, 4)] == [2, 3, 4]
+    assert [a.handle for a in database.iter_range(4, 0xFFFF)] == [4, 5]
+    assert database.find_range(6, 10) == []
+    assert [a.handle for a in database.find_by_type(UUID(0x2801), start=2, end=5)] == [3, 5]
+    assert [a.handle for a in database.find_by_type(UUID(0x2801), UUID(0x2800), start=2)] == \
+        [2, 3, 4, 5]
+    assert list(database.find_by_type(UUID(0x2802))) == []
+
+def test_database_by_uuid():
+    """Services and characteristics are found by their own UUID.
+    """
+    profile = GenericProfile()
+    profile.add_service(make_service(0x1000, 2))
+    db = AttributeDatabase()
+    for attr in profile.attr_by_range():
+        db.add(attr)
+
+    assert [type(a) for a in db.find_by_uuid(UUID(0x1000))] == [PrimaryService]
+    assert [type(a) for a in db.find_by_uuid(UUID(0x1002))] == \
+        [Characteristic, CharacteristicValue]
+    assert [a.handle for a in db.find_by_uuid(UUID(0x2902))] == [4, 7]
+
+def test_profile_update_service():
+    """Profile indexes are kept consistent when services are updated.
+    """
+    profile = GenericProfile()
+    first = make_service(0x1000, 1)
+    second = make_service(0x2000, 1)
+    profile.add_service(first)
+    profile.add_service(second)
+    assert (first.end_handle, second.handle) == (4, 5)
+
+    # Add a characteristic to the first service, moving the second one
+    first.add_characteristic(Characteristic(uuid=UUID(0x1010),
+                                            properties=CharacteristicProperties.READ))
+    assert profile.update_service(first)
+    assert second.handle == first.end_handle + 1
+    handles = [attr.handle for attr in profile.attr_by_range()]
+    assert handles == list(range(1, second.end_handle + 1))
+    assert profile.find_object_by_handle(second.handle) is second
+    assert profile.get_characteristic_by_uuid(UUID(0x2001)).handle == second.handle + 1
+    assert [s.uuid for s in profile.services()] == [UUID(0x1000), UUID(0x2000)]
+    assert profile.find_characteristic_end_handle(2) == 4
+
+    profile.remove_service(first)
+    assert profile.get_service_by_uuid(UUID(0x1000)) is None
+    assert profile.get_characteristic_by_uuid(UUID(0x1010)) is None
+    assert profile.find_objects_by_range(1, first.end_handle) == []
+    assert [s.uuid for s in profile.services()] == [UUID(0x2000)]
+
+def test_large_profile_lookups():
+    """Lookups in a large profile return the expected attributes.
+    """
+    profile = GenericProfile()
+    for i in range(200):
+        profile.add_service(make_service(0x8000 + i*0x40, 10))
+    nb_attributes = len(list(profile.attr_by_range()))
+    assert nb_attributes == 200*(1 + 10*3)
+
+    for i in range(1000):
+        handle = 1 + (i*37) % nb_attributes
+        assert profile.find_objects_by_range(handle, handle + 3)[0].handle == handle
+        assert profile.get_service_by_uuid(UUID(0x8000 + (i % 200)*0x40)) is not None
+        next(profile.attr_by_type_uuid(UUID(0x2803), start=handle))
@@ -9,6 +9,7 @@ the ATT layer is working as expected:
 
 '''
 import pytest
+from threading import Timer
 
 from scapy.layers.bluetooth import *
 
@@ -23,6 +24,7 @@ from whad.ble.stack.att.exceptions import *
 from whad.ble.stack.gatt import GattLayer, GattClient, GattServer
 from whad.ble.stack.gatt.message import *
 from whad.ble.stack.gatt.exceptions import GattTimeoutException
+from whad.ble.exceptions import ConnectionLostException
 
 from whad.ble.profile import GenericProfile, Characteristic, PrimaryService as BlePrimaryService
 from whad.ble.profile.service import PrimaryService
@@ -112,6 +114,12 @@ class TestGatt(GattTest):
             GattWriteResponse
         )
 
+    def test_wait_for_message_terminated(self, gatt):
+        # Connection termination wakes up a waiting procedure
+        Timer(0.05, gatt.terminate).start()
+        with pytest.raises(ConnectionLostException):
+            gatt.wait_for_message(GattWriteResponse, timeout=5.0)
+
 
 #######################
 # GATT/L2CAP tests
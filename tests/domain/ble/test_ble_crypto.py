@@ -1,7 +1,17 @@
-from whad.ble.crypto import e,em1,s1,aes_cmac,xor,c1,c1m1,ah,f4,f5,f6,g2,h6,h7,LinkLayerCryptoManager
-from whad.protocol.ble.ble_pb2 import BleDirection
+import os
+from threading import Event
+
+from scapy.utils import rdpcap
+from scapy.layers.bluetooth4LE import BTLE, BTLE_DATA
+
+from whad.ble.crypto import e,em1,s1,aes_cmac,xor,c1,c1m1,ah,f4,f5,f6,g2,h6,h7,LinkLayerCryptoManager, \
+    LegacyPairingCracker, LegacyPairingCracking, LinkLayerSession, LinkLayerDecryptor
+from whad.ble.exceptions import MissingCryptographicMaterial
+from whad.hub.ble import Direction as BleDirection
 import pytest
 
+PCAPS = os.path.join(os.path.dirname(__file__), "..", "..", "..", "whad", "resources", "pcaps")
+
 @pytest.mark.parametrize("test_input, expected", [
 (("6fd5a34b151b814a6862123af5042986", "30750bfc537ed6e8b8760ba26e7e449c"), "58df56e513175d4b07574c7a086a8656"),
 (("9ca466f44746c248b927ce560fda193b", "3b35320801d9856370a187a656d3f0bb"), "dd47561145876763399faa5bd754a158"),
@@ -260,3 +270,102 @@ def test_LinkLayerCryptoManager(test_input, expected):
     llcm_ciphertext = llcm.encrypt(result,direction)
     assert valid and result == expected and llcm_ciphertext == ciphertext
 '''
+
+
+def legacy_pairing_material(tk):
+    r = bytes.fromhex("5783D52156AD6F0E6388274EC6702EE0")
+    pres, preq = bytes.fromhex("05000800000302"), bytes.fromhex("07071000000101")
+    iat, ia = b"\x01", bytes.fromhex("A1A2A3A4A5A6")
+    rat, ra = b"\x00", bytes.fromhex("B1B2B3B4B5B6")
+    confirm = c1(tk.to_bytes(16, "big"), r, pres, preq, iat, ia, rat, ra)
+    return r, confirm, pres, preq, iat, ia, rat, ra
+
+@pytest.mark.parametrize("tk, processes", [(0, 1), (12345, 1), (31337, 2)])
+def test_LegacyPairingCracker(tk, processes):
+    cracker = LegacyPairingCracker(*legacy_pairing_material(tk), processes=processes,
+                                   chunk_size=10000)
+    assert cracker.crack() == tk.to_bytes(16, "big")
+    assert tk < cracker.candidates <= tk + 10000*processes
+    if processes == 1:
+        # Only values actually tested are counted
+        assert cracker.candidates == tk + 1
+    assert cracker.rate > 0
+
+def test_LegacyPairingCracker_background():
+    found = Event()
+    cracker = LegacyPairingCracker(*legacy_pairing_material(15000), processes=1,
+                                   chunk_size=10000)
+    cracker.start(lambda tk: found.set())
+    assert found.wait(5.0)
+    cracker.join()
+    assert cracker.tk == (15000).to_bytes(16, "big")
+
+    # Search is stopped once cancelled
+    cracker = LegacyPairingCracker(*legacy_pairing_material(999999), processes=1,
+                                   chunk_size=1000)
+    cracker.start()
+    cracker.cancel()
+    cracker.join(5.0)
+    assert not cracker.running
+    assert cracker.tk is None and cracker.candidates < 100000
+
+def test_LegacyPairingCracking():
+    analyzer = LegacyPairingCracking()
+    for packet in rdpcap(os.path.join(PCAPS, "ble_pairing.pcap")):
+        analyzer.process_packet(packet[BTLE])
+        if analyzer.ready:
+            break
+    assert analyzer.keys == (
+        bytes(16), bytes.fromhex("f72fa81ee5e86708243e920107de31b9")
+    )
+
+def test_LinkLayerSession():
+    material = (0x7d027501426377a9, 0x6c71f00a, 0x102c2869b542e91c, 0xcd59cff4)
+    ltk = bytes.fromhex("7f62c053f104a5bbe68b1d896a2ed49c")
+    llcm = LinkLayerCryptoManager(ltk, *material)
+    session = LinkLayerSession(ltk, *material)
+    plaintext = bytes.fromhex("0e0f07000400080100ffff002a")
+
+    # Expected counters of both directions are followed
+    for direction, counter in ((BleDirection.MASTER_TO_SLAVE, 0),
+                               (BleDirection.SLAVE_TO_MASTER, 0),
+                               (BleDirection.MASTER_TO_SLAVE, 1),
+                               # Lost PDU
+                               (BleDirection.MASTER_TO_SLAVE, 3),
+                               (BleDirection.SLAVE_TO_MASTER, 1),
+                               # Retransmitted PDU
+                               (BleDirection.SLAVE_TO_MASTER, 1)):
+        llcm.update_master_counter(counter)
+        llcm.update_slave_counter(counter)
+        ciphertext = llcm.encrypt(plaintext, direction)
+        assert session.decrypt(ciphertext) == (plaintext, direction)
+    assert session.counters == {
+        BleDirection.MASTER_TO_SLAVE: 4,
+        BleDirection.SLAVE_TO_MASTER: 2
+    }
+
+    # Out of window counter
+    llcm.update_master_counter(10)
+    assert session.decrypt(llcm.encrypt(plaintext, BleDirection.MASTER_TO_SLAVE)) is None
+
+def test_LinkLayerDecryptor():
+    stk = bytes.fromhex("f72fa81ee5e86708243e920107de31b9")
+    decryptor = LinkLayerDecryptor(b"\x11"*16, b"\x22"*16)
+    packets = [packet[BTLE] for packet in rdpcap(os.path.join(PCAPS, "ble_pairing.pcap"))]
+    with pytest.raises(MissingCryptographicMaterial):
+        decryptor.attempt_to_decrypt(packets[-1])
+
+    # Unknown key
+    decrypted = [pdu for _, pdu in decryptor.decrypt_packets(packets) if pdu is not None]
+    assert len(decrypted) == 0 and len(decryptor.material) == 1
+
+    decryptor = LinkLayerDecryptor(b"\x11"*16, b"\x22"*16, stk)
+    decrypted = [pdu for _, pdu in decryptor.decrypt_packets(packets) if pdu is not None]
+    assert len(decrypted) == 82
+    assert decrypted[0][BTLE_DATA].LLID == 3
+
+    # Session is bound to the connection access address
+    access_address = packets[-1].access_addr
+    assert list(decryptor.sessions) == [access_address]
+    assert decryptor.sessions[access_address].key == stk
+    assert len(decryptor.material) == 0
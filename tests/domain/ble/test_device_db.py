@@ -1,6 +1,12 @@
 """Test device database used when scanning BLE devices.
 """
-from scapy.layers.bluetooth4LE import BTLE, BTLE_ADV, BTLE_ADV_IND
+from time import sleep, perf_counter
+
+import pytest
+
+from scapy.layers.bluetooth import EIR_Hdr, EIR_CompleteLocalName
+from scapy.layers.bluetooth4LE import BTLE, BTLE_ADV, BTLE_ADV_IND, BTLE_SCAN_RSP
+from whad.hub.ble import AdvType
 from whad.hub.ble.bdaddr import BDAddress
 from whad.ble.scanning import AdvertisingDevice, AdvertisingDevicesDB
 
@@ -35,3 +41,106 @@ def test_dev_db_scanrsp():
     db.find_device("00:11:22:33:44:BB").set_scan_rsp(None)
     devices = db.on_device_found(-35, pkt, None)
     assert len(devices) == 1
+
+def test_dev_db_raw_advertisements(monkeypatch):
+    """Advertisements provided as raw fields, AD records are parsed on access.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0.05)
+    db = AdvertisingDevicesDB()
+    address = BDAddress("00:11:22:33:44:01").value
+    assert db.on_advertisement(-40, AdvType.ADV_NONCONN_IND, 1, address, b"\x02\x01\x06") == []
+    devices = db.on_advertisement(-40, AdvType.ADV_SCAN_RSP, 1, address, b"\x04\x09foo")
+    assert [(dev.address, dev.address_type, dev.connectable) for dev in devices] == [
+        ("00:11:22:33:44:01", 1, False)
+    ]
+    assert devices[0].name == "foo"
+    assert devices[0].adv_records.to_bytes() == b"\x02\x01\x06"
+
+    # Records exceeding advertising data are ignored
+    address = BDAddress("00:11:22:33:44:02").value
+    db.on_advertisement(-40, AdvType.ADV_IND, 0, address, b"\x05\x09foo")
+    assert db.find_device("00:11:22:33:44:02") is None
+
+    # Malformed records are only detected once parsed
+    db.on_advertisement(-40, AdvType.ADV_IND, 0, address, b"\x01\x01")
+    assert len(db.find_device("00:11:22:33:44:02").ad_records) == 0
+
+def adv_ind(address, scan_rsp=False):
+    layer = BTLE_SCAN_RSP if scan_rsp else BTLE_ADV_IND
+    return BTLE()/BTLE_ADV()/layer(AdvA=address, data=[EIR_Hdr()/EIR_CompleteLocalName(
+        local_name=b"foo")])
+
+def test_dev_db_scan_rsp_timeout(monkeypatch):
+    """Devices are reported once, on scan response or after the scan response timeout.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0.05)
+    db = AdvertisingDevicesDB()
+    assert db.on_device_found(-40, adv_ind("00:11:22:33:44:01"), None) == []
+    assert db.on_device_found(-40, adv_ind("00:11:22:33:44:02"), None) == []
+
+    devices = db.on_device_found(-40, adv_ind("00:11:22:33:44:02", scan_rsp=True), None)
+    assert [device.address for device in devices] == ["00:11:22:33:44:02"]
+    assert devices[0].got_scan_rsp and devices[0].name == "foo"
+
+    sleep(0.1)
+    devices = db.on_device_found(-40, adv_ind("00:11:22:33:44:02"), None)
+    assert [device.address for device in devices] == ["00:11:22:33:44:01"]
+    assert not devices[0].got_scan_rsp
+    assert db.on_device_found(-40, adv_ind("00:11:22:33:44:01"), None) == []
+
+def test_dev_db_eviction():
+    db = AdvertisingDevicesDB(max_devices=2)
+    for i in range(3):
+        db.on_device_found(-40, adv_ind(f"00:11:22:33:44:0{i}"), None)
+    # Device 0 is seen again, device 1 is the least recently seen
+    db.on_device_found(-40, adv_ind("00:11:22:33:44:00"), None)
+    db.on_device_found(-40, adv_ind("00:11:22:33:44:03"), None)
+    assert len(db) == 2
+    assert db.find_device("00:11:22:33:44:01") is None
+    assert db.find_device("00:11:22:33:44:00") is not None
+
+    db = AdvertisingDevicesDB(max_age=0.05)
+    db.on_device_found(-40, adv_ind("00:11:22:33:44:00"), None)
+    sleep(0.1)
+    db.on_device_found(-40, adv_ind("00:11:22:33:44:01"), None)
+    assert len(db) == 1 and db.find_device("00:11:22:33:44:00") is None
+
+def make_adv_packets(nb_devices: int):
+    return [
+        BTLE(bytes(adv_ind(f"00:11:22:{i >> 16:02x}:{(i >> 8) & 0xff:02x}:{i & 0xff:02x}")))
+        for i in range(nb_devices)
+    ]
+
+def test_dev_db_many_devices(monkeypatch):
+    """Each device is reported once, when its scan response has timed out.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0.1)
+    packets = make_adv_packets(500)
+    db = AdvertisingDevicesDB(max_age=60)
+    reported = 0
+    for i in range(5000):
+        reported += len(db.on_device_found(-40, packets[i % 500], None))
+
+    sleep(0.1)
+    reported += len(db.on_device_found(-40, packets[0], None))
+    assert len(db) == 500
+    assert reported == 500
+
+@pytest.mark.benchmark
+def test_dev_db_benchmark(monkeypatch):
+    """Feed 100k advertisements sent by 5k devices.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0.1)
+    packets = make_adv_packets(5000)
+    db = AdvertisingDevicesDB(max_age=60)
+    reported = 0
+    start = perf_counter()
+    for i in range(100000):
+        reported += len(db.on_device_found(-40, packets[i % 5000], None))
+    duration = perf_counter() - start
+    print(f"{100000/duration:.0f} advertisements/s")
+
+    sleep(0.1)
+    reported += len(db.on_device_found(-40, packets[0], None))
+    assert len(db) == 5000
+    assert reported == 5000
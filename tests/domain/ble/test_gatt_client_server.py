@@ -0,0 +1,185 @@
+'''BLE GATT client against the in-tree GATT server
+
+These tests connect a GATT client stack to a GATT server stack and check the
+client procedures relying on Read Multiple requests and batched descriptors
+discovery, and measure the number of ATT requests needed to enumerate a large
+profile.
+'''
+
+from scapy.layers.bluetooth import ATT_Hdr, ATT_Read_Multiple_Request, ATT_Read_Request
+
+from whad.common.stack import alias
+from whad.common.stack.tests import Sandbox, contextual
+
+from whad.ble.stack.att import ATTLayer
+from whad.ble.stack.att.constants import BleAttOpcode, BleAttErrorCode
+from whad.ble.stack.gatt import GattClient, GattServer
+from whad.ble.profile import GenericProfile, Characteristic, PrimaryService
+from whad.ble.profile.attribute import UUID
+
+
+@alias('l2cap')
+class L2capBridge(Sandbox):
+    '''L2CAP mock forwarding ATT PDUs to a peer stack.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.peer = None
+        self.requests = []
+
+    def get_local_mtu(self):
+        return 23
+    def set_local_mtu(self, mtu):
+        pass
+    def set_remote_mtu(self, mtu):
+        pass
+    def get_conn_handle(self):
+        return 1
+
+    @contextual(True)
+    def dummy_message_handler(self, source, data, tag='default', **kwargs):
+        if tag == 'default' and self.peer is not None:
+            self.requests.append(data)
+            self.peer.send('att', ATT_Hdr(bytes(data)))
+
+class ClientBridge(L2capBridge):
+    pass
+ClientBridge.add(ATTLayer)
+ClientBridge.add(GattClient)
+
+class ServerBridge(L2capBridge):
+    pass
+ServerBridge.add(ATTLayer)
+ServerBridge.add(GattServer)
+
+class LegacyGattServer(GattServer):
+    '''GATT server not supporting Read Multiple requests.
+    '''
+    def on_read_multiple_request(self, request):
+        self.error(BleAttOpcode.READ_MULTIPLE_REQUEST, request.handles[0],
+                   BleAttErrorCode.REQUEST_NOT_SUPP)
+
+class LegacyServerBridge(L2capBridge):
+    pass
+LegacyServerBridge.add(ATTLayer)
+LegacyServerBridge.add(LegacyGattServer)
+
+
+def make_profile(nb_services, nb_characs):
+    '''Build a profile with notifiable characteristics, each of them having a
+    Client Characteristic Configuration and a User Description descriptor.
+    '''
+    services = {}
+    for i in range(nb_services):
+        characs = {}
+        for j in range(nb_characs):
+            characs[f"charac{j}"] = Characteristic(
+                uuid=UUID(0x2A00 + j),
+                permissions=['read', 'write'],
+                notify=True,
+                value=bytes([i, j]) * 4,
+                description=f"Characteristic {i}.{j}"
+            )
+        services[f"service{i}"] = PrimaryService(uuid=UUID(0x1800 + i), **characs)
+    return type("LargeProfile", (GenericProfile,), services)()
+
+def connect(server_profile):
+    client, server = ClientBridge(), ServerBridge()
+    client.peer, server.peer = server, client
+    server.get_layer('gatt').set_model(server_profile)
+    client.get_layer('gatt').set_model(GenericProfile())
+    return client, server
+
+def attributes(profile):
+    '''List attributes (handle, uuid, value) of a profile.
+    '''
+    output = []
+    for service in profile.services():
+        output.append((service.handle, service.uuid))
+        for charac in service.characteristics():
+            output.append((charac.handle, charac.uuid, charac.value_handle))
+            for desc in charac.descriptors():
+                output.append((desc.handle, desc.uuid, desc.value))
+    return output
+
+
+def test_read_multiple():
+    profile = make_profile(1, 4)
+    client, _ = connect(profile)
+    gatt = client.get_layer('gatt')
+    characs = list(profile.services())[0].characteristics()
+    handles = [charac.value_handle for charac in characs]
+
+    assert gatt.read_multiple(handles[:2]) == profile.find_object_by_handle(handles[0] - 1).value + \
+        profile.find_object_by_handle(handles[1] - 1).value
+
+    # Values are split based on sizes, last value size is unknown
+    client.requests.clear()
+    values = gatt.read_many(handles[:2], {handles[0]: 8})
+    assert values == [bytes([0, j]) * 4 for j in range(2)]
+    assert len(client.requests) == 1
+
+    # Last value has been truncated and is read again
+    client.requests.clear()
+    values = gatt.read_many(handles[:3], {handle: 8 for handle in handles[:2]})
+    assert values == [bytes([0, j]) * 4 for j in range(3)]
+    assert len(client.requests) == 2
+    assert ATT_Read_Multiple_Request in client.requests[0]
+
+    # Values exceeding the response size are read in several requests
+    client.requests.clear()
+    values = gatt.read_many(handles, {handle: 8 for handle in handles})
+    assert values == [bytes([0, j]) * 4 for j in range(4)]
+    assert len(client.requests) == 2
+
+def test_read_multiple_full_response():
+    '''Attributes are not read once the response is full.
+    '''
+    profile = make_profile(1, 4)
+    client, _ = connect(profile)
+    gatt = client.get_layer('gatt')
+    handles = [charac.value_handle for charac in list(profile.services())[0].characteristics()]
+
+    lengths = []
+    on_characteristic_read = profile.on_characteristic_read
+    def recording_read(service, charac, offset, length):
+        lengths.append(length)
+        return on_characteristic_read(service, charac, offset, length)
+    profile.on_characteristic_read = recording_read
+
+    # 8-byte values, response holds 22 bytes
+    assert gatt.read_multiple(handles) == bytes([0, 0]) * 4 + bytes([0, 1]) * 4 + \
+        bytes([0, 2]) * 3
+    assert lengths == [22, 14, 6]
+
+def test_read_many_unsupported():
+    '''Attributes are read one by one if Read Multiple is not supported.
+    '''
+    profile = make_profile(1, 3)
+    client, server = ClientBridge(), LegacyServerBridge()
+    client.peer, server.peer = server, client
+    server.get_layer('gatt').set_model(profile)
+    gatt = client.get_layer('gatt')
+    handles = [charac.value_handle for charac in list(profile.services())[0].characteristics()]
+    values = gatt.read_many(handles, {handle: 8 for handle in handles})
+    assert values == [bytes([0, j]) * 4 for j in range(3)]
+    assert sum(1 for request in client.requests if ATT_Read_Request in request) == 3
+
+def test_discover_large_profile():
+    '''Discover a large profile with a limited number of requests.
+    '''
+    profile = make_profile(8, 8)
+    client, _ = connect(profile)
+    gatt = client.get_layer('gatt')
+
+    gatt.discover()
+
+    assert attributes(gatt.model) == attributes(profile)
+    nb_reads = sum(1 for request in client.requests if ATT_Read_Request in request)
+
+    # Descriptors are discovered service by service, and CCC descriptors are
+    # read by groups
+    nb_descriptors = 8 * 8 * 2
+    assert nb_reads < nb_descriptors
+    assert len(client.requests) < 8 * 8 * 3
@@ -1,6 +1,13 @@
-from whad.ble.utils.phy import channel_to_frequency,frequency_to_channel,crc
+import random
+from struct import pack
+from time import perf_counter
+
 import pytest
 
+from whad.helpers import swap_bits
+from whad.ble.utils.phy import channel_to_frequency,frequency_to_channel,crc, \
+    whitening, dewhitening, decoding, check_crc, BLEPhysicalLayerConfiguration
+
 @pytest.mark.parametrize("test_input, expected", [
     ( 2402000000, 37 ),
     ( 2404000000, 0 ),
@@ -105,3 +112,84 @@ def test_crc(test_input, expected):
     data = bytes.fromhex(test_input)
     crc_value = bytes.fromhex(expected)
     assert crc(data) == crc_value
+
+
+def bitwise_crc(data, init=0x555555):
+    """Reference CRC-24, computed bit by bit.
+    """
+    ret = [(init >> 16) & 0xff, (init >> 8) & 0xff, init & 0xff]
+    for d in data:
+        for _ in range(8):
+            t = (ret[0] >> 7) & 1
+            ret[0] = ((ret[0] << 1) | (ret[1] >> 7)) & 0xff
+            ret[1] = ((ret[1] << 1) | (ret[2] >> 7)) & 0xff
+            ret[2] = (ret[2] << 1) & 0xff
+            if d & 1 != t:
+                ret[2] ^= 0x5b
+                ret[1] ^= 0x06
+            d >>= 1
+    return bytes(swap_bits(b) for b in ret)
+
+def bitwise_dewhitening(data, channel):
+    """Reference dewhitening, computed bit by bit.
+    """
+    ret = []
+    lfsr = swap_bits(channel) | 2
+    for d in data:
+        d = swap_bits(d)
+        for i in 128, 64, 32, 16, 8, 4, 2, 1:
+            if lfsr & 0x80:
+                lfsr ^= 0x11
+                d ^= i
+            lfsr = (lfsr << 1) & 0xff
+        ret.append(swap_bits(d))
+    return bytes(ret)
+
+def random_pdus(count, seed=0):
+    rand = random.Random(seed)
+    return [
+        bytes(rand.getrandbits(8) for _ in range(rand.randint(0, 300)))
+        for _ in range(count)
+    ]
+
+def test_crc_random_pdus():
+    rand = random.Random(1)
+    for pdu in random_pdus(500):
+        crc_init = rand.getrandbits(24)
+        assert crc(pdu, crc_init) == bitwise_crc(pdu, crc_init)
+        assert crc(pdu) == bitwise_crc(pdu)
+    assert crc(b"") == bitwise_crc(b"")
+
+@pytest.mark.parametrize("channel", range(40))
+def test_dewhitening(channel):
+    for pdu in random_pdus(20, seed=channel):
+        whitened = whitening(pdu, channel)
+        assert whitened == bitwise_dewhitening(pdu, channel)
+        assert dewhitening(whitened, channel) == pdu
+    assert whitening(b"", channel) == b""
+
+def test_decoding():
+    """Decode a whitened advertising PDU, and check its CRC.
+    """
+    pdu = bytes.fromhex("0215110006000461ca0ce41b1e430559ac74e382667051")
+    pkt = pack("<I", 0x8e89bed6) + pdu + crc(pdu)
+    config = BLEPhysicalLayerConfiguration()
+    whitened = b"\xaa" + pkt[:4] + whitening(pkt[4:] + b"garbage", config.channel)
+    assert decoding(whitened, config) == pkt
+    assert check_crc(pkt, config)
+
+@pytest.mark.benchmark
+def test_benchmark():
+    """Compare bitwise and table-driven implementations on random PDUs.
+    """
+    pdus = random_pdus(1000, seed=2)
+    size = sum(len(pdu) for pdu in pdus)
+    for name, crc_func, whitening_func in (
+        ("bitwise", bitwise_crc, bitwise_dewhitening),
+        ("table-driven", crc, dewhitening)
+    ):
+        start = perf_counter()
+        for pdu in pdus:
+            whitening_func(pdu + crc_func(pdu, 0x123456), 12)
+        duration = perf_counter() - start
+        print(f"{name}: {size/duration/1000:.0f} kB/s")
@@ -0,0 +1,206 @@
+"""BLE scanner tests, using a synthetic loopback device streaming advertisements.
+"""
+from collections import deque
+from threading import Lock
+from time import sleep, perf_counter
+
+import pytest
+from scapy.layers.bluetooth4LE import BTLE_ADV_IND
+
+from whad.ble import Scanner
+from whad.device.device import VirtualDevice
+from whad.helpers import message_filter
+from whad.hub.ble import BDAddress, AdvType, Commands, Direction, BleRawPduReceived
+from whad.hub.discovery import Capability, Domain
+from whad.hub.generic.cmdresult import CommandResult
+from whad.ble.scanning import AdvertisingDevice
+
+ADV_DATA = b"\x02\x01\x06\x09\x09Loopback"
+
+def adv_pdu(address: BDAddress, pdu_type: int = 0, adv_data: bytes = ADV_DATA) -> bytes:
+    """Build an advertising PDU, header included.
+    """
+    payload = address.value + adv_data
+    return bytes([pdu_type | (0x40 if address.is_random() else 0), len(payload)]) + payload
+
+
+class LoopbackDevice(VirtualDevice):
+    """Virtual device streaming the advertisements it has been given.
+    """
+
+    INTERFACE_NAME = "loopback"
+
+    @classmethod
+    def list(cls):
+        return []
+
+    def __init__(self, raw_pdu: bool = True):
+        super().__init__()
+        self.__raw_pdu = raw_pdu
+        self.__messages = deque()
+        self.__lock = Lock()
+
+    def open(self):
+        self._dev_id = b"\x00"*16
+        self._fw_author = b"whad"
+        self._fw_url = b"https://github.com/whad-team/whad-client"
+        self._dev_capabilities = {
+            Domain.BtLE : (
+                Capability.Scan | (0 if self.__raw_pdu else Capability.NoRawData),
+                [Commands.ScanMode, Commands.Start, Commands.Stop]
+            )
+        }
+        super().open()
+
+    def reset(self):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+    def read(self):
+        with self.__lock:
+            messages = list(self.__messages)
+            self.__messages.clear()
+        if len(messages) == 0:
+            sleep(0.01)
+        for message in messages:
+            self._send_whad_message(message)
+
+    def stream(self, messages):
+        """Queue advertisements, received by the next `discover_devices()` call.
+        """
+        self.set_queue_filter(message_filter(type(messages[0])))
+        with self.__lock:
+            self.__messages.extend(messages)
+
+    def _on_whad_ble_scan_mode(self, message):
+        self._send_whad_command_result(CommandResult.SUCCESS)
+
+    def _on_whad_ble_start(self, message):
+        self._send_whad_command_result(CommandResult.SUCCESS)
+
+    def _on_whad_ble_stop(self, message):
+        self._send_whad_command_result(CommandResult.SUCCESS)
+
+
+@pytest.fixture
+def device():
+    device = LoopbackDevice()
+    device.open()
+    yield device
+    device.close()
+
+def raw_pdu(device, pdu, rssi=-40):
+    return device.hub.ble.create_raw_pdu_received(
+        Direction.UNKNOWN, pdu, 0x8e89bed6, rssi=rssi, crc=0, crc_validity=True
+    )
+
+def discover(scanner, count, **kwargs):
+    devices = []
+    for device in scanner.discover_devices(timeout=5.0, **kwargs):
+        devices.append(device)
+        if len(devices) == count:
+            break
+    return devices
+
+@pytest.mark.parametrize("raw_advertisements", [False, True])
+def test_discover_devices(device, monkeypatch, raw_advertisements):
+    """Both scanning modes report the same devices.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0)
+    scanner = Scanner(device, raw_advertisements=raw_advertisements)
+    scanner.start()
+    random = BDAddress("c0:11:22:33:44:55", random=True)
+    device.stream([
+        raw_pdu(device, adv_pdu(BDAddress("00:11:22:33:44:55"))),
+        raw_pdu(device, adv_pdu(random, pdu_type=2), rssi=-60),
+        # CONNECT_IND, ignored
+        raw_pdu(device, adv_pdu(BDAddress("00:11:22:33:44:66"), pdu_type=5)),
+    ])
+    devices = discover(scanner, 2)
+    scanner.stop()
+
+    assert [(dev.address, dev.address_type, dev.rssi, dev.connectable)
+            for dev in devices] == [
+        ("00:11:22:33:44:55", 0, -40, True),
+        ("c0:11:22:33:44:55", 1, -60, False),
+    ]
+    assert [dev.name for dev in devices] == ["Loopback"] * 2
+
+def test_discover_adv_pdus(monkeypatch):
+    """Advertisements are also handled when the device does not support raw PDUs.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0)
+    device = LoopbackDevice(raw_pdu=False)
+    device.open()
+    try:
+        scanner = Scanner(device, raw_advertisements=True)
+        scanner.start()
+        device.stream([
+            device.hub.ble.create_adv_pdu_received(
+                AdvType.ADV_IND, -50, BDAddress("c0:11:22:33:44:55", random=True), ADV_DATA
+            )
+        ])
+        devices = discover(scanner, 1, minimal_rssi=-60)
+        scanner.stop()
+    finally:
+        device.close()
+
+    assert [(dev.address, dev.address_type, dev.name) for dev in devices] == [
+        ("c0:11:22:33:44:55", 1, "Loopback")
+    ]
+
+def test_raw_advertisements_monitor(device, monkeypatch):
+    """Scapy packets are only built when a monitor is attached.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0)
+    conversions = []
+    to_packet = BleRawPduReceived.to_packet
+    def counting_to_packet(message):
+        conversions.append(message)
+        return to_packet(message)
+    monkeypatch.setattr(BleRawPduReceived, "to_packet", counting_to_packet)
+
+    scanner = Scanner(device, raw_advertisements=True)
+    scanner.start()
+    device.stream([raw_pdu(device, adv_pdu(BDAddress("00:11:22:33:44:55")))])
+    assert len(discover(scanner, 1)) == 1
+    assert len(conversions) == 0
+
+    packets = []
+    scanner.attach_callback(packets.append, on_reception=True, on_transmission=False)
+    device.stream([raw_pdu(device, adv_pdu(BDAddress("00:11:22:33:44:66")))])
+    assert len(discover(scanner, 1)) == 1
+    scanner.stop()
+    assert len(conversions) == 1
+    assert packets[0][BTLE_ADV_IND].AdvA == "00:11:22:33:44:66"
+
+@pytest.mark.benchmark
+def test_raw_advertisements_rate(monkeypatch):
+    """Measure discovered advertisements per second, with and without Scapy.
+    """
+    monkeypatch.setattr(AdvertisingDevice, "SCAN_RSP_TIMEOUT", 0)
+    nb_devices = 2000
+    rates = {}
+    for raw_advertisements in (False, True):
+        device = LoopbackDevice()
+        device.open()
+        try:
+            scanner = Scanner(device, raw_advertisements=raw_advertisements)
+            scanner.start()
+            messages = [
+                raw_pdu(device, adv_pdu(BDAddress(i.to_bytes(6, "little"))))
+                for i in range(nb_devices)
+            ]
+            start = perf_counter()
+            device.stream(messages)
+            devices = discover(scanner, nb_devices)
+            rates[raw_advertisements] = nb_devices / (perf_counter() - start)
+            scanner.stop()
+        finally:
+            device.close()
+        assert len(devices) == nb_devices
+
+    print(f"{rates[False]:.0f} advertisements/s with Scapy, "
+          f"{rates[True]:.0f} advertisements/s from raw fields")
@@ -0,0 +1,187 @@
+"""BLE sniffer tests, using a synthetic loopback device streaming advertisements.
+"""
+import os
+from collections import deque
+from threading import Event, Lock
+from time import sleep
+
+from scapy.all import rdpcap
+from scapy.layers.bluetooth4LE import BTLE
+
+import whad.ble.crypto
+from whad.ble import Sniffer
+from whad.ble.crypto import LinkLayerDecryptor
+from whad.ble.sniffing import KeyExtractedEvent
+from whad.device import WhadDevice
+from whad.device.device import VirtualDevice
+from whad.helpers import message_filter
+from whad.hub.ble import BDAddress, Commands, Direction
+from whad.hub.discovery import Capability, Domain
+from whad.hub.generic.cmdresult import CommandResult
+
+PCAPS = os.path.join(os.path.dirname(__file__), "..", "..", "..", "whad", "resources", "pcaps")
+
+
+class LoopbackDevice(VirtualDevice):
+    """Virtual device streaming the raw PDUs it has been given.
+    """
+
+    INTERFACE_NAME = "loopback"
+
+    @classmethod
+    def list(cls):
+        return []
+
+    def __init__(self):
+        super().__init__()
+        self.__messages = deque()
+        self.__lock = Lock()
+
+    def open(self):
+        self._dev_id = b"\x00"*16
+        self._fw_author = b"whad"
+        self._fw_url = b"https://github.com/whad-team/whad-client"
+        self._dev_capabilities = {
+            Domain.BtLE : (
+                Capability.Sniff,
+                [Commands.SniffAdv, Commands.Start, Commands.Stop]
+            )
+        }
+        super().open()
+
+    def reset(self):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+    def read(self):
+        with self.__lock:
+            messages = list(self.__messages)
+            self.__messages.clear()
+        if len(messages) == 0:
+            sleep(0.01)
+        for message in messages:
+            self._send_whad_message(message)
+
+    def stream(self, messages):
+        """Queue raw PDUs, received by the next `sniff()` call.
+        """
+        self.set_queue_filter(message_filter(type(messages[0])))
+        with self.__lock:
+            self.__messages.extend(messages)
+
+
+def adv_ind(device, address: BDAddress):
+    payload = address.value + b"\x02\x01\x06"
+    return device.hub.ble.create_raw_pdu_received(
+        Direction.UNKNOWN, bytes([0, len(payload)]) + payload, 0x8e89bed6,
+        rssi=-40, crc=0, crc_validity=True
+    )
+
+def test_sniff_interrupted():
+    """Packets captured by an interrupted session are not yielded by the next one.
+    """
+    device = LoopbackDevice()
+    device.open()
+    try:
+        sniffer = Sniffer(device)
+        process_packet = sniffer.process_packet
+        def slow_process_packet(packet):
+            sleep(0.05)
+            return process_packet(packet)
+        sniffer.process_packet = slow_process_packet
+
+        device.stream([adv_ind(device, BDAddress(i.to_bytes(6, "little"))) for i in range(10)])
+        for _ in sniffer.sniff(timeout=5.0):
+            break
+
+        assert list(sniffer.sniff(timeout=0.3)) == []
+    finally:
+        device.close()
+
+def raw_pdus(device, packets):
+    return [
+        device.hub.ble.create_raw_pdu_received(
+            Direction.UNKNOWN, bytes(packet[BTLE])[4:-3], packet.access_addr,
+            rssi=-40, crc=packet.crc, crc_validity=True
+        ) for packet in packets
+    ]
+
+def sniff_all(sniffer, count):
+    packets = []
+    for packet in sniffer.sniff(timeout=10.0):
+        packets.append(packet)
+        if len(packets) == count:
+            break
+    return packets
+
+def test_sniff_legacy_pairing_slow_cracking(monkeypatch):
+    """Connection is decrypted once the legacy pairing key is found, even if
+    encrypted PDUs have been received during the search.
+    """
+    pcap = rdpcap(os.path.join(PCAPS, "ble_pairing.pcap"))
+    # Encryption starts at PDU 1278, key is found at PDU 1400
+    captured, remaining = pcap[:1400], pcap[1400:]
+
+    cracking = Event()
+    tk_search = whad.ble.crypto.legacy_pairing_tk_search
+    def slow_tk_search(*args):
+        cracking.wait(5.0)
+        return tk_search(*args)
+    monkeypatch.setattr(whad.ble.crypto, "legacy_pairing_tk_search", slow_tk_search)
+
+    device = LoopbackDevice()
+    device.open()
+    try:
+        sniffer = Sniffer(device)
+        sniffer.configuration.pairing = True
+        sniffer.configuration.decrypt = True
+        keys = []
+        key_extracted = Event()
+        def on_event(event):
+            if isinstance(event, KeyExtractedEvent):
+                keys.append(event)
+                key_extracted.set()
+        sniffer.add_event_listener(on_event)
+
+        device.stream(raw_pdus(device, captured))
+        packets = sniff_all(sniffer, len(captured))
+        assert not any(packet.metadata.decrypted for packet in packets)
+
+        cracking.set()
+        assert key_extracted.wait(5.0)
+        device.stream(raw_pdus(device, remaining))
+        packets = sniff_all(sniffer, len(remaining))
+        assert len(packets) == len(remaining)
+    finally:
+        device.close()
+
+    # Same PDUs as when decrypting the whole capture with the recovered key
+    assert len(keys) == 1
+    decryptor = LinkLayerDecryptor(keys[0].key)
+    expected = [decrypted is not None for _, decrypted in decryptor.decrypt_packets(pcap)]
+    assert sum(expected[len(captured):]) > 0
+    assert [packet.metadata.decrypted for packet in packets] == expected[len(captured):]
+
+def test_sniff_pcap_backpressure(monkeypatch):
+    """Packets replayed from a PCAP file are not dropped by a slow processing stage.
+    """
+    monkeypatch.setattr(Sniffer, "PROCESSING_QUEUE_SIZE", 2)
+    pcap = os.path.join(PCAPS, "ble_pairing.pcap")
+    count = len(rdpcap(pcap))
+    device = WhadDevice.create("pcap:flush:" + pcap)
+    try:
+        sniffer = Sniffer(device)
+        process_packet = sniffer.process_packet
+        def slow_process_packet(packet):
+            sleep(0.0005)
+            return process_packet(packet)
+        sniffer.process_packet = slow_process_packet
+        sniffer.start()
+        packets = sniff_all(sniffer, count)
+    finally:
+        device.close()
+
+    assert len(packets) == count
+    assert sniffer.dropped_packets == 0
@@ -0,0 +1,189 @@
+"""BT Mesh Lower Transport layer unit tests.
+
+Checks the segmentation and reassembly of PDUs, run by the stack scheduler.
+"""
+
+import threading
+from time import sleep, perf_counter
+
+import pytest
+from whad.common.stack import alias
+from whad.common.stack.tests import Sandbox
+from whad.btmesh.profile import BaseMeshProfile
+from whad.btmesh.stack.lower_transport import LowerTransportLayer
+from whad.btmesh.stack.utils import MeshMessageContext
+from whad.scapy.layers.btmesh import (
+    BTMesh_Upper_Transport_Access_PDU,
+    BTMesh_Lower_Transport_Control_Message,
+    BTMesh_Lower_Transport_Access_Message,
+    BTMesh_Lower_Transport_Segmented_Access_Message,
+    BTMesh_Lower_Transport_Segment_Acknoledgment_Message,
+)
+
+
+@alias("network")
+class NetworkMock(Sandbox):
+    def __init__(self, parent=None, layer_name=None, options={}):
+        super().__init__(parent=parent, layer_name=layer_name, options=options)
+
+
+NetworkMock.add(LowerTransportLayer)
+
+
+def make_context(src_addr, dest_addr, seq_number):
+    ctx = MeshMessageContext()
+    ctx.src_addr = src_addr.to_bytes(2, "big")
+    ctx.dest_addr = dest_addr.to_bytes(2, "big")
+    ctx.seq_number = seq_number
+    ctx.seq_auth = seq_number
+    ctx.net_key_id = 0
+    ctx.application_key_index = 0
+    ctx.aid = 1
+    ctx.ttl = 0
+    return ctx
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = perf_counter() + timeout
+    while not predicate():
+        if perf_counter() > deadline:
+            return False
+        sleep(0.005)
+    return True
+
+
+class TestLowerTransportLayer(object):
+    @pytest.fixture
+    def network(self):
+        profile = BaseMeshProfile()
+        options = {
+            "lower_transport": {
+                "profile": profile,
+                "upper_transport": {"profile": profile, "access": {"profile": profile}},
+            }
+        }
+        return NetworkMock(options=options)
+
+    def sent_segments(self, network):
+        return [
+            msg.data
+            for msg in list(network.messages)
+            if msg.source == "lower_transport" and msg.destination == "network"
+        ]
+
+    def test_segmented_unicast(self, network):
+        """Segments are sent until acked, then the next queued message is sent."""
+        lower_transport = network.get_layer("lower_transport")
+        pdu = BTMesh_Upper_Transport_Access_PDU(enc_access_message_and_mic=bytes(range(30)))
+        lower_transport.on_upper_transport_layer_message(
+            (pdu, make_context(0x0001, 0x0002, 100))
+        )
+        pdu = BTMesh_Upper_Transport_Access_PDU(enc_access_message_and_mic=b"foo")
+        lower_transport.on_upper_transport_layer_message(
+            (pdu, make_context(0x0001, 0x0002, 110))
+        )
+
+        assert wait_for(lambda: len(self.sent_segments(network)) == 3)
+        segments = self.sent_segments(network)
+        assert [ctx.segment_number for _, ctx in segments] == [0, 1, 2]
+        assert [ctx.seq_number for _, ctx in segments] == [100, 101, 102]
+        seg = segments[2][0].getlayer(BTMesh_Lower_Transport_Segmented_Access_Message)
+        assert (seg.seg_offset, seg.last_seg_number, seg.seq_zero) == (2, 2, 100)
+
+        # Queued message is only sent once the transaction is acked
+        sleep(0.1)
+        assert len(self.sent_segments(network)) == 3
+        ack = BTMesh_Lower_Transport_Control_Message(seg=0, opcode=0) / \
+            BTMesh_Lower_Transport_Segment_Acknoledgment_Message(seq_zero=100, acked_segments=0b111)
+        network.send("lower_transport", (ack, make_context(0x0002, 0x0001, 10)))
+
+        assert wait_for(lambda: len(self.sent_segments(network)) == 4)
+        pkt, ctx = self.sent_segments(network)[3]
+        assert pkt.seg == 0 and ctx.seq_number == 110
+        assert lower_transport.state.tx_transactions[ctx.dest_addr].is_transaction_finished
+
+    def test_retransmissions(self, network):
+        """Segments not acked are retransmitted, until the retransmission count is reached."""
+        lower_transport = network.get_layer("lower_transport")
+        pdu = BTMesh_Upper_Transport_Access_PDU(enc_access_message_and_mic=bytes(range(20)))
+        lower_transport.on_upper_transport_layer_message(
+            (pdu, make_context(0x0001, 0x0002, 100))
+        )
+        assert wait_for(lambda: len(self.sent_segments(network)) == 2)
+
+        # Ack first segment, only the second one is retransmitted
+        ack = BTMesh_Lower_Transport_Control_Message(seg=0, opcode=0) / \
+            BTMesh_Lower_Transport_Segment_Acknoledgment_Message(seq_zero=100, acked_segments=0b1)
+        network.send("lower_transport", (ack, make_context(0x0002, 0x0001, 10)))
+
+        transaction = lower_transport.state.tx_transactions[b"\x00\x02"]
+        assert wait_for(lambda: transaction.is_transaction_finished)
+        segments = [ctx.segment_number for _, ctx in self.sent_segments(network)]
+        assert segments == [0, 1] + [1] * (len(segments) - 2)
+        assert len(segments) <= 2 + 3
+
+    def test_bounded_threads(self, network):
+        """Concurrent transactions do not create any thread."""
+        lower_transport = network.get_layer("lower_transport")
+        pdu = BTMesh_Upper_Transport_Access_PDU(enc_access_message_and_mic=bytes(range(30)))
+        lower_transport.on_upper_transport_layer_message(
+            (pdu, make_context(0x0001, 0x0100, 0))
+        )
+        assert wait_for(lambda: len(self.sent_segments(network)) > 0)
+
+        nb_threads = threading.active_count()
+        for i in range(1, 200):
+            lower_transport.on_upper_transport_layer_message(
+                (pdu, make_context(0x0001, 0x0100 + i, i * 3))
+            )
+        assert threading.active_count() == nb_threads
+        assert wait_for(lambda: len(self.sent_segments(network)) >= 600)
+        assert threading.active_count() == nb_threads
+
+    def test_reassembly(self, network):
+        """Segments are reassembled and acked by the receiver."""
+        payload = bytes(range(24))
+        for seg_offset in (1, 0):
+            segment = BTMesh_Lower_Transport_Access_Message(
+                seg=1, application_key_flag=1, application_key_id=1,
+                payload_field=BTMesh_Lower_Transport_Segmented_Access_Message(
+                    seq_zero=50, seg_offset=seg_offset, last_seg_number=1
+                ) / payload[seg_offset*12:(seg_offset + 1)*12]
+            )
+            ctx = make_context(0x0002, 0x0001, 50 + seg_offset)
+            ctx.segment_number = seg_offset
+            network.send("lower_transport", (segment, ctx))
+
+        messages = [msg for msg in network.messages if msg.destination == "upper_transport"]
+        assert len(messages) == 1
+        assert bytes(messages[0].data[0]) == payload
+
+        assert wait_for(lambda: len(self.sent_segments(network)) > 0)
+        ack, ctx = self.sent_segments(network)[-1]
+        ack = ack.getlayer(BTMesh_Lower_Transport_Segment_Acknoledgment_Message)
+        assert (ack.seq_zero, ack.acked_segments) == (50, 0b11)
+        assert ctx.dest_addr == b"\x00\x02"
+
+    def test_ack_scheduled_in_scheduler(self, network):
+        """Acks of a received transaction are replaced by the scheduler thread only."""
+        lower_transport = network.get_layer("lower_transport")
+        threads = []
+        schedule_ack = lower_transport.schedule_ack
+        def recording_schedule_ack(transaction):
+            threads.append(threading.current_thread().name)
+            schedule_ack(transaction)
+        lower_transport.schedule_ack = recording_schedule_ack
+
+        for seg_offset in (0, 1, 1):
+            segment = BTMesh_Lower_Transport_Access_Message(
+                seg=1, application_key_flag=1, application_key_id=1,
+                payload_field=BTMesh_Lower_Transport_Segmented_Access_Message(
+                    seq_zero=50, seg_offset=seg_offset, last_seg_number=1
+                ) / bytes(12)
+            )
+            ctx = make_context(0x0002, 0x0001, 50 + seg_offset)
+            ctx.segment_number = seg_offset
+            network.send("lower_transport", (segment, ctx))
+
+        assert wait_for(lambda: len(threads) == 2)
+        assert threads == ["stack-scheduler"] * 2
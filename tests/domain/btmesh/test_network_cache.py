@@ -0,0 +1,156 @@
+"""BT Mesh network message cache unit tests.
+"""
+
+import random
+
+import pytest
+from scapy.all import raw
+from whad.btmesh.profile import BaseMeshProfile
+from whad.btmesh.stack.network import NetworkLayer
+from whad.btmesh.stack.network.cache import NetworkCache
+from whad.scapy.layers.btmesh import (
+    BTMesh_Network_PDU,
+    BTMesh_Obfuscated_Network_PDU,
+    BTMesh_Lower_Transport_Access_Message,
+)
+
+
+class TestNetworkCache(object):
+    @pytest.fixture
+    def cache(self):
+        return NetworkCache(size=4)
+
+    def test_duplicates(self, cache):
+        assert not cache.check(0x0001, 10)
+        assert not cache.check(0x0002, 10)
+        assert cache.check(0x0001, 10)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_out_of_order(self, cache):
+        """PDUs received out of order within the cache window are accepted"""
+        assert not cache.check(0x0001, 12)
+        assert not cache.check(0x0001, 10)
+        assert not cache.check(0x0001, 11)
+        assert cache.check(0x0001, 12)
+
+    def test_eviction(self, cache):
+        for seq in range(10):
+            assert not cache.check(0x0001, seq)
+        assert len(cache) == cache.size == 4
+
+        # Evicted PDUs are still detected thanks to the source high-water mark
+        for seq in range(10):
+            assert cache.check(0x0001, seq)
+
+        # Other sources and IV Index are not affected
+        assert not cache.check(0x0002, 0)
+        assert not cache.check(0x0001, 0, iv_index=1)
+
+    def test_contains(self, cache):
+        """Lookups do not add PDUs to the cache"""
+        assert not cache.contains(0x0001, 10)
+        assert not cache.contains(0x0001, 10)
+        cache.add(0x0001, 10)
+        assert cache.contains(0x0001, 10)
+        assert len(cache) == 1
+
+    def test_clear(self, cache):
+        cache.check(0x0001, 1)
+        cache.clear()
+        assert len(cache) == 0 and cache.hits == cache.misses == 0
+        assert not cache.check(0x0001, 1)
+
+    def test_stress(self):
+        """Cache size does not grow with the number of PDUs"""
+        cache = NetworkCache(size=1024)
+        sources = list(range(1, 201))
+        seq_numbers = dict.fromkeys(sources, 0)
+        rand = random.Random(0)
+
+        nb_pdus = 20000
+        for i in range(nb_pdus):
+            src = rand.choice(sources)
+            # Every PDU is received twice, a few PDUs later (relayed copy)
+            if i % 2 == 0:
+                seq_numbers[src] += 1
+                last = (src, seq_numbers[src])
+                assert not cache.check(*last)
+            else:
+                assert cache.check(*last)
+
+        assert len(cache) == 1024
+        assert cache.hits == cache.misses == nb_pdus // 2
+
+
+class ConnectorMock(object):
+    sniffing_only = False
+
+    def send_raw(self, pkt):
+        pass
+
+
+class TestNetworkLayerCache(object):
+    @pytest.fixture
+    def network(self):
+        profile = BaseMeshProfile()
+        profile.auto_provision()
+        options = {
+            "profile": profile,
+            "cache_size": 2,
+            "lower_transport": {
+                "profile": profile,
+                "upper_transport": {"profile": profile, "access": {"profile": profile}},
+            },
+        }
+        network = NetworkLayer(ConnectorMock(), options=options)
+        network.received = []
+        network.send_to_lower_transport = lambda ctx, pdu: network.received.append(
+            (int.from_bytes(ctx.src_addr, "big"), ctx.seq_number)
+        )
+        return network
+
+    def make_pdu(self, network, src_addr, seq_number, forged=False):
+        """Build an obfuscated network PDU sent to our primary element."""
+        profile = network.state.profile
+        net_key = profile.get_net_key(0)
+        net_pdu = BTMesh_Network_PDU(
+            ivi=profile.iv_index[0] & 1,
+            nid=net_key.nid_mf,
+            network_ctl=0,
+            ttl=3,
+            seq_number=seq_number,
+            src_addr=src_addr,
+        )
+        enc = net_key.encrypt(
+            raw(BTMesh_Lower_Transport_Access_Message(seg=0, application_key_flag=0,
+                                                      application_key_id=0) / b"data"),
+            profile.primary_element_addr.to_bytes(2, "big"),
+            net_pdu,
+            profile.iv_index,
+        )
+        if forged:
+            # Wrong NetMIC, obfuscation is not affected
+            enc = enc[:-1] + bytes([enc[-1] ^ 0xFF])
+        net_pdu.enc_dst_enc_transport_pdu_mic = enc
+        return BTMesh_Obfuscated_Network_PDU(
+            ivi=net_pdu.ivi,
+            nid=net_pdu.nid,
+            obfuscated_data=net_key.obfuscate_net_pdu(net_pdu, profile.iv_index),
+            enc_dst_enc_transport_pdu_mic=enc,
+        )
+
+    def test_unauthenticated_pdu(self, network):
+        """A forged PDU does not affect later PDUs from the same source"""
+        network.on_net_pdu_received(self.make_pdu(network, 0x0010, 0xFFFFFF, forged=True), -40)
+        assert len(network.state.cache) == 0
+
+        # Fill the cache so that any cached entry would have been evicted
+        for seq in range(3):
+            network.on_net_pdu_received(self.make_pdu(network, 0x0020, seq), -40)
+
+        network.on_net_pdu_received(self.make_pdu(network, 0x0010, 5), -40)
+        assert network.received == [(0x0020, 0), (0x0020, 1), (0x0020, 2), (0x0010, 5)]
+
+        # Authenticated PDUs are cached
+        network.on_net_pdu_received(self.make_pdu(network, 0x0010, 5), -40)
+        assert network.received[-1] == (0x0010, 5) and len(network.received) == 4
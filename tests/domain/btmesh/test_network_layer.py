@@ -0,0 +1,64 @@
+"""BT Mesh Network layer unit tests.
+
+Checks that raw packets are sent without blocking the stack scheduler.
+"""
+
+from threading import Event
+from time import sleep, perf_counter
+
+import pytest
+from whad.common.stack import Scheduler
+from whad.btmesh.profile import BaseMeshProfile
+from whad.btmesh.stack.network import NetworkLayer
+
+
+class SlowConnectorMock(object):
+    sniffing_only = False
+
+    def __init__(self):
+        self.sent = []
+
+    def send_raw(self, pkt):
+        # Sending an advertisement takes a few synchronous device commands
+        sleep(0.05)
+        self.sent.append(pkt)
+
+
+class TestNetworkLayer(object):
+    @pytest.fixture
+    def scheduler(self):
+        scheduler = Scheduler()
+        yield scheduler
+        scheduler.close()
+
+    @pytest.fixture
+    def connector(self):
+        return SlowConnectorMock()
+
+    @pytest.fixture
+    def network(self, connector, scheduler):
+        profile = BaseMeshProfile()
+        options = {
+            "profile": profile,
+            "scheduler": scheduler,
+            "lower_transport": {
+                "profile": profile,
+                "upper_transport": {"profile": profile, "access": {"profile": profile}},
+            },
+        }
+        return NetworkLayer(connector, options=options)
+
+    def test_raw_tx_worker(self, network, connector, scheduler):
+        """Scheduler tasks are not delayed by raw transmissions."""
+        for i in range(5):
+            scheduler.call_soon(network.sending_thread, i)
+        timer = Event()
+        start = perf_counter()
+        scheduler.call_soon(timer.set)
+
+        assert timer.wait(1.0)
+        assert perf_counter() - start < 0.05
+        deadline = perf_counter() + 2.0
+        while len(connector.sent) < 5 and perf_counter() < deadline:
+            sleep(0.01)
+        assert connector.sent == list(range(5))
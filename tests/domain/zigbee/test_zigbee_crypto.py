@@ -1,7 +1,16 @@
-from whad.zigbee.crypto import NetworkLayerCryptoManager, ApplicationSubLayerCryptoManager
+import os
+from time import perf_counter
+
+from whad.zigbee.crypto import NetworkLayerCryptoManager, ApplicationSubLayerCryptoManager, \
+    ZigbeeDecryptor, TransportKeyDistribution, hash, hash_key
 from scapy.compat import raw
+from scapy.utils import rdpcap
+from scapy.layers.dot15d4 import Dot15d4, Dot15d4FCS
+from scapy.layers.zigbee import ZigbeeSecurityHeader, ZigbeeAppCommandPayload
 import pytest
 
+PCAPS = os.path.join(os.path.dirname(__file__), "..", "..", "..", "whad", "resources", "pcaps")
+
 @pytest.mark.parametrize("test_input, expected", [
 (("ad8ebbc4f96ae7000506d3fcd1627fb8", "618864472400008a5c480200008a5c1e5d28e1000000013ce801008d150001ea59de1f960eea8aee185a11893096414e05a243"), "618864472400008a5c480200008a5c1e5d28e1000000013ce801008d150001000112000401016218c30a5500210100ac4c76af"),
 (("44819751b602049181dc8bc2714df09d", "6188f73acb73e523ed480273e523ed1e7228a3b2890283b6a90101881700007657e59a7002fac5e9b7315bf67d5f9afc"), "6188f73acb73e523ed480273e523ed1e7228a3b2890283b6a9010188170000000b0800040140a300860000002e22fb48"),
@@ -35,3 +44,71 @@ def test_ApplicationSubLayerCryptoManager(test_input, expected):
     decryption_ok = raw(decrypted) == expected and valid_mic
     encryption_ok = raw(ciphertext_generated) == ciphertext
     assert  decryption_ok and encryption_ok
+
+@pytest.mark.parametrize("test_input, expected", [
+("c0", "ae3a102a28d43ee0d4a09e22788b206c"),
+("c0c1c2c3c4c5c6c7c8c9cacbcccdcecf", "a7977e88bc0b61e8210827109a228f2d"),
+])
+def test_hash(test_input, expected):
+    assert hash(bytes.fromhex(test_input)) == bytes.fromhex(expected)
+
+def test_hash_key():
+    key = bytes.fromhex("c0c1c2c3c4c5c6c7c8c9cacbcccdcecf")
+    ipad = bytes([0x36 ^ i for i in key])
+    opad = bytes([0x5c ^ i for i in key])
+    for input in (0, 1, 2):
+        assert hash_key(key, input) == hash(opad + hash(ipad + bytes([input])))
+
+def decrypt_capture(decryptor, packets):
+    """Decrypt secured frames, adding transport keys to the decryptor.
+    """
+    transport_key_distribution = TransportKeyDistribution()
+    decrypted = []
+    for packet in packets:
+        if ZigbeeSecurityHeader in packet:
+            payload, success = decryptor.attempt_to_decrypt(packet)
+            if success:
+                decrypted.append(payload)
+                packet = packet.copy()
+                packet.data = payload
+                transport_key_distribution.process_packet(packet)
+                if transport_key_distribution.transport_key is not None:
+                    decryptor.add_key(transport_key_distribution.transport_key)
+                    transport_key_distribution.reset()
+    return decrypted
+
+def test_ZigbeeDecryptor():
+    packets = [
+        Dot15d4FCS(raw(packet[Dot15d4]))
+        for packet in rdpcap(os.path.join(PCAPS, "zigbee_philips_hue_association.pcap"))
+    ]
+    link_key = bytes.fromhex("814286865dc1c8b2c8cbc52e5d65d1b8")
+
+    # Transport key is decrypted with the link key, then used to decrypt NWK frames
+    decryptor = ZigbeeDecryptor(bytes(16), link_key)
+    decrypted = decrypt_capture(decryptor, packets)
+    assert len(decrypted) == len([p for p in packets if ZigbeeSecurityHeader in p])
+    assert isinstance(decrypted[0], ZigbeeAppCommandPayload)
+    assert len(decryptor.keys) == 3
+
+    # Some random keys being tried first
+    secured = [p for p in packets if ZigbeeSecurityHeader in p]
+    decryptor = ZigbeeDecryptor(*[os.urandom(16) for _ in range(4)], link_key)
+    assert len(decrypt_capture(decryptor, secured)) == len(secured)
+
+@pytest.mark.benchmark
+def test_ZigbeeDecryptor_benchmark():
+    packets = [
+        Dot15d4FCS(raw(packet[Dot15d4]))
+        for packet in rdpcap(os.path.join(PCAPS, "zigbee_philips_hue_association.pcap"))
+    ]
+    link_key = bytes.fromhex("814286865dc1c8b2c8cbc52e5d65d1b8")
+
+    # Large capture, some random keys being tried first
+    packets = [p for p in packets if ZigbeeSecurityHeader in p] * 10
+    decryptor = ZigbeeDecryptor(*[os.urandom(16) for _ in range(4)], link_key)
+    start = perf_counter()
+    decrypted = decrypt_capture(decryptor, packets)
+    duration = perf_counter() - start
+    print(f"{len(packets)/duration:.0f} frames/s")
+    assert len(decrypted) == len(packets)
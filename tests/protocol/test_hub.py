@@ -0,0 +1,87 @@
+"""Protocol hub dispatch unit tests
+"""
+from time import perf_counter
+
+import pytest
+from scapy.layers.dot15d4 import Dot15d4
+
+from whad.protocol.whad_pb2 import Message
+from whad.protocol.generic_pb2 import ResultCode
+from whad.hub import ProtocolHub
+from whad.hub.registry import Registry
+from whad.hub.ble import BleDomain, BleRawPduReceived
+from whad.hub.dot15d4 import Dot15d4Metadata, SendRawPdu
+from whad.hub.generic.cmdresult import Success
+
+def walk_registry(registry, name, version):
+    """Resolve a registry node without relying on the registry cache.
+    """
+    while version > 0:
+        if name in registry.VERSIONS.get(version, {}):
+            return registry.VERSIONS[version][name]
+        version -= 1
+    return None
+
+class TestProtocolHubDispatch(object):
+    """Test ProtocolHub dispatch table and factories
+    """
+
+    @pytest.fixture
+    def hub(self):
+        return ProtocolHub(2)
+
+    def test_factory_singleton(self, hub):
+        assert hub.ble is hub.ble
+        assert isinstance(hub.ble, BleDomain)
+
+    def test_dispatch_table(self, hub):
+        """Make sure dispatch table matches the versioned registries.
+        """
+        table = ProtocolHub.get_dispatch_table(2)
+        assert ("ble", "raw_pdu") in table
+        for (domain, message_name), clazz in table.items():
+            domain_clazz = walk_registry(ProtocolHub, domain, 2)
+            assert walk_registry(domain_clazz, message_name, 2) is clazz
+
+    def test_parse_nested(self, hub):
+        """Messages parsed by a wrapper class are still dispatched further.
+        """
+        msg = Message()
+        msg.generic.cmd_result.result = ResultCode.SUCCESS
+        assert isinstance(hub.parse(msg.SerializeToString()), Success)
+
+    def test_parse_raw_pdu(self, hub):
+        msg = Message()
+        msg.ble.raw_pdu.pdu = b"\x00\x01"
+        assert isinstance(hub.parse(msg), BleRawPduReceived)
+
+    def test_parse_empty(self, hub):
+        assert hub.parse(b"\xff\xff") is None
+
+    def test_registry_cache_flush(self):
+        Registry.CACHE[("dummy",)] = None
+        class DummyRegistry(Registry):
+            VERSIONS = {}
+        DummyRegistry.add_node_version(1, "dummy", int)
+        assert ("dummy",) not in Registry.CACHE
+        assert DummyRegistry.bound("dummy", 3) is int
+
+    def test_convert_packet(self, hub):
+        packet = Dot15d4()
+        packet.metadata = Dot15d4Metadata(channel=11, raw=True)
+        assert isinstance(hub.convert_packet(packet), SendRawPdu)
+
+    @pytest.mark.benchmark
+    def test_parse_benchmark(self, hub):
+        """Measure parsed messages per second.
+        """
+        msg = Message()
+        msg.ble.raw_pdu.channel = 37
+        msg.ble.raw_pdu.pdu = b"\x40\x06\x11\x22\x33\x44\x55\x66"
+        raw = msg.SerializeToString()
+        start = perf_counter()
+        for _ in range(20000):
+            parsed = hub.parse(raw)
+        duration = perf_counter() - start
+        assert isinstance(parsed, BleRawPduReceived)
+        print(f"hub parsing: {20000/duration:.0f} messages/s")
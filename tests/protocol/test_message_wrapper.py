@@ -0,0 +1,80 @@
+"""Protocol hub message wrapper unit tests and benchmark
+"""
+from time import perf_counter
+
+import pytest
+
+from whad.protocol.whad_pb2 import Message
+from whad.hub.message import PbFieldInt
+from whad.hub.ble import BleRawPduReceived
+from whad.hub.dot15d4 import RawPduReceived
+from whad.hub.phy import PacketReceived
+
+BENCH_ITERATIONS = 20000
+
+@pytest.fixture
+def ble_raw_pdu():
+    msg = Message()
+    msg.ble.raw_pdu.channel = 37
+    msg.ble.raw_pdu.rssi = -40
+    msg.ble.raw_pdu.access_address = 0x8e89bed6
+    msg.ble.raw_pdu.pdu = b"\x40\x06\x11\x22\x33\x44\x55\x66"
+    msg.ble.raw_pdu.crc = 0x123456
+    return msg
+
+@pytest.fixture
+def dot15d4_raw_pdu():
+    msg = Message()
+    msg.dot15d4.raw_pdu.channel = 11
+    msg.dot15d4.raw_pdu.pdu = b"\x41\x88\x01\xff\xff"
+    msg.dot15d4.raw_pdu.fcs = 0x1234
+    msg.dot15d4.raw_pdu.lqi = 200
+    return msg
+
+@pytest.fixture
+def phy_packet():
+    msg = Message()
+    msg.phy.packet.frequency = 433920000
+    msg.phy.packet.packet = b"\xaa\xbb\xcc"
+    return msg
+
+def test_class_fields_are_cached():
+    """PB fields are discovered once per class and exposed as descriptors.
+    """
+    assert isinstance(BleRawPduReceived.channel, PbFieldInt)
+    assert "channel" in BleRawPduReceived._pb_fields
+    assert "to_packet" not in BleRawPduReceived._pb_fields
+    assert RawPduReceived._pb_fields is not BleRawPduReceived._pb_fields
+
+def test_field_read_write(ble_raw_pdu):
+    parsed = BleRawPduReceived(ble_raw_pdu)
+    assert parsed.channel == 37
+    parsed.channel = 12
+    assert ble_raw_pdu.ble.raw_pdu.channel == 12
+
+def test_optional_field(dot15d4_raw_pdu):
+    parsed = RawPduReceived(dot15d4_raw_pdu)
+    assert parsed.lqi == 200
+    assert parsed.rssi is None
+
+def test_unknown_attribute_ignored(phy_packet):
+    parsed = PacketReceived(phy_packet)
+    parsed.unknown = 42
+    assert not hasattr(parsed, "unknown")
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("wrapper, field, fixture", [
+    (BleRawPduReceived, "pdu", "ble_raw_pdu"),
+    (RawPduReceived, "pdu", "dot15d4_raw_pdu"),
+    (PacketReceived, "packet", "phy_packet"),
+])
+def test_wrapper_benchmark(wrapper, field, fixture, request):
+    """Measure wrapper creation + field read per second.
+    """
+    message = request.getfixturevalue(fixture)
+    start = perf_counter()
+    for _ in range(BENCH_ITERATIONS):
+        value = getattr(wrapper(message), field)
+    duration = perf_counter() - start
+    assert len(value) > 0
+    print(f"{wrapper.__name__}: {BENCH_ITERATIONS/duration:.0f} messages/s")
@@ -25,6 +25,18 @@ This connector must be instantiated with a compatible WHAD device, as shown belo
 If the underlying device does not support scanning, this connector will raise
 an :class:`UnsupportedCapability` exception.
 
+When created with `raw_advertisements` set to `True`, the scanner builds discovered
+devices directly from the fields of the advertisements received from the device
+(PDU header, advertiser address and advertising data). AD records are then parsed
+only when needed and Scapy packets are only built if a monitor is attached to
+the scanner:
+
+.. code-block:: python
+
+    scanner = Scanner(device, raw_advertisements=True)
+    for device in scanner.discover_devices():
+        print(device)
+
 """
 from time import time
 from typing import Iterator
@@ -32,12 +44,24 @@ from typing import Iterator
 from scapy.packet import Packet
 from scapy.layers.bluetooth4LE import BTLE_ADV
 
-from whad.hub.ble import BleAdvPduReceived, BleRawPduReceived
+from whad.hub.ble import BleAdvPduReceived, BleRawPduReceived, AdvType
 from whad.ble.connector.base import BLE
 from whad.ble.scanning import AdvertisingDevicesDB, AdvertisingDevice
 from whad.exceptions import UnsupportedCapability
 from whad.helpers import message_filter
 
+# Advertising channels access address
+ADV_ACCESS_ADDRESS = 0x8e89bed6
+
+# Advertising PDU types (PDU header), as defined in Vol 6, Part B, section 2.3
+ADV_PDU_TYPES = {
+    0x00: AdvType.ADV_IND,
+    0x01: AdvType.ADV_DIRECT_IND,
+    0x02: AdvType.ADV_NONCONN_IND,
+    0x04: AdvType.ADV_SCAN_RSP,
+    0x06: AdvType.ADV_SCAN_IND,
+}
+
 class Scanner(BLE):
     """
     BLE Observer interface for compatible WHAD device.
@@ -45,14 +69,18 @@ class Scanner(BLE):
 
     domain = 'ble'
 
-    def __init__(self, device):
+    def __init__(self, device, raw_advertisements: bool = False):
         """Instantiate scanner connector over `device`.
 
         :param  device: BLE WHAD device instance
         :type   device: :class:`whad.device.WhadDevice`
+        :param  raw_advertisements: Discover devices from raw advertisements, without
+                                    converting them into Scapy packets
+        :type   raw_advertisements: bool, optional
         """
         super().__init__(device)
         self.__db = AdvertisingDevicesDB()
+        self.__raw_advertisements = raw_advertisements
 
         # Check device accept scanning mode
         if not self.can_scan():
@@ -95,6 +123,10 @@ class Scanner(BLE):
         :param  timeout:            Timeout in seconds
         :type   timeout:            float, optional
         """
+        if self.__raw_advertisements:
+            yield from self.__discover_raw_devices(minimal_rssi, filter_address, timeout)
+            return
+
         start_time = time()
         for advertisement in self.sniff(timeout=timeout):
             if minimal_rssi is None or advertisement.metadata.rssi > minimal_rssi:
@@ -110,9 +142,61 @@ class Scanner(BLE):
             if (timeout is not None) and (time() - start_time > timeout):
                 break
 
-    def sniff(self, timeout: float = None) -> Iterator[Packet]:
+    def __discover_raw_devices(self, minimal_rssi, filter_address,
+                               timeout) -> Iterator[AdvertisingDevice]:
         """
-        Listen and yield incoming advertising PDUs.
+        Yield devices discovered from raw advertisements.
+        """
+        start_time = time()
+        for message in self.__wait_advertisements(timeout):
+            # Scapy packets are only needed by monitors
+            if self.has_reception_callbacks:
+                self.monitor_packet_rx(self.__to_packet(message))
+
+            if minimal_rssi is None or message.rssi > minimal_rssi:
+                if isinstance(message, BleRawPduReceived):
+                    fields = self.__split_raw_pdu(message)
+                else:
+                    fields = (
+                        message.adv_type,
+                        1 if message.addr_type > 0 else 0,
+                        bytes(message.bd_address),
+                        bytes(message.adv_data)
+                    )
+
+                if fields is not None:
+                    adv_type, addr_type, bd_address, adv_data = fields
+                    yield from self.__db.on_advertisement(
+                        message.rssi, adv_type, addr_type, bd_address, adv_data,
+                        filter_addr=filter_address
+                    )
+
+            if (timeout is not None) and (time() - start_time > timeout):
+                break
+
+    @staticmethod
+    def __split_raw_pdu(message):
+        """Extract advertisement type, address type, advertiser address and advertising
+        data from a raw advertising PDU.
+
+        :return: Advertisement fields, `None` if message is not an advertising PDU
+        :rtype: tuple
+        """
+        if message.access_address != ADV_ACCESS_ADDRESS:
+            return None
+        pdu = bytes(message.pdu)
+        if len(pdu) < 8 or (pdu[0] & 0x0f) not in ADV_PDU_TYPES:
+            return None
+        return (
+            ADV_PDU_TYPES[pdu[0] & 0x0f],
+            (pdu[0] >> 6) & 1,
+            pdu[2:8],
+            pdu[8:2 + pdu[1]]
+        )
+
+    def __wait_advertisements(self, timeout: float = None):
+        """
+        Yield incoming advertising messages.
         """
         start_time = time()
         while True:
@@ -123,18 +207,32 @@ class Scanner(BLE):
 
             message = self.wait_for_message(filter=message_filter(message_type), timeout=timeout)
             if message is not None:
-                # Convert message from rebuilt PDU
-                packet = message.to_packet()
-                self.monitor_packet_rx(packet)
-                # Force TxAdd value to propagate the address type
-                if isinstance(message, BleAdvPduReceived):
-                    if message.addr_type > 0:
-                        packet.getlayer(BTLE_ADV).TxAdd = 1
-                yield packet
+                yield message
 
             if timeout is not None and time() - start_time > timeout:
                 break
 
+    @staticmethod
+    def __to_packet(message) -> Packet:
+        """Convert an advertising message into a Scapy packet.
+        """
+        packet = message.to_packet()
+        # Force TxAdd value to propagate the address type
+        if isinstance(message, BleAdvPduReceived):
+            if message.addr_type > 0:
+                packet.getlayer(BTLE_ADV).TxAdd = 1
+        return packet
+
+    def sniff(self, timeout: float = None) -> Iterator[Packet]:
+        """
+        Listen and yield incoming advertising PDUs.
+        """
+        for message in self.__wait_advertisements(timeout):
+            # Convert message from rebuilt PDU
+            packet = self.__to_packet(message)
+            self.monitor_packet_rx(packet)
+            yield packet
+
     def clear(self):
         """
         Clear device database.
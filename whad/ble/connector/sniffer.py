@@ -1,11 +1,13 @@
 """Bluetooth Low Energy sniffing module.
 """
 import logging
+from collections import deque
+from threading import Lock
 from typing import List, Generator
 from time import sleep, time
 
 from scapy.packet import Packet
-from scapy.layers.bluetooth4LE import BTLE_DATA, BTLE
+from scapy.layers.bluetooth4LE import BTLE_DATA, BTLE, LL_ENC_REQ
 
 from whad.ble.connector.base import BLE
 from whad.ble.connector.injector import Injector
@@ -21,14 +23,29 @@ from whad.exceptions import WhadDeviceDisconnected
 from whad.exceptions import UnsupportedCapability
 from whad.helpers import message_filter
 from whad.common.sniffing import EventsManager
+from whad.common.pipeline import PipelineStage
 
 logger = logging.getLogger(__name__)
 
 class Sniffer(BLE, EventsManager):
     """
     BLE Sniffer interface for compatible WHAD device.
+
+    Sniffed packets are decrypted, analyzed and sent to monitors by a
+    processing stage running in its own thread, so that slow processing
+    does not delay packet capture. Up to `PROCESSING_QUEUE_SIZE` packets
+    can wait to be processed, other packets are dropped. Packets replayed
+    from a PCAP file are never dropped, their capture waits for the
+    processing stage instead.
+
+    Legacy pairing temporary keys are brute-forced in the background. Up to
+    `ENCRYPTED_BACKLOG_SIZE` encrypted PDUs received until the key is found
+    are kept, and replayed through the decryptor to synchronize its counters.
     """
 
+    PROCESSING_QUEUE_SIZE = 4096
+    ENCRYPTED_BACKLOG_SIZE = 4096
+
     def __init__(self, device):
         BLE.__init__(self, device)
         EventsManager.__init__(self)
@@ -38,12 +55,35 @@ class Sniffer(BLE, EventsManager):
         self.__decryptor = LinkLayerDecryptor()
         self.__encrypted_session_initialization = EncryptedSessionInitialization()
         self.__legacy_pairing_cracking = LegacyPairingCracking()
+        self.__legacy_pairing_cracker = None
+        self.__encrypted_backlog = deque(maxlen=self.ENCRYPTED_BACKLOG_SIZE)
+        self.__decryption_lock = Lock()
         self.__configuration = SnifferConfiguration()
 
+        # Avoid circular import, PCAP device depends on BLE helpers
+        from whad.device.virtual.pcap import PCAPDevice
+
+        # Captured packets are processed by a dedicated stage, then yielded by `sniff()`
+        self.__processed_packets = deque()
+        self.__processing = PipelineStage(
+            self.__process_captured_packet,
+            maxsize=self.PROCESSING_QUEUE_SIZE,
+            block=isinstance(device, PCAPDevice),
+            output=self.__processed_packets.append,
+            name="ble-sniffer-processing"
+        )
+
         # Check if device accepts advertisements or connection sniffing
         if not self.can_sniff_advertisements() and not self.can_sniff_new_connection():
             raise UnsupportedCapability("Sniff")
 
+    @property
+    def dropped_packets(self) -> int:
+        """Number of captured packets dropped because the processing stage
+        could not keep up.
+        """
+        return self.__processing.dropped
+
     @property
     def synchronized(self):
         """Synchromization state
@@ -269,41 +309,89 @@ class Sniffer(BLE, EventsManager):
         """Process sniffed packet
         """
         if self.__configuration.decrypt and BTLE_DATA in packet:
-            self.__encrypted_session_initialization.process_packet(packet)
-            if self.__encrypted_session_initialization.encryption:
-                self.__decryptor.add_crypto_material(
-                    *self.__encrypted_session_initialization.crypto_material
-                )
-                self.__encrypted_session_initialization.reset()
-            try:
-                decrypted, success = self.__decryptor.attempt_to_decrypt(packet[BTLE])
-                if success:
-                    #packet.decrypted = decrypted
-                    decrypted_packet = decrypted
-                    decrypted_packet.metadata = packet.metadata
-                    packet[BTLE_DATA].remove_payload()
-                    packet.payload = decrypted
-                    packet.metadata = decrypted_packet.metadata
-                    packet.metadata.decrypted = True
-                    return packet
-            except MissingCryptographicMaterial:
-                pass
+            # Decryptor is also updated by the legacy pairing cracker thread
+            with self.__decryption_lock:
+                self.__encrypted_session_initialization.process_packet(packet)
+                if self.__encrypted_session_initialization.encryption:
+                    self.__decryptor.add_crypto_material(
+                        *self.__encrypted_session_initialization.crypto_material
+                    )
+                    self.__encrypted_session_initialization.reset()
+                try:
+                    decrypted, success = self.__decryptor.attempt_to_decrypt(packet[BTLE])
+                except MissingCryptographicMaterial:
+                    success = False
+
+                # Keep encrypted PDUs until the legacy pairing key is found
+                if not success and self.__legacy_pairing_cracker is not None:
+                    if LL_ENC_REQ in packet:
+                        self.__encrypted_backlog.clear()
+                    self.__encrypted_backlog.append(packet[BTLE])
+
+            if success:
+                #packet.decrypted = decrypted
+                decrypted_packet = decrypted
+                decrypted_packet.metadata = packet.metadata
+                packet[BTLE_DATA].remove_payload()
+                packet.payload = decrypted
+                packet.metadata = decrypted_packet.metadata
+                packet.metadata.decrypted = True
+                return packet
 
 
         if self.__configuration.pairing:
             self.__legacy_pairing_cracking.process_packet(packet[BTLE])
             if self.__legacy_pairing_cracking.ready:
-                keys = self.__legacy_pairing_cracking.keys
-                if keys is not None:
-                    tk, stk = keys
-                    logger.info("[i] New temporary key extracted: %s", tk.hex())
-                    logger.info("[i] New short term key extracted: %s", stk.hex())
-                    self.trigger_event(KeyExtractedEvent(stk))
-                    self.__decryptor.add_key(stk)
-                    self.__legacy_pairing_cracking.reset()
+                # Brute-force TK in the background, packets keep being processed
+                with self.__decryption_lock:
+                    if self.__legacy_pairing_cracker is not None:
+                        self.__legacy_pairing_cracker.cancel()
+                    self.__encrypted_backlog.clear()
+                    self.__legacy_pairing_cracker = self.__legacy_pairing_cracking.start_cracking(
+                        self.on_legacy_pairing_keys
+                    )
+                self.__legacy_pairing_cracking.reset()
+
+        return packet
 
+    def __process_captured_packet(self, packet):
+        """Processing stage: decrypt and analyze a captured packet, then
+        send it to monitors.
+        """
+        packet = self.process_packet(packet)
+        self.monitor_packet_rx(packet)
         return packet
 
+    def on_legacy_pairing_keys(self, tk: bytes, stk: bytes):
+        """Legacy pairing keys recovery callback
+        """
+        logger.info("[i] New temporary key extracted: %s", tk.hex())
+        logger.info("[i] New short term key extracted: %s", stk.hex())
+        self.trigger_event(KeyExtractedEvent(stk))
+        with self.__decryption_lock:
+            self.__decryptor.add_key(stk)
+
+            # Replay encrypted PDUs received during the search, so that the
+            # session counters match the next PDUs
+            decrypted = 0
+            for packet in self.__encrypted_backlog:
+                try:
+                    _, success = self.__decryptor.attempt_to_decrypt(packet)
+                except MissingCryptographicMaterial:
+                    break
+                decrypted += int(success)
+            logger.debug("[i] %d encrypted PDUs replayed, %d decrypted",
+                         len(self.__encrypted_backlog), decrypted)
+            self.__encrypted_backlog.clear()
+            self.__legacy_pairing_cracker = None
+
+    def __reset_processing(self):
+        """Drop captured packets left over by a previous sniffing session.
+        """
+        self.__processing.clear()
+        self.__processing.join(timeout=1.0)
+        self.__processed_packets.clear()
+
     def sniff(self, timeout: float = None) -> Generator[Packet, None, None]:
         """Main sniffing function
 
@@ -311,6 +399,7 @@ class Sniffer(BLE, EventsManager):
                         Wait forever if set to `None`.
         :type timeout: float
         """
+        self.__reset_processing()
         start = time()
         try:
             while True:
@@ -362,19 +451,35 @@ class Sniffer(BLE, EventsManager):
                     else:
                         message_type = BleAdvPduReceived
 
-                    message = self.wait_for_message(filter=message_filter(message_type),
-                                                    timeout=0.1)
+                    # Do not wait too long if packets are being processed
+                    message = self.wait_for_message(
+                        filter=message_filter(message_type),
+                        timeout=0.01 if self.__processing.pending else 0.1
+                    )
+
+                    # Capture stage only converts messages into packets
                     if message is not None:
-                        packet = message.to_packet()
-                        packet = self.process_packet(packet)
-                        self.monitor_packet_rx(packet)
-                        yield packet
+                        self.__processing.put(message.to_packet())
+
+                    while len(self.__processed_packets) > 0:
+                        yield self.__processed_packets.popleft()
 
                 # Check if timeout has been reached
                 if timeout is not None:
                     if time() - start >= timeout:
+                        # Give captured packets a chance to be processed
+                        self.__processing.join(timeout=1.0)
+                        while len(self.__processed_packets) > 0:
+                            yield self.__processed_packets.popleft()
                         break
 
         # Handle device disconnection
         except WhadDeviceDisconnected:
+            self.__processing.join(timeout=1.0)
+            while len(self.__processed_packets) > 0:
+                yield self.__processed_packets.popleft()
             return
+
+        # Sniffing may have been interrupted by the caller
+        finally:
+            self.__reset_processing()
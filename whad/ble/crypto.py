@@ -1,15 +1,22 @@
 """Bluetooth Low Energy cryptographic helpers (based on Bluetooth Specification)
 """
+import os
+import logging
 from struct import pack
+from threading import Thread, Event
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 from Cryptodome.Cipher import AES
 from Cryptodome.Hash import CMAC
 from Cryptodome.Random import get_random_bytes
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.asymmetric.ec import SECP256R1, \
     generate_private_key, derive_private_key, EllipticCurvePublicNumbers, \
     ECDH
+from cryptography.hazmat.primitives.ciphers.aead import AESCCM
 from scapy.layers.bluetooth4LE import LL_ENC_REQ, LL_ENC_RSP, LL_START_ENC_REQ, \
-    BTLE_CTRL, BTLE_DATA, BTLE_CONNECT_REQ
+    BTLE, BTLE_CTRL, BTLE_DATA, BTLE_CONNECT_REQ
 from scapy.layers.bluetooth import SM_Hdr, SM_Pairing_Request, SM_Random, \
     SM_Pairing_Response, SM_Confirm, SM_Encryption_Information, SM_Master_Identification, \
     SM_Identity_Information, SM_Identity_Address_Information, SM_Signing_Information
@@ -19,6 +26,7 @@ from whad.hub.ble.bdaddr import BDAddress
 from whad.hub.ble import Direction as BleDirection
 from whad.ble.exceptions import MissingCryptographicMaterial
 
+logger = logging.getLogger(__name__)
 
 def generate_random_value(bits):
     """Generate a random value of provided bit size.
@@ -384,26 +392,97 @@ class EncryptedSessionInitialization(TrafficAnalyzer):
 
 
 
+class LinkLayerSession:
+    """Encrypted link-layer session, bound to a connection once its
+    cryptographic material and key have been identified.
+
+    Decryption relies on a single AES-CCM context created with the session key,
+    and on the expected counter of each direction: a payload is first
+    decrypted with the expected counter, then with the counters of a lost or a
+    retransmitted PDU.
+    """
+
+    def __init__(self, key, master_skd, master_iv, slave_skd, slave_iv):
+        self.key = key
+        self.material = (master_skd, master_iv, slave_skd, slave_iv)
+        self.session_key = e(key, pack(">QQ", slave_skd, master_skd))
+        self.iv = pack("<LL", master_iv, slave_iv)
+        self.counters = {
+            BleDirection.MASTER_TO_SLAVE: 0,
+            BleDirection.SLAVE_TO_MASTER: 0
+        }
+        self.last_direction = None
+        self.__ccm = AESCCM(self.session_key, tag_length=4)
+
+    def decrypt_with_counter(self, payload, direction, counter):
+        """Decrypt and verify a payload with a given counter value.
+
+        :return: Decrypted payload, `None` if MIC is invalid.
+        """
+        nonce = pack("<IB", counter, 0x00 if direction == BleDirection.MASTER_TO_SLAVE else 0x80)
+        # Only some header bits are authenticated
+        header = bytes([payload[0] & 0xe3])
+        try:
+            plaintext = self.__ccm.decrypt(nonce + self.iv, payload[2:], header)
+        except InvalidTag:
+            return None
+        return payload[:2] + plaintext
+
+    def decrypt(self, payload, error_tolerance=2):
+        """Decrypt and verify a payload sent in any direction, updating the
+        counter of this direction on success.
+
+        The direction opposite to the last decrypted PDU is tried first, as
+        master and slave alternate during connection events.
+
+        :param payload: Link-layer PDU, header included
+        :type payload: bytes
+        :param error_tolerance: Number of counter values tried per direction
+        :type error_tolerance: int
+        :return: Decrypted PDU (MIC excluded) and its direction, `None` if not decrypted.
+        """
+        if self.last_direction == BleDirection.MASTER_TO_SLAVE:
+            directions = (BleDirection.SLAVE_TO_MASTER, BleDirection.MASTER_TO_SLAVE)
+        else:
+            directions = (BleDirection.MASTER_TO_SLAVE, BleDirection.SLAVE_TO_MASTER)
+
+        # Expected counters, then lost PDUs, then retransmitted PDUs
+        offsets = list(range(error_tolerance)) + [-1]
+        for offset in offsets:
+            for direction in directions:
+                counter = self.counters[direction] + offset
+                if counter < 0:
+                    continue
+                plaintext = self.decrypt_with_counter(payload, direction, counter)
+                if plaintext is not None:
+                    if offset >= 0:
+                        self.counters[direction] = counter + 1
+                    self.last_direction = direction
+                    return (plaintext, direction)
+        return None
+
+
 class LinkLayerDecryptor:
     """Custom decryptor for BLE link-layer.
+
+    Cryptographic material and keys are tried on encrypted PDUs until a
+    combination decrypts one of them. The resulting session is then bound to
+    the connection access address, following PDUs being decrypted with this
+    session only.
     """
 
     def __init__(self, *keys):
         self.keys = list(keys)
-        self.managers = {}
-        self.master_skd = []
-        self.master_iv = []
-        self.slave_skd = []
-        self.slave_iv = []
-
+        self.material = []
+        self.sessions = {}
+        self.__candidates = {}
 
     def add_crypto_material(self, master_skd, master_iv, slave_skd, slave_iv):
         """Add cryptographic material to the decryptor.
         """
-        self.master_skd.append(master_skd)
-        self.master_iv.append(master_iv)
-        self.slave_skd.append(slave_skd)
-        self.slave_iv.append(slave_iv)
+        material = (master_skd, master_iv, slave_skd, slave_iv)
+        if material not in self.material:
+            self.material.append(material)
 
 
     def add_key(self, key):
@@ -426,16 +505,35 @@ class LinkLayerDecryptor:
             return True
         return False
 
+    def __resolve_session(self, access_address, payload):
+        """Find the cryptographic material and key decrypting a payload, and
+        bind the corresponding session to the access address.
+        """
+        current = self.sessions.get(access_address)
+        for material in self.material:
+            for key in self.keys:
+                if current is not None and (key, material) == (current.key, current.material):
+                    continue
+
+                # Session keys are derived once per material and key
+                if (key, material) not in self.__candidates:
+                    self.__candidates[(key, material)] = LinkLayerSession(key, *material)
+                session = self.__candidates[(key, material)]
+
+                result = session.decrypt(payload)
+                if result is not None:
+                    self.sessions[access_address] = session
+                    # Material is bound, only keep unresolved material
+                    self.material.remove(material)
+                    for candidate in self.keys:
+                        self.__candidates.pop((candidate, material), None)
+                    return result
+        return None
+
     def attempt_to_decrypt(self, packet):
         """Try to decrypt a packet based on known cryptograpgic material.
         """
-        if (
-                len(self.master_skd) == 0 or
-                len(self.master_iv) == 0 or
-                len(self.slave_skd) == 0 or
-                len(self.slave_iv) == 0 or
-                len(self.keys) == 0
-        ):
+        if len(self.sessions) == 0 and (len(self.material) == 0 or len(self.keys) == 0):
             raise MissingCryptographicMaterial()
 
         if BTLE_DATA not in packet:
@@ -444,34 +542,49 @@ class LinkLayerDecryptor:
         if packet.len == 0 and packet.LLID == 1:
             return (None, False)
 
-        for i, skd in enumerate(self.master_skd):
-            for key in self.keys:
+        # Strip access address and CRC
+        payload = bytes(packet)[4:-3]
 
-                if key not in self.managers:
-                    manager = LinkLayerCryptoManager(key, skd,
-                                                     self.master_iv[i], self.slave_skd[i],
-                                                     self.slave_iv[i])
-                else:
-                    manager = self.managers[key]
+        result = None
+        session = self.sessions.get(packet.access_addr)
+        if session is not None:
+            result = session.decrypt(payload)
 
-                plaintext, success = manager.decrypt(bytes(packet)[4:-3],
-                                                     direction=BleDirection.MASTER_TO_SLAVE)
-                if success:
-                    manager.increment_master_counter()
-                    self.managers[key] = manager
-                else:
-                    plaintext, success = manager.decrypt(bytes(packet)[4:-3],
-                                                         direction=BleDirection.SLAVE_TO_MASTER)
-                    if success:
-                        manager.increment_slave_counter()
-                        self.managers[key] = manager
-
-                if success:
-                    decrypted_packet = BTLE_DATA(plaintext)
-                    decrypted_packet.len = decrypted_packet.len - 4
-                    return (decrypted_packet, True)
+        # Encryption may have been restarted with new material
+        if result is None and len(self.keys) > 0:
+            result = self.__resolve_session(packet.access_addr, payload)
+
+        if result is not None:
+            plaintext, _ = result
+            decrypted_packet = BTLE_DATA(plaintext)
+            decrypted_packet.len = decrypted_packet.len - 4
+            return (decrypted_packet, True)
         return (None, False)
 
+    def decrypt_packets(self, packets):
+        """Decrypt a sequence of BLE packets (e.g. read from a PCAP file) in a
+        single pass, cryptographic material being extracted from the encryption
+        procedures found in these packets.
+
+        :param packets: BLE packets
+        :return: Generator yielding each packet with its decrypted PDU (`None` if not decrypted)
+        """
+        session_init = EncryptedSessionInitialization()
+        for packet in packets:
+            decrypted = None
+            if BTLE_DATA in packet:
+                session_init.process_packet(packet)
+                if session_init.encryption:
+                    self.add_crypto_material(*session_init.crypto_material)
+                    session_init.reset()
+                try:
+                    decrypted, success = self.attempt_to_decrypt(packet[BTLE])
+                    if not success:
+                        decrypted = None
+                except MissingCryptographicMaterial:
+                    pass
+            yield (packet, decrypted)
+
 
 class IdentityResolvingKeyDistribution(TrafficAnalyzer):
     """Traffic analyzer aiming at recovering an IRK
@@ -580,6 +693,186 @@ class ConnectionSignatureResolvingKeyDistribution(TrafficAnalyzer):
         super().reset()
         self.csrk = None
 
+def legacy_pairing_tk_search(a, p2, confirm, start, end):
+    """
+    Search the temporary key (TK) matching a legacy pairing confirm value among
+    the TK values between start (included) and end (excluded).
+
+    `a` is the invariant first input of c1 (p1 XOR r) and `p2` the second one,
+    as an integer.
+
+    :return: Matching TK value (`None` if not found) and number of TK values tested.
+    :rtype: tuple
+    """
+    new_aes = AES.new
+    mode = AES.MODE_ECB
+    for value in range(start, end):
+        aes = new_aes(value.to_bytes(16, "big"), mode)
+        b = (int.from_bytes(aes.encrypt(a), "big") ^ p2).to_bytes(16, "big")
+        if aes.encrypt(b) == confirm:
+            return (value, value - start + 1)
+    return (None, end - start)
+
+class LegacyPairingCracker:
+    """Legacy pairing temporary key (TK) brute-force engine.
+
+    The c1 inputs that do not depend on the TK are computed once, then the
+    keyspace (Just Works and 6-digit passkeys) is split into chunks searched by
+    a pool of processes. The first chunk, covering Just Works and small
+    passkeys, is searched in the calling process before the pool is started.
+    Remaining chunks are cancelled as soon as a match is found.
+
+    Parameters follow the conventions of :func:`c1`, `r` being the random value
+    used to compute `confirm`.
+    """
+
+    KEYSPACE = 1000000
+    CHUNK_SIZE = 20000
+
+    def __init__(self, r, confirm, pres, preq, iat, ia, rat, ra, processes=None,
+                 chunk_size=CHUNK_SIZE):
+        if isinstance(ia, str):
+            ia = bytes.fromhex(ia.replace(":",""))
+
+        if isinstance(ra, str):
+            ra = bytes.fromhex(ra.replace(":",""))
+
+        self.__a = xor(pres + preq + rat + iat, r)
+        self.__p2 = int.from_bytes(b"\x00\x00\x00\x00" + ia + ra, "big")
+        self.__confirm = confirm
+        self.__processes = processes or os.cpu_count() or 1
+        self.__chunk_size = chunk_size
+
+        self.__tk = None
+        self.__candidates = 0
+        self.__duration = 0.0
+        self.__cancelled = Event()
+        self.__thread = None
+
+    @property
+    def tk(self):
+        """Recovered temporary key, `None` if not found (yet).
+        """
+        return self.__tk
+
+    @property
+    def candidates(self) -> int:
+        """Number of TK values tested.
+        """
+        return self.__candidates
+
+    @property
+    def rate(self) -> float:
+        """Number of TK values tested per second.
+        """
+        if self.__duration == 0:
+            return 0.0
+        return self.__candidates / self.__duration
+
+    @property
+    def running(self) -> bool:
+        """Background search state.
+        """
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def __search(self, start, end):
+        return legacy_pairing_tk_search(self.__a, self.__p2, self.__confirm, start, end)
+
+    def __found(self, value):
+        self.__tk = value.to_bytes(16, "big")
+
+    def crack(self):
+        """Search the temporary key, blocking until it is found, the keyspace
+        exhausted or the search cancelled.
+
+        :return: Temporary key if found, `None` otherwise.
+        :rtype: bytes
+        """
+        if self.__tk is not None:
+            return self.__tk
+
+        start_time = perf_counter()
+        chunks = [
+            (start, min(start + self.__chunk_size, self.KEYSPACE))
+            for start in range(0, self.KEYSPACE, self.__chunk_size)
+        ]
+        try:
+            # Just Works and small passkeys are searched first, in this process
+            start, end = chunks.pop(0)
+            value, tested = self.__search(start, end)
+            self.__candidates += tested
+            if value is not None:
+                self.__found(value)
+            elif self.__processes > 1:
+                self.__crack_in_pool(chunks)
+            else:
+                for start, end in chunks:
+                    if self.__cancelled.is_set():
+                        break
+                    value, tested = self.__search(start, end)
+                    self.__candidates += tested
+                    if value is not None:
+                        self.__found(value)
+                        break
+        finally:
+            self.__duration = perf_counter() - start_time
+
+        logger.info("legacy pairing cracking: %d candidates tested in %.2fs (%d candidates/s)",
+                    self.__candidates, self.__duration, self.rate)
+        return self.__tk
+
+    def __crack_in_pool(self, chunks):
+        """Search chunks with a process pool, cancelling pending chunks once the
+        temporary key is found.
+        """
+        executor = ProcessPoolExecutor(max_workers=self.__processes)
+        pending = {}
+        try:
+            pending = {
+                executor.submit(
+                    legacy_pairing_tk_search, self.__a, self.__p2, self.__confirm, start, end
+                ) for start, end in chunks
+            }
+            while len(pending) > 0 and not self.__cancelled.is_set():
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    value, tested = future.result()
+                    self.__candidates += tested
+                    if value is not None:
+                        self.__found(value)
+                        return
+        finally:
+            # Futures are cancelled here as the executor may be collected
+            # before its manager thread handles the shutdown request
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def start(self, callback=None):
+        """Search the temporary key in a background thread.
+
+        :param callback: Function called with the temporary key once found
+        :type callback: callable
+        """
+        def run():
+            if self.crack() is not None and callback is not None:
+                callback(self.__tk)
+
+        self.__cancelled.clear()
+        self.__thread = Thread(target=run, daemon=True)
+        self.__thread.start()
+
+    def cancel(self):
+        """Cancel the search.
+        """
+        self.__cancelled.set()
+
+    def join(self, timeout=None):
+        """Wait for the background search to end.
+        """
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
 class LegacyPairingCracking(TrafficAnalyzer):
     """Traffic analyzer to break legacy pairing whenever it is possible.
     """
@@ -705,8 +998,11 @@ class LegacyPairingCracking(TrafficAnalyzer):
         }
 
     @property
-    def keys(self):
-        """Recovered keys
+    def cracker(self):
+        """Temporary key brute-force engine initialized with the collected
+        pairing material, `None` if material is missing.
+
+        :rtype: :class:`LegacyPairingCracker`
         """
         if self.master_confirm is not None and self.master_random is not None:
             rand = self.master_random
@@ -717,29 +1013,51 @@ class LegacyPairingCracking(TrafficAnalyzer):
         else:
             return None
 
-        if self.tk is not None and self.stk is not None:
-            return (self.tk, self.stk)
+        return LegacyPairingCracker(
+            rand[::-1],
+            confirm[::-1],
+            self.pairing_rsp[::-1],
+            self.pairing_req[::-1],
+            b"\x01" if self.initiator.is_random() else b"\x00",
+            self.initiator.value[::-1],
+            b"\x01" if self.responder.is_random() else b"\x00",
+            self.responder.value[::-1]
+        )
 
-        for i in range(0,1000000):
-            tk = pack(">IIII", 0,0,0,i)
+    def start_cracking(self, callback):
+        """Start a temporary key brute-force in the background, to keep
+        processing packets while searching.
 
-            p1 = self.pairing_rsp[::-1] + self.pairing_req[::-1] + (
-                (b"\x01" if self.responder.is_random() else b"\x00") +
-                (b"\x01" if self.initiator.is_random() else b"\x00")
-            )
+        :param callback: Function called with the recovered TK and STK
+        :type callback: callable
+        :return: Running brute-force engine, `None` if material is missing.
+        :rtype: :class:`LegacyPairingCracker`
+        """
+        cracker = self.cracker
+        if cracker is None:
+            return None
 
-            p2 = b"\x00\x00\x00\x00" + self.initiator.value[::-1] + self.responder.value[::-1]
+        master_random, slave_random = self.master_random, self.slave_random
+        def on_tk(tk):
+            callback(tk, s1(tk, slave_random[::-1], master_random[::-1]))
 
-            a = xor(p1, rand[::-1])
-            aes = AES.new(tk, AES.MODE_ECB)
-            res1 = aes.encrypt(a)
-            b = xor(res1, p2)
-            res2 = aes.encrypt(b)
+        cracker.start(on_tk)
+        return cracker
 
-            if res2 == confirm[::-1]:
+    @property
+    def keys(self):
+        """Recovered keys
+        """
+        if self.tk is not None and self.stk is not None:
+            return (self.tk, self.stk)
 
-                stk = s1(tk, self.slave_random[::-1], self.master_random[::-1])
-                self.tk = tk
-                self.stk = stk
-                return (tk, stk)
+        cracker = self.cracker
+        if cracker is None:
+            return None
+
+        tk = cracker.crack()
+        if tk is not None:
+            self.tk = tk
+            self.stk = s1(tk, self.slave_random[::-1], self.master_random[::-1])
+            return (self.tk, self.stk)
         return None
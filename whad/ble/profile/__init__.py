@@ -23,6 +23,7 @@ from whad.ble.profile.characteristic import Characteristic as BleCharacteristic,
 from whad.ble.profile.service import PrimaryService as BlePrimaryService, \
     SecondaryService as BleSecondaryService, IncludeService as BleIncludeService, \
     Service
+from whad.ble.profile.database import AttributeDatabase
 from whad.ble.exceptions import InvalidHandleValueException
 from whad.ble.stack.att.constants import SecurityAccess
 
@@ -507,7 +508,7 @@ class GenericProfile:
         :param  from_json:      JSON data describing a GATT profile
         :type   from_json:      str
         """
-        self.__attr_db = {}
+        self.__attr_db = AttributeDatabase()
         self.__services = []
         self.__service_by_characteristic_handle = {}
 
@@ -610,7 +611,7 @@ class GenericProfile:
                         uuid=service.uuid,
                         handle=self.__alloc_handle()
                     )
-                    self.__attr_db[service_obj.handle] = service_obj
+                    self.register_attribute(service_obj)
                 else:
                     continue
 
@@ -793,7 +794,7 @@ class GenericProfile:
         :type   attribute:  :class:`whad.ble.profile.attribute.Attribute`
         """
         if isinstance(attribute, Attribute):
-            self.__attr_db[attribute.handle] = attribute
+            self.__attr_db.add(attribute)
 
 
     def add_service(self, service, handles_only=False):
@@ -843,7 +844,12 @@ class GenericProfile:
         :type   handles_only:   bool
         """
         if isinstance(service, (BlePrimaryService, BleSecondaryService)):
-            service_obj = self.get_service_by_uuid(service.uuid)
+            # Service attributes may have been replaced in the attribute DB
+            # while another service was being updated
+            if service in self.__services:
+                service_obj = service
+            else:
+                service_obj = self.get_service_by_uuid(service.uuid)
         elif isinstance(service, UUID):
             service_obj = self.get_service_by_uuid(service)
         else:
@@ -853,21 +859,19 @@ class GenericProfile:
         if service_obj is not None:
             # Remove service and all its characteristics from the attribute DB
             for charac in service_obj.characteristics():
-                # Remove characteristic handle
-                if charac.handle in self.__attr_db:
-                    del self.__attr_db[charac.handle]
+                # Remove characteristic
+                self.__attr_db.remove(charac)
+                self.__service_by_characteristic_handle.pop(charac.handle, None)
 
-                # Remove characteristic value handle
-                if charac.value_handle in self.__attr_db:
-                    del self.__attr_db[charac.value_handle]
+                # Remove characteristic value
+                self.__attr_db.remove(charac.value_attr)
 
-                # Remove all the attached descriptors
+                # Remove all the attached descriptors
                 for desc in charac.descriptors():
-                    if desc.handle in self.__attr_db:
-                        del self.__attr_db[desc.handle]
+                    self.__attr_db.remove(desc)
 
-            # Remove service object from attribute db
-            del self.__attr_db[service_obj.handle]
+            # Remove service object from attribute db
+            self.__attr_db.remove(service_obj)
 
             # Remove service from our list of services (if required)
             if not handles_only:
@@ -933,12 +937,7 @@ class GenericProfile:
         :return:        List of objects with handles between start and end values
         :rtype: list
         """
-        handles = []
-        for handle in self.__attr_db:
-            if start <= handle <= end:
-                handles.append(handle)
-        handles.sort()
-        return [self.find_object_by_handle(handle) for handle in handles]
+        return self.__attr_db.find_range(start, end)
 
 
     def find_characteristic_by_value_handle(self, value_handle) -> BleCharacteristic:
@@ -973,18 +972,12 @@ class GenericProfile:
             # Find service owning the characteristic
             service = self.find_service_by_characteristic_handle(handle)
 
-            # Build a list of characteristic handles
-            service_char_handles=[]
-            for characteristic in service.characteristics():
-                service_char_handles.append(characteristic.handle)
-
-            # Sort handles
-            service_char_handles.sort()
-            idx = service_char_handles.index(handle)
-            if idx == len(service_char_handles) - 1:
-                return service.end_handle
-
-            return service_char_handles[idx+1] - 1
+            # Characteristic ends before the next characteristic declaration
+            # of this service, if any
+            for next_charac in self.__attr_db.find_by_type(
+                UUID(0x2803), start=handle + 1, end=service.end_handle):
+                return next_charac.handle - 1
+            return service.end_handle
 
         except InvalidHandleValueException:
             return None
@@ -1017,14 +1010,14 @@ class GenericProfile:
         This method is a generator and will yield service objects registered
         into the profile.
         """
-        for _, obj in self.__attr_db.items():
+        for obj in self.__attr_db.find_by_type(UUID(0x2800), UUID(0x2801)):
             if isinstance(obj, (BlePrimaryService, BleSecondaryService)):
                 yield obj
 
     def included_services(self) -> Iterator[BleIncludeService]:
         """Enumerate included services.
         """
-        for _, obj in self.__attr_db.items():
+        for obj in self.__attr_db.find_by_type(UUID(0x2802)):
             if isinstance(obj, BleIncludeService):
                 yield obj
 
@@ -1036,10 +1029,9 @@ class GenericProfile:
         :return:    Service if found, ``None`` otherwise
         :rtype:     :class:`whad.ble.profile.service.Service`
         """
-        for _, obj in self.__attr_db.items():
+        for obj in self.__attr_db.find_by_uuid(service_uuid):
             if isinstance(obj, (BlePrimaryService, BleSecondaryService)):
-                if obj.uuid == service_uuid:
-                    return obj
+                return obj
 
         # Not found
         return None
@@ -1052,15 +1044,25 @@ class GenericProfile:
         :return:    Characteristic if found, ``None`` otherwise
         :rtype:     :class:`whad.ble.profile.characteristic.Characteristic`
         """
-        for _, obj in self.__attr_db.items():
+        for obj in self.__attr_db.find_by_uuid(charac_uuid):
             if isinstance(obj, BleCharacteristic):
-                if obj.uuid == charac_uuid:
-                    return obj
+                return obj
 
         # Not found
         return None
 
 
+    def attr_by_range(self, start=1, end=0xFFFF) -> Iterator[Attribute]:
+        """Enumerate attributes with handles belonging in the [start, end] interval,
+        sorted by handle.
+
+        :param  start:  Start handle
+        :type   start:  int
+        :param  end:    End handle
+        :type   end:    int
+        """
+        yield from self.__attr_db.iter_range(start, end)
+
     def attr_by_type_uuid(self, uuid, start=1, end=0xFFFF) -> Iterator[Attribute]:
         """Enumerate attributes that have a specific type UUID.
 
@@ -1071,9 +1073,7 @@ class GenericProfile:
         :param  end:    End handle
         :type   end:    int
         """
-        for _, obj in self.__attr_db.items():
-            if obj.type_uuid == uuid and start <= obj.handle <= end:
-                yield obj
+        yield from self.__attr_db.find_by_type(uuid, start=start, end=end)
 
     def export_json(self):
         """Export profile as JSON data, including services, characteristics and descriptors
@@ -0,0 +1,152 @@
+"""BLE GATT attribute database
+
+This module provides :class:`AttributeDatabase`, the indexed attribute
+storage used by :class:`whad.ble.profile.GenericProfile`. Attributes are
+indexed by handle, with a sorted handle array used for range queries, by
+type UUID and by UUID (service or characteristic UUID), so that GATT
+discovery requests are answered in O(log n + k) time whatever the number of
+attributes.
+"""
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge
+from typing import Iterator, List
+
+from whad.ble.profile.attribute import Attribute, UUID
+
+
+class AttributeDatabase:
+    """Attribute database indexed by handle, type UUID and UUID.
+
+    Attributes are indexed with the handle they have when registered. If the
+    handle of a registered attribute is modified, the attribute must be removed
+    and registered again to update the indexes.
+    """
+
+    def __init__(self):
+        self.__attributes = {}
+        self.__handles = []
+        self.__handles_by_type = {}
+        self.__handles_by_uuid = {}
+        self.__registered = {}
+
+    def __len__(self):
+        return len(self.__handles)
+
+    def __contains__(self, handle: int) -> bool:
+        return handle in self.__attributes
+
+    def __getitem__(self, handle: int) -> Attribute:
+        return self.__attributes[handle]
+
+    def __iter__(self) -> Iterator[Attribute]:
+        """Iterate over attributes, sorted by handle.
+        """
+        for handle in self.__handles:
+            yield self.__attributes[handle]
+
+    def add(self, attribute: Attribute):
+        """Register an attribute, replacing any attribute registered with the
+        same handle.
+
+        :param  attribute:  Attribute to register
+        :type   attribute:  :class:`whad.ble.profile.attribute.Attribute`
+        """
+        # Attribute may have been registered with another handle
+        self.remove(attribute)
+
+        handle = attribute.handle
+        if handle in self.__attributes:
+            self.remove(self.__attributes[handle])
+
+        # Services and characteristics are also indexed by their own UUID
+        uuid = getattr(attribute, "uuid", None)
+        if not isinstance(uuid, UUID):
+            uuid = attribute.type_uuid
+
+        self.__attributes[handle] = attribute
+        self.__registered[id(attribute)] = (handle, attribute.type_uuid.packed, uuid.packed)
+        insort(self.__handles, handle)
+        insort(self.__handles_by_type.setdefault(attribute.type_uuid.packed, []), handle)
+        insort(self.__handles_by_uuid.setdefault(uuid.packed, []), handle)
+
+    def remove(self, attribute: Attribute) -> bool:
+        """Remove a registered attribute.
+
+        :param  attribute:  Attribute to remove
+        :type   attribute:  :class:`whad.ble.profile.attribute.Attribute`
+        :return: ``True`` if attribute has been removed, ``False`` if it was not registered
+        :rtype: bool
+        """
+        if id(attribute) not in self.__registered:
+            return False
+        handle, type_uuid, uuid = self.__registered.pop(id(attribute))
+        del self.__attributes[handle]
+        del self.__handles[bisect_left(self.__handles, handle)]
+        for index, key in ((self.__handles_by_type, type_uuid), (self.__handles_by_uuid, uuid)):
+            handles = index[key]
+            del handles[bisect_left(handles, handle)]
+            if len(handles) == 0:
+                del index[key]
+        return True
+
+    @staticmethod
+    def __slice(handles: List[int], start: int, end: int) -> Iterator[int]:
+        """Enumerate the handles of a sorted list between start and end (included),
+        without copying the list.
+        """
+        for i in range(bisect_left(handles, start), bisect_right(handles, end)):
+            yield handles[i]
+
+    def find_range(self, start: int, end: int) -> List[Attribute]:
+        """Find attributes with handles between start and end (included).
+
+        :param  start:  Start handle value
+        :type   start:  int
+        :param  end:    End handle value
+        :type   end:    int
+        :return: Attributes sorted by handle
+        :rtype: list
+        """
+        return list(self.iter_range(start, end))
+
+    def iter_range(self, start: int, end: int) -> Iterator[Attribute]:
+        """Enumerate attributes with handles between start and end (included),
+        sorted by handle.
+
+        :param  start:  Start handle value
+        :type   start:  int
+        :param  end:    End handle value
+        :type   end:    int
+        """
+        for handle in self.__slice(self.__handles, start, end):
+            yield self.__attributes[handle]
+
+    def find_by_type(self, *type_uuids: UUID, start: int = 0, end: int = 0xFFFF) -> Iterator[Attribute]:
+        """Enumerate attributes of one or more types, with handles between
+        start and end (included), sorted by handle.
+
+        :param  type_uuids: Attribute type UUIDs
+        :type   type_uuids: :class:`whad.ble.profile.attribute.UUID`
+        :param  start:  Start handle value
+        :type   start:  int
+        :param  end:    End handle value
+        :type   end:    int
+        """
+        ranges = [
+            self.__slice(self.__handles_by_type.get(type_uuid.packed, []), start, end)
+            for type_uuid in type_uuids
+        ]
+        handles = ranges[0] if len(ranges) == 1 else merge(*ranges)
+        for handle in handles:
+            yield self.__attributes[handle]
+
+    def find_by_uuid(self, uuid: UUID) -> Iterator[Attribute]:
+        """Enumerate attributes with a specific UUID, sorted by handle. The UUID
+        of services and characteristics is their own UUID, other attributes
+        are identified by their type UUID.
+
+        :param  uuid:   Attribute UUID
+        :type   uuid:   :class:`whad.ble.profile.attribute.UUID`
+        """
+        for handle in self.__handles_by_uuid.get(uuid.packed, []):
+            yield self.__attributes[handle]
@@ -5,16 +5,70 @@ BLE Scanning device database
 This module provides a database that keeps track of discovered devices,
 :class:`whad.ble.scanning.AdvertisingDevicesDB`. Discovered devices information
 are handled in :class:`whad.ble.scanning.AdvertisingDevice`.
+
+Scan response timeouts are tracked in a heap sorted by deadline, so that the
+cost of processing an advertisement does not depend on the number of known
+devices. Devices that have not been seen for a while can also be evicted, to
+keep the database bounded during long scans.
+
+Advertisements can also be provided as raw fields, as received from a WHAD
+device, with :meth:`AdvertisingDevicesDB.on_advertisement`. In this case, no
+scapy packet is involved and AD records are only parsed when they are first
+accessed.
 """
+from collections import OrderedDict
+from heapq import heappush, heappop
+from itertools import count
 from time import time
 
 from scapy.layers.bluetooth4LE import BTLE_ADV_IND, BTLE_ADV_NONCONN_IND, \
     BTLE_SCAN_RSP, BTLE_ADV
 
-from whad.hub.ble import BDAddress
+from whad.hub.ble import BDAddress, AdvType
 from whad.ble.profile.advdata import AdvDataFieldList, AdvCompleteLocalName, \
     AdvDataError, AdvDataFieldListOverflow, AdvShortenedLocalName
 
+# Advertising data maximum size
+MAX_ADV_DATA_SIZE = 31
+
+def check_ad_structure(adv_data: bytes) -> bool:
+    """Check the length of each AD record, without parsing them.
+
+    :param  adv_data: Raw advertising data
+    :type   adv_data: bytes
+    :return: `True` if records fit into advertising data, `False` otherwise
+    :rtype: bool
+    """
+    if len(adv_data) > MAX_ADV_DATA_SIZE:
+        return False
+    offset = 0
+    while len(adv_data) - offset >= 2:
+        length = adv_data[offset]
+        if len(adv_data) - offset - 2 < length - 1:
+            return False
+        offset += length + 1
+    return True
+
+def parse_ad_records(adv_data: bytes) -> AdvDataFieldList:
+    """Parse raw advertising data, ignoring malformed records.
+
+    :param  adv_data: Raw advertising data
+    :type   adv_data: bytes
+    :return: Parsed records, empty if advertising data is malformed
+    :rtype: :class:`whad.ble.profile.advdata.AdvDataFieldList`
+    """
+    try:
+        return AdvDataFieldList.from_bytes(adv_data)
+    except (AdvDataError, AdvDataFieldListOverflow):
+        return AdvDataFieldList()
+
+# Scapy advertising layers handled by the database
+ADV_LAYERS = (
+    (BTLE_ADV_IND, AdvType.ADV_IND),
+    (BTLE_ADV_NONCONN_IND, AdvType.ADV_NONCONN_IND),
+    (BTLE_SCAN_RSP, AdvType.ADV_SCAN_RSP),
+)
+
 class AdvertisingDevice:
     """Store information about a device:
 
@@ -29,7 +83,7 @@ class AdvertisingDevice:
     SCAN_RSP_TIMEOUT = 0.5
 
     def __init__(self, rssi, address_type, bd_address, adv_data, rsp_data=None,
-                 undirected=True, connectable=True):
+                 undirected=True, connectable=True, raw_records=False):
         """Instantiate an AdvertisingDevice.
 
         :param  rssi:           Received Signal Strength Indicator
@@ -46,6 +100,9 @@ class AdvertisingDevice:
         :type   undirected:     bool, optional
         :param  connectable:    ``True`` if device accepts connection, `False` otherwise
         :type   connectable:    bool, optional
+        :param  raw_records:    ``True`` if advertising and scan response data are raw bytes,
+                                parsed when first accessed
+        :type   raw_records:    bool, optional
         """
         self.__address_type = address_type
         self.__bd_address = bd_address
@@ -55,6 +112,7 @@ class AdvertisingDevice:
         self.__got_scan_rsp = False
         self.__undirected = undirected
         self.__connectable = connectable
+        self.__raw_records = raw_records
         self.__scanned = False
         self.__reported = False
         self.__timestamp = time()
@@ -82,12 +140,16 @@ class AdvertisingDevice:
     def adv_records(self) -> bytes:
         """Advertising records.
         """
+        if self.__raw_records and isinstance(self.__adv_data, bytes):
+            self.__adv_data = parse_ad_records(self.__adv_data)
         return self.__adv_data
 
     @property
     def scan_rsp_records(self) -> bytes:
         """Scan response records.
         """
+        if self.__raw_records and isinstance(self.__rsp_data, bytes):
+            self.__rsp_data = parse_ad_records(self.__rsp_data)
         return self.__rsp_data
 
     @property
@@ -95,10 +157,10 @@ class AdvertisingDevice:
         """Combined advertising and scan response records.
         """
         out = AdvDataFieldList()
-        for record in self.__adv_data:
+        for record in self.adv_records:
             out.add(record)
-        if self.__rsp_data is not None:
-            for record in self.__rsp_data:
+        if self.scan_rsp_records is not None:
+            for record in self.scan_rsp_records:
                 out.add(record)
         return out
 
@@ -246,14 +308,30 @@ class AdvertisingDevicesDB:
     This class stores information about discovered devices.
     """
 
-    def __init__(self):
+    def __init__(self, max_age: float = None, max_devices: int = None):
+        """Create a devices database.
+
+        :param  max_age: Remove devices that have not been seen for `max_age` seconds
+        :type   max_age: float, optional
+        :param  max_devices: Maximum number of devices, least recently seen devices are
+                             removed first
+        :type   max_devices: int, optional
+        """
+        self.__max_age = max_age
+        self.__max_devices = max_devices
         self.reset()
 
+    def __len__(self):
+        """Number of devices in database.
+        """
+        return len(self.__db)
 
     def reset(self):
         """Remove database content.
         """
-        self.__db = {}
+        self.__db = OrderedDict()
+        self.__deadlines = []
+        self.__counter = count()
 
 
     def find_device(self, address: str) -> AdvertisingDevice:
@@ -278,20 +356,51 @@ class AdvertisingDevicesDB:
         """
         if device.address not in self.__db:
             self.__db[device.address] = device
+            if not device.scanned:
+                heappush(self.__deadlines, (
+                    device.timestamp + device.SCAN_RSP_TIMEOUT, next(self.__counter), device
+                ))
         else:
             self.__db[device.address].seen()
+            self.__db.move_to_end(device.address)
 
 
-    def __apply_scan_rsp_timeout(self):
-        """Check every device to determine if our scan request has timed out.
+    def __evict_devices(self):
+        """Remove least recently seen devices, if eviction is enabled.
         """
-        for _, device in self.__db.items():
-            if not device.scanned:
-                device.update()
+        if self.__max_age is not None:
+            oldest = time() - self.__max_age
+            while len(self.__db) > 0 and next(iter(self.__db.values())).last_seen < oldest:
+                self.__db.popitem(last=False)
+
+        if self.__max_devices is not None:
+            while len(self.__db) > self.__max_devices:
+                self.__db.popitem(last=False)
+
+
+    def __apply_scan_rsp_timeout(self, address=None):
+        """Report devices whose scan request has timed out, and the device
+        identified by `address` if it has been scanned.
+        """
+        now = time()
+        while len(self.__deadlines) > 0 and self.__deadlines[0][0] < now:
+            _, _, device = heappop(self.__deadlines)
+
+            # Device may have been evicted
+            if self.__db.get(device.address) is not device:
+                continue
+
+            device.update()
             if device.scanned and not device.reported:
                 device.mark_reported()
                 yield device
 
+        if address is not None:
+            device = self.__db.get(address)
+            if device is not None and device.scanned and not device.reported:
+                device.mark_reported()
+                yield device
+
 
     def on_device_found(self, rssi, adv_packet, filter_addr=None):
         """Device advertising packet or scan response received.
@@ -305,74 +414,84 @@ class AdvertisingDevicesDB:
         :param  filter_addr:    BD address to filter
         :type   filter_addr:    str
         """
-        devices = []
+        bd_address = None
+        adv_type = None
+        adv_list = None
         addr_type = adv_packet.getlayer(BTLE_ADV).TxAdd
 
-        if adv_packet.haslayer(BTLE_ADV_IND):
-            bd_address = BDAddress(adv_packet[BTLE_ADV_IND].AdvA)
-            try:
-                adv_data = b''.join([ bytes(record) for record in adv_packet[BTLE_ADV_IND].data])
-                adv_list = AdvDataFieldList.from_bytes(adv_data)
-                device = AdvertisingDevice(
-                    rssi,
-                    addr_type,
-                    bd_address,
-                    adv_list
-                )
-
-
-                # Register device if it matches our criterias
-                if filter_addr is not None and filter_addr.lower() == str(bd_address).lower():
-                    self.register_device(device)
-                elif filter_addr is None:
-                    self.register_device(device)
-
-            except AdvDataError:
-                pass
-            except AdvDataFieldListOverflow:
-                pass
-
-        elif adv_packet.haslayer(BTLE_ADV_NONCONN_IND):
-            try:
-                bd_address = BDAddress(adv_packet[BTLE_ADV_NONCONN_IND].AdvA)
-                adv_data = b''.join([ bytes(record)
-                                     for record in adv_packet[BTLE_ADV_NONCONN_IND].data])
-                adv_list = AdvDataFieldList.from_bytes(adv_data)
-                device = AdvertisingDevice(
+        for layer, layer_type in ADV_LAYERS:
+            if adv_packet.haslayer(layer):
+                adv_type = layer_type
+                bd_address = BDAddress(adv_packet[layer].AdvA)
+                try:
+                    adv_data = b''.join([ bytes(record) for record in adv_packet[layer].data])
+                    adv_list = AdvDataFieldList.from_bytes(adv_data)
+                except AdvDataError:
+                    pass
+                except AdvDataFieldListOverflow:
+                    pass
+                break
+
+        return self.__process_advertisement(rssi, adv_type, addr_type, bd_address, adv_list,
+                                            filter_addr)
+
+    def on_advertisement(self, rssi, adv_type, addr_type, bd_address, adv_data,
+                         filter_addr=None):
+        """Device advertising PDU or scan response received, as raw fields.
+
+        AD records are not parsed here but only when they are accessed, advertisements
+        whose records do not fit into advertising data are ignored.
+
+        :param  rssi:           Received Signal Strength Indicator
+        :type   rssi:           float
+        :param  adv_type:       Advertisement type
+        :type   adv_type:       :class:`whad.hub.ble.AdvType`
+        :param  addr_type:      Address type (0 if public, 1 if random)
+        :type   addr_type:      int
+        :param  bd_address:     Advertiser address, as sent over the air (little-endian)
+        :type   bd_address:     bytes
+        :param  adv_data:       Raw advertising data
+        :type   adv_data:       bytes
+        :param  filter_addr:    BD address to filter
+        :type   filter_addr:    str
+        """
+        if not check_ad_structure(adv_data):
+            adv_data = None
+        return self.__process_advertisement(rssi, adv_type, addr_type, BDAddress(bd_address),
+                                            adv_data, filter_addr, raw_records=True)
+
+    def __process_advertisement(self, rssi, adv_type, addr_type, bd_address, adv_data,
+                                filter_addr, raw_records=False):
+        """Register advertising devices and scan responses, then report devices
+        whose scan is complete.
+        """
+        devices = []
+        address = str(bd_address) if bd_address is not None else None
+
+        if adv_data is not None and adv_type in (AdvType.ADV_IND, AdvType.ADV_NONCONN_IND):
+            # Register device if it matches our criterias
+            if filter_addr is None or filter_addr.lower() == address:
+                self.register_device(AdvertisingDevice(
                     rssi,
                     addr_type,
                     bd_address,
-                    adv_list,
-                    connectable=False
-                )
-
-                # Register device if it matches our criterias
-                if filter_addr is not None and filter_addr.lower() == str(bd_address).lower():
-                    self.register_device(device)
-                elif filter_addr is None:
-                    self.register_device(device)
-
-            except AdvDataError:
-                pass
-            except AdvDataFieldListOverflow:
-                pass
-
-        elif adv_packet.haslayer(BTLE_SCAN_RSP):
-            try:
-                bd_address = BDAddress(adv_packet[BTLE_SCAN_RSP].AdvA)
-                adv_data = b''.join([ bytes(record) for record in adv_packet[BTLE_SCAN_RSP].data])
-                adv_list = AdvDataFieldList.from_bytes(adv_data)
-                if str(bd_address) in self.__db:
-                    device = self.__db[str(bd_address)]
-                    if not device.got_scan_rsp:
-                        device.set_scan_rsp(adv_list)
-            except AdvDataError:
-                pass
-            except AdvDataFieldListOverflow:
-                pass
+                    adv_data,
+                    connectable=adv_type == AdvType.ADV_IND,
+                    raw_records=raw_records
+                ))
+
+        elif adv_data is not None and adv_type == AdvType.ADV_SCAN_RSP:
+            if address in self.__db:
+                device = self.__db[address]
+                device.seen()
+                self.__db.move_to_end(address)
+                if not device.got_scan_rsp:
+                    device.set_scan_rsp(adv_data)
+
+        self.__evict_devices()
 
         # Check if some devices scan response timeout is reached
-        for device in self.__apply_scan_rsp_timeout():
+        for device in self.__apply_scan_rsp_timeout(address):
             devices.append(device)
 
         return devices
@@ -2,10 +2,12 @@
 """
 import logging
 
-from time import time
-from queue import Queue, Empty
+from time import time, monotonic
+from queue import Empty
 from struct import unpack, pack
 from threading import Lock
+from bisect import bisect_right
+from itertools import islice
 
 from scapy.layers.bluetooth import ATT_Handle
 
@@ -14,15 +16,16 @@ from whad.ble.exceptions import HookReturnValue, HookReturnAuthentRequired,\
     HookReturnNotFound, ConnectionLostException
 from whad.ble.stack.att.constants import BleAttOpcode, BleAttErrorCode, ReadAccess, \
     WriteAccess, Authentication, Authorization, Encryption
-from whad.ble.stack.att.exceptions import error_response_to_exc, AttErrorCode, AttError
+from whad.ble.stack.att.exceptions import error_response_to_exc, AttErrorCode, AttError, \
+    UnsupportedRequestError
 from whad.ble.stack.gatt.message import *
-from whad.ble.stack.gatt.exceptions import GattTimeoutException
+from whad.ble.stack.gatt.exceptions import GattTimeoutException, GattReadError
 from whad.ble.profile import GenericProfile
 from whad.ble.stack.smp import Pairing
 from whad.ble.profile.characteristic import Characteristic, CharacteristicDescriptor, ClientCharacteristicConfig, CharacteristicValue
 from whad.ble.profile.service import PrimaryService, SecondaryService, IncludeService
 
-from whad.common.stack import Layer, source, alias
+from whad.common.stack import Layer, source, alias, MessageQueue, MessageQueueClosed
 
 logger = logging.getLogger(__name__)
 
@@ -60,7 +63,7 @@ class GattLayer(Layer):
     def configure(self, options):
         '''Configure the GATT layer
         '''
-        self.__queue = Queue()
+        self.__queue = MessageQueue()
         self.__proc_lock = Lock()
         self.__tx_lock = Lock()
         self.state.terminated = False
@@ -169,7 +172,14 @@ class GattLayer(Layer):
 
         :param message: GATT message to add to our queue
         """
-        self.__queue.put(message, block=True, timeout=None)
+        self.__queue.put(message)
+
+    def terminate(self):
+        """Mark the connection as terminated and wake up any procedure
+        waiting for a message.
+        """
+        self.state.terminated = True
+        self.__queue.close()
 
     def wait_for_message(self, message_clazz, timeout=10.0):
         """Wait for a specific message type or error, other messages are dropped
@@ -177,19 +187,26 @@ class GattLayer(Layer):
         :param type message_clazz: Expected message class
         :param float timeout: Timeout value (default: 30 seconds)
         """
-        start_time = time()
-        while (time() - start_time) < timeout:
+        deadline = monotonic() + timeout
+        while True:
             # Check if connection has been terminated.
             if self.state.terminated:
                 logger.debug('Connection lost')
                 raise ConnectionLostException(None)
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise GattTimeoutException
             try:
-                msg = self.__queue.get(block=False,timeout=0.5)
-                if isinstance(msg, message_clazz) or isinstance(msg, GattErrorResponse):
-                    return msg
+                # Wake up at least every 0.5 second to check termination state
+                return self.__queue.get(
+                    lambda msg: isinstance(msg, (message_clazz, GattErrorResponse)),
+                    timeout=min(remaining, 0.5)
+                )
             except Empty:
                 pass
-        raise GattTimeoutException
+            except MessageQueueClosed:
+                logger.debug('Connection lost')
+                raise ConnectionLostException(None)
 
 
     def error(self, request, handle, reason):
@@ -438,10 +455,20 @@ class GattLayer(Layer):
 
 class GattClient(GattLayer):
 
+    # Value size of standard descriptors, used to read them with
+    # Read Multiple requests
+    DESCRIPTOR_SIZES = {
+        0x2900: 2,  # Characteristic Extended Properties
+        0x2902: 2,  # Client Characteristic Configuration
+        0x2903: 2,  # Server Characteristic Configuration
+        0x2904: 7,  # Characteristic Presentation Format
+    }
+
     def __init__(self, parent=None, layer_name=None, options={}):
         super().__init__(parent=parent, layer_name=layer_name, options=options)
         self.__model = None
         self.__notification_callbacks = {}
+        self.__read_multiple_supported = True
 
     def configure(self, options):
         '''Configure GATT client.
@@ -505,6 +532,13 @@ class GattClient(GattLayer):
         """
         self.on_gatt_message(response)
 
+    def on_read_multiple_response(self, response: GattReadMultipleResponse):
+        """ATT Read Multiple Response callback
+
+        :param GattReadMultipleResponse response: Response
+        """
+        self.on_gatt_message(response)
+
     def on_write_response(self, response):
         """ATT Write Response callback
         """
@@ -790,6 +824,54 @@ class GattClient(GattLayer):
 
                 handle += 1
 
+    @proclock
+    def discover_service_descriptors(self, service):
+        """Discover the descriptors of all the characteristics of a service.
+
+        A single Find Information procedure covers the whole service instead
+        of one procedure per characteristic. Characteristic declarations and
+        values returned by the remote device are skipped.
+
+        This function will yield a (characteristic, descriptor) tuple for every
+        discovered descriptor.
+        """
+        characteristics = sorted(service.characteristics(), key=lambda c: c.handle)
+        if len(characteristics) == 0:
+            return
+        charac_handles = [charac.handle for charac in characteristics]
+        skipped = set(charac_handles)
+        skipped.update(charac.value_handle for charac in characteristics)
+
+        handle = characteristics[0].value_handle + 1
+        while handle <= service.end_handle:
+            self.lock_tx()
+            self.att.find_info_request(
+                handle,
+                service.end_handle
+            )
+            self.unlock_tx()
+
+            msg = self.wait_for_message(GattFindInfoResponse)
+            if isinstance(msg, GattFindInfoResponse):
+                for descriptor in msg:
+                    handle = descriptor.handle
+
+                    # End discovery if returned handle is Ending Handle (0xFFFF)
+                    if handle == 0xFFFF:
+                        return
+
+                    if handle not in skipped:
+                        # Descriptor belongs to the last characteristic declared before it
+                        owner = characteristics[bisect_right(charac_handles, handle) - 1]
+                        yield (owner, descriptor)
+            elif isinstance(msg, GattErrorResponse):
+                if msg.reason == AttErrorCode.ATTR_NOT_FOUND:
+                    break
+                else:
+                    raise error_response_to_exc(msg.reason, msg.request, msg.handle)
+
+            handle += 1
+
     def get_descriptor(self, characteristic: Characteristic, uuid: UUID, handle: int) -> CharacteristicDescriptor:
         """Read a characteristic descriptor identified by its handle.
 
@@ -806,7 +888,7 @@ class GattClient(GattLayer):
                                                       uuid, desc_value)
 
     def discover(self, save_values: bool = False):
-        # Discover services
+        # Discover services
         services = []
         for service in self.discover_primary_services():
             services.append(service)
@@ -816,13 +898,23 @@ class GattClient(GattLayer):
                 service.add_characteristic(characteristic)
             self.__model.add_service(service)
 
-        # Searching for descriptors
+        # Searching for descriptors, service by service
         for service in self.__model.services():
-            for characteristic in service.characteristics():
-                for descriptor in self.discover_characteristic_descriptors(characteristic):
-                    desc = self.get_descriptor(characteristic, descriptor.uuid, descriptor.handle)
-                    if desc is not None:
-                        characteristic.add_descriptor(desc)
+            descriptors = list(self.discover_service_descriptors(service))
+
+            # Read descriptors values, grouping descriptors of known size
+            sizes = {}
+            for _, descriptor in descriptors:
+                if descriptor.uuid.type == UUID.TYPE_16 and \
+                    descriptor.uuid.value() in self.DESCRIPTOR_SIZES:
+                    sizes[descriptor.handle] = self.DESCRIPTOR_SIZES[descriptor.uuid.value()]
+            values = self.read_many([descriptor.handle for _, descriptor in descriptors], sizes)
+
+            for (characteristic, descriptor), value in zip(descriptors, values):
+                desc = CharacteristicDescriptor.from_uuid(characteristic, descriptor.handle,
+                                                          descriptor.uuid, value)
+                if desc is not None:
+                    characteristic.add_descriptor(desc)
 
     @proclock
     def read(self, handle):
@@ -840,6 +932,94 @@ class GattClient(GattLayer):
         elif isinstance(msg, GattErrorResponse):
             raise error_response_to_exc(msg.reason, msg.request, msg.handle)
 
+    @proclock
+    def read_multiple(self, handles):
+        """Read multiple characteristics or descriptors with a single request.
+
+        The remote device returns the concatenation of the attributes values,
+        truncated to ATT_MTU-1 bytes.
+
+        :param list handles: Handles of the attributes to read
+        :return bytes: Concatenated values
+        """
+        self.lock_tx()
+        self.att.read_multiple_request(list(handles))
+        self.unlock_tx()
+
+        msg = self.wait_for_message(GattReadMultipleResponse)
+        if isinstance(msg, GattReadMultipleResponse):
+            return msg.values
+        elif isinstance(msg, GattErrorResponse):
+            raise error_response_to_exc(msg.reason, msg.request, msg.handle)
+
+    def read_many(self, handles, sizes=None):
+        """Read multiple characteristics or descriptors, using as few requests
+        as possible.
+
+        Attributes whose value size is known are read by groups with Read
+        Multiple requests, an attribute of unknown size being allowed as the
+        last member of a group. Other attributes are read one by one, as well
+        as every attribute if the remote device does not support Read Multiple
+        requests.
+
+        :param list handles: Handles of the attributes to read
+        :param dict sizes: Value sizes indexed by handle (optional)
+        :return list: Attributes values, in the order of `handles`
+        """
+        sizes = sizes or {}
+        max_size = self.att.get_server_mtu() - 1
+        values = []
+        i = 0
+        while i < len(handles):
+            # Group attributes that can be read at once
+            group = [handles[i]]
+            known_size = sizes.get(handles[i])
+            i += 1
+            while self.__read_multiple_supported and known_size is not None and i < len(handles):
+                size = sizes.get(handles[i])
+                if size is None and known_size < max_size:
+                    # Attribute of unknown size ends the group
+                    group.append(handles[i])
+                    i += 1
+                    break
+                if size is None or known_size + size > max_size:
+                    break
+                group.append(handles[i])
+                known_size += size
+                i += 1
+
+            if len(group) == 1:
+                values.append(self.read(group[0]))
+                continue
+
+            try:
+                data = self.read_multiple(group)
+            except UnsupportedRequestError:
+                self.__read_multiple_supported = False
+                values.extend(self.read(handle) for handle in group)
+                continue
+
+            # Split values, falling back to single reads on size mismatch
+            group_values = []
+            offset = 0
+            for handle in group:
+                size = sizes.get(handle)
+                if size is None:
+                    size = len(data) - offset
+                group_values.append(data[offset:offset + size])
+                offset += size
+            last_size = len(group_values[-1])
+            if offset != len(data) or any(
+                len(value) != sizes[handle] for handle, value in zip(group, group_values)
+                if handle in sizes
+            ):
+                group_values = [self.read(handle) for handle in group]
+            elif group[-1] not in sizes and offset >= max_size and last_size < max_size:
+                # Last value may have been truncated
+                group_values[-1] = self.read(group[-1])
+            values.extend(group_values)
+        return values
+
     @proclock
     def read_blob(self, handle, offset=0):
         """Read a characteristic or a descriptor starting from `offset`.
@@ -1208,7 +1388,10 @@ class GattServer(GattLayer):
         # List attributes by type UUID, sorted by handles
         attrs = {}
         attrs_handles = []
-        for attribute in self.server_model.find_objects_by_range(request.start, request.end):
+        # Only the first attributes fit in a response, an item being at least one
+        # byte long
+        for attribute in islice(self.server_model.attr_by_range(request.start, request.end),
+                                self.att.get_client_mtu()):
             attrs[attribute.handle] = attribute
             attrs_handles.append(attribute.handle)
         attrs_handles.sort()
@@ -1327,134 +1510,135 @@ class GattServer(GattLayer):
             )
 
 
-    @txlock
-    def on_read_request(self, request):
-        """Read attribute value (if any)
+    def __read_attribute(self, handle: int, length: int):
+        """Read an attribute value on behalf of a read or read multiple request.
 
         :param int handle: Characteristic or descriptor handle
+        :param int length: Maximum length of the returned value
+        :return: Attribute value, or `None` if attribute cannot be read
+        :raise GattReadError: Attribute access refused
         """
         try:
-            local_mtu = self.att.get_client_mtu()
+            # Search attribute by handle
+            attr = self.server_model.find_object_by_handle(handle)
+        except IndexError:
+            raise GattReadError(BleAttErrorCode.ATTRIBUTE_NOT_FOUND)
+
+        # Ensure attribute is a readable characteristic value or a descriptor
+        if isinstance(attr, CharacteristicValue):
+
+            # Check characteristic is readable
+            charac = self.server_model.find_object_by_handle(handle - 1)
+
+            conn_handle = self.get_layer('l2cap').get_conn_handle()
+            if charac.check_security_property(ReadAccess, Authentication):
+                print("[i] authentication required for read access !")
+                if not self.get_layer('ll').state.is_authenticated(conn_handle):
+                    raise GattReadError(BleAttErrorCode.INSUFFICIENT_AUTHENT)
+            if charac.check_security_property(ReadAccess, Encryption):
+                print("[i] encryption required for read access !")
+                if not self.get_layer('ll').state.is_encrypted(conn_handle):
+                    raise GattReadError(BleAttErrorCode.INSUFFICIENT_ENCRYPTION)
+            if charac.check_security_property(ReadAccess, Authorization):
+                print("[i] authorization required for read access !")
+                # TODO: not supported for now
+                raise GattReadError(BleAttErrorCode.INSUFFICIENT_AUTHOR)
+            if not charac.readable():
+                # Characteristic is not readable
+                raise GattReadError(BleAttErrorCode.READ_NOT_PERMITTED)
 
-            # Search attribute by handle and send respons
-            attr = self.server_model.find_object_by_handle(request.handle)
+            try:
+                service = self.server_model.find_service_by_characteristic_handle(charac.handle)
+                self.server_model.on_characteristic_read(
+                    service,
+                    charac,
+                    0,
+                    length
+                )
 
-            # Ensure attribute is a readable characteristic value or a descriptor
-            if isinstance(attr, CharacteristicValue):
+                # Make sure the returned value matches the boundaries
+                return charac.value[:length]
+            except HookReturnValue as force_value:
+                # Make sure the returned value matches the boundaries
+                return force_value.value[:length]
+            except HookReturnAuthentRequired as authent_error:
+                raise GattReadError(BleAttErrorCode.INSUFFICIENT_AUTHENT)
+            except HookReturnAuthorRequired as author_error:
+                raise GattReadError(BleAttErrorCode.INSUFFICIENT_AUTHOR)
+            except HookReturnAccessDenied as access_denied:
+                raise GattReadError(BleAttErrorCode.READ_NOT_PERMITTED)
+            except HookReturnNotFound as not_found:
+                raise GattReadError(BleAttErrorCode.ATTRIBUTE_NOT_FOUND)
+            except HookReturnGattError as gatt_error:
+                raise GattReadError(
+                    gatt_error.error if gatt_error.error is not None else BleAttErrorCode.ATTRIBUTE_NOT_FOUND,
+                    gatt_error.request,
+                    gatt_error.handle
+                )
+        elif isinstance(attr, Characteristic):
+            # Return characteristic value
+            return attr.payload()
+        elif isinstance(attr, PrimaryService):
+            # Return primary service value
+            return attr.payload()
+        elif isinstance(attr, CharacteristicDescriptor):
+            # Make sure the returned value matches the boundaries
+            return attr.value[:length]
+        return None
 
-                # Check characteristic is readable
-                charac = self.server_model.find_object_by_handle(request.handle - 1)
+    @txlock
+    def on_read_request(self, request):
+        """Read attribute value (if any)
 
-                conn_handle = self.get_layer('l2cap').get_conn_handle()
-                if charac.check_security_property(ReadAccess, Authentication):
-                    print("[i] authentication required for read access !")
-                    if not self.get_layer('ll').state.is_authenticated(conn_handle):
-                        self.error(
-                            BleAttOpcode.READ_REQUEST,
-                            request.handle,
-                            BleAttErrorCode.INSUFFICIENT_AUTHENT
-                        )
-                        return
-                if charac.check_security_property(ReadAccess, Encryption):
-                    print("[i] encryption required for read access !")
-                    if not self.get_layer('ll').state.is_encrypted(conn_handle):
-                        self.error(
-                            BleAttOpcode.READ_REQUEST,
-                            request.handle,
-                            BleAttErrorCode.INSUFFICIENT_ENCRYPTION
-                        )
-                        return
-                if charac.check_security_property(ReadAccess, Authorization):
-                    print("[i] authorization required for read access !")
-                    # TODO: not supported for now
-                    self.error(
-                        BleAttOpcode.READ_REQUEST,
-                        request.handle,
-                        BleAttErrorCode.INSUFFICIENT_AUTHOR
-                    )
-                    return
-                if charac.readable():
-                    try:
-                        service = self.server_model.find_service_by_characteristic_handle(charac.handle)
-                        self.server_model.on_characteristic_read(
-                            service,
-                            charac,
-                            0,
-                            local_mtu - 1
-                        )
+        :param int handle: Characteristic or descriptor handle
+        """
+        local_mtu = self.att.get_client_mtu()
+        try:
+            value = self.__read_attribute(request.handle, local_mtu - 1)
+            if value is not None:
+                self.att.read_response(
+                    value
+                )
+        except GattReadError as err:
+            self.error(
+                err.request if err.request is not None else BleAttOpcode.READ_REQUEST,
+                err.handle if err.handle is not None else request.handle,
+                err.reason
+            )
 
-                        # Make sure the returned value matches the boundaries
-                        value = charac.value[:local_mtu - 1]
+    @txlock
+    def on_read_multiple_request(self, request: GattReadMultipleRequest):
+        """Read multiple attribute values at once.
 
-                        self.att.read_response(
-                            value
-                        )
-                    except HookReturnValue as force_value:
-                        # Make sure the returned value matches the boundaries
-                        value = force_value.value[:local_mtu - 1]
+        Values are concatenated and the response is truncated to ATT_MTU-1
+        bytes, as described in Vol 3, Part F, section 3.4.4.8.
 
-                        self.att.read_response(
-                            value
-                        )
-                    except HookReturnAuthentRequired as authent_error:
-                        self.error(
-                            BleAttOpcode.READ_REQUEST,
-                            request.handle,
-                            BleAttErrorCode.INSUFFICIENT_AUTHENT
-                        )
-                    except HookReturnAuthorRequired as author_error:
-                        self.error(
-                            BleAttOpcode.READ_REQUEST,
-                            request.handle,
-                            BleAttErrorCode.INSUFFICIENT_AUTHOR
-                        )
-                    except HookReturnAccessDenied as access_denied:
-                        self.error(
-                            BleAttOpcode.READ_REQUEST,
-                            request.handle,
-                            BleAttErrorCode.READ_NOT_PERMITTED
-                        )
-                    except HookReturnNotFound as not_found:
-                        self.error(
-                            BleAttOpcode.READ_REQUEST,
-                            request.handle,
-                            BleAttErrorCode.ATTRIBUTE_NOT_FOUND
-                        )
-                    except HookReturnGattError as gatt_error:
-                        self.error(
-                            gatt_error.request if gatt_error.request is not None else BleAttOpcode.READ_REQUEST,
-                            gatt_error.handle if gatt_error.handle is not None else request.handle,
-                            gatt_error.error if gatt_error.error is not None else BleAttErrorCode.ATTRIBUTE_NOT_FOUND
-                        )
-                else:
-                    # Characteristic is not readable
-                    self.error(
-                        BleAttOpcode.READ_REQUEST,
-                        request.handle,
-                        BleAttErrorCode.READ_NOT_PERMITTED
-                    )
-            elif isinstance(attr, Characteristic):
-                # Return characteristic value
-                self.att.read_response(
-                    attr.payload()
-                )
-            elif isinstance(attr, PrimaryService):
-                # Return primary service value
-                self.att.read_response(
-                    attr.payload()
+        :param handles: List of handles
+        """
+        local_mtu = self.att.get_client_mtu()
+        values = b""
+        for handle in request.handles:
+            # Response is full, remaining attributes are not read
+            if len(values) >= local_mtu - 1:
+                break
+            try:
+                value = self.__read_attribute(handle, local_mtu - 1 - len(values))
+            except GattReadError as err:
+                self.error(
+                    err.request if err.request is not None else BleAttOpcode.READ_MULTIPLE_REQUEST,
+                    err.handle if err.handle is not None else handle,
+                    err.reason
                 )
-            elif isinstance(attr, CharacteristicDescriptor):
-                # Make sure the returned value matches the boundaries
-                self.att.read_response(
-                    attr.value[:local_mtu - 1]
+                return
+            if value is None:
+                self.error(
+                    BleAttOpcode.READ_MULTIPLE_REQUEST,
+                    handle,
+                    BleAttErrorCode.READ_NOT_PERMITTED
                 )
-
-        except IndexError as e:
-            self.error(
-                BleAttOpcode.READ_REQUEST,
-                request.handle,
-                BleAttErrorCode.ATTRIBUTE_NOT_FOUND
-            )
+                return
+            values += value
+        self.att.read_multiple_response(values[:local_mtu - 1])
 
     @txlock
     def on_read_blob_request(self, request: GattReadBlobRequest):
@@ -2038,7 +2222,10 @@ class GattServer(GattLayer):
         # List attributes by type UUID, sorted by handles
         attrs = {}
         attrs_handles = []
-        for attribute in self.server_model.attr_by_type_uuid(UUID(request.type), request.start, request.end):
+        # Only the first attributes fit in a response, an item being at least one
+        # byte long
+        for attribute in islice(self.server_model.attr_by_type_uuid(UUID(request.type), request.start, request.end),
+                                self.att.get_client_mtu()):
             attrs[attribute.handle] = attribute
             attrs_handles.append(attribute.handle)
         attrs_handles.sort()
@@ -2158,7 +2345,10 @@ class GattServer(GattLayer):
         # List attributes by type UUID, sorted by handles
         attrs = {}
         attrs_handles = []
-        for attribute in self.server_model.attr_by_type_uuid(UUID(request.type), request.start, request.end):
+        # Only the first attributes fit in a response, an item being at least one
+        # byte long
+        for attribute in islice(self.server_model.attr_by_type_uuid(UUID(request.type), request.start, request.end),
+                                self.att.get_client_mtu()):
             attrs[attribute.handle] = attribute
             attrs_handles.append(attribute.handle)
         attrs_handles.sort()
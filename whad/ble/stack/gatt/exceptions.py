@@ -4,3 +4,12 @@
 class GattTimeoutException(Exception):
     def __init__(self):
         super().__init__()
+
+class GattReadError(Exception):
+    """Raised by the GATT server when an attribute cannot be read.
+    """
+    def __init__(self, reason, request=None, handle=None):
+        super().__init__()
+        self.reason = reason
+        self.request = request
+        self.handle = handle
@@ -466,8 +466,11 @@ class LinkLayer(Layer):
         # Free the previously instantiated L2CAP layer
         conn_layer = self.state.get_connection_l2cap(conn_handle)
         if conn_layer is not None:
-            # Mark GATT layer as disconnected
-            self.get_layer(conn_layer).get_layer("gatt").state.terminated = True
+            # Mark GATT layer as disconnected and wake up pending procedures
+            gatt_layer = self.get_layer(conn_layer).get_layer("gatt")
+            gatt_layer.state.terminated = True
+            if hasattr(gatt_layer, "terminate"):
+                gatt_layer.terminate()
             self.destroy(self.get_layer(conn_layer))
 
         # Remove connection from our registered connections
@@ -63,25 +63,53 @@ def channel_to_frequency(channel):
 
     return (2400 + freq_offset) * 1000000
 
+# Whitening LFSR (x^7 + x^4 + 1) has a period of 127 bits, its keystream is
+# therefore periodic with a period of 127 bytes.
+WHITENING_PERIOD = 127
+
+# Whitening keystreams indexed by channel, computed on first use
+_whitening_keystreams = {}
+
+def whitening_keystream(channel, length=WHITENING_PERIOD):
+    """
+    Returns the whitening keystream of a BLE channel.
+
+    :param channel: BLE channel
+    :type channel: int
+    :param length: Keystream length in bytes
+    :type length: int
+    :return: Keystream to XOR with data to (de)whiten it
+    :rtype: bytes
+    """
+    keystream = _whitening_keystreams.get(channel)
+    if keystream is None:
+        keystream = []
+        lfsr = swap_bits(channel) | 2
+        for _ in range(WHITENING_PERIOD):
+            mask = 0
+            for i in 128, 64, 32, 16, 8, 4, 2, 1:
+                if lfsr & 0x80:
+                    lfsr ^= 0x11
+                    mask |= i
+                lfsr = (lfsr << 1) & 0xff
+            keystream.append(swap_bits(mask))
+        keystream = bytes(keystream)
+        _whitening_keystreams[channel] = keystream
+
+    if length > WHITENING_PERIOD:
+        keystream = keystream * (length // WHITENING_PERIOD + 1)
+    return keystream[:length]
+
 def dewhitening(data, channel):
     """
     Dewhiten data based on BLE channel.
     """
-    ret = []
-    lfsr = swap_bits(channel) | 2
-
-    for d in data:
-        d = swap_bits(d)
-        for i in 128, 64, 32, 16, 8, 4, 2, 1:
-            if lfsr & 0x80:
-                lfsr ^= 0x11
-                d ^= i
-
-            lfsr <<= 1
-            i >>=1
-        ret.append(swap_bits(d))
-
-    return bytes(ret)
+    data = bytes(data)
+    size = len(data)
+    keystream = whitening_keystream(channel, size)
+    return (
+        int.from_bytes(data, "little") ^ int.from_bytes(keystream, "little")
+    ).to_bytes(size, "little")
 
 def whitening(data, channel):
     """
@@ -89,35 +117,44 @@ def whitening(data, channel):
     """
     return dewhitening(data, channel)
 
-def crc(data, init=0x555555):
+def _reverse_crc_register(value):
     """
-    Computes the 24-bit CRC of provided data.
+    Reverse the bits of a 24-bit CRC register.
     """
-    ret = [(init >> 16) & 0xff, (init >> 8) & 0xff, init & 0xff]
-    for d in data:
-        for _ in range(8):
-            t = (ret[0] >> 7) & 1
+    return (swap_bits(value & 0xff) << 16) | (swap_bits((value >> 8) & 0xff) << 8) | \
+        swap_bits((value >> 16) & 0xff)
 
-            ret[0] <<= 1
-            if ret[1] & 0x80:
-                ret[0] |= 1
-
-            ret[1] <<= 1
-            if ret[2] & 0x80:
-                ret[1] |= 1
+def _build_crc_table():
+    """
+    Build the lookup table of the reflected CRC-24 (polynomial 0x00065B), data
+    being transmitted LSB first.
+    """
+    poly = _reverse_crc_register(0x00065b)
+    table = []
+    for i in range(256):
+        value = i
+        for _ in range(8):
+            value = (value >> 1) ^ poly if value & 1 else value >> 1
+        table.append(value)
+    return tuple(table)
 
-            ret[2] <<= 1
-            if d & 1 != t:
-                ret[2] ^= 0x5b
-                ret[1] ^= 0x06
+_CRC_TABLE = _build_crc_table()
 
-            d >>= 1
+# Reflected CRC initial values, indexed by CRCInit
+_crc_inits = {}
 
-    ret[0] = swap_bits(ret[0] & 0xFF)
-    ret[1] = swap_bits(ret[1] & 0xFF)
-    ret[2] = swap_bits(ret[2] & 0xFF)
-    return bytes(ret)
+def crc(data, init=0x555555):
+    """
+    Computes the 24-bit CRC of provided data.
+    """
+    value = _crc_inits.get(init)
+    if value is None:
+        value = _crc_inits[init] = _reverse_crc_register(init)
 
+    table = _CRC_TABLE
+    for d in data:
+        value = (value >> 8) ^ table[(value ^ d) & 0xff]
+    return value.to_bytes(3, "little")
 
 
 def is_access_address_valid(aa):
@@ -5,7 +5,7 @@ Handles Segmentation/Reassembly of Upper Transport PDU
 """
 
 import logging
-from whad.common.stack import Layer, alias, source
+from whad.common.stack import Layer, Scheduler, alias, source
 from whad.btmesh.stack.upper_transport import UpperTransportLayer
 from whad.btmesh.stack.upper_transport.df_attacks import UpperTransportDFAttacks
 from whad.btmesh.stack.utils import (
@@ -13,7 +13,7 @@ from whad.btmesh.stack.utils import (
     UNICAST_ADDR_TYPE,
     calculate_seq_auth,
 )
-from queue import Queue
+from collections import deque
 from whad.scapy.layers.btmesh import (
     BTMesh_Upper_Transport_Access_PDU,
     BTMesh_Lower_Transport_Segmented_Access_Message,
@@ -42,8 +42,7 @@ from whad.scapy.layers.btmesh import (
 
 
 from scapy.all import raw, Raw
-from threading import Thread, Event, Timer
-from time import sleep, time
+from time import monotonic
 from copy import copy
 
 
@@ -95,8 +94,8 @@ class Transaction:
         # Set to True when the Transaction is finished (all segments received and acked if needed, or all segments sent and acked if needed)
         self.is_transaction_finished = False
 
-        # Event object to stop the timer if acked received to restart transmission/ restart ack sending thread
-        self.event = None
+        # Pending task of the transaction in the stack scheduler (segment transmission, retransmission or ack)
+        self.timer = None
 
 
 class TxTransaction(Transaction):
@@ -115,8 +114,6 @@ class TxTransaction(Transaction):
         """
         super().__init__(message)
 
-        self.sending_thread = None
-
         raw_pkt = raw(self.pkt)
         self.fragments = []
 
@@ -133,6 +130,9 @@ class TxTransaction(Transaction):
         # True for each retransmission if we receive one ack
         self.acked_received = False
 
+        # True when all the segments have been sent and we wait before retransmitting
+        self.waiting_for_ack = False
+
         # get the rentransmission interval and counts from the SAR state in the ConfigurationServerModel
         sar_state = sar_transmitter_state
         self.interval_step = sar_state.get_sub_state(
@@ -208,10 +208,6 @@ class TxTransaction(Transaction):
         # check is all segments have been acked
         if len(acked_segments) == self.nb_of_segments:
             self.is_transaction_finished = True
-            return
-        # if segements left to be sent, reset timer
-        else:
-            self.event.set()
 
 
 class RxTransaction(Transaction):
@@ -259,16 +255,13 @@ class RxTransaction(Transaction):
 
         self.min_ack_delay = self.sar_ack_delay_inc * self.sar_seg_reception_interval
 
-        # main ack sending thread
-        self.main_ack_thread = None
-
         # initial delay before sending the first ack message
         self.initial_ack_delay = (
             min(self.seg_n + 0.5, self.sar_ack_delay_inc)
             * self.sar_seg_reception_interval
         )
 
-        # epoch time of last ack sent
+        # monotonic time of last ack sent
         self.time_last_ack = None
 
         # add the fragment to the dictionary
@@ -286,12 +279,15 @@ class LowerTransportLayer(Layer):
         """
         LowerTransport Layer.
 
-        :param options: [TODO:description], defaults to {}.
+        :param options: Options of the layer, defaults to {}. Need to pass the "profile" object, "scheduler" is the Scheduler running the SAR timers (created if not given)
         :type options: [TODO:type], optional
         """
 
         super().configure(options=options)
 
+        # Scheduler running segment transmissions, retransmissions and acks of all the transactions
+        self.__scheduler = options.get("scheduler") or Scheduler()
+
         # list queue of pending upper_transport layer message waiting to be sent to the network layer
         # keys are the dst_addr and the value are queues for each message where the dst_addr matches
         self.__queues = {}
@@ -347,7 +343,11 @@ class LowerTransportLayer(Layer):
         # if ack received
         if isinstance(pkt, BTMesh_Lower_Transport_Control_Message):
             if pkt.opcode == 0 and ctx.src_addr in self.state.tx_transactions.keys():
-                self.state.tx_transactions[ctx.src_addr].process_ack((pkt[1], ctx))
+                self.__scheduler.call_soon(
+                    self.process_ack,
+                    self.state.tx_transactions[ctx.src_addr],
+                    (pkt[1], ctx),
+                )
             else:
                 self.dispatch_control_rx_pdu(message)
 
@@ -440,13 +440,12 @@ class LowerTransportLayer(Layer):
             )
             self.state.rx_transactions[ctx.src_addr] = transaction
             self.state.seq_auth_values[ctx.src_addr] = ctx.seq_auth
-            transaction.event = Event()
-            transaction.main_ack_thread = Timer(
+            transaction.timer = self.__scheduler.call_later(
                 transaction.initial_ack_delay / 1000,
-                self.sending_ack_thread,
-                args=(transaction, True, transaction.event),
+                self.send_ack,
+                transaction,
+                True,
             )
-            transaction.main_ack_thread.start()
 
     def dispatch_access_rx_pdu(self, message):
         """
@@ -523,13 +522,12 @@ class LowerTransportLayer(Layer):
             )
             self.state.rx_transactions[ctx.src_addr] = transaction
             self.state.seq_auth_values[ctx.src_addr] = ctx.seq_auth
-            transaction.event = Event()
-            transaction.main_ack_thread = Timer(
+            transaction.timer = self.__scheduler.call_later(
                 transaction.initial_ack_delay / 1000,
-                self.sending_ack_thread,
-                args=(transaction, True, transaction.event),
+                self.send_ack,
+                transaction,
+                True,
             )
-            transaction.main_ack_thread.start()
 
     def process_rx_seg_message(self, transaction, message):
         """
@@ -543,24 +541,7 @@ class LowerTransportLayer(Layer):
         # if transaction finished, resend ack after min delay
         pkt, ctx = message
         if transaction.is_transaction_finished:
-            if transaction.time_last_ack is not None:
-                delay = (
-                    max(
-                        0,
-                        transaction.min_ack_delay
-                        - (time() - transaction.time_last_ack),
-                    )
-                    / 1000
-                )
-            else:
-                delay = transaction.min_ack_delay / 1000
-
-            transaction.main_ack_thread = Timer(
-                delay,
-                self.sending_ack_thread,
-                args=(transaction, False, transaction.event),
-            )
-            transaction.main_ack_thread.start()
+            self.__scheduler.call_soon(self.schedule_ack, transaction)
 
         else:
             # check if segment is one we have already received
@@ -569,29 +550,10 @@ class LowerTransportLayer(Layer):
 
             # if all segments received, send ack and send to upper_transport
             if len(transaction.fragments.keys()) == transaction.seg_n + 1:
-                if transaction.time_last_ack is not None:
-                    delay = (
-                        max(
-                            0,
-                            transaction.min_ack_delay
-                            - (time() - transaction.time_last_ack),
-                        )
-                        / 1000
-                    )
-                else:
-                    delay = transaction.min_ack_delay / 1000
-
                 ctx.seq_number = ctx.seq_auth & 0xFFFFFF
 
-                # "kill" previous ack sending thread to send last one
-                transaction.event.clear()
-                transaction.event = Event()
-                transaction.main_ack_thread = Timer(
-                    delay,
-                    self.sending_ack_thread,
-                    args=(transaction, False, transaction.event),
-                )
-                transaction.main_ack_thread.start()
+                # replace the pending ack by the last one
+                self.__scheduler.call_soon(self.schedule_ack, transaction)
                 transaction.is_transaction_finished = True
 
                 raw_upper_pkt = b""
@@ -607,11 +569,39 @@ class LowerTransportLayer(Layer):
 
                 self.send_to_upper_transport((pkt, transaction.ctx))
 
+    def schedule_ack(self, transaction):
+        """
+        Replaces the pending ack of an Rx transaction by a single ack, sent at least min_ack_delay after the last one.
+        Runs in the scheduler, like send_ack which also updates the transaction timer
+
+        :param transaction: The transaction in question
+        :type transaction: RxTransaction
+        """
+        delay = transaction.min_ack_delay / 1000
+        if transaction.time_last_ack is not None:
+            delay = max(0, delay - (monotonic() - transaction.time_last_ack))
+
+        if transaction.timer is not None:
+            transaction.timer.cancel()
+        transaction.timer = self.__scheduler.call_later(
+            delay, self.send_ack, transaction, False
+        )
+
     @source("upper_transport")
     def on_upper_transport_layer_message(self, message):
         """
         Handler when the Upper transport Layer sends a PDU
 
+        :param message: The Upper Transport Layer message and its context
+        :type message: (Packet, MeshMessageContext)
+        """
+        self.__scheduler.call_soon(self.queue_tx_message, message)
+
+    def queue_tx_message(self, message):
+        """
+        Starts a Tx transaction for a message, or queues it if a transaction is active for its destination.
+        Runs in the scheduler.
+
         :param message: The Upper Transport Layer message and its context
         :type message: (Packet, MeshMessageContext)
         """
@@ -622,11 +612,7 @@ class LowerTransportLayer(Layer):
             ctx.dest_addr in self.state.tx_transactions.keys()
             and not self.state.tx_transactions[ctx.dest_addr].is_transaction_finished
         ):
-            if ctx.dest_addr in self.__queues.keys():
-                self.__queues[ctx.dest_addr].put_nowait(message)
-            else:
-                self.__queues[ctx.dest_addr] = Queue()
-                self.__queues[ctx.dest_addr].put_nowait(message)
+            self.__queues.setdefault(ctx.dest_addr, deque()).append(message)
 
         else:  # create transaction to send it
             sar_state = self.state.profile.get_configuration_server_model().get_state(
@@ -634,353 +620,252 @@ class LowerTransportLayer(Layer):
             )
             transaction = TxTransaction(message, sar_state)
             self.state.tx_transactions[ctx.dest_addr] = transaction
-            self.start_sending_thread(transaction)
+            self.start_transaction(transaction)
 
-    def start_sending_thread(self, transaction):
+    def start_transaction(self, transaction):
         """
-        Initiates the sending thread for a Transaction depending on the parameters of the PDU
+        Starts sending a Tx Transaction. Unsegmented PDUs are sent right away,
+        segmented PDUs are sent by tasks of the scheduler
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Tx Transaction to send
         :type transaction: TxTransaction
         """
-        transaction.event = Event()
         if len(transaction.fragments) > 1:
-            if transaction.dst_addr_type == UNICAST_ADDR_TYPE:
-                if transaction.ctx.is_ctl:
-                    transaction.sending_thread = Thread(
-                        target=self.sending_thread_ctl_unicast_segmented,
-                        args=(transaction, transaction.event),
-                    )
-                else:
-                    transaction.sending_thread = Thread(
-                        target=self.sending_thread_access_unicast_segmented,
-                        args=(transaction, transaction.event),
-                    )
-            else:
-                if transaction.ctx.is_ctl:
-                    transaction.sending_thread = Thread(
-                        target=self.sending_thread_ctl_multicast_segmented,
-                        args=(transaction, transaction.event),
-                    )
-                else:
-                    transaction.sending_thread = Thread(
-                        target=self.sending_thread_access_multicast_segmented,
-                        args=(transaction, transaction.event),
-                    )
+            self.send_round(transaction)
         else:
             if transaction.ctx.is_ctl:
-                transaction.sending_thread = Thread(
-                    target=self.sending_thread_ctl_unsegmented,
-                    args=(transaction, transaction.event),
+                pkt = BTMesh_Lower_Transport_Control_Message(
+                    seg=0, opcode=transaction.opcode
                 )
             else:
-                transaction.sending_thread = Thread(
-                    target=self.sending_thread_access_unsegmented,
-                    args=(transaction, transaction.event),
+                application_key_flag, application_key_id = self.get_app_key_fields(
+                    transaction
                 )
+                pkt = BTMesh_Lower_Transport_Access_Message(
+                    seg=0,
+                    application_key_flag=application_key_flag,
+                    application_key_id=application_key_id,
+                )
+            self.send_to_network((pkt / transaction.pkt, transaction.ctx))
+            self.end_transaction(transaction)
 
-        transaction.sending_thread.start()
-
-    def sending_thread_ctl_unicast_segmented(self, transaction, event):
+    def end_transaction(self, transaction):
         """
-        Function running in the sending thread to send each segment to the network layer for a unicast destination
-        FOR CONTROL MESSAGES
+        Marks a Tx Transaction as finished (acked, cancelled or out of retransmissions)
+        and starts the next one queued for the same destination
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Finished Tx Transaction
         :type transaction: TxTransaction
-        :param event: Event object to received signal from main thread
-        :type: Event
         """
-        while (
-            transaction.unicast_retrans_count > 0
-            and transaction.unicast_retrans_no_progress_count > 0
-            and not transaction.is_transaction_finished
-        ):
-            if not transaction.acked_received:
-                transaction.unicast_retrans_no_progress_count -= 1
+        transaction.is_transaction_finished = True
+        if transaction.timer is not None:
+            transaction.timer.cancel()
+            transaction.timer = None
 
-            transaction.acked_received = False
-            transaction.unicast_retrans_count -= 1
-            for fragment_index in range(len(transaction.fragments)):
-                if fragment_index not in transaction.acked_segments:
-                    payload = (
-                        BTMesh_Lower_Transport_Segmented_Control_Message(
-                            seq_zero=transaction.ctx.seq_auth & 0x1FFF,
-                            seg_offset=fragment_index,
-                            last_seg_number=len(transaction.fragments) - 1,
-                        )
-                        / transaction.fragments[fragment_index]
-                    )
+        dest_addr = transaction.ctx.dest_addr
+        if self.state.tx_transactions.get(dest_addr) is not transaction:
+            return
 
-                    # create new context for the segment
-                    segment_ctx = copy(transaction.ctx)
-                    segment_ctx.segment_number = fragment_index
-                    segment_ctx.seq_number = transaction.ctx.seq_number + fragment_index
-                    self.send_to_network((
-                        BTMesh_Lower_Transport_Control_Message(
-                            seg=1,
-                            opcode=transaction.opcode,
-                            payload_field=payload,
-                        ),
-                        segment_ctx,
-                    ))
-                    sleep(transaction.interval_step / 1000)
-            if transaction.ctx.ttl == 0:
-                event.wait(transaction.unicast_retrans_interval_step / 1000)
-            else:
-                event.wait(
-                    (
-                        transaction.unicast_retrans_interval_step
-                        + (transaction.unicast_interval_inc * (transaction.ctx.ttl - 1))
-                    )
-                    / 1000
-                )
+        queue = self.__queues.get(dest_addr)
+        if queue:
+            message = queue.popleft()
+            if len(queue) == 0:
+                del self.__queues[dest_addr]
+            self.queue_tx_message(message)
 
-    def sending_thread_access_unicast_segmented(self, transaction, event):
+    def get_app_key_fields(self, transaction):
         """
-        Function running in the sending thread to send each segment to the network layer for a unicast destination
-        For Access messages
+        Returns the application key flag and id of the Access messages of a transaction
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Tx Transaction
         :type transaction: TxTransaction
-        :param event: Event object to received signal from main thread
-        :type: Event
+        :returns: The application_key_flag and application_key_id values
+        :rtype: (int, int)
         """
-        while (
-            transaction.unicast_retrans_count > 0
-            and transaction.unicast_retrans_no_progress_count > 0
-            and not transaction.is_transaction_finished
-        ):
-            if not transaction.acked_received:
-                transaction.unicast_retrans_no_progress_count -= 1
-
-            transaction.acked_received = False
-            transaction.unicast_retrans_count -= 1
-            for fragment_index in range(len(transaction.fragments)):
-                if fragment_index not in transaction.acked_segments:
-                    payload = (
-                        BTMesh_Lower_Transport_Segmented_Access_Message(
-                            aszmic=0,
-                            seq_zero=transaction.ctx.seq_auth & 0x1FFF,
-                            seg_offset=fragment_index,
-                            last_seg_number=len(transaction.fragments) - 1,
-                        )
-                        / transaction.fragments[fragment_index]
-                    )
-
-                    # create new context for the segment
-                    segment_ctx = copy(transaction.ctx)
-                    segment_ctx.segment_number = fragment_index
-                    segment_ctx.seq_number = transaction.ctx.seq_number + fragment_index
-                    if transaction.ctx.application_key_index == -1:
-                        application_key_flag = 0
-                        application_key_id = 0
-                    else:
-                        application_key_flag = 1
-                        application_key_id = transaction.ctx.aid
-                    self.send_to_network((
-                        BTMesh_Lower_Transport_Access_Message(
-                            seg=1,
-                            application_key_flag=application_key_flag,
-                            application_key_id=application_key_id,
-                            payload_field=payload,
-                        ),
-                        segment_ctx,
-                    ))
-                    sleep(transaction.interval_step / 1000)
-            if transaction.ctx.ttl == 0:
-                event.wait(transaction.unicast_retrans_interval_step / 1000)
-            else:
-                event.wait(
-                    (
-                        transaction.unicast_retrans_interval_step
-                        + (transaction.unicast_interval_inc * (transaction.ctx.ttl - 1))
-                    )
-                    / 1000
-                )
+        if transaction.ctx.application_key_index == -1:
+            return 0, 0
+        return 1, transaction.ctx.aid
 
-    def sending_thread_access_multicast_segmented(self, transaction, event):
+    def build_segment(self, transaction, fragment_index):
         """
-        Function running in the sending thread to send a segmented PDU to a multicast destination
-        For Access messages
-        No ack needed
+        Creates the Lower Transport PDU of a segment of a Tx Transaction and its context
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Tx Transaction
         :type transaction: TxTransaction
-        :param event: Event object to received signal from main thread
-        :type: Event
-        """
-        while (
-            transaction.multicast_retrans_count > 0
-            and not transaction.is_transaction_finished
-        ):
-            transaction.multicast_retrans_count -= 1
-            for fragment_index in range(len(transaction.fragments)):
-                if fragment_index not in transaction.acked_segments:
-                    if transaction.ctx.application_key_index == -1:
-                        application_key_flag = 0
-                        application_key_id = 0
-                    else:
-                        application_key_flag = 1
-                        application_key_id = transaction.ctx.aid
-
-                    payload = (
-                        BTMesh_Lower_Transport_Segmented_Access_Message(
-                            aszmic=0,
-                            seq_zero=transaction.ctx.seq_zero,
-                            seg_offset=fragment_index,
-                            last_seg_number=len(transaction.fragments) - 1,
-                        )
-                        / transaction.fragments[fragment_index]
-                    )
-
-                    # create new context for the segment
-                    segment_ctx = copy(transaction.ctx)
-                    segment_ctx.segment_number = fragment_index
-
-                    segment_ctx.seq_number = transaction.ctx.seq_number + fragment_index
+        :param fragment_index: Index of the segment
+        :type fragment_index: int
+        :returns: The segment and its context
+        :rtype: (BTMesh_Lower_Transport_Access_Message|BTMesh_Lower_Transport_Control_Message, MeshMessageContext)
+        """
+        if transaction.ctx.is_ctl:
+            payload = BTMesh_Lower_Transport_Segmented_Control_Message(
+                seq_zero=transaction.ctx.seq_auth & 0x1FFF,
+                seg_offset=fragment_index,
+                last_seg_number=len(transaction.fragments) - 1,
+            )
+            pkt = BTMesh_Lower_Transport_Control_Message(
+                seg=1,
+                opcode=transaction.opcode,
+                payload_field=payload / transaction.fragments[fragment_index],
+            )
+        else:
+            payload = BTMesh_Lower_Transport_Segmented_Access_Message(
+                aszmic=0,
+                seq_zero=transaction.ctx.seq_auth & 0x1FFF,
+                seg_offset=fragment_index,
+                last_seg_number=len(transaction.fragments) - 1,
+            )
+            application_key_flag, application_key_id = self.get_app_key_fields(
+                transaction
+            )
+            pkt = BTMesh_Lower_Transport_Access_Message(
+                seg=1,
+                application_key_flag=application_key_flag,
+                application_key_id=application_key_id,
+                payload_field=payload / transaction.fragments[fragment_index],
+            )
 
-                    self.send_to_network((
-                        BTMesh_Lower_Transport_Access_Message(
-                            seg=1,
-                            application_key_id=application_key_id,
-                            application_key_flag=application_key_flag,
-                            payload_field=payload,
-                        ),
-                        segment_ctx,
-                    ))
-                    sleep(transaction.interval_step / 1000)
-            sleep(transaction.multicast_retrans_interval_step / 1000)
+        # create new context for the segment
+        segment_ctx = copy(transaction.ctx)
+        segment_ctx.segment_number = fragment_index
+        segment_ctx.seq_number = transaction.ctx.seq_number + fragment_index
+        return pkt, segment_ctx
 
-    def sending_thread_ctl_multicast_segmented(self, transaction, event):
+    def send_round(self, transaction):
         """
-        Function running in the sending thread to send a segmented PDU to a multicast destination
-        For ctl messages
-        No ack needed
+        Starts a (re)transmission of the segments of a Tx Transaction not acked yet.
+        Unicast transactions are retransmitted until acked, multicast ones a fixed number of times.
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Tx Transaction
         :type transaction: TxTransaction
-        :param event: Event object to received signal from main thread
-        :type: Event
         """
-        while (
-            transaction.multicast_retrans_count > 0
-            and not transaction.is_transaction_finished
-        ):
-            transaction.multicast_retrans_count -= 1
-            for fragment_index in range(len(transaction.fragments)):
-                if fragment_index not in transaction.acked_segments:
-                    payload = (
-                        BTMesh_Lower_Transport_Segmented_Control_Message(
-                            seq_zero=transaction.ctx.seq_zero,
-                            seg_offset=fragment_index,
-                            last_seg_number=len(transaction.fragments) - 1,
-                        )
-                        / transaction.fragments[fragment_index]
-                    )
+        transaction.timer = None
+        transaction.waiting_for_ack = False
+        if transaction.is_transaction_finished:
+            return
 
-                    # create new context for the segment
-                    segment_ctx = copy(transaction.ctx)
-                    segment_ctx.segment_number = fragment_index
+        if transaction.dst_addr_type == UNICAST_ADDR_TYPE:
+            if (
+                transaction.unicast_retrans_count <= 0
+                or transaction.unicast_retrans_no_progress_count <= 0
+            ):
+                self.end_transaction(transaction)
+                return
 
-                    segment_ctx.seq_number = transaction.ctx.seq_number + fragment_index
+            if not transaction.acked_received:
+                transaction.unicast_retrans_no_progress_count -= 1
+            transaction.acked_received = False
+            transaction.unicast_retrans_count -= 1
+        else:
+            if transaction.multicast_retrans_count <= 0:
+                self.end_transaction(transaction)
+                return
+            transaction.multicast_retrans_count -= 1
 
-                    self.send_to_network((
-                        BTMesh_Lower_Transport_Control_Message(
-                            seg=1,
-                            opcode=transaction.opcode,
-                            payload_field=payload,
-                        ),
-                        segment_ctx,
-                    ))
-                    sleep(transaction.interval_step / 1000)
-            sleep(transaction.multicast_retrans_interval_step / 1000)
+        self.send_segment(transaction, 0)
 
-    def sending_thread_access_unsegmented(self, transaction, event):
+    def send_segment(self, transaction, fragment_index):
         """
-        Function running in a thread to send a unsegmented PDU
-        For Access messages
-        No ack
+        Sends the next segment not acked of a Tx Transaction, starting from fragment_index,
+        and schedules the next one. Once all segments are sent, schedules the next round.
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Tx Transaction
         :type transaction: TxTransaction
-        :param event: Event object to received signal from main thread
-        :type: Event
+        :param fragment_index: Index of the first segment to consider
+        :type fragment_index: int
         """
-        if transaction.ctx.application_key_index == -1:
-            application_key_flag = 0
-            application_key_id = 0
-        else:
-            application_key_flag = 1
-            application_key_id = transaction.ctx.aid
+        transaction.timer = None
+        if transaction.is_transaction_finished:
+            return
 
-        self.send_to_network((
-            BTMesh_Lower_Transport_Access_Message(
-                seg=0,
-                application_key_flag=application_key_flag,
-                application_key_id=application_key_id,
+        while fragment_index < len(transaction.fragments):
+            if fragment_index not in transaction.acked_segments:
+                self.send_to_network(self.build_segment(transaction, fragment_index))
+                transaction.timer = self.__scheduler.call_later(
+                    transaction.interval_step / 1000,
+                    self.send_segment,
+                    transaction,
+                    fragment_index + 1,
+                )
+                return
+            fragment_index += 1
+
+        # all segments sent, wait for acks (unicast) before next round
+        if transaction.dst_addr_type != UNICAST_ADDR_TYPE:
+            interval = transaction.multicast_retrans_interval_step
+        elif transaction.ctx.ttl == 0:
+            interval = transaction.unicast_retrans_interval_step
+        else:
+            interval = transaction.unicast_retrans_interval_step + (
+                transaction.unicast_interval_inc * (transaction.ctx.ttl - 1)
             )
-            / transaction.pkt,
-            transaction.ctx,
-        ))
-        transaction.is_transaction_finished = True
+        transaction.waiting_for_ack = True
+        transaction.timer = self.__scheduler.call_later(
+            interval / 1000, self.send_round, transaction
+        )
 
-    def sending_thread_ctl_unsegmented(self, transaction, event):
+    def process_ack(self, transaction, message):
         """
-        Function running in a thread to send a unsegmented PDU
-        For control messages
-        No ack
+        Processes an ack received for a Tx Transaction. Runs in the scheduler.
+        Ends the transaction if all segments are acked, or retransmits the other ones right away
+        if we were waiting for acks.
 
-        :param transacion: Tx Transaction for which we start the thread
+        :param transacion: Tx Transaction
         :type transaction: TxTransaction
-        :param event: Event object to received signal from main thread
-        :type: Event
-        """
-        self.send_to_network((
-            BTMesh_Lower_Transport_Control_Message(seg=0, opcode=transaction.opcode)
-            / transaction.pkt,
-            transaction.ctx,
-        ))
-        transaction.is_transaction_finished = True
+        :param message: The Lower Transport Layer Ack received and its context
+        :type message: (BTMesh_Lower_Transport_Segment_Acknoledgment_Message, MeshMessageContext)
+        """
+        if transaction.is_transaction_finished:
+            return
+
+        transaction.process_ack(message)
+        if transaction.is_transaction_finished:
+            self.end_transaction(transaction)
+        elif transaction.waiting_for_ack:
+            transaction.timer.cancel()
+            self.send_round(transaction)
 
-    def sending_ack_thread(self, transaction, resend=True, event=None):
+    def send_ack(self, transaction, resend=True):
         """
-        Function running a Timer object to send an ack in a seperate thread for the transaction
+        Sends an ack for an Rx transaction. Runs in the scheduler.
         Depending on the number of segments, it resends acks based on sar_segment_threshold and sar_ack_retrans_count
 
         :param transaction: The transaction in question
         :type transaction: RxTransaction
         :param resend: Resend or not ack based on threshold
         :type resend: boolean
-        :param event: Event object to communicate with main thread
-        :type event: Event
         """
-        while (
-            event.is_set()
+        transaction.timer = None
+
+        pkt = BTMesh_Lower_Transport_Segment_Acknoledgment_Message(
+            obo=0,
+            seq_zero=transaction.ctx.seq_zero,
+            acked_segments=sum(1 << num for num in list(transaction.fragments)),
+        )
+        pkt = BTMesh_Lower_Transport_Control_Message(seg=0, opcode=0) / pkt
+        ctx = copy(transaction.ctx)
+        ctx.src_addr = transaction.ctx.dest_addr
+        ctx.dest_addr = transaction.ctx.src_addr
+        ctx.is_ctl = True
+
+        # the sequence number of the ack is
+        ctx.seq_number = self.state.profile.get_next_seq_number()
+        self.send_to_network((pkt, ctx))
+        transaction.time_last_ack = monotonic()
+
+        if (
+            resend
+            and not transaction.is_transaction_finished
             and transaction.seg_n > transaction.sar_segment_threshold
             and transaction.sar_ack_retrans_count > 0
         ):
-            pkt = BTMesh_Lower_Transport_Segment_Acknoledgment_Message(
-                obo=0,
-                seq_zero=transaction.ctx.seq_zero,
-                acked_segments=sum(1 << num for num in transaction.fragments.keys()),
+            transaction.sar_ack_retrans_count -= 1
+            transaction.timer = self.__scheduler.call_later(
+                transaction.sar_seg_reception_interval / 1000,
+                self.send_ack,
+                transaction,
+                True,
             )
-            pkt = BTMesh_Lower_Transport_Control_Message(seg=0, opcode=0) / pkt
-            ctx = copy(transaction.ctx)
-            ctx.src_addr = transaction.ctx.dest_addr
-            ctx.dest_addr = transaction.ctx.src_addr
-            ctx.is_ctl = True
-
-            # the sequence number of the ack is
-            ctx.seq_number = self.state.profile.get_next_seq_number()
-            self.send_to_network((pkt, ctx))
-            transaction.time_last_ack = time()
-            transaction.sar_ack_retrans_count = -1
-
-            if not resend:
-                return
-
-            sleep(transaction.sar_seg_reception_interval / 1000)
 
 
 LowerTransportLayer.add(UpperTransportLayer)
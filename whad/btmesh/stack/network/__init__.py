@@ -5,7 +5,8 @@ Handles Relay and Proxy features, Cipher/Decipher network level (netkey), cachin
 """
 
 import logging
-from whad.common.stack import Layer, alias, source
+from whad.common.pipeline import PipelineStage
+from whad.common.stack import Layer, Scheduler, alias, source
 from whad.scapy.layers.btmesh import (
     BTMesh_Network_PDU,
     BTMesh_Obfuscated_Network_PDU,
@@ -28,8 +29,8 @@ from whad.btmesh.stack.utils import (
     MeshMessageContext,
 )
 from whad.btmesh.stack.lower_transport import LowerTransportLayer
+from whad.btmesh.stack.network.cache import NetworkCache
 from scapy.all import raw
-from threading import Thread
 
 logger = logging.getLogger(__name__)
 
@@ -42,14 +43,28 @@ class NetworkLayer(Layer):
 
         :param connector: Connector handling the advertising bearer (or GATT later ?)
         :type connector: Connector
-        :param options: Options passed to the layer. defaults to {}. Need to pass the "profile" object
+        :param options: Options passed to the layer. defaults to {}. Need to pass the "profile" object, "cache_size" sets the size of the network cache
         :type options: [TODO:type], optional
         """
+        # Scheduler shared with the Lower Transport Layer, queues the raw packets and runs the SAR timers
+        self.__scheduler = options.get("scheduler") or Scheduler()
+        options = dict(
+            options,
+            lower_transport=dict(
+                options.get("lower_transport", {}), scheduler=self.__scheduler
+            ),
+        )
+
         super().__init__(options=options)
 
         # save connector (BLE phy stack, advertising Bearer (and GATT I guess ?))
         self.__connector = connector
 
+        # Raw packets are sent one at a time by a dedicated worker, sending blocks the caller
+        self.__raw_tx = PipelineStage(
+            self.__connector.send_raw, name="btmesh-raw-tx"
+        )
+
         # Network Key Crypto managers. Correspondance between nid and net_key_index
         # FOR MANAGED FLOODING NIDs
         self.state.mf_nid_to_net_key_id = {}
@@ -58,8 +73,10 @@ class NetworkLayer(Layer):
         # FOR DIRECTED FORWARDING NIDs
         self.state.df_nid_to_net_key_id = {}
 
-        # Stores concatenation of seq_number and src_addr.
-        self.state.cache = []
+        # Network message cache, stores seq_number and src_addr of received PDUs
+        self.state.cache = NetworkCache(
+            options.get("cache_size", NetworkCache.DEFAULT_SIZE)
+        )
 
         # Check if relay feature is enabled on this device (proxy not implemented)
         self.state.is_relay_enabled = False
@@ -149,21 +166,32 @@ class NetworkLayer(Layer):
 
     def __cache_verif(self, deobf_net_pdu):
         """
-        Checks if received Net pdu in cache. Adds it if not.
+        Checks if received Net pdu in cache. The cache is not modified, as the PDU
+        has not been authenticated yet.
 
         :param deobf_net_pdu: Received deobfuscated network pdu
         :type deobf_net_pdu: BTMesh_Network_PDU
         :returns: True if message is in cache, False otherwise
         :rtype: boolean
         """
-        cache_string = deobf_net_pdu.seq_number.to_bytes(
-            3, "big"
-        ) + deobf_net_pdu.src_addr.to_bytes(2, "big")
-        if cache_string in self.state.cache:
-            return True
+        return self.state.cache.contains(
+            deobf_net_pdu.src_addr,
+            deobf_net_pdu.seq_number,
+            int.from_bytes(self.state.profile.iv_index, "big"),
+        )
+
+    def __cache_add(self, deobf_net_pdu):
+        """
+        Adds an authenticated Net pdu to the cache.
 
-        self.state.cache.append(cache_string)
-        return False
+        :param deobf_net_pdu: Received deobfuscated network pdu
+        :type deobf_net_pdu: BTMesh_Network_PDU
+        """
+        self.state.cache.add(
+            deobf_net_pdu.src_addr,
+            deobf_net_pdu.seq_number,
+            int.from_bytes(self.state.profile.iv_index, "big"),
+        )
 
     def send_to_lower_transport(self, msg_ctx, lower_transport_pdu):
         """
@@ -212,8 +240,7 @@ class NetworkLayer(Layer):
             obfuscated_data=obfu_data,
             enc_dst_enc_transport_pdu_mic=deobf_net_pdu.enc_dst_enc_transport_pdu_mic,
         )
-        thread = Thread(target=self.sending_thread, args=EIR_Hdr(type=0x2A) / pkt)
-        thread.start()
+        self.__scheduler.call_soon(self.sending_thread, EIR_Hdr(type=0x2A) / pkt)
 
     def on_net_pdu_received(self, net_pdu, rssi):
         """
@@ -269,6 +296,9 @@ class NetworkLayer(Layer):
             # )
             return
 
+        # Only authenticated PDUs are cached, forged PDUs must not affect the cache
+        self.__cache_add(deobf_net_pdu)
+
         # If sniffing_only mode, we display packet and leave
         if self.__connector.sniffing_only:
             raw_lower_transport = plaintext[2:]
@@ -354,12 +384,11 @@ class NetworkLayer(Layer):
         )
 
         message.authentication_value = net_key.compute_secure_beacon_auth_value(message)
-        thread = Thread(
-            target=self.sending_thread,
-            args=EIR_Hdr(type=0x2B)
+        self.__scheduler.call_soon(
+            self.sending_thread,
+            EIR_Hdr(type=0x2B)
             / EIR_BTMesh_Beacon(mesh_beacon_type=0x01, secure_beacon_data=message),
         )
-        thread.start()
 
     @source("lower_transport")
     def on_lower_transport_packet(self, message):
@@ -407,8 +436,7 @@ class NetworkLayer(Layer):
             obfuscated_data=obfu_data,
             enc_dst_enc_transport_pdu_mic=enc,
         )
-        thread = Thread(target=self.sending_thread, args=EIR_Hdr(type=0x2A) / pkt)
-        thread.start()
+        self.__scheduler.call_soon(self.sending_thread, EIR_Hdr(type=0x2A) / pkt)
 
         """
         if smallest_seq_num == self.state.next_seq_to_send:
@@ -416,7 +444,14 @@ class NetworkLayer(Layer):
         """
 
     def sending_thread(self, pkt):
-        self.__connector.send_raw(pkt)
+        """
+        Queues a raw packet, sent through the connector by the raw tx worker. Runs in the scheduler, which must not
+        block on the connector
+
+        :param pkt: The packet to send
+        :type pkt: Packet (EIR_Element subclass)
+        """
+        self.__raw_tx.put(pkt)
 
 
 NetworkLayer.add(LowerTransportLayer)
@@ -0,0 +1,142 @@
+"""
+Network message cache
+
+Bounded cache of the (SRC, SEQ) pairs of received network PDUs, used to drop
+PDUs that have already been processed or relayed (Mesh Spec section 3.4.6.5).
+"""
+
+from collections import deque
+
+
+class NetworkCache:
+    """
+    Fixed-capacity network message cache.
+
+    Lookups and insertions are done in O(1) with a hash set, the oldest entries
+    being evicted first (FIFO). The highest SEQ evicted for each source is kept
+    as a high-water mark, so that a replayed PDU older than the cache content
+    is still detected (Mesh Spec section 3.9.8), while PDUs received out of
+    order within the cache window are accepted.
+
+    SEQ values are only compared within the same IV Index.
+
+    :meth:`contains` does not modify the cache, so that PDUs can be looked up
+    before being authenticated and only added once their MIC has been checked.
+    """
+
+    DEFAULT_SIZE = 4096
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """
+        Creates the cache
+
+        :param size: Maximum number of cached PDUs, defaults to DEFAULT_SIZE
+        :type size: int, optional
+        """
+        if size <= 0:
+            raise ValueError("cache size must be positive")
+
+        self.__size = size
+        self.__entries = set()
+        self.__fifo = deque()
+
+        # Highest evicted SEQ (and its IV Index) per source address
+        self.__watermarks = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        """
+        Maximum number of cached PDUs
+        """
+        return self.__size
+
+    def __len__(self):
+        return len(self.__fifo)
+
+    def contains(self, src_addr, seq_number, iv_index=0):
+        """
+        Checks if a PDU has already been received, without adding it to the cache.
+
+        :param src_addr: Source address of the PDU
+        :type src_addr: int
+        :param seq_number: Sequence number of the PDU
+        :type seq_number: int
+        :param iv_index: IV Index used by the PDU, defaults to 0
+        :type iv_index: int, optional
+        :returns: True if PDU has already been received, False otherwise
+        :rtype: boolean
+        """
+        entry = (iv_index << 40) | (src_addr << 24) | seq_number
+        if entry in self.__entries:
+            self.hits += 1
+            return True
+
+        watermark = self.__watermarks.get(src_addr)
+        if watermark is not None and watermark[0] == iv_index and seq_number <= watermark[1]:
+            self.hits += 1
+            return True
+
+        return False
+
+    def add(self, src_addr, seq_number, iv_index=0):
+        """
+        Adds a PDU to the cache, evicting the oldest entry if the cache is full.
+
+        :param src_addr: Source address of the PDU
+        :type src_addr: int
+        :param seq_number: Sequence number of the PDU
+        :type seq_number: int
+        :param iv_index: IV Index used by the PDU, defaults to 0
+        :type iv_index: int, optional
+        """
+        entry = (iv_index << 40) | (src_addr << 24) | seq_number
+        if entry in self.__entries:
+            return
+
+        self.misses += 1
+        self.__entries.add(entry)
+        self.__fifo.append((src_addr, seq_number, iv_index, entry))
+        if len(self.__fifo) > self.__size:
+            self.__evict()
+
+    def check(self, src_addr, seq_number, iv_index=0):
+        """
+        Checks if a PDU has already been received. Adds it to the cache if not.
+
+        :param src_addr: Source address of the PDU
+        :type src_addr: int
+        :param seq_number: Sequence number of the PDU
+        :type seq_number: int
+        :param iv_index: IV Index used by the PDU, defaults to 0
+        :type iv_index: int, optional
+        :returns: True if PDU has already been received, False otherwise
+        :rtype: boolean
+        """
+        if self.contains(src_addr, seq_number, iv_index):
+            return True
+        self.add(src_addr, seq_number, iv_index)
+        return False
+
+    def __evict(self):
+        """
+        Removes the oldest entry, updating the high-water mark of its source.
+        """
+        src_addr, seq_number, iv_index, entry = self.__fifo.popleft()
+        self.__entries.discard(entry)
+
+        watermark = self.__watermarks.get(src_addr)
+        if watermark is None or watermark[0] != iv_index or watermark[1] < seq_number:
+            self.__watermarks[src_addr] = (iv_index, seq_number)
+
+    def clear(self):
+        """
+        Removes all entries and high-water marks, and resets counters.
+        """
+        self.__entries.clear()
+        self.__fifo.clear()
+        self.__watermarks.clear()
+        self.hits = 0
+        self.misses = 0
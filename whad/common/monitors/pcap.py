@@ -3,15 +3,46 @@ from scapy.all import conf
 from scapy.layers.bluetooth4LE import *
 from scapy.utils import PcapWriter,PcapReader
 from os.path import exists
-from whad.common.pcap import patch_pcap_metadata, extract_pcap_metadata
-from time import time
+from whad.common.pcap import patch_pcap_metadata, get_pcap_metadata_tag
+from time import time, monotonic
 from os import stat, remove
 from stat import S_ISFIFO
-from threading import Lock
+from struct import pack
+from threading import Lock, Thread
+from queue import Queue, Empty
 
 import logging
 logger = logging.getLogger(__name__)
 
+class DomainPcapWriter(PcapWriter):
+    """
+    PCAP writer storing the WHAD domain in the global header of the capture
+    file when this header is emitted, avoiding to patch it once the capture
+    file has been written.
+    """
+    def __init__(self, filename, domain=None, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.domain = domain
+
+    def _write_header(self, pkt):
+        # Headers of appended files are patched in place when closed
+        if self.domain is None or self.append:
+            super()._write_header(pkt)
+            return
+
+        self.header_present = True
+        if self.linktype is None:
+            raise ValueError(
+                "linktype could not be guessed. "
+                "Please pass a linktype while creating the writer"
+            )
+        self.f.write(
+            pack(self.endian + "IHH", 0xa1b23c4d if self.nano else 0xa1b2c3d4, 2, 4) +
+            get_pcap_metadata_tag(self.domain) +
+            pack(self.endian + "II", self.snaplen, self.linktype)
+        )
+        self.f.flush()
+
 class PcapWriterMonitor(WhadMonitor):
     """
     PcapWriterMonitor.
@@ -25,8 +56,13 @@ class PcapWriterMonitor(WhadMonitor):
         >>> monitor.attach(connector)
         >>> monitor.start()
 
+    Packets are timestamped in the thread that reports them, and written to
+    the PCAP file by a dedicated writer thread draining a bounded queue. The
+    writer thread writes packets by batches and flushes the file every
+    `flush_interval` seconds.
     """
-    def __init__(self, pcap_file, monitor_reception=True, monitor_transmission=True):
+    def __init__(self, pcap_file, monitor_reception=True, monitor_transmission=True,
+                 queue_size=4096, flush_interval=0.5):
         super().__init__(monitor_reception, monitor_transmission)
         self._pcap_file = pcap_file
         self._writer = None
@@ -35,6 +71,11 @@ class PcapWriterMonitor(WhadMonitor):
         self._start_time = None
         self._nb_pkts_written = 0
         self._writer_lock = Lock()
+        self._sync = False
+        self._appending = False
+        self._queue = Queue(maxsize=queue_size)
+        self._flush_interval = flush_interval
+        self._writer_thread = None
 
 
     @property
@@ -68,15 +109,23 @@ class PcapWriterMonitor(WhadMonitor):
                     remove(self._pcap_file)
                     existing_pcap_file = False
 
-        # Instantiate the PCAP Writer with the appropriate parameters
+        # Instantiate the PCAP Writer with the appropriate parameters.
+        # Domain is written in the PCAP header, except for named pipes.
+        self._sync = sync
+        self._appending = existing_pcap_file and not sync
         self._writer_lock.acquire()
-        self._writer = PcapWriter(
+        self._writer = DomainPcapWriter(
                                     self._pcap_file,
-                                    append=existing_pcap_file and not sync,
+                                    domain=None if sync else getattr(self._connector, "domain", None),
+                                    append=self._appending,
                                     sync=sync
         )
         self._writer_lock.release()
 
+        # Start writer thread
+        self._writer_thread = Thread(target=self._write_packets, daemon=True)
+        self._writer_thread.start()
+
         # Checks if there is a scapy packet formatter associated with the connector.
         # A formatter allows to describe manually how to build the packet, it is mainly
         # useful to populate a relevant header for PCAP export.
@@ -88,7 +137,66 @@ class PcapWriterMonitor(WhadMonitor):
             self._formatter = getattr(self._connector, "format")
 
 
+    def _write_packets(self):
+        """
+        Writer thread, writes queued packets by batches until a `None`
+        sentinel is received.
+        """
+        last_flush = monotonic()
+        pending = False
+        running = True
+        broken = False
+        while running:
+            try:
+                batch = [self._queue.get(timeout=self._flush_interval)]
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                batch = []
+
+            # Packets queued after the sentinel are dropped
+            for index, packet in enumerate(batch):
+                if packet is None:
+                    running = False
+                    del batch[index:]
+                    break
+
+            if not broken:
+                try:
+                    if batch:
+                        self._writer.write(batch)
+                        self._nb_pkts_written += len(batch)
+                        pending = True
+
+                    # Flush periodically, or as soon as possible for named pipes
+                    if pending and (self._sync or not running or
+                                    monotonic() - last_flush >= self._flush_interval):
+                        self._writer.flush()
+                        last_flush = monotonic()
+                        pending = False
+                except BrokenPipeError:
+                    # Reader is gone, discard remaining packets
+                    broken = True
+
+    def _stop_writer_thread(self):
+        """
+        Write queued packets and stop the writer thread.
+        """
+        # No packet can be queued once the writer thread has been unset
+        self._writer_lock.acquire()
+        writer_thread = getattr(self, "_writer_thread", None)
+        self._writer_thread = None
+        if writer_thread is not None:
+            self._queue.put(None)
+        self._writer_lock.release()
+
+        if writer_thread is not None:
+            writer_thread.join()
+
     def close(self):
+        # Write pending packets
+        self._stop_writer_thread()
+
         # Acquire lock on writer
         self._writer_lock.acquire()
         if hasattr(self, "_writer") and self._writer is not None:
@@ -97,7 +205,10 @@ class PcapWriterMonitor(WhadMonitor):
             # Close writer
             try:
                 self._writer.close()
-                patch_pcap_metadata(self._pcap_file, self._connector.domain)
+
+                # Domain has not been written in the header of appended files
+                if self._appending and self._writer.header_present:
+                    patch_pcap_metadata(self._pcap_file, self._connector.domain)
 
             except BrokenPipeError:
                 pass
@@ -148,16 +259,12 @@ class PcapWriterMonitor(WhadMonitor):
 
             # Convert timestamp to second (float)
             packet.time = timestamp / 1000000
-            try:
-                if self._writer is not None:
-                    # Write packet
-                    self._writer.write(packet)
-                    self._nb_pkts_written += 1
-                else:
-                    # We are trying to write to a closed PCAP monitor,
-                    # issue a warning message
-                    logger.warning('cannot write to PCAP: file has already been closed')
-            except BrokenPipeError:
-                pass
+            if self._writer_thread is not None:
+                # Queue packet, it will be written by the writer thread
+                self._queue.put(packet)
+            else:
+                # We are trying to write to a closed PCAP monitor,
+                # issue a warning message
+                logger.warning('cannot write to PCAP: file has already been closed')
         # Release lock
         self._writer_lock.release()
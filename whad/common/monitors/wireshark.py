@@ -75,6 +75,9 @@ class WiresharkMonitor(PcapWriterMonitor):
         return self._wireshark_process.poll() is not None
 
     def close(self):
+        # Write pending packets
+        self._stop_writer_thread()
+
         self._writer_lock.acquire()
         if hasattr(self, "_writer") and self._writer is not None:
 
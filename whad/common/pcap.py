@@ -1,19 +1,52 @@
 """Multi-domain PCAP reader
+
+This module provides a header-only PCAP/PCAPng record reader relying on a
+memory-mapped file, an offset index cached next to capture files to access
+any record directly, and a PCAP reader yielding scapy packets on top of them.
 """
+import os
+import mmap
+import logging
+from bisect import bisect_left
+from collections import namedtuple
+from struct import Struct
 from time import sleep
-from scapy.utils import rdpcap
+
+from scapy.config import conf
+from scapy.utils import EDecimal
 
 from whad.scapy.layers import *
 
-def patch_pcap_metadata(filename, domain):
-    with open(filename, "rb") as f:
-        dump = f.read()
+logger = logging.getLogger(__name__)
+
+def get_pcap_metadata_tag(domain: str) -> bytes:
+    """Build the 8-byte metadata tag stored in a PCAP global header.
+
+    WHAD stores the domain name in the `thiszone` and `sigfigs` fields of the
+    global header, padded with null bytes or truncated to 8 bytes.
+
+    :param domain: Domain name
+    :type domain: str
+    :return: Metadata tag
+    :rtype: bytes
+    """
+    return domain.encode('ascii')[:8].ljust(8, b"\x00")
+
+def patch_pcap_metadata(filename: str, domain: str):
+    """Write metadata into the global header of an existing PCAP file
+    (incompatible with PCAPng).
 
-    domain_bytes = domain.encode('ascii') + b"\x00" * (8-len(domain)) if len(domain) <= 8 else domain.encode('ascii')[:8]
+    Only the 8 bytes of metadata are overwritten, the rest of the file is
+    left untouched.
 
-    dump = dump[:8] + domain_bytes + dump[16:]
-    with open(filename, "wb") as f:
-        f.write(dump)
+    :param filename: PCAP file path
+    :type filename: str
+    :param domain: Domain name
+    :type domain: str
+    """
+    with open(filename, "r+b") as f:
+        f.seek(8)
+        f.write(get_pcap_metadata_tag(domain))
 
 def extract_pcap_metadata(filename: str) -> str:
     """Extract metadata from a PCAP file (incompatible with PCAPng).
@@ -24,20 +57,519 @@ def extract_pcap_metadata(filename: str) -> str:
     :rtype: str
     """
     with open(filename, "rb") as f:
-        dump = f.read()
-    return dump[8:16].replace(b"\x00", b"").decode('ascii')
+        f.seek(8)
+        metadata = f.read(8)
+    return metadata.replace(b"\x00", b"").decode('ascii')
+
+# PCAP magics (microsecond and nanosecond resolution)
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+
+# PCAPng block types
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_IDB = 0x00000001
+PCAPNG_OPB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_OPT_IF_TSRESOL = 9
+
+PcapRecord = namedtuple("PcapRecord", ["index", "timestamp", "offset", "data"])
+PcapRecord.__doc__ = """Capture record.
+
+`timestamp` is expressed in nanoseconds, `offset` is the position of the
+record header in the capture file and `data` holds the captured bytes.
+"""
+
+class PcapRecordReader:
+    """Header-only PCAP/PCAPng reader.
+
+    Captured data is only copied out of the memory-mapped file when a record
+    is yielded, and no dissection is performed.
+    """
+
+    def __init__(self, filename: str):
+        """Open a capture file and parse its global header.
+
+        :param filename: Capture file path
+        :type filename: str
+        :raises ValueError: File is not a valid PCAP or PCAPng file
+        """
+        self.__filename = filename
+        with open(filename, "rb") as capture:
+            try:
+                self.__mm = mmap.mmap(capture.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as err:
+                raise ValueError("empty capture file") from err
+
+        self.__linktype = None
+        self.__first_offset = 0
+
+        # Per-interface linktype and timestamp resolution (PCAPng)
+        self.__interfaces = []
+
+        try:
+            self.__parse_header()
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def filename(self) -> str:
+        """Capture file path.
+        """
+        return self.__filename
+
+    @property
+    def linktype(self) -> int:
+        """Link-layer type of the capture (first interface for PCAPng files).
+        """
+        return self.__linktype
+
+    @property
+    def is_pcapng(self) -> bool:
+        """`True` if the capture file uses the PCAPng format.
+        """
+        return self.__pcapng
+
+    @property
+    def first_offset(self) -> int:
+        """Offset of the first record.
+        """
+        return self.__first_offset
+
+    def close(self):
+        """Release the underlying memory mapping.
+        """
+        if self.__mm is not None:
+            self.__mm.close()
+            self.__mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __parse_header(self):
+        """Parse global header (PCAP) or section header block (PCAPng).
+        """
+        mm = self.__mm
+        if len(mm) < 24:
+            raise ValueError("truncated capture file")
+
+        magic_le = Struct("<I").unpack_from(mm, 0)[0]
+        magic_be = Struct(">I").unpack_from(mm, 0)[0]
+
+        if magic_le == PCAPNG_SHB:
+            self.__pcapng = True
+            self.__parse_pcapng_header()
+            return
+
+        self.__pcapng = False
+        for endian, magic in (("<", magic_le), (">", magic_be)):
+            if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                self.__endian = endian
+                self.__ts_factor = 1 if magic == PCAP_MAGIC_NS else 1000
+                break
+        else:
+            raise ValueError("not a PCAP or PCAPng file")
+
+        self.__linktype = Struct(endian + "I").unpack_from(mm, 20)[0] & 0x0fffffff
+        self.__record_hdr = Struct(endian + "IIII")
+        self.__first_offset = 24
+
+    def __parse_pcapng_header(self):
+        """Parse PCAPng section header block and the interface description
+        blocks that directly follow it.
+        """
+        mm = self.__mm
+        byte_order = Struct("<I").unpack_from(mm, 8)[0]
+        if byte_order == PCAPNG_BYTE_ORDER_MAGIC:
+            self.__endian = "<"
+        elif byte_order == 0x4d3c2b1a:
+            self.__endian = ">"
+        else:
+            raise ValueError("invalid PCAPng byte order magic")
+
+        self.__block_hdr = Struct(self.__endian + "II")
+        block_len = self.__block_hdr.unpack_from(mm, 0)[1]
+        self.__first_offset = block_len
+
+        # Parse the interface description blocks located at the beginning of
+        # this section, they define the linktype of our capture
+        offset = self.__first_offset
+        size = len(mm)
+        while offset + 12 <= size:
+            block_type, block_len = self.__block_hdr.unpack_from(mm, offset)
+            if block_type != PCAPNG_IDB or block_len < 20:
+                break
+            self.__interfaces.append(self.__parse_idb(offset, block_len))
+            offset += block_len
+        if len(self.__interfaces) == 0:
+            raise ValueError("no interface defined in PCAPng file")
+        self.__linktype = self.__interfaces[0][0]
+
+    def __parse_idb(self, offset: int, block_len: int) -> tuple:
+        """Parse a PCAPng interface description block.
+
+        :return: Interface linktype and timestamp resolution, as a ratio of
+                 nanoseconds per timestamp unit
+        """
+        mm = self.__mm
+        endian = self.__endian
+        linktype = Struct(endian + "H").unpack_from(mm, offset + 8)[0]
+
+        # Look for an if_tsresol option, default to microseconds
+        ts_resolution = (1000, 1)
+        opt_offset = offset + 16
+        end = offset + block_len - 4
+        option = Struct(endian + "HH")
+        while opt_offset + 4 <= end:
+            code, length = option.unpack_from(mm, opt_offset)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_IF_TSRESOL and length >= 1:
+                tsresol = mm[opt_offset + 4]
+                if tsresol & 0x80:
+                    ts_resolution = (1000000000, 1 << (tsresol & 0x7f))
+                elif tsresol <= 9:
+                    ts_resolution = (10**(9 - tsresol), 1)
+                else:
+                    ts_resolution = (1, 10**(tsresol - 9))
+            opt_offset += 4 + ((length + 3) & ~3)
+        return (linktype, ts_resolution)
+
+    def records(self, offset: int = None, index: int = 0):
+        """Iterate over capture records.
+
+        :param offset: Offset of the first record to read (optional)
+        :type offset: int
+        :param index: Index of the record located at `offset`
+        :type index: int
+        :return: Iterator over :class:`PcapRecord` tuples
+        """
+        if offset is None:
+            offset = self.__first_offset
+        if self.__pcapng:
+            yield from self.__pcapng_records(offset, index)
+        else:
+            yield from self.__pcap_records(offset, index)
+
+    def __pcap_records(self, offset: int, index: int):
+        """Iterate over PCAP records.
+        """
+        mm = self.__mm
+        size = len(mm)
+        record_hdr = self.__record_hdr
+        ts_factor = self.__ts_factor
+        while offset + 16 <= size:
+            ts_sec, ts_frac, caplen, _ = record_hdr.unpack_from(mm, offset)
+            data_end = offset + 16 + caplen
+            if data_end > size:
+                logger.debug("[pcap] truncated record at offset %d", offset)
+                return
+            yield PcapRecord(
+                index,
+                ts_sec*1000000000 + ts_frac*ts_factor,
+                offset,
+                mm[offset + 16:data_end]
+            )
+            offset = data_end
+            index += 1
+
+    def __pcapng_records(self, offset: int, index: int):
+        """Iterate over PCAPng packet blocks.
+        """
+        mm = self.__mm
+        size = len(mm)
+        endian = self.__endian
+        block_hdr = self.__block_hdr
+        epb_hdr = Struct(endian + "IIIII")
+        opb_hdr = Struct(endian + "HHIIII")
+        spb_hdr = Struct(endian + "I")
+
+        # Interfaces are parsed again when reading from the first block
+        interfaces = [] if offset <= self.__first_offset else list(self.__interfaces)
+
+        while offset + 12 <= size:
+            block_type, block_len = block_hdr.unpack_from(mm, offset)
+            if block_len < 12 or offset + block_len > size:
+                logger.debug("[pcap] truncated PCAPng block at offset %d", offset)
+                return
+            block_offset = offset
+            offset += block_len
+
+            if block_type == PCAPNG_EPB:
+                if_id, ts_high, ts_low, caplen, _ = epb_hdr.unpack_from(mm, block_offset + 8)
+                data_offset = block_offset + 28
+            elif block_type == PCAPNG_OPB:
+                if_id, _, ts_high, ts_low, caplen, _ = opb_hdr.unpack_from(mm, block_offset + 8)
+                data_offset = block_offset + 28
+            elif block_type == PCAPNG_SPB:
+                if_id, ts_high, ts_low = 0, 0, 0
+                caplen = min(spb_hdr.unpack_from(mm, block_offset + 8)[0], block_len - 16)
+                data_offset = block_offset + 12
+            else:
+                if block_type == PCAPNG_IDB:
+                    interfaces.append(self.__parse_idb(block_offset, block_len))
+                elif block_type == PCAPNG_SHB:
+                    # New section, interfaces are redefined
+                    interfaces = []
+                continue
+
+            if if_id >= len(interfaces):
+                logger.debug("[pcap] packet block refers to an unknown interface")
+                continue
+            ts_mul, ts_div = interfaces[if_id][1]
+            yield PcapRecord(
+                index,
+                ((ts_high << 32) | ts_low)*ts_mul // ts_div,
+                block_offset,
+                mm[data_offset:data_offset + caplen]
+            )
+            index += 1
+
+# Link-layer types providing a domain-specific key
+DLT_BLUETOOTH_LE_LL_WITH_PHDR = 256
+DLT_IEEE802_15_4_TAP = 283
+
+def get_record_key(linktype: int, data: bytes) -> int:
+    """Extract a domain-specific key from a raw record: the access address of
+    a BLE packet or the PAN ID of a 802.15.4 frame.
+
+    :param linktype: Capture link-layer type
+    :type linktype: int
+    :param data: Raw record data
+    :type data: bytes
+    :return: Record key, or -1 if not available
+    :rtype: int
+    """
+    if linktype == DLT_BLUETOOTH_LE_LL_WITH_PHDR:
+        if len(data) >= 14:
+            return int.from_bytes(data[10:14], "little")
+    elif linktype == DLT_IEEE802_15_4_TAP:
+        if len(data) >= 4:
+            # Skip TAP header, PAN ID follows frame control and sequence number
+            frame = data[2] | (data[3] << 8)
+            if len(data) >= frame + 5:
+                fcf = data[frame] | (data[frame + 1] << 8)
+                if (fcf >> 10) & 3 or (fcf >> 14) & 3:
+                    return data[frame + 3] | (data[frame + 4] << 8)
+    return -1
+
+class PcapIndex:
+    """Offset index of a capture file.
+
+    The index stores, for each record, its offset in the capture file, its
+    timestamp (in nanoseconds), its captured length and a domain-specific key
+    (see :func:`get_record_key`), as fixed-size entries. It is built in a
+    single pass over the capture and cached in a sidecar file, which is
+    memory-mapped when loaded: records are found by position in O(1) and by
+    timestamp in O(log n), without loading the index in memory.
+    """
+
+    MAGIC = b"WPIX"
+    VERSION = 1
+    SUFFIX = ".whadidx"
+
+    # Header: magic, version, capture size, capture mtime, number of entries
+    HEADER = Struct("<4sHxxQQQ")
+
+    # Entry: offset, timestamp, captured length, key
+    ENTRY = Struct("<QqIq")
+
+    def __init__(self, buffer, count: int):
+        """Create an index from a buffer holding a header and `count` entries.
+        """
+        self.__buffer = buffer
+        self.__count = count
+
+    @classmethod
+    def get_index_path(cls, filename: str) -> str:
+        """Sidecar index file path of a capture file.
+        """
+        return filename + cls.SUFFIX
+
+    @classmethod
+    def build(cls, reader: PcapRecordReader) -> bytearray:
+        """Build an index in a single pass over a capture file.
+
+        :param reader: Capture record reader
+        :type reader: PcapRecordReader
+        :return: Serialized index
+        :rtype: bytearray
+        """
+        stat = os.stat(reader.filename)
+        entry = cls.ENTRY
+        linktype = reader.linktype
+        buffer = bytearray(cls.HEADER.size)
+        count = 0
+        for record in reader.records():
+            buffer += entry.pack(record.offset, record.timestamp, len(record.data),
+                                 get_record_key(linktype, record.data))
+            count += 1
+        cls.HEADER.pack_into(buffer, 0, cls.MAGIC, cls.VERSION, stat.st_size,
+                             stat.st_mtime_ns, count)
+        return buffer
+
+    @classmethod
+    def open(cls, filename: str, cache: bool = True):
+        """Load the index of a capture file from its sidecar file, building it
+        (and saving it if `cache` is set) if it is missing or outdated.
+
+        :param filename: Capture file path
+        :type filename: str
+        :param cache: Save index next to the capture file
+        :type cache: bool
+        :return: Capture index
+        :rtype: PcapIndex
+        """
+        stat = os.stat(filename)
+        index_path = cls.get_index_path(filename)
+
+        # Load cached index if it matches our capture file
+        try:
+            with open(index_path, "rb") as index_file:
+                buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, size, mtime, count = cls.HEADER.unpack_from(buffer, 0)
+            if (magic, version, size, mtime) == (cls.MAGIC, cls.VERSION, stat.st_size,
+                                                 stat.st_mtime_ns) and \
+                    len(buffer) == cls.HEADER.size + count*cls.ENTRY.size:
+                return cls(buffer, count)
+            buffer.close()
+            logger.debug("[pcap] outdated index %s", index_path)
+        except (OSError, ValueError):
+            logger.debug("[pcap] no valid index found for %s", filename)
+
+        # Build index
+        with PcapRecordReader(filename) as reader:
+            buffer = cls.build(reader)
+        count = cls.HEADER.unpack_from(buffer, 0)[4]
+
+        if cache:
+            try:
+                tmp_path = index_path + ".tmp"
+                with open(tmp_path, "wb") as index_file:
+                    index_file.write(buffer)
+                os.replace(tmp_path, index_path)
+            except OSError as err:
+                logger.debug("[pcap] cannot save index %s (%s)", index_path, err)
+
+        return cls(buffer, count)
+
+    def close(self):
+        """Release index buffer.
+        """
+        if isinstance(self.__buffer, mmap.mmap):
+            self.__buffer.close()
+        self.__buffer = None
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __getitem__(self, index: int) -> tuple:
+        """Get an index entry.
+
+        :return: Record offset, timestamp (ns), captured length and key
+        :rtype: tuple
+        """
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError("record index out of range")
+        return self.ENTRY.unpack_from(self.__buffer, self.HEADER.size + index*self.ENTRY.size)
+
+    def offset(self, index: int) -> int:
+        """Offset of a record in the capture file.
+        """
+        return self[index][0]
+
+    def timestamp(self, index: int) -> int:
+        """Timestamp of a record, in nanoseconds.
+        """
+        return self[index][1]
+
+    def find_timestamp(self, timestamp: int) -> int:
+        """Find the first record captured at or after a timestamp, assuming
+        records are sorted by timestamp.
+
+        :param timestamp: Timestamp in nanoseconds
+        :type timestamp: int
+        :return: Record index, or the number of records if none matches
+        :rtype: int
+        """
+        return bisect_left(_IndexTimestamps(self), timestamp)
+
+    def find_key(self, key: int, start: int = 0):
+        """Iterate over the indexes of records matching a domain-specific key.
+        """
+        for index in range(start, self.__count):
+            if self[index][3] == key:
+                yield index
+
+class _IndexTimestamps:
+    """Sequence view of index timestamps, used for binary search.
+    """
+
+    def __init__(self, index: PcapIndex):
+        self.__index = index
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __getitem__(self, position: int) -> int:
+        return self.__index.timestamp(position)
 
 class PCAPReader(object):
     """PCAP reader class.
+
+    Records are read from the capture file on demand, and a record index
+    is used to seek directly to the first requested packet.
     """
 
     def __init__(self, pcapfile : str):
         """Initialize a multi-domain PCAP layer
         """
-        # Load packets from PCAP file
-        self.__packets = rdpcap(pcapfile)
+        self.__filename = pcapfile
+        self.__reader = PcapRecordReader(pcapfile)
+        self.__index = None
+        self.__l2_class = conf.l2types.num2layer.get(self.__reader.linktype, conf.raw_layer)
 
-    def packets(self, start=0, count=None, accurate=True, offset=0.0, exclude=[], filter=lambda x: True):
+    @property
+    def index(self) -> PcapIndex:
+        """Capture index, loaded or built when first required.
+        """
+        if self.__index is None:
+            self.__index = PcapIndex.open(self.__filename)
+        return self.__index
+
+    def close(self):
+        """Close capture file and index.
+        """
+        if self.__index is not None:
+            self.__index.close()
+            self.__index = None
+        self.__reader.close()
+
+    def find(self, timestamp: float) -> int:
+        """Find the position of the first packet captured `timestamp` seconds
+        after the first packet of the capture.
+
+        :param timestamp: Time offset in seconds
+        :type timestamp: float
+        :return: Packet position
+        :rtype: int
+        """
+        if len(self.index) == 0:
+            return 0
+        return self.index.find_timestamp(self.index.timestamp(0) + int(timestamp*1000000000))
+
+    def __len__(self):
+        return len(self.index)
+
+    def packets(self, start=0, count=None, accurate=True, offset=0.0, exclude=[],
+                filter=lambda x: True, start_time=None):
         """Filter packets from PCAP file and yields them.
 
         :param start: Start position in the PCAP
@@ -46,43 +578,41 @@ class PCAPReader(object):
         :type count: int
         :param filter: Lambda function used to filter packets. By default, keeps everything.
         :type filter: lambda
+        :param start_time: Start from the first packet captured `start_time` seconds after
+                           the first packet of the capture, overrides `start` (optional)
+        :type start_time: float
         """
-        timestamp = None
-        if count is None:
-            for pos, packet in enumerate(self.__packets[start:]):
-                # Packet must be excluded ?
-                if (pos+1) in exclude:
-                    # continue
-                    #timestamp = float(packet.time)
-                    continue
-
-                # Process packet
-                if timestamp is None:
-                    timestamp = float(packet.time)
-                else:
-                    delay = float(packet.time) - timestamp
-                    timestamp = float(packet.time)
-                    if accurate:
-                        sleep(delay + offset)
+        if start_time is not None:
+            start = self.find(start_time)
 
-                if filter(packet):
-                    yield packet
+        # Seek to our first record
+        if start > 0:
+            if start >= len(self.index):
+                return
+            records = self.__reader.records(self.index.offset(start), start)
         else:
-            for packet in self.__packets[start:start+count]:
+            records = self.__reader.records()
 
-                # Packet must be excluded ?
-                if (pos+1) in exclude:
-                    # continue
-                    #timestamp = float(packet.time)
-                    continue
+        timestamp = None
+        for pos, record in enumerate(records):
+            if count is not None and pos >= count:
+                break
 
-                # Process packet
-                if timestamp is None:
-                    timestamp = float(packet.time)
-                else:
-                    delay = float(packet.time) - timestamp
-                    timestamp = float(packet.time)
-                    if accurate:
-                        sleep(delay+offset)
-                if filter(packet):
-                    yield packet
+            # Packet must be excluded ?
+            if (pos+1) in exclude:
+                continue
+
+            packet = self.__l2_class(record.data)
+            packet.time = EDecimal(record.timestamp) / 1000000000
+
+            # Process packet
+            if timestamp is None:
+                timestamp = float(packet.time)
+            else:
+                delay = float(packet.time) - timestamp
+                timestamp = float(packet.time)
+                if accurate:
+                    sleep(delay + offset)
+
+            if filter(packet):
+                yield packet
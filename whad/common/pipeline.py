@@ -0,0 +1,166 @@
+"""
+Staged packet processing.
+
+Capturing packets must keep up with the device, while decryption, traffic
+analyzers or monitors can be slow. This module provides :class:`PipelineStage`,
+a bounded queue of items processed by a dedicated worker thread, so that the
+capture code only parses packets and hands them over to processing stages.
+Stages can be chained by using the :meth:`PipelineStage.put` method of a stage
+as the output of the previous one.
+
+When a stage queue is full, new items are either dropped (default) or the
+caller waits for some room to be available (backpressure). Dropped items are
+counted.
+"""
+import logging
+from collections import deque
+from threading import Condition, Thread
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineStage:
+    """
+    Processing stage backed by a worker thread.
+
+    Items are processed in order by calling `process` with each of them. If
+    an output is set, the values returned by `process` (except `None`) are
+    passed to this output.
+    """
+
+    def __init__(self, process, maxsize: int = 1024, block: bool = False,
+                 timeout: float = None, output=None, name: str = "pipeline-stage"):
+        """Create a processing stage.
+
+        :param process: Processing function, called with each item
+        :type process: callable
+        :param maxsize: Maximum number of pending items
+        :type maxsize: int
+        :param block: Wait for room in the queue instead of dropping items when it is full
+        :type block: bool
+        :param timeout: Maximum time in seconds to wait for room before dropping an item, wait forever if `None`
+        :type timeout: float
+        :param output: Function called with the result of each processed item
+        :type output: callable
+        :param name: Worker thread name
+        :type name: str
+        """
+        if maxsize <= 0:
+            raise ValueError("stage size must be positive")
+
+        self.__process = process
+        self.__output = output
+        self.__maxsize = maxsize
+        self.__block = block
+        self.__timeout = timeout
+        self.__name = name
+        self.__items = deque()
+        self.__condition = Condition()
+        self.__thread = None
+        self.__busy = False
+        self.__stopped = False
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def __len__(self):
+        """Number of items waiting to be processed.
+        """
+        return len(self.__items)
+
+    @property
+    def pending(self) -> bool:
+        """`True` if some items are waiting or being processed.
+        """
+        return self.__busy or len(self.__items) > 0
+
+    def put(self, item) -> bool:
+        """Submit an item to this stage.
+
+        :param item: Item to process
+        :return: `True` if item has been queued, `False` if it has been dropped
+        :rtype: bool
+        """
+        with self.__condition:
+            if self.__stopped:
+                self.dropped += 1
+                return False
+
+            if len(self.__items) >= self.__maxsize and self.__block:
+                deadline = None if self.__timeout is None else monotonic() + self.__timeout
+                while len(self.__items) >= self.__maxsize and not self.__stopped:
+                    remaining = None if deadline is None else deadline - monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+
+            if len(self.__items) >= self.__maxsize or self.__stopped:
+                self.dropped += 1
+                logger.debug("[%s] queue full, item dropped (%d dropped)", self.__name,
+                             self.dropped)
+                return False
+
+            self.__items.append(item)
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__run, name=self.__name, daemon=True)
+                self.__thread.start()
+            self.__condition.notify_all()
+            return True
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait for all the queued items to be processed.
+
+        :param timeout: Maximum time to wait in seconds, wait forever if `None`
+        :type timeout: float
+        :return: `True` if all items have been processed, `False` on timeout
+        :rtype: bool
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.__condition:
+            while self.pending and not self.__stopped:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return not self.pending
+
+    def clear(self):
+        """Drop the items waiting to be processed, the stage keeps running.
+        """
+        with self.__condition:
+            self.dropped += len(self.__items)
+            self.__items.clear()
+            self.__condition.notify_all()
+
+    def stop(self):
+        """Stop the worker thread. Pending items are dropped.
+        """
+        with self.__condition:
+            self.__stopped = True
+            self.dropped += len(self.__items)
+            self.__items.clear()
+            self.__condition.notify_all()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__busy = False
+                self.__condition.notify_all()
+                while len(self.__items) == 0 and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                item = self.__items.popleft()
+                self.__busy = True
+                self.__condition.notify_all()
+
+            try:
+                result = self.__process(item)
+                if result is not None and self.__output is not None:
+                    self.__output(result)
+            except Exception as err:
+                self.errors += 1
+                logger.error("[%s] error while processing item: %s", self.__name, err)
+            self.processed += 1
@@ -2,6 +2,8 @@
 '''
 
 from .layer import source, alias, state, instance, LayerState,  Layer, ContextualLayer
+from .queue import MessageQueue, MessageQueueClosed
+from .scheduler import Scheduler, ScheduledTask
 
 
 __all__ = [
@@ -11,5 +13,9 @@ __all__ = [
     'alias',
     'state',
     'LayerState',
-    'ContextualLayer'
+    'ContextualLayer',
+    'MessageQueue',
+    'MessageQueueClosed',
+    'Scheduler',
+    'ScheduledTask'
 ]
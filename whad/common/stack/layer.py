@@ -291,6 +291,35 @@ class Layer(object):
     Basic stack layer.
     """
 
+    # Incremented each time a layer is created or destroyed, to invalidate
+    # the cached routes of every layer.
+    __topology_version = 0
+
+    def __init_subclass__(cls, **kwargs):
+        """Compute the message handlers table of a layer class once, when
+        the class is created.
+        """
+        super().__init_subclass__(**kwargs)
+        cls.handlers_table()
+
+    @classmethod
+    def handlers_table(cls):
+        """Return the names of the message handlers of this layer class,
+        indexed by (source, tag).
+        """
+        table = cls.__dict__.get('_Layer__handlers_table')
+        if table is None:
+            table = {}
+            for prop in dir(cls):
+                method = getattr(cls, prop, None)
+                match_sources = getattr(method, 'match_sources', None)
+                if callable(method) and isinstance(match_sources, dict):
+                    for _source, tags in match_sources.items():
+                        for tag in tags:
+                            table[(_source, tag)] = prop
+            cls.__handlers_table = table
+        return table
+
     @classmethod
     def instantiable(cls):
         return False
@@ -351,25 +380,14 @@ class Layer(object):
         self.__options = options
         self.__monitor_callbacks = []
 
-        # Cache our message handlers
-        self.__handlers = {}
-        methods = []
-        for prop in dir(self):
-            try:
-                prop_obj = getattr(self, prop)
-                if callable(prop_obj):
-                    methods.append(prop_obj)
-            except AttributeError as att_err:
-                pass
-
-        for method in methods:
-            if hasattr(method, 'match_sources') and isinstance(getattr(method, 'match_sources'), dict):
-                match_sources = getattr(method, 'match_sources')
-                for source in match_sources:
-                    tags = match_sources[source]
-                    for tag in tags:
-                        handler_key = '%s:%s'%(source,tag)
-                    self.__handlers[handler_key] = method
+        # Bind our message handlers
+        self.__handlers = {
+            key: getattr(self, name) for key, name in self.handlers_table().items()
+        }
+
+        # Handlers resolved by `send_from`, indexed by (source, destination, tag)
+        self.__routes = {}
+        self.__routes_version = Layer.__topology_version
 
         # Call configure to set up options
         self.configure(options)
@@ -416,6 +434,7 @@ class Layer(object):
         """
         layer_options = self.options[layer_class.alias] if layer_class.alias in self.options else {}
         self.__layers[inst_name] = layer_class(self, inst_name, options=layer_options)
+        Layer.__topology_version += 1
         return self.__layers[inst_name]
 
     def destroy(self, layer_instance):
@@ -423,6 +442,7 @@ class Layer(object):
         '''
         if layer_instance.name in self.__layers:
             del self.__layers[layer_instance.name]
+            Layer.__topology_version += 1
 
     def register_monitor_callback(self, callback):
         '''Register a callback to monitor messages sent between layers.
@@ -461,17 +481,11 @@ class Layer(object):
     def get_handler(self, source, tag='default'):
         """Retrieve the registered handler for a given source and tag (if any).
         """
-        handler_key = '%s:%s'%(source, tag)
-        if handler_key in self.__handlers:
-            return self.__handlers[handler_key]
-
-        # If not found, fall back on 'default' tag
-        handler_key = '%s:%s'%(source, 'default')
-        if handler_key in self.__handlers:
-            return self.__handlers[handler_key]
-
-        # Not found
-        return None
+        handler = self.__handlers.get((source, tag))
+        if handler is None:
+            # If not found, fall back on 'default' tag
+            handler = self.__handlers.get((source, 'default'))
+        return handler
 
     def get_layer(self, name, children_only=False):
         """Retrieve a specific layer based on its name.
@@ -545,52 +559,15 @@ class Layer(object):
         """Find sublayers that send messages to the specified layer.
         """
         emitters = []
-
-        # First, loop on our own methods to find the sources we are using.
-        methods = [getattr(cls, prop) for prop in dir(cls) if callable(getattr(cls, prop))]
-        for method in methods:
-            if hasattr(method, 'match_sources') and isinstance(getattr(method, 'match_sources'), dict):
-                match_sources = getattr(method, 'match_sources')
-                for _source in match_sources:
-                    if _source not in emitters:
-                        emitters.append(_source)
-
+        for _source, _ in cls.handlers_table():
+            if _source not in emitters:
+                emitters.append(_source)
         return emitters
 
-    def get_message_handler(self, source):
+    def get_message_handler(self, source, tag='default'):
         """Find the message handler associated with the source
         """
-        methods = [getattr(self, prop) for prop in dir(self) if callable(getattr(self, prop))]
-        for method in methods:
-            if hasattr(method, 'match_sources') and isinstance(getattr(method, 'match_sources'), dict):
-                match_sources = getattr(method, 'match_sources')
-                if source in match_sources:
-                    if tag in match_sources[source]:
-                        return method
-
-    def __get_layer_handler_by_source(self, layer, source, tag='default'):
-        """Find the method associated with a source for a given layer.
-        """
-        layer = self.get_layer(layer)
-        if layer is None:
-            return None
-        else:
-            methods = [getattr(layer, prop) for prop in dir(layer) if callable(getattr(layer, prop))]
-            for method in methods:
-                if hasattr(method, 'match_sources') and isinstance(getattr(method, 'match_sources'), dict):
-                    match_sources = getattr(method, 'match_sources')
-                    if source in match_sources:
-                        if tag in match_sources[source]:
-                            return method
-
-        # if tag is not default, try again with 'default'
-        for method in methods:
-            if hasattr(method, 'match_sources') and isinstance(getattr(method, 'match_sources'), dict):
-                match_sources = getattr(method, 'match_sources')
-                if source in match_sources:
-                    if 'default' in match_sources[source]:
-                        return method
-        return None
+        return self.get_handler(source, tag=tag)
 
     def send(self, destination, data, tag='default', **kwargs):
         """Send a message to the corresponding layer.
@@ -601,7 +578,31 @@ class Layer(object):
         """Dispatch data from source to destination, with an optional tag
         and arguments.
         """
-        # If source name has a '#' in it, then it is an instance of a
+        # notify monitors
+        if self.__monitor_callbacks:
+            self.monitor_message(source, destination, data, tag=tag, **kwargs)
+
+        # Routes are resolved once, until a layer is created or destroyed
+        if self.__routes_version != Layer.__topology_version:
+            self.__routes.clear()
+            self.__routes_version = Layer.__topology_version
+        route = self.__routes.get((source, destination, tag))
+        if route is None:
+            route = self.__resolve_route(source, destination, tag)
+            if route is None:
+                return
+
+        handler, contextual = route
+        if contextual:
+            handler(source, data, **kwargs)
+        else:
+            handler(data, **kwargs)
+
+    def __resolve_route(self, source, destination, tag):
+        """Find the handler of the destination layer processing messages
+        from a given source and tag, and cache it.
+        """
+        # If source name has a '#' in it, then it is an instance of a
         # contextual layer and we must remove this to route the message.
         if '#' in source:
             idx = source.find('#')
@@ -609,23 +610,21 @@ class Layer(object):
         else:
             source_layer = source
 
-        # notify monitors
-        self.monitor_message(source, destination, data, tag=tag, **kwargs)
-
-        # Find the target layer object
+        # Find the target layer object
         target_layer = self.get_layer(destination)
-        if target_layer is not None:
-            # Then we search the corresponding handler for our source
-            handler = target_layer.get_handler(source_layer, tag)
-            if handler is not None:
-                if handler.is_contextual:
-                    handler(source, data, **kwargs)
-                else:
-                    handler(data, **kwargs)
-            else:
-                print('[oops] No handler found in layer %s to process messages from %s' % (destination, source))
-        else:
+        if target_layer is None:
             print('[oops] layer %s does not exist' % destination)
+            return None
+
+        # Then we search the corresponding handler for our source
+        handler = target_layer.get_handler(source_layer, tag)
+        if handler is None:
+            print('[oops] No handler found in layer %s to process messages from %s' % (destination, source))
+            return None
+
+        route = (handler, handler.is_contextual)
+        self.__routes[(source, destination, tag)] = route
+        return route
 
 
     def __getitem__(self, name):
@@ -0,0 +1,88 @@
+'''Stack message queue
+
+This module provides a message queue used by stack layers and services to
+wait for a specific response. Waiters block on a condition variable and are
+woken up as soon as a message is added to the queue or the queue is closed
+(e.g. when the underlying connection is terminated), without polling.
+'''
+from collections import deque
+from queue import Empty
+from threading import Condition
+from time import monotonic
+
+
+class MessageQueueClosed(Exception):
+    """Raised when waiting for a message on a closed queue.
+    """
+
+
+class MessageQueue(object):
+    """Thread-safe message queue with filtered blocking reads.
+    """
+
+    def __init__(self):
+        self.__messages = deque()
+        self.__condition = Condition()
+        self.__closed = False
+
+    @property
+    def closed(self) -> bool:
+        """Closed state of this queue.
+        """
+        return self.__closed
+
+    def __len__(self):
+        return len(self.__messages)
+
+    def put(self, message):
+        """Add a message to this queue and wake up waiters.
+
+        :param message: Message to add
+        """
+        with self.__condition:
+            self.__messages.append(message)
+            self.__condition.notify()
+
+    def get(self, predicate=None, timeout=None):
+        """Wait for a message matching a predicate. Messages that do not match
+        the predicate are removed from the queue and dropped.
+
+        :param predicate: Filtering function, any message matches if `None`
+        :type predicate: callable
+        :param float timeout: Maximum time to wait in seconds, wait forever if `None`
+        :return: First matching message
+        :raise Empty: No matching message received before timeout
+        :raise MessageQueueClosed: Queue has been closed
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.__condition:
+            while True:
+                while len(self.__messages) > 0:
+                    message = self.__messages.popleft()
+                    if predicate is None or predicate(message):
+                        return message
+
+                if self.__closed:
+                    raise MessageQueueClosed()
+
+                if deadline is None:
+                    self.__condition.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise Empty()
+                    self.__condition.wait(remaining)
+
+    def clear(self):
+        """Remove all queued messages.
+        """
+        with self.__condition:
+            self.__messages.clear()
+
+    def close(self):
+        """Close this queue, waking up every waiter. Queued messages can
+        still be read.
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
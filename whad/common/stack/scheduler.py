@@ -0,0 +1,134 @@
+'''Stack scheduler
+
+This module provides a scheduler used by stack layers to run timers
+(retransmissions, acknowledgements, ...) and deferred transmissions from a
+single worker thread, instead of creating a `Thread` or a `threading.Timer`
+for each of them. Tasks are kept in a heap sorted by deadline, tasks sharing
+the same deadline being run in submission order.
+'''
+import logging
+from heapq import heappush, heappop
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledTask(object):
+    """Task scheduled by a :class:`Scheduler`.
+    """
+
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel this task. Has no effect if the task has already been run.
+        """
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """Thread-safe task scheduler.
+
+    Tasks are run one at a time by a single daemon thread, started when the
+    first task is scheduled. Tasks must therefore not block, and should
+    schedule a new task instead of sleeping.
+    """
+
+    def __init__(self, name='stack-scheduler'):
+        self.__name = name
+        self.__tasks = []
+        self.__counter = count()
+        self.__condition = Condition()
+        self.__thread = None
+        self.__closed = False
+
+    def __len__(self):
+        """Number of pending tasks, including cancelled tasks that have not
+        reached their deadline yet.
+        """
+        return len(self.__tasks)
+
+    @property
+    def closed(self) -> bool:
+        """Closed state of this scheduler.
+        """
+        return self.__closed
+
+    def call_later(self, delay, callback, *args) -> ScheduledTask:
+        """Schedule a callback.
+
+        :param float delay: Delay in seconds before calling the callback
+        :param callback: Function to call
+        :param args: Arguments passed to the callback
+        :return: Scheduled task, that can be cancelled
+        :rtype: ScheduledTask
+        """
+        task = ScheduledTask(monotonic() + max(delay, 0), callback, args)
+        with self.__condition:
+            if self.__closed:
+                task.cancel()
+                return task
+            heappush(self.__tasks, (task.deadline, next(self.__counter), task))
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__run, name=self.__name, daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+        return task
+
+    def call_soon(self, callback, *args) -> ScheduledTask:
+        """Schedule a callback as soon as possible, after the tasks already due.
+
+        :param callback: Function to call
+        :param args: Arguments passed to the callback
+        :return: Scheduled task, that can be cancelled
+        :rtype: ScheduledTask
+        """
+        return self.call_later(0, callback, *args)
+
+    def close(self):
+        """Stop the worker thread, dropping every pending task.
+        """
+        with self.__condition:
+            self.__closed = True
+            for _, _, task in self.__tasks:
+                task.cancel()
+            self.__tasks.clear()
+            self.__condition.notify_all()
+
+    def __next_task(self):
+        """Wait for the next task due, or return `None` once closed.
+        """
+        with self.__condition:
+            while not self.__closed:
+                if len(self.__tasks) == 0:
+                    self.__condition.wait()
+                    continue
+
+                deadline, _, task = self.__tasks[0]
+                if task.cancelled:
+                    heappop(self.__tasks)
+                    continue
+
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    heappop(self.__tasks)
+                    return task
+                self.__condition.wait(remaining)
+        return None
+
+    def __run(self):
+        while True:
+            task = self.__next_task()
+            if task is None:
+                return
+            try:
+                task.callback(*task.args)
+            except Exception as err:
+                logger.error('[scheduler] task %s raised an exception: %s', task.callback, err)
@@ -15,6 +15,7 @@ from whad.device.info import WhadDeviceInfo
 from whad.device.connector import WhadDeviceConnector
 from whad.device.bridge import Bridge
 from whad.device.device import WhadDevice, VirtualDevice
+from whad.device.aio import AsyncWhadDevice, AsyncWhadDeviceConnector
 
 # Import derived classes
 from whad.device.uart import UartDevice
@@ -31,6 +32,8 @@ __all__ = [
     "WhadDeviceConnector",
     "WhadDeviceInfo",
     "WhadDevice",
+    "AsyncWhadDevice",
+    "AsyncWhadDeviceConnector",
     "UartDevice",
     "VirtualDevice",
     "TCPSocketDevice",
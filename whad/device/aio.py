@@ -0,0 +1,752 @@
+"""
+WHAD asyncio device layer.
+
+This module provides asyncio-native counterparts of the threaded WHAD device
+and connector classes. Asynchronous devices do not rely on any background
+thread: incoming data is read by the event loop (asyncio streams for TCP and
+Unix sockets, `loop.add_reader()` for UART devices), reassembled by a
+:class:`whad.device.framing.WhadFrameDecoder` and parsed by the device's
+protocol hub, right from the event loop.
+
+Commands are sent with `await device.send_command(...)` and each of them is
+resolved through a dedicated future, while received packets are consumed by
+iterating over an asynchronous connector:
+
+.. code-block:: python
+
+    async with AsyncWhadDevice.create("tcp:127.0.0.1:12345") as device:
+        await device.discover()
+        connector = AsyncWhadDeviceConnector(device)
+        async for packet in connector.packets():
+            packet.show()
+
+The threaded API (:class:`whad.device.WhadDevice` and its connectors) is left
+untouched and remains the default one.
+"""
+import os
+import asyncio
+import logging
+from typing import Callable
+
+# Import serial
+from serial import Serial
+
+from whad.exceptions import WhadDeviceNotReady, WhadDeviceNotFound, \
+    WhadDeviceDisconnected, WhadDeviceTimeout, WhadDeviceError, RequiredImplementation
+from whad.helpers import message_filter
+from whad.hub import ProtocolHub
+from whad.hub.message import AbstractPacket, AbstractEvent
+from whad.hub.generic.cmdresult import CommandResult, Success
+from whad.hub.discovery import InfoQueryResp, DomainInfoQueryResp, DeviceReady
+from whad.device.info import WhadDeviceInfo
+from whad.device.framing import WhadFrameDecoder, frame_message
+
+logger = logging.getLogger(__name__)
+
+class AsyncWhadDevice:
+    """Asynchronous WHAD device base class.
+
+    Subclasses must implement `_connect()`, `_disconnect()` and `_write()`,
+    and call `on_data_received()` each time data is received from the
+    underlying transport (or `on_disconnection()` when the transport is lost).
+    """
+
+    INTERFACE_NAME = None
+
+    @classmethod
+    def _get_sub_classes(cls):
+        """Retrieve every asynchronous device class.
+        """
+        subclasses = []
+        for subclass in cls.__subclasses__():
+            if subclass.INTERFACE_NAME is not None:
+                subclasses.append(subclass)
+            subclasses.extend(subclass._get_sub_classes())
+        return subclasses
+
+    @classmethod
+    def create(cls, interface_string: str):
+        """Create an asynchronous device from an interface string, formed as
+        `<device_type>:<device_identifier>`.
+
+        Examples:
+            - `uart:/dev/ttyACM0`: UART device identified by `/dev/ttyACM0`
+            - `tcp:127.0.0.1:12345`: device exposed on a TCP socket
+            - `unix:/tmp/whad_1234.sock`: device exposed on a Unix socket
+
+        :param str interface_string: Interface string
+        :raises WhadDeviceNotFound: No asynchronous device class matches
+        """
+        if ":" in interface_string:
+            interface, identifier = interface_string.split(":", 1)
+            for device_class in cls._get_sub_classes():
+                if device_class.INTERFACE_NAME == interface:
+                    return device_class.from_identifier(identifier)
+        raise WhadDeviceNotFound
+
+    @classmethod
+    def from_identifier(cls, identifier: str):
+        """Create a device instance from its identifier.
+        """
+        return cls(identifier)
+
+    def __init__(self):
+        """Create an asynchronous device.
+        """
+        self.__hub = ProtocolHub(2)
+        self.__decoder = WhadFrameDecoder()
+        self.__connector = None
+        self.__info = None
+        self.__discovered = False
+        self.__opened = False
+        self.__timeout = 5.0
+
+        # Futures waiting for a specific message, in registration order
+        self.__waiters = []
+
+        # Write lock, created on open() as it must belong to the running loop
+        self.__tx_lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def hub(self) -> ProtocolHub:
+        """Protocol hub used by this device.
+        """
+        return self.__hub
+
+    @property
+    def opened(self) -> bool:
+        """Device state.
+        """
+        return self.__opened
+
+    @property
+    def identifier(self) -> str:
+        """Device identifier, must be overriden by subclasses.
+        """
+        return None
+
+    @property
+    def interface(self) -> str:
+        """Device interface string.
+        """
+        return f"{self.INTERFACE_NAME}:{self.identifier}"
+
+    @property
+    def info(self) -> WhadDeviceInfo:
+        """Get device info object, set once the device has been discovered.
+        """
+        return self.__info
+
+    @property
+    def device_id(self):
+        """Return device ID
+        """
+        return self.__info.device_id
+
+    def set_connector(self, connector):
+        """Set the connector receiving the messages sent by this device.
+        """
+        self.__connector = connector
+
+    ######################################
+    # Transport
+    ######################################
+
+    async def _connect(self):
+        """Connect to the underlying transport, must be implemented by subclasses.
+        """
+        logger.error("method `_connect` must be implemented in inherited classes")
+        raise RequiredImplementation()
+
+    async def _disconnect(self):
+        """Disconnect from the underlying transport, must be implemented by subclasses.
+        """
+        logger.error("method `_disconnect` must be implemented in inherited classes")
+        raise RequiredImplementation()
+
+    async def _write(self, data: bytes):
+        """Write data to the underlying transport, must be implemented by subclasses.
+        """
+        logger.error("method `_write` must be implemented in inherited classes")
+        raise RequiredImplementation()
+
+    async def open(self):
+        """Open device.
+        """
+        if not self.__opened:
+            self.__tx_lock = asyncio.Lock()
+            self.__decoder.reset()
+            await self._connect()
+            self.__opened = True
+
+    async def close(self):
+        """Close device and cancel every pending command.
+        """
+        if self.__opened:
+            self.__opened = False
+            await self._disconnect()
+            self.__cancel_waiters()
+            if self.__connector is not None:
+                self.__connector.on_disconnection()
+
+    def on_disconnection(self):
+        """Called by subclasses when the underlying transport has been lost.
+        """
+        if self.__opened:
+            logger.debug("[%s] device disconnected", self.interface)
+            self.__opened = False
+            self.__cancel_waiters()
+            if self.__connector is not None:
+                self.__connector.on_disconnection()
+
+    def __cancel_waiters(self):
+        """Wake up every pending waiter with a disconnection error.
+        """
+        waiters = self.__waiters
+        self.__waiters = []
+        for _, future in waiters:
+            if not future.done():
+                future.set_exception(WhadDeviceDisconnected())
+
+    ######################################
+    # Reception
+    ######################################
+
+    def on_data_received(self, data: bytes):
+        """Parse received data and process every complete message.
+
+        :param bytes data: Data received from the transport
+        """
+        for raw_message in self.__decoder.feed(data):
+            message = self.__hub.parse(raw_message)
+            if message is not None:
+                self.on_message_received(message)
+            else:
+                logger.debug("[%s] cannot parse message %s", self.interface, raw_message)
+
+    def on_message_received(self, message):
+        """Deliver a message to the first waiter expecting it, or dispatch it
+        to the connector.
+
+        :param HubMessage message: Message received
+        """
+        for i, (predicate, future) in enumerate(self.__waiters):
+            if not future.done() and predicate(message):
+                del self.__waiters[i]
+                future.set_result(message)
+                return
+        self.dispatch_message(message)
+
+    def dispatch_message(self, message):
+        """Forward a message to the corresponding connector callback.
+
+        :param HubMessage message: Message to dispatch
+        """
+        connector = self.__connector
+        if connector is None:
+            logger.debug("[%s] no connector set, message dropped: %s", self.interface, message)
+            return
+
+        connector.on_any_msg(message)
+        if message.message_type == "discovery":
+            connector.on_discovery_msg(message)
+        elif message.message_type == "generic":
+            connector.on_generic_msg(message)
+        elif message.message_type is not None:
+            if issubclass(type(message), AbstractPacket):
+                packet = message.to_packet()
+                if packet is not None:
+                    connector.on_packet(packet)
+            elif issubclass(type(message), AbstractEvent):
+                event = message.to_event()
+                if event is not None:
+                    connector.on_event(event)
+            else:
+                connector.on_domain_msg(message.message_type, message)
+
+    async def wait_for_message(self, predicate: Callable, timeout: float = None):
+        """Wait for a message matching a predicate.
+
+        :param predicate: Message filtering function
+        :param float timeout: Timeout in seconds, `None` to wait forever
+        :returns: Matching message, or `None` if timed out
+        :raises WhadDeviceDisconnected: Device has been disconnected
+        """
+        future = self.__add_waiter(predicate)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.__remove_waiter(future)
+
+    def __add_waiter(self, predicate: Callable) -> asyncio.Future:
+        """Register a future resolved by the next message matching `predicate`.
+        """
+        if not self.__opened:
+            raise WhadDeviceDisconnected()
+        future = asyncio.get_running_loop().create_future()
+        self.__waiters.append((predicate, future))
+        return future
+
+    def __remove_waiter(self, future: asyncio.Future):
+        """Unregister a waiter, if still registered.
+        """
+        for i, (_, waiter) in enumerate(self.__waiters):
+            if waiter is future:
+                del self.__waiters[i]
+                break
+
+    ######################################
+    # Transmission
+    ######################################
+
+    async def send_message(self, message):
+        """Serialize a message and send it to the device, without waiting for
+        an answer.
+
+        :param HubMessage message: Message to send
+        """
+        if not self.__opened:
+            raise WhadDeviceNotReady()
+        logger.debug("[%s] sending message %s", self.interface, message)
+        async with self.__tx_lock:
+            await self._write(frame_message(message.serialize()))
+
+    async def send_command(self, command, keep: Callable = None, timeout: float = None):
+        """Send a command and wait for the device response. WHAD commands
+        usually expect a CmdResult message, which is awaited if `keep` is not
+        provided.
+
+        Several tasks may send commands concurrently, each command being
+        resolved by its own future.
+
+        :param HubMessage command: Command to send
+        :param keep: Message filtering function (optional)
+        :param float timeout: Timeout in seconds (optional)
+        :returns: Response message from the device
+        :raises WhadDeviceTimeout: Device did not answer in time
+        """
+        if keep is None:
+            keep = message_filter(CommandResult)
+        if timeout is None:
+            timeout = self.__timeout
+
+        # Register our waiter before sending the command to catch its answer
+        future = self.__add_waiter(keep)
+        try:
+            await self.send_message(command)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError as err:
+            raise WhadDeviceTimeout("WHAD device did not answer to a command") from err
+        finally:
+            self.__remove_waiter(future)
+
+    ######################################
+    # Discovery
+    ######################################
+
+    async def discover(self):
+        """Perform device discovery.
+
+        Query device information and supported commands of every domain, and
+        update the protocol hub to the device's protocol version.
+        """
+        if self.__discovered:
+            return
+
+        resp = await self.send_command(
+            self.__hub.discovery.create_info_query(0x0100),
+            message_filter(InfoQueryResp)
+        )
+        if resp is None:
+            raise WhadDeviceNotReady()
+        self.__info = WhadDeviceInfo(resp)
+        self.__hub = ProtocolHub(resp.proto_min_ver)
+
+        for domain in self.__info.domains:
+            resp = await self.send_command(
+                self.__hub.discovery.create_domain_query(domain),
+                message_filter(DomainInfoQueryResp)
+            )
+            self.__info.add_supported_commands(resp.domain, resp.supported_commands)
+
+        logger.info("[%s] device discovery done", self.interface)
+        self.__discovered = True
+
+    async def reset(self):
+        """Reset device.
+        """
+        return await self.send_command(
+            self.__hub.discovery.create_reset_query(),
+            message_filter(DeviceReady)
+        )
+
+class AsyncStreamDevice(AsyncWhadDevice):
+    """Asynchronous device relying on asyncio streams.
+
+    Subclasses must implement `_open_connection()` and return a pair of
+    stream reader and writer.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__reader = None
+        self.__writer = None
+        self.__rx_task = None
+
+    async def _open_connection(self):
+        """Open the underlying stream, must be implemented by subclasses.
+        """
+        logger.error("method `_open_connection` must be implemented in inherited classes")
+        raise RequiredImplementation()
+
+    async def _connect(self):
+        """Connect to the stream and start reading from it.
+        """
+        try:
+            self.__reader, self.__writer = await self._open_connection()
+        except OSError as err:
+            raise WhadDeviceNotFound from err
+        self.__rx_task = asyncio.get_running_loop().create_task(self.__read_stream())
+
+    async def _disconnect(self):
+        """Stop reading and close the stream.
+        """
+        if self.__rx_task is not None:
+            self.__rx_task.cancel()
+            try:
+                await self.__rx_task
+            except asyncio.CancelledError:
+                pass
+            self.__rx_task = None
+        if self.__writer is not None:
+            self.__writer.close()
+            try:
+                await self.__writer.wait_closed()
+            except OSError:
+                pass
+            self.__writer = None
+            self.__reader = None
+
+    async def _write(self, data: bytes):
+        """Write data to the stream.
+        """
+        try:
+            self.__writer.write(data)
+            await self.__writer.drain()
+        except OSError as err:
+            self.on_disconnection()
+            raise WhadDeviceDisconnected() from err
+
+    async def __read_stream(self):
+        """Read data from the stream until it is closed.
+        """
+        try:
+            while True:
+                data = await self.__reader.read(4096)
+                if len(data) == 0:
+                    break
+                self.on_data_received(data)
+        except OSError as err:
+            logger.debug("[%s] stream error: %s", self.interface, err)
+        self.on_disconnection()
+
+class AsyncTCPSocketDevice(AsyncStreamDevice):
+    """Asynchronous TCP socket device.
+    """
+
+    INTERFACE_NAME = "tcp"
+
+    @classmethod
+    def from_identifier(cls, identifier: str):
+        """Create a device from a `host[:port]` identifier.
+        """
+        if ":" in identifier:
+            host, port = identifier.rsplit(":", 1)
+            try:
+                return cls(host, int(port))
+            except ValueError as err:
+                raise WhadDeviceNotFound from err
+        return cls(identifier)
+
+    def __init__(self, address: str = "127.0.0.1", port: int = 12345):
+        super().__init__()
+        self.__address = address
+        self.__port = port
+
+    @property
+    def identifier(self) -> str:
+        """Device identifier (host and port).
+        """
+        return f"{self.__address}:{self.__port}"
+
+    async def _open_connection(self):
+        return await asyncio.open_connection(self.__address, self.__port)
+
+class AsyncUnixSocketDevice(AsyncStreamDevice):
+    """Asynchronous Unix socket device.
+    """
+
+    INTERFACE_NAME = "unix"
+
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.__path = path
+
+    @property
+    def identifier(self) -> str:
+        """Device identifier (socket path).
+        """
+        return self.__path
+
+    async def _open_connection(self):
+        return await asyncio.open_unix_connection(self.__path)
+
+class AsyncUartDevice(AsyncWhadDevice):
+    """Asynchronous UART device.
+
+    The serial port is put in non-blocking mode and monitored by the event
+    loop through `loop.add_reader()`.
+    """
+
+    INTERFACE_NAME = "uart"
+
+    def __init__(self, port: str = "/dev/ttyUSB0", baudrate: int = 115200):
+        super().__init__()
+        self.__port = port
+        self.__baudrate = baudrate
+        self.__uart = None
+        self.__fileno = None
+        self.__loop = None
+
+    @property
+    def identifier(self) -> str:
+        """Device identifier (serial port).
+        """
+        return self.__port
+
+    async def _connect(self):
+        """Open serial port and register it into the event loop.
+        """
+        try:
+            self.__uart = Serial(self.__port, self.__baudrate, timeout=0, write_timeout=0)
+        except OSError as err:
+            raise WhadDeviceNotFound from err
+        self.__fileno = self.__uart.fileno()
+        self.__loop = asyncio.get_running_loop()
+        self.__loop.add_reader(self.__fileno, self.__on_readable)
+
+    async def _disconnect(self):
+        """Unregister serial port from the event loop and close it.
+        """
+        if self.__fileno is not None:
+            self.__loop.remove_reader(self.__fileno)
+            self.__loop.remove_writer(self.__fileno)
+            self.__fileno = None
+        if self.__uart is not None:
+            self.__uart.close()
+            self.__uart = None
+
+    def __on_readable(self):
+        """Read available data, called by the event loop.
+        """
+        try:
+            data = os.read(self.__fileno, 1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if len(data) == 0:
+            # Device does not behave as expected, consider it disconnected.
+            self.__loop.remove_reader(self.__fileno)
+            self.on_disconnection()
+        else:
+            self.on_data_received(data)
+
+    async def _write(self, data: bytes):
+        """Write data to the serial port, waiting for it to be writable if
+        required.
+        """
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                nb_bytes_written = os.write(self.__fileno, view)
+            except BlockingIOError:
+                nb_bytes_written = 0
+            except OSError as err:
+                raise WhadDeviceError("error while writing to UART device") from err
+            view = view[nb_bytes_written:]
+            if len(view) > 0:
+                await self.__wait_writable()
+
+    async def __wait_writable(self):
+        """Wait for the serial port to be writable.
+        """
+        future = self.__loop.create_future()
+        self.__loop.add_writer(self.__fileno, future.set_result, None)
+        try:
+            await future
+        finally:
+            self.__loop.remove_writer(self.__fileno)
+
+class AsyncWhadDeviceConnector:
+    """Asynchronous WHAD device connector.
+
+    Received packets and events are queued and consumed by iterating over
+    `packets()` and `events()`. Other messages are forwarded to the
+    `on_discovery_msg()`, `on_generic_msg()` and `on_domain_msg()` callbacks
+    that can be overriden by subclasses.
+    """
+
+    def __init__(self, device: AsyncWhadDevice = None, max_pending: int = 0):
+        """Create an asynchronous connector.
+
+        :param device: Asynchronous device to use
+        :param int max_pending: Maximum number of queued packets/events, 0 for no limit
+        """
+        self.__device = None
+        self.__max_pending = max_pending
+        self.__packets = asyncio.Queue(max_pending)
+        self.__events = asyncio.Queue(max_pending)
+        self.__dropped = 0
+        if device is not None:
+            self.set_device(device)
+
+    def set_device(self, device: AsyncWhadDevice = None):
+        """Set device.
+        """
+        self.__device = device
+        if device is not None:
+            device.set_connector(self)
+
+    @property
+    def device(self) -> AsyncWhadDevice:
+        """Get device.
+        """
+        return self.__device
+
+    @property
+    def hub(self) -> ProtocolHub:
+        """Get the device protocol hub.
+        """
+        return self.__device.hub
+
+    @property
+    def dropped(self) -> int:
+        """Number of packets and events dropped because of full queues.
+        """
+        return self.__dropped
+
+    async def send_message(self, message):
+        """Send a message to the device.
+        """
+        await self.__device.send_message(message)
+
+    async def send_command(self, message, keep: Callable = None, timeout: float = None):
+        """Send a command to the device and wait for its response.
+        """
+        return await self.__device.send_command(message, keep, timeout)
+
+    async def send_packet(self, packet) -> bool:
+        """Send a packet through the device.
+
+        :param packet: Scapy packet to send
+        :returns: `True` if the device successfully sent the packet, `False` otherwise
+        """
+        msg = self.hub.convert_packet(packet)
+        if msg is None:
+            logger.error("[connector] packet cannot be converted into a WHAD message")
+            return False
+
+        resp = await self.send_command(msg, message_filter(CommandResult))
+        return isinstance(resp, Success)
+
+    async def packets(self, timeout: float = None):
+        """Iterate asynchronously over received packets, until the device is
+        disconnected or no packet has been received during `timeout` seconds.
+
+        :param float timeout: Inter-packet timeout in seconds (optional)
+        """
+        while True:
+            try:
+                packet = await asyncio.wait_for(self.__packets.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+            if packet is None:
+                return
+            yield packet
+
+    async def events(self, timeout: float = None):
+        """Iterate asynchronously over received events, until the device is
+        disconnected or no event has been received during `timeout` seconds.
+
+        :param float timeout: Inter-event timeout in seconds (optional)
+        """
+        while True:
+            try:
+                event = await asyncio.wait_for(self.__events.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+            if event is None:
+                return
+            yield event
+
+    def __enqueue(self, queue: asyncio.Queue, item):
+        """Add an item to a queue, dropping the oldest one if full.
+        """
+        if queue.full():
+            queue.get_nowait()
+            self.__dropped += 1
+        queue.put_nowait(item)
+
+    def on_disconnection(self):
+        """Device has been disconnected, terminate packet and event iterators.
+        """
+        for queue in (self.__packets, self.__events):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def on_packet(self, packet):
+        """Queue a received packet.
+        """
+        self.__enqueue(self.__packets, packet)
+
+    def on_event(self, event):
+        """Queue a received event.
+        """
+        self.__enqueue(self.__events, event)
+
+    def on_any_msg(self, message): # pylint: disable=W0613
+        """Callback function to process any incoming message.
+        """
+
+    def on_discovery_msg(self, message): # pylint: disable=W0613
+        """Callback function to process incoming discovery messages.
+        """
+
+    def on_generic_msg(self, message): # pylint: disable=W0613
+        """Callback function to process incoming generic messages.
+        """
+
+    def on_domain_msg(self, domain, message): # pylint: disable=W0613
+        """Callback function to process incoming domain-related messages.
+        """
+
+__all__ = [
+    "AsyncWhadDevice",
+    "AsyncStreamDevice",
+    "AsyncTCPSocketDevice",
+    "AsyncUnixSocketDevice",
+    "AsyncUartDevice",
+    "AsyncWhadDeviceConnector"
+]
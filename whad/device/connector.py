@@ -5,17 +5,44 @@ This module provides a default connector class `WhadDeviceConnector` that
 implements all the basic features of a device connector.
 """
 import logging
+from collections import deque
+from dataclasses import dataclass, field
 from queue import Queue, Empty
 from threading import Lock
+from time import perf_counter
 
 from whad.helpers import message_filter
 from whad.hub import ProtocolHub
 from whad.hub.generic.cmdresult import CommandResult, Success
-from whad.exceptions import WhadDeviceError, WhadDeviceDisconnected, \
+from whad.exceptions import WhadDeviceError, WhadDeviceDisconnected, WhadDeviceTimeout, \
     RequiredImplementation
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class TransmissionReport:
+    """Outcome of a pipelined packet transmission.
+
+    `results` holds, for each packet and in the same order, `True` if the
+    device successfully sent it or `False` otherwise.
+    """
+    results: list = field(default_factory=list)
+    duration: float = 0.0
+
+    @property
+    def sent(self) -> int:
+        """Number of packets successfully sent.
+        """
+        return sum(self.results)
+
+    @property
+    def rate(self) -> float:
+        """Aggregate transmission rate, in packets per second.
+        """
+        if self.duration > 0:
+            return len(self.results) / self.duration
+        return 0.0
+
 class WhadDeviceConnector:
     """
     Device connector.
@@ -166,6 +193,15 @@ class WhadDeviceConnector:
         return len(callbacks_dicts) > 0
 
 
+    @property
+    def has_reception_callbacks(self) -> bool:
+        """`True` if at least one callback monitors reception.
+
+        Connectors can rely on this property to avoid building packets
+        that nobody would receive.
+        """
+        return len(self.__reception_callbacks) > 0
+
     def monitor_packet_tx(self, packet):
         """
         Signals the transmission of a packet and triggers execution of matching
@@ -386,6 +422,68 @@ class WhadDeviceConnector:
         return False
 
 
+    def send_packets(self, packets, window: int = 8) -> TransmissionReport:
+        """Send a series of packets to our device, keeping up to `window`
+        packet commands in flight instead of waiting for the result of each
+        command before sending the next one.
+
+        Packets are converted and sent as `packets` is iterated, and each one
+        is monitored once sent. If the transmission fails, the report of the
+        packets handled so far is available in the `report` attribute of the
+        raised exception.
+
+        :param packets: Iterable of packets to send
+        :param int window: Maximum number of packets awaiting a command result
+        :return: Transmission report including per-packet success and rate
+        :rtype: TransmissionReport
+        """
+        start = perf_counter()
+        report = TransmissionReport()
+
+        # Position in report of each packet awaiting a command result
+        in_flight = deque()
+
+        def commands():
+            for packet in packets:
+                msg = self.hub.convert_packet(packet)
+                if msg is None:
+                    logger.error(("[connector] Packet cannot be converted into the"
+                                  "corresponding WHAD message"))
+                    report.results.append(False)
+                    continue
+
+                in_flight.append(len(report.results))
+                report.results.append(False)
+                yield msg
+
+                # Next command is requested once this one has been sent
+                self.monitor_packet_tx(packet)
+
+        # Send messages in a pipelined fashion
+        logger.info("[connector] send packet commands (window: %d)", window)
+        try:
+            for resp in self.__device.iter_commands(commands(), window=window,
+                                                    keep=message_filter(CommandResult)):
+                if resp is None:
+                    # Report WHAD device as disconnected
+                    raise WhadDeviceDisconnected()
+                report.results[in_flight.popleft()] = isinstance(resp, Success)
+        except WhadDeviceError as device_error:
+            logger.debug("an error occured while communicating with the WHAD device !")
+            self.on_error(device_error)
+            error = WhadDeviceDisconnected()
+            error.report = report
+            raise error from device_error
+        except (WhadDeviceDisconnected, WhadDeviceTimeout) as error:
+            error.report = report
+            raise
+        finally:
+            report.duration = perf_counter() - start
+
+        logger.info("[connector] %d/%d packets sent (%.1f packets/s)",
+                    report.sent, len(report.results), report.rate)
+        return report
+
     def wait_for_message(self, timeout=None, filter=None, command=False):
         """Waits for a specific message to be received.
 
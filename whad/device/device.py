@@ -6,9 +6,10 @@ including background threads.
 """
 import logging
 from binascii import hexlify
-from time import time, sleep
+from time import time
+from collections import deque
 from queue import Queue, Empty
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, Timer
 
 # Whad imports
 from whad.exceptions import UnsupportedDomain, WhadDeviceNotReady, \
@@ -25,6 +26,7 @@ from whad.hub.discovery import DeviceType
 from whad.hub.generic.cmdresult import ResultCode
 
 from whad.device.info import WhadDeviceInfo
+from whad.device.framing import WhadFrameDecoder, frame_message
 
 logger = logging.getLogger(__name__)
 
@@ -183,6 +185,66 @@ class WhadDeviceIOThread:
         self.__processing.cancel()
 
 
+class MessageWaiter:
+    """Pending wait for a message matching a given predicate.
+
+    Waiters are registered on a device and checked by `on_message_received()`
+    in registration order: the first waiter whose predicate matches an incoming
+    message gets it, and the thread waiting on it is immediately woken up.
+    One-shot waiters are unregistered once they received a matching message.
+    """
+
+    def __init__(self, predicate, one_shot: bool = True):
+        self.__predicate = predicate
+        self.__one_shot = one_shot
+        self.__messages = deque()
+        self.__cancelled = False
+        self.__cond = Condition()
+
+    @property
+    def one_shot(self) -> bool:
+        """Determine if this waiter expects a single message.
+        """
+        return self.__one_shot
+
+    @property
+    def cancelled(self) -> bool:
+        """Determine if this waiter has been cancelled.
+        """
+        return self.__cancelled
+
+    def match(self, message) -> bool:
+        """Check if a message matches this waiter predicate.
+        """
+        return self.__predicate(message)
+
+    def put(self, message):
+        """Deliver a matching message and wake up the waiting thread.
+        """
+        with self.__cond:
+            self.__messages.append(message)
+            self.__cond.notify()
+
+    def cancel(self):
+        """Cancel this waiter, waking up the waiting thread.
+        """
+        with self.__cond:
+            self.__cancelled = True
+            self.__cond.notify_all()
+
+    def wait(self, timeout: float = None):
+        """Wait for a matching message.
+
+        :param float timeout: Maximum number of seconds to wait (optional)
+        :returns: Matching message, or `None` if timed out or cancelled
+        """
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__messages or self.__cancelled, timeout)
+            if self.__messages:
+                return self.__messages.popleft()
+            return None
+
+
 class WhadDevice:
     """
     WHAD Device interface class.
@@ -411,13 +473,23 @@ class WhadDevice:
         self.__msg_queue = Queue()
         self.__mq_filter = None
 
-        # Input pipes
-        self.__inpipe = bytearray()
+        # Registered message waiters
+        self.__waiters = []
+        self.__waiters_lock = Lock()
 
-        # Create locks
+        # Input frame decoder
+        self.__decoder = WhadFrameDecoder()
+
+        # Create locks
         self.__lock = Lock()
         self.__tx_lock = Lock()
 
+        # Outbound messages coalescing (disabled by default)
+        self.__tx_buffer = bytearray()
+        self.__tx_deadline = None
+        self.__tx_max_size = 0
+        self.__tx_timer = None
+
         # Protocol hub
         self.__hub = ProtocolHub(2)
 
@@ -509,6 +581,9 @@ class WhadDevice:
             if self.__io_thread.is_alive():
                 self.__io_thread.cancel()
 
+        # Wake up any thread waiting for a message
+        self.cancel_waiters()
+
         # Send a NOP message to unlock process_messages()
         logger.debug("send NOP message")
         msg = self.hub.generic.create_verbose(b'')
@@ -538,16 +613,95 @@ class WhadDevice:
         """
         return self.__opened
 
-    def __write(self, data):
+    def __write_all(self, data: bytes):
+        """
+        Writes a complete buffer to the device, handling partial writes.
+
+        This is an internal method that SHALL NOT be used from inherited classes,
+        and that must be called with the output lock held.
+        """
+        logger.debug("sending %s to WHAD device %s", data, self.interface)
+        while len(data) > 0:
+            nb_bytes_written = self.write(data)
+
+            # Some devices do not report the number of bytes written
+            if nb_bytes_written is None:
+                break
+
+            if nb_bytes_written == 0:
+                raise WhadDeviceError("Sending data to WHAD device failed.")
+            data = data[nb_bytes_written:]
+
+    def __queue_write_locked(self, data: bytes):
+        """
+        Adds data to the outbound buffer, and writes it to the device once the
+        buffer is full or the flush deadline is reached. Must be called with
+        the output lock held.
+        """
+        self.__tx_buffer.extend(data)
+        if len(self.__tx_buffer) >= self.__tx_max_size:
+            self.__flush_locked()
+        elif self.__tx_timer is None:
+            self.__tx_timer = Timer(self.__tx_deadline, self.__flush_on_deadline)
+            self.__tx_timer.daemon = True
+            self.__tx_timer.start()
+
+    def __flush_locked(self):
+        """
+        Writes the outbound buffer to the device, with the output lock held.
+        """
+        if self.__tx_timer is not None:
+            self.__tx_timer.cancel()
+            self.__tx_timer = None
+        if len(self.__tx_buffer) > 0:
+            data = bytes(self.__tx_buffer)
+            self.__tx_buffer.clear()
+            self.__write_all(data)
+
+    def flush(self):
+        """
+        Writes any pending outbound message to the device.
+        """
+        with self.__lock:
+            self.__flush_locked()
+
+    def __flush_on_deadline(self):
+        """
+        Coalescing timer callback, writes pending messages from the timer thread.
+
+        As no caller can catch a write error here, it is reported to the connector
+        and the device is closed.
+        """
+        try:
+            self.flush()
+        except (WhadDeviceError, WhadDeviceNotReady, WhadDeviceDisconnected, OSError) as error:
+            logger.error("[%s] pending messages could not be written: %s",
+                         self.interface, error)
+            if self.__connector is not None:
+                self.__connector.on_error(error)
+            self.close()
+
+    def enable_write_coalescing(self, deadline: float = 0.001, max_size: int = 4096):
         """
-        Sends data to the device.
+        Enables outbound messages coalescing: messages sent in a burst are
+        gathered and written to the device at once, when `max_size` bytes are
+        pending or `deadline` seconds after the first pending message at most.
+        Pending messages are also written before waiting for a command response.
+
+        :param float deadline: Maximum delay before pending messages are written
+        :param int max_size: Number of pending bytes triggering a write
+        """
+        with self.__lock:
+            self.__tx_deadline = deadline
+            self.__tx_max_size = max_size
 
-        This is an internal method that SHALL NOT be used from inherited classes.
+    def disable_write_coalescing(self):
         """
-        self.lock()
-        logger.debug("sending %s to WHAD device %s", bytes(data), self.interface)
-        self.write(bytes(data))
-        self.unlock()
+        Disables outbound messages coalescing and writes pending messages.
+        """
+        with self.__lock:
+            self.__tx_deadline = None
+            self.__flush_locked()
 
     def write(self, data: bytes) -> int:
         """Default write method. This implementation emulates a successful write,
@@ -581,6 +735,62 @@ class WhadDevice:
         return self.__msg_queue.get(block=True, timeout=timeout)
 
 
+    def add_waiter(self, predicate, one_shot: bool = True) -> MessageWaiter:
+        """Register a waiter for messages matching a given predicate.
+
+        Matching messages are delivered to the waiter as soon as they are
+        received, instead of being dispatched or queued. Waiters registered
+        first take precedence over the others.
+
+        :param predicate: Message filtering function
+        :param bool one_shot: Unregister waiter after its first matching message
+        :returns: Registered waiter
+        :rtype: MessageWaiter
+        """
+        waiter = MessageWaiter(predicate, one_shot=one_shot)
+        with self.__waiters_lock:
+            self.__waiters.append(waiter)
+        return waiter
+
+    def remove_waiter(self, waiter: MessageWaiter):
+        """Unregister a message waiter.
+
+        :param MessageWaiter waiter: Waiter to unregister
+        """
+        with self.__waiters_lock:
+            if waiter in self.__waiters:
+                self.__waiters.remove(waiter)
+
+    def cancel_waiters(self):
+        """Cancel every registered waiter, waking up waiting threads.
+        """
+        with self.__waiters_lock:
+            waiters = self.__waiters
+            self.__waiters = []
+        for waiter in waiters:
+            waiter.cancel()
+
+    def wait_for_waiter(self, waiter: MessageWaiter, timeout=None, command=False):
+        """Wait for a message to be delivered to a registered waiter.
+
+        :param MessageWaiter waiter: Waiter to wait on
+        :param float timeout: Timeout
+        :param bool command: Raise an exception on timeout if set
+        :returns: Matching message, or `None` if timed out
+        """
+        # Make sure the expected answer is not waiting for a pending message
+        if self.__tx_deadline is not None:
+            self.flush()
+
+        msg = waiter.wait(timeout)
+        if msg is None:
+            self.remove_waiter(waiter)
+            if waiter.cancelled:
+                raise WhadDeviceDisconnected()
+            if command:
+                raise WhadDeviceTimeout("WHAD device did not answer to a command")
+        return msg
+
     def wait_for_message(self, timeout=None, filter=None, command=False):
         """
         Configures the device message queue filter to automatically move messages
@@ -601,32 +811,27 @@ class WhadDevice:
         if filter is not None:
             self.set_queue_filter(filter)
 
-        start_time = time()
+        deadline = None if timeout is None else time() + timeout
 
         while True:
             try:
-                # Wait for a matching message to be caught (blocking)
-                msg = self.__msg_queue.get(block=True, timeout=timeout)
+                # Wait for a matching message to be caught (blocking)
+                remaining = None if deadline is None else max(0, deadline - time())
+                msg = self.__msg_queue.get(block=True, timeout=remaining)
 
-                # If message does not match, dispatch.
-                if not self.__mq_filter(msg):
+                # If message does not match, dispatch.
+                if self.__mq_filter is None or not self.__mq_filter(msg):
                     self.dispatch_message(msg)
-                    logger.debug("exiting wait_for_message ...")
                 else:
                     logger.debug("exiting wait_for_message ...")
                     return msg
             except Empty as err:
-                # Queue is empty, wait for a message to show up.
-                if timeout is not None and (time() - start_time > timeout):
-                    if command:
-                        raise WhadDeviceTimeout("WHAD device did not answer to a command") from err
-
-                    logger.debug("exiting wait_for_message ...")
-                    return None
-
-                sleep(0.001)
-
+                # No matching message received before timeout.
+                if command:
+                    raise WhadDeviceTimeout("WHAD device did not answer to a command") from err
 
+                logger.debug("exiting wait_for_message ...")
+                return None
 
     def send_message(self, message, keep=None):
         """
@@ -644,20 +849,14 @@ class WhadDevice:
             logger.debug("send_message:set_queue_filter")
             self.set_queue_filter(keep)
 
-        # Convert message into bytes
-        raw_message = message.serialize()
-
-
-        # Define header
-        header = [
-            0xAC, 0xBE,
-            len(raw_message) & 0xff,
-            (len(raw_message) >> 8) & 0xff
-        ]
-
-        # Send header followed by serialized message
-        self.__write(header)
-        self.__write(raw_message)
+        # Convert message into a frame and send it at once, coalescing may be
+        # enabled or disabled concurrently
+        frame = frame_message(message.serialize())
+        with self.__lock:
+            if self.__tx_deadline is None:
+                self.__write_all(frame)
+            else:
+                self.__queue_write_locked(frame)
 
 
     def send_command(self, command, keep=None):
@@ -666,37 +865,97 @@ class WhadDevice:
         WHAD commands usualy expect a CmdResult message, if `keep` is not
         provided then this method will by default wait for a CmdResult.
 
+        Several threads may send commands concurrently: each command registers
+        its own waiter before being sent, and responses are matched with
+        waiters in the order commands have been sent.
+
         :param Message command: Command message to send to the device
         :param keep: Message queue filter function (optional)
         :returns: Response message from the device
         :rtype: Message
         """
-        with self.__tx_lock:
+        # If a queue filter is not provided, expect a default CmdResult
+        if keep is None:
+            keep = message_filter(CommandResult)
 
-            # If a queue filter is not provided, expect a default CmdResult
-            try:
-                if keep is None:
-                    self.send_message(command, message_filter(CommandResult))
-                else:
-                    self.send_message(command, keep)
-            except WhadDeviceError as error:
-                # Device error has been triggered, it looks like our device is in
-                # an unspecified state, notify user.
-                logger.debug("WHAD device in error while sending message: %s", error)
-                raise error
+        waiter = self.__send_with_waiter(command, keep)
 
-            try:
-                # Retrieve the first message matching our filter.
-                result = self.wait_for_message(self.__timeout, command=True)
-            except WhadDeviceTimeout as timedout:
-                # Forward exception
-                raise timedout
+        # Retrieve the first message matching our filter.
+        result = self.wait_for_waiter(waiter, self.__timeout, command=True)
 
         # Log message
         logger.debug("Command result: %s", result)
 
         return result
 
+    def send_commands(self, commands, window: int = 8, keep=None) -> list:
+        """
+        Sends a series of commands in a pipelined fashion, keeping up to `window`
+        commands in flight. Responses are expected to be sent back by the device
+        in the same order as the commands, and are returned in this order.
+
+        :param commands: Iterable of command messages to send to the device
+        :param int window: Maximum number of commands awaiting a response
+        :param keep: Message queue filter function (optional)
+        :returns: List of response messages from the device
+        :rtype: list
+        """
+        return list(self.iter_commands(commands, window=window, keep=keep))
+
+    def iter_commands(self, commands, window: int = 8, keep=None):
+        """
+        Sends a series of commands like :meth:`send_commands`, yielding each
+        response as soon as it is received. Commands are only taken from
+        `commands` when there is room in the window, so a generator is
+        consumed as commands are sent.
+
+        :param commands: Iterable of command messages to send to the device
+        :param int window: Maximum number of commands awaiting a response
+        :param keep: Message queue filter function (optional)
+        :returns: Generator yielding response messages from the device, in order
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+
+        # If a queue filter is not provided, expect a default CmdResult
+        if keep is None:
+            keep = message_filter(CommandResult)
+
+        in_flight = deque()
+        commands = iter(commands)
+        try:
+            while True:
+                # Wait for the oldest command response if window is full
+                if len(in_flight) >= window:
+                    yield self.wait_for_waiter(in_flight.popleft(), self.__timeout, command=True)
+                command = next(commands, None)
+                if command is None:
+                    break
+                in_flight.append(self.__send_with_waiter(command, keep))
+
+            # Collect remaining responses
+            while len(in_flight) > 0:
+                yield self.wait_for_waiter(in_flight.popleft(), self.__timeout, command=True)
+        finally:
+            for waiter in in_flight:
+                self.remove_waiter(waiter)
+
+    def __send_with_waiter(self, command, keep) -> MessageWaiter:
+        """Register a waiter for the expected response and send a command,
+        as a single operation with respect to other senders.
+        """
+        with self.__tx_lock:
+            waiter = self.add_waiter(keep)
+            try:
+                self.send_message(command)
+            except WhadDeviceError as error:
+                # Device error has been triggered, it looks like our device is in
+                # an unspecified state, notify user.
+                logger.debug("WHAD device in error while sending message: %s", error)
+                self.remove_waiter(waiter)
+                raise error
+        return waiter
+
 
     def on_data_received(self, data):
         """
@@ -710,36 +969,13 @@ class WhadDevice:
         #logger.info("[WhadDevice] entering on_data_received()")
         logger.debug("[WhadDevice] received raw data from device <%s>: %s",
                      self.interface, hexlify(data))
-        self.__inpipe.extend(data)
-        while len(self.__inpipe) > 2:
-            # Is the magic correct ?
-            if self.__inpipe[0] == 0xAC and self.__inpipe[1] == 0xBE:
-                # Have we received a complete message ?
-                if len(self.__inpipe) > 4:
-                    msg_size = self.__inpipe[2] | (self.__inpipe[3] << 8)
-                    if len(self.__inpipe) >= (msg_size+4):
-                        raw_message = self.__inpipe[4:4+msg_size]
-
-                        # Parse received message with our Protocol Hub
-                        msg = self.__hub.parse(bytes(raw_message))
-
-                        # Forward message if successfully parsed
-                        if msg is not None:
-                            self.on_message_received(msg)
-
-                        # Chomp
-                        self.__inpipe = self.__inpipe[msg_size + 4:]
-                    else:
-                        break
-                else:
-                    break
-            else:
-                # Nope, that's not a header
-                while len(self.__inpipe) >= 2:
-                    if (self.__inpipe[0] != 0xAC) or (self.__inpipe[1] != 0xBE):
-                        self.__inpipe = self.__inpipe[1:]
-                    else:
-                        break
+        for raw_message in self.__decoder.feed(data):
+            # Parse received message with our Protocol Hub
+            msg = self.__hub.parse(raw_message)
+
+            # Forward message if successfully parsed
+            if msg is not None:
+                self.on_message_received(msg)
 
 
     def dispatch_message(self, message):
@@ -782,9 +1018,22 @@ class WhadDevice:
         logger.debug(("[WhadDevice::on_message_received()][%s] "
                      "message queue filter: %s"), self.interface, self.__mq_filter)
 
-        # If message queue filter is defined and message matches this filter,
-        # move it into our message queue.
-        if self.__mq_filter is not None and self.__mq_filter(message):
+        # If a registered waiter expects this message, deliver it.
+        with self.__waiters_lock:
+            for waiter in self.__waiters:
+                if waiter.match(message):
+                    if waiter.one_shot:
+                        self.__waiters.remove(waiter)
+                    break
+            else:
+                waiter = None
+        if waiter is not None:
+            logger.debug("message matches a registered waiter, deliver it")
+            waiter.put(message)
+
+        # If message queue filter is defined and message matches this filter,
+        # move it into our message queue.
+        elif self.__mq_filter is not None and self.__mq_filter(message):
             logger.info("message does match current filter, save it for processing")
             self.__msg_queue.put(message, block=True)
             logger.info("message added to message queue")
@@ -1108,7 +1357,8 @@ class VirtualDevice(WhadDevice):
         """Send message to host.
         """
         with self.__lock:
-            super().set_queue_filter(keep)
+            if keep is not None:
+                super().set_queue_filter(keep)
             self._on_whad_message(message)
 
     def _on_whad_message(self, message):
@@ -0,0 +1,116 @@
+"""
+WHAD transport framing module.
+
+WHAD messages are exchanged over byte streams (UART, TCP or Unix sockets)
+encapsulated in a tiny frame composed of a 2-byte magic (0xAC, 0xBE), a
+2-byte little-endian payload length and the serialized protobuf message.
+
+This module provides a frame decoder able to reassemble these frames from an
+arbitrary stream of bytes, shared by every WHAD device and socket connector,
+as well as the corresponding frame encoder.
+"""
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# WHAD frame magic and header size
+WHAD_FRAME_MAGIC = b"\xac\xbe"
+WHAD_FRAME_HEADER_SIZE = 4
+
+def frame_message(raw_message: bytes) -> bytes:
+    """Encapsulate a serialized WHAD message into a transport frame, in a
+    single buffer that can be written at once.
+
+    :param raw_message: Serialized WHAD message
+    :type raw_message: bytes
+    :return: Frame including header and message
+    :rtype: bytes
+    """
+    msg_size = len(raw_message)
+    return b"".join((
+        WHAD_FRAME_MAGIC,
+        bytes((msg_size & 0xff, (msg_size >> 8) & 0xff)),
+        raw_message
+    ))
+
+class WhadFrameDecoder:
+    """WHAD frame decoder.
+
+    This decoder accumulates incoming data into a single buffer and extracts
+    every complete frame available in one pass, keeping track of a read offset
+    instead of re-slicing the buffer after each frame. Consumed data is only
+    discarded once per call to `feed()`, and resynchronization on a corrupted
+    stream relies on a single `find()` of the frame magic rather than dropping
+    bytes one at a time, so decoding is linear in the amount of data received.
+    """
+
+    def __init__(self):
+        """Create an empty frame decoder.
+        """
+        self.__buffer = bytearray()
+        self.__dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of bytes buffered and waiting for a complete frame.
+        """
+        return len(self.__buffer)
+
+    @property
+    def dropped(self) -> int:
+        """Number of bytes discarded while resynchronizing on the frame magic.
+        """
+        return self.__dropped
+
+    def reset(self):
+        """Discard any buffered data.
+        """
+        self.__buffer.clear()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Feed the decoder with data received from the transport and return
+        the payloads of every complete frame found.
+
+        :param data: Data received from the transport
+        :type data: bytes
+        :return: List of raw (serialized) WHAD messages
+        :rtype: list
+        """
+        buffer = self.__buffer
+        buffer.extend(data)
+        size = len(buffer)
+        offset = 0
+        frames = []
+
+        with memoryview(buffer) as view:
+            while size - offset >= 2:
+                # Is the magic correct ?
+                if buffer[offset] != 0xAC or buffer[offset + 1] != 0xBE:
+                    # Nope, that's not a header, look for the next magic
+                    next_magic = buffer.find(WHAD_FRAME_MAGIC, offset + 1)
+                    if next_magic < 0:
+                        # Keep a trailing 0xAC, it may be the start of a magic
+                        next_magic = size - 1 if buffer[-1] == 0xAC else size
+                    self.__dropped += next_magic - offset
+                    offset = next_magic
+                    continue
+
+                # Have we received a complete header ?
+                if size - offset < WHAD_FRAME_HEADER_SIZE:
+                    break
+
+                # Have we received a complete message ?
+                msg_size = buffer[offset + 2] | (buffer[offset + 3] << 8)
+                msg_end = offset + WHAD_FRAME_HEADER_SIZE + msg_size
+                if msg_end > size:
+                    break
+
+                frames.append(bytes(view[offset + WHAD_FRAME_HEADER_SIZE:msg_end]))
+                offset = msg_end
+
+        # Chomp consumed data, once.
+        if offset > 0:
+            del buffer[:offset]
+
+        return frames
@@ -15,6 +15,7 @@ from binascii import hexlify
 from ipaddress import ip_address
 
 from whad.device import WhadDevice, WhadDeviceConnector
+from whad.device.framing import WhadFrameDecoder, frame_message
 from whad.exceptions import WhadDeviceNotReady, WhadDeviceDisconnected, WhadDeviceNotFound
 logger = logging.getLogger(__name__)
 
@@ -241,8 +242,8 @@ class TCPSocketConnector(WhadDeviceConnector):
         # No client connected
         self.__client = None
 
-        # Input pipes
-        self.__inpipe = bytearray()
+        # Input frame decoder
+        self.__decoder = WhadFrameDecoder()
 
         # Socket
         self.__socket = None
@@ -268,45 +269,18 @@ class TCPSocketConnector(WhadDeviceConnector):
         :type data: bytes
         """
         logger.debug("received raw data from socket: %s", hexlify(data))
-        self.__inpipe.extend(data)
-        while len(self.__inpipe) > 2:
-            # Is the magic correct ?
-            if self.__inpipe[0] == 0xAC and self.__inpipe[1] == 0xBE:
-                # Have we received a complete message ?
-                if len(self.__inpipe) > 4:
-                    msg_size = self.__inpipe[2] | (self.__inpipe[3] << 8)
-                    if len(self.__inpipe) >= (msg_size+4):
-                        raw_message = self.__inpipe[4:4+msg_size]
-
-                        # Old parsing code
-                        #_msg = Message()
-                        #_msg.ParseFromString(bytes(raw_message))
-
-                        # Parse our message with our Protocol Hub
-                        _msg = self.hub.parse(bytes(raw_message))
-
-                        # Send to device
-                        if _msg is not None:
-                            logger.debug(("WHAD message successfully parsed, "
-                                        "forward to underlying device"))
-                            self.device.send_message(_msg)
-
-                            # Notify message
-                            self.on_msg_sent(_msg)
-
-                        # Chomp
-                        self.__inpipe = self.__inpipe[msg_size + 4:]
-                    else:
-                        break
-                else:
-                    break
-            else:
-                # Nope, that's not a header
-                while len(self.__inpipe) >= 2:
-                    if (self.__inpipe[0] != 0xAC) or (self.__inpipe[1] != 0xBE):
-                        self.__inpipe = self.__inpipe[1:]
-                    else:
-                        break
+        for raw_message in self.__decoder.feed(data):
+            # Parse our message with our Protocol Hub
+            _msg = self.hub.parse(raw_message)
+
+            # Send to device
+            if _msg is not None:
+                logger.debug(("WHAD message successfully parsed, "
+                            "forward to underlying device"))
+                self.device.send_message(_msg)
+
+                # Notify message
+                self.on_msg_sent(_msg)
 
     def shutdown(self):
         """Shutdown TCP connection.
@@ -375,19 +349,8 @@ class TCPSocketConnector(WhadDeviceConnector):
         try:
             logger.debug('Received a message from device, forward to client if any')
             if self.__client is not None:
-                # Convert message into bytes
-                raw_message = message.serialize()
-
-                # Define header
-                header = [
-                    0xAC, 0xBE,
-                    len(raw_message) & 0xff,
-                    (len(raw_message) >> 8) & 0xff
-                ]
-
-                # Send header followed by serialized message
-                self.__client.send(bytes(header))
-                self.__client.send(raw_message)
+                # Convert message into a frame and send it at once
+                self.__client.sendall(frame_message(message.serialize()))
                 logger.debug('Message sent to client')
         except BrokenPipeError:
             logger.debug('Client socket disconnected')
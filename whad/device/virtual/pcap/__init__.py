@@ -8,21 +8,24 @@ some compatible hardware.
 import logging
 
 from os.path import exists
-from time import sleep
-from struct import unpack
+from decimal import Decimal
+from struct import unpack, unpack_from
 
+from scapy.config import conf
 from scapy.layers.bluetooth4LE import BTLE
 from scapy.layers.dot15d4 import Dot15d4
-from scapy.utils import PcapReader
 
 from whad.exceptions import WhadDeviceNotFound, WhadDeviceNotReady, WhadDeviceAccessDenied, \
     WhadDeviceDisconnected
 from whad.device import VirtualDevice
-from whad.device.virtual.pcap.capabilities import CAPABILITIES
+from whad.device.virtual.pcap.capabilities import CAPABILITIES, \
+    DLT_BLUETOOTH_LE_LL_WITH_PHDR, DLT_IEEE802_15_4_TAP
+from whad.device.virtual.pcap.replay import PcapReplay
+from whad.common.pcap import PcapRecordReader, PcapIndex
 from whad.hub.generic.cmdresult import CommandResult
 from whad.scapy.layers.phy import Phy_Packet
 from whad.hub.dot15d4 import Dot15d4Metadata
-from whad.hub.ble import BLEMetadata
+from whad.hub.ble import BLEMetadata, Direction as BleDirection
 from whad.hub.esb import ESBMetadata
 from whad.hub.phy import PhyMetadata, Modulation, Endianness
 from whad.hub.unifying import UnifyingMetadata
@@ -31,6 +34,44 @@ from whad.ble.utils.phy import FieldsSize
 
 logger = logging.getLogger(__name__)
 
+# Replay options that may prefix the capture file name
+REPLAY_OPTIONS = ("flush", "speed", "start", "stop", "range")
+
+def parse_replay_options(interface: str):
+    """Split a PCAP device identifier into a capture file name and replay
+    options. Options are prepended to the file name and separated by colons,
+    for instance `flush:capture.pcap` or `speed=2:range=100-200:capture.pcap`:
+
+    - `flush`: replay packets without any delay
+    - `speed=<factor>`: replay speed multiplier (0 is equivalent to `flush`)
+    - `start=<seconds>`, `stop=<seconds>`: only replay packets captured in
+      this time window, relative to the first packet of the capture
+    - `range=<first>-<last>`: only replay packets with an index (starting
+      from 0) in this range, `<last>` being optional
+
+    :param interface: PCAP device identifier
+    :type interface: str
+    :return: Capture file name and replay options
+    :rtype: tuple
+    :raises ValueError: An option value is invalid
+    """
+    options = {}
+    tokens = interface.split(":")
+    while len(tokens) > 1:
+        name, _, value = tokens[0].partition("=")
+        if name not in REPLAY_OPTIONS:
+            break
+        if name == "flush":
+            options["speed"] = 0.0
+        elif name == "range":
+            first, _, last = value.partition("-")
+            options["first"] = int(first)
+            options["last"] = int(last) if len(last) > 0 else None
+        else:
+            options[name] = float(value)
+        tokens.pop(0)
+    return ":".join(tokens), options
+
 class PCAPDevice(VirtualDevice):
     """PCAP replay virtual device implementation.
     """
@@ -50,7 +91,11 @@ class PCAPDevice(VirtualDevice):
         This method checks dynamically if the provided interface can be instantiated.
         '''
         logger.info("Checking interface: %s", str(interface))
-        return interface.endswith(".pcap") or interface.endswith(".pcapng")
+        try:
+            filename, _ = parse_replay_options(interface)
+        except ValueError:
+            return False
+        return filename.endswith(".pcap") or filename.endswith(".pcapng")
 
     @property
     def identifier(self):
@@ -67,12 +112,14 @@ class PCAPDevice(VirtualDevice):
         """
         self.__opened = False
         self.__started = False
-        self.__flush = "flush:" in filename
-        self.__filename = filename.replace("flush:", "")
+        self.__filename, self.__options = parse_replay_options(filename)
         self.__pcap_reader = None
+        self.__replay = None
+        self.__records = None
         self.__dlt = None
+        self.__l2_class = None
         self.__domain = None
-        self.__start_timestamp, self.__last_timestamp = None, None
+        self.__start_timestamp = None
 
 
         self.__supported_frequency_range = [
@@ -89,20 +136,6 @@ class PCAPDevice(VirtualDevice):
         """
         return self.__pcap_reader is not None
 
-    def _get_dlt(self):
-        if self._is_reader():
-            if hasattr(self.__pcap_reader, "linktype"):
-                dlt = self.__pcap_reader.linktype
-            else:
-                # PCAP-ng
-                _ = self.__pcap_reader.read_packet()
-                dlt = self.__pcap_reader.interfaces[0][0]
-                self.__pcap_reader = PcapReader(self.__filename)
-            return dlt
-
-        # No DLT
-        return None
-
     def _get_domain(self):
         return list(CAPABILITIES[self.__dlt][0].keys())[0]
 
@@ -110,9 +143,21 @@ class PCAPDevice(VirtualDevice):
         try:
             if exists(self.__filename):
                 logger.info("Existing PCAP file")
-                self.__pcap_reader = PcapReader(self.__filename)
-                self.__dlt = self._get_dlt()
+                self.__pcap_reader = PcapRecordReader(self.__filename)
+
+                # Use capture index to seek directly to the first packet to replay
+                index = None
+                if self.__options.get("first") or self.__options.get("start"):
+                    index = PcapIndex.open(self.__filename)
+                self.__replay = PcapReplay(self.__pcap_reader, index=index, **self.__options)
+                self.__dlt = self.__pcap_reader.linktype
                 self.__domain = self._get_domain()
+
+                # Link-layer class used for domains relying on scapy dissectors
+                self.__l2_class = conf.l2types.num2layer.get(self.__dlt, conf.raw_layer)
+
+                # Timestamps are relative to the first packet of the capture
+                self.__start_timestamp = self.__replay.origin // 10000
             else:
                 logger.info("No PCAP file")
                 raise WhadDeviceNotFound("pcap")
@@ -139,19 +184,36 @@ class PCAPDevice(VirtualDevice):
         """
         if not self.__opened:
             raise WhadDeviceNotReady()
-        while self.__started:
-            try:
-                if self._is_reader():
-                    pkt = self.__pcap_reader.read_packet()
-                    self._send_packet(pkt)
-            except EOFError as eof:
+        while self.__started and self._is_reader():
+            if self.__records is None:
+                self.__records = iter(self.__replay)
+            record = next(self.__records, None)
+            if record is None:
                 # TODO: add an event to indicate end of stream ?
                 logger.debug("[PCAPDevice] EOF reached")
-                raise WhadDeviceDisconnected() from eof
+                raise WhadDeviceDisconnected()
+            self._send_record(record)
+
+    def close(self):
+        """Close device and release the capture file.
+        """
+        super().close()
+        if self.__pcap_reader is not None:
+            self.__records = None
+            self.__pcap_reader.close()
+            self.__pcap_reader = None
 
     def reset(self):
         pass
 
+    def _resume_replay(self):
+        """Start or resume packets replay, timing is computed again from the
+        next packet to replay.
+        """
+        if self.__replay is not None:
+            self.__replay.reset_clock()
+        self.__started = True
+
     def _generate_metadata(self, pkt):
         if self.__domain == Domain.Dot15d4:
             metadata = Dot15d4Metadata.convert_from_header(pkt)
@@ -171,39 +233,109 @@ class PCAPDevice(VirtualDevice):
         metadata.timestamp = metadata.timestamp - self.__start_timestamp
         return metadata
 
-    def _interframe_delay(self, timestamp):
-        if not self.__flush:
-            if self.__last_timestamp is None:
-                self.__last_timestamp = 0
-            sleep((timestamp - self.__last_timestamp)/100000)
+    def _send_record(self, record):
+        """Send a WHAD message built from a capture record.
+
+        BLE and 802.15.4 messages are built directly from the record bytes,
+        other domains rely on scapy to dissect the record.
+        """
+        timestamp = record.timestamp // 10000 - self.__start_timestamp
+        if self.__dlt == DLT_BLUETOOTH_LE_LL_WITH_PHDR:
+            msg = self._build_ble_raw_pdu(record.data, timestamp)
+        elif self.__dlt == DLT_IEEE802_15_4_TAP:
+            msg = self._build_zigbee_raw_pdu(record.data, timestamp)
+        else:
+            pkt = self.__l2_class(record.data)
+            pkt.time = Decimal(record.timestamp) / 1000000000
+            self._send_packet(pkt)
+            return
+
+        if msg is not None:
+            self._send_whad_message(msg)
+        else:
+            logger.debug("[PCAPDevice] malformed record #%d", record.index)
+
+    def _build_ble_raw_pdu(self, data: bytes, timestamp: int):
+        """Build a BLE RawPduReceived message from a record captured with a
+        BTLE_RF header (10 bytes), followed by the access address, the PDU and
+        its CRC.
+        """
+        if len(data) < 17:
+            return None
+        signal = data[1] - 256 if data[1] > 127 else data[1]
+        flags = data[8] | (data[9] << 8)
+        packet_type = (flags >> 7) & 0x07
+        if packet_type == 2:
+            direction = BleDirection.MASTER_TO_SLAVE
+        elif packet_type == 3:
+            direction = BleDirection.SLAVE_TO_MASTER
+        else:
+            direction = BleDirection.UNKNOWN
+
+        return self.hub.ble.create_raw_pdu_received(
+            direction,
+            data[14:-3],
+            unpack_from("<I", data, 10)[0],
+            0,
+            crc_validity=(flags & 0x800) != 0,
+            crc=int.from_bytes(data[-3:], "big"),
+            channel=data[0],
+            timestamp=timestamp,
+            rssi=signal
+        )
+
+    def _build_zigbee_raw_pdu(self, data: bytes, timestamp: int):
+        """Build a 802.15.4 RawPduReceived message from a record captured with
+        a TAP header, followed by the frame and its FCS.
+        """
+        if len(data) < 4:
+            return None
+        hdr_len = data[2] | (data[3] << 8)
+        if hdr_len < 4 or len(data) < hdr_len + 2:
+            return None
+
+        # Parse TLVs
+        rssi, lqi, channel = None, None, None
+        offset = 4
+        while offset + 4 <= hdr_len:
+            tlv_type, tlv_len = unpack_from("<HH", data, offset)
+            if tlv_type == 1 and tlv_len >= 4:
+                rssi = int(unpack_from("<f", data, offset + 4)[0])
+            elif tlv_type == 3 and tlv_len >= 2:
+                channel = unpack_from("<H", data, offset + 4)[0]
+            elif tlv_type == 10 and tlv_len >= 1:
+                lqi = data[offset + 4]
+            offset += 4 + ((tlv_len + 3) & ~3)
+
+        msg = self.hub.dot15d4.create_raw_pdu_received(
+            channel,
+            data[hdr_len:-2],
+            unpack_from("<H", data, len(data) - 2)[0],
+            lqi = lqi,
+            fcs_validity=True
+        )
+        if rssi is not None:
+            msg.rssi = rssi
+        msg.timestamp = timestamp
+        return msg
 
     def _send_packet(self, pkt):
         if self.__domain == Domain.Dot15d4:
             metadata = self._generate_metadata(pkt)
-            self._interframe_delay(metadata.timestamp)
-            self.__last_timestamp = metadata.timestamp
             self._send_whad_zigbee_raw_pdu(bytes(pkt[Dot15d4]), channel=metadata.channel,
                                            lqi=metadata.lqi, rssi=metadata.rssi,
                                            timestamp=metadata.timestamp)
         elif self.__domain == Domain.BtLE:
             metadata = self._generate_metadata(pkt)
-            self._interframe_delay(metadata.timestamp)
-            self.__last_timestamp = metadata.timestamp
             self._send_whad_ble_raw_pdu(pkt, metadata)
         elif self.__domain == Domain.Esb:
             metadata = self._generate_metadata(pkt)
-            self._interframe_delay(metadata.timestamp)
-            self.__last_timestamp = metadata.timestamp
             self._send_whad_esb_raw_pdu(pkt, metadata)
         elif self.__domain == Domain.LogitechUnifying:
             metadata = self._generate_metadata(pkt)
-            self._interframe_delay(metadata.timestamp)
-            self.__last_timestamp = metadata.timestamp
             self._send_whad_unifying_raw_pdu(pkt, metadata)
         elif self.__domain == Domain.Phy:
             metadata = self._generate_metadata(pkt)
-            self._interframe_delay(metadata.timestamp)
-            self.__last_timestamp = metadata.timestamp
             self._send_whad_phy_pdu(pkt, metadata)
 
 
@@ -306,7 +438,7 @@ class PCAPDevice(VirtualDevice):
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_ble_start(self, message): # pylint: disable=W0613
-        self.__started = True
+        self._resume_replay()
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_ble_sniff_adv(self, message): # pylint: disable=W0613
@@ -327,7 +459,7 @@ class PCAPDevice(VirtualDevice):
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_phy_start(self, message): # pylint: disable=W0613
-        self.__started = True
+        self._resume_replay()
         self._send_whad_command_result(CommandResult.SUCCESS)
 
 
@@ -396,7 +528,7 @@ class PCAPDevice(VirtualDevice):
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_dot15d4_start(self, message): # pylint: disable=W0613
-        self.__started = True
+        self._resume_replay()
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_esb_stop(self, message): # pylint: disable=W0613
@@ -410,7 +542,7 @@ class PCAPDevice(VirtualDevice):
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_esb_start(self, message): # pylint: disable=W0613
-        self.__started = True
+        self._resume_replay()
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     def _on_whad_unifying_stop(self, message): # pylint: disable=W0613
@@ -428,7 +560,7 @@ class PCAPDevice(VirtualDevice):
 
     def _on_whad_unifying_start(self, message): # pylint: disable=W0613
         self.__domain = Domain.LogitechUnifying
-        self.__started = True
+        self._resume_replay()
         self._send_whad_command_result(CommandResult.SUCCESS)
 
     # Discovery related functions
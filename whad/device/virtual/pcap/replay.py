@@ -0,0 +1,122 @@
+"""
+PCAP replay engine.
+
+This module provides a replay engine scheduling the emission of capture
+records, read by :class:`whad.common.pcap.PcapRecordReader`, against an
+absolute monotonic clock.
+
+Record payloads are returned as raw bytes and are never dissected by scapy,
+leaving the caller free to build the corresponding WHAD messages directly from
+these bytes.
+"""
+import logging
+from time import perf_counter, sleep
+
+from whad.common.pcap import PcapRecordReader, PcapIndex
+
+logger = logging.getLogger(__name__)
+
+class PcapReplay:
+    """PCAP replay engine.
+
+    Records are yielded at the time they have been captured, relative to the
+    first yielded record, scaled by a speed factor. Each emission time is
+    computed from an absolute monotonic reference taken when the replay
+    starts, so that processing time and sleep overshoots never accumulate.
+    """
+
+    def __init__(self, reader: PcapRecordReader, speed: float = 1.0, start: float = None,
+                 stop: float = None, first: int = None, last: int = None,
+                 index: PcapIndex = None):
+        """Create a replay engine.
+
+        :param reader: Capture record reader
+        :type reader: PcapRecordReader
+        :param speed: Speed multiplier, 0 to replay records without any delay
+        :type speed: float
+        :param start: Skip records captured less than `start` seconds after the first record
+        :type start: float
+        :param stop: Stop after records captured `stop` seconds after the first record
+        :type stop: float
+        :param first: Index of the first record to replay
+        :type first: int
+        :param last: Index of the last record to replay (included)
+        :type last: int
+        :param index: Capture index used to seek to the first record to replay (optional)
+        :type index: PcapIndex
+        """
+        if speed < 0:
+            raise ValueError("speed must be positive")
+        self.__reader = reader
+        self.__speed = speed
+        self.__start = start
+        self.__stop = stop
+        self.__first = first
+        self.__last = last
+        self.__index = index
+        self.__origin = None
+        self.__ref = None
+
+    @property
+    def origin(self) -> int:
+        """Timestamp of the first record of the capture, in nanoseconds.
+        """
+        if self.__origin is None:
+            for record in self.__reader.records():
+                self.__origin = record.timestamp
+                break
+            else:
+                self.__origin = 0
+        return self.__origin
+
+    def reset_clock(self):
+        """Take the next record as the new timing reference, to be used when
+        the replay resumes after a pause.
+        """
+        self.__ref = None
+
+    def __iter__(self):
+        """Iterate over selected records, waiting for their emission time.
+        """
+        origin = self.origin
+        start = None if self.__start is None else origin + int(self.__start*1000000000)
+        stop = None if self.__stop is None else origin + int(self.__stop*1000000000)
+        first = self.__first or 0
+        last = self.__last
+        speed = self.__speed
+
+        # Seek to the first record to replay, if possible
+        records = None
+        if self.__index is not None and (first > 0 or start is not None):
+            position = first
+            if start is not None:
+                position = max(position, self.__index.find_timestamp(start))
+            if position >= len(self.__index):
+                return
+            records = self.__reader.records(self.__index.offset(position), position)
+        if records is None:
+            records = self.__reader.records()
+
+        self.__ref = None
+        for record in records:
+            # Filter records based on their index and timestamp
+            if record.index < first:
+                continue
+            if last is not None and record.index > last:
+                break
+            if start is not None and record.timestamp < start:
+                continue
+            if stop is not None and record.timestamp > stop:
+                break
+
+            # Wait for the emission time of this record
+            if speed > 0:
+                if self.__ref is None:
+                    self.__ref = (perf_counter(), record.timestamp)
+                else:
+                    ref_clock, ref_timestamp = self.__ref
+                    delay = ref_clock + (record.timestamp - ref_timestamp)/(1e9*speed) \
+                        - perf_counter()
+                    if delay > 0:
+                        sleep(delay)
+            yield record
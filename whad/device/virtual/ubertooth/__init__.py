@@ -7,26 +7,33 @@ from time import sleep
 from usb.core import find, USBError
 from usb.util import get_string
 
-from scapy.layers.bluetooth4LE import BTLE, BTLE_ADV, BTLE_CONNECT_REQ, BTLE_DATA
-from scapy.compat import raw
+from scapy.layers.bluetooth4LE import BTLE, BTLE_CONNECT_REQ
 
-from whad.exceptions import WhadDeviceNotFound, WhadDeviceNotReady, WhadDeviceAccessDenied
+from whad.exceptions import WhadDeviceNotFound, WhadDeviceNotReady, WhadDeviceAccessDenied, \
+    WhadDeviceDisconnected
 from whad.device import VirtualDevice
 from whad.hub.discovery import Domain, Capability
-from whad.ble.utils.phy import channel_to_frequency, frequency_to_channel, crc,\
-    FieldsSize, is_access_address_valid
+from whad.ble.utils.phy import channel_to_frequency, frequency_to_channel, \
+    is_access_address_valid
 from whad.hub.ble import Direction, ChannelMap
 from whad.hub.generic.cmdresult import CommandResult
 from whad.hub.ble import Commands
 from whad.device.virtual.ubertooth.constants import UbertoothId, \
     UbertoothTransfers, UbertoothModulations, UbertoothCommands, \
-    UbertoothInternalState, UbertoothModes, UbertoothJammingModes
-from whad.scapy.layers.ubertooth import Ubertooth_Hdr,UBERTOOTH_PACKET_TYPES, \
+    UbertoothInternalState, UbertoothModes, UbertoothJammingModes, UbertoothPacketTypes
+from whad.device.virtual.ubertooth.stream import UbertoothStream, split_le_packet, check_crcs
+from whad.scapy.layers.ubertooth import Ubertooth_Hdr, \
     BTLE_Promiscuous_Access_Address, BTLE_Promiscuous_CRCInit, BTLE_Promiscuous_Hop_Interval, \
     BTLE_Promiscuous_Hop_Increment
 
 logger = logging.getLogger(__name__)
 
+BLE_ADV_ACCESS_ADDRESS = 0x8e89bed6
+
+# Offset of AdvA in advertising PDUs, SCAN_REQ and CONNECT_IND start with
+# the scanner or initiator address.
+ADV_A_OFFSETS = {0x00: 2, 0x01: 2, 0x02: 2, 0x03: 8, 0x04: 2, 0x05: 8, 0x06: 2}
+
 # Helpers functions
 def get_ubertooth(index: int = 0, serial: str = None):
     """
@@ -49,6 +56,9 @@ def get_ubertooth(index: int = 0, serial: str = None):
 
 class UbertoothDevice(VirtualDevice):
     """Ubertooth virtual device implementation.
+
+    Received packets are streamed from the Ubertooth bulk endpoint by an
+    :class:`UbertoothStream` and processed by batches.
     """
 
     INTERFACE_NAME = "ubertooth"
@@ -98,6 +108,7 @@ class UbertoothDevice(VirtualDevice):
         self.__show_empty_packets = False
         self.__internal_state = UbertoothInternalState.NONE
         self.__index, self.__ubertooth = device
+        self.__stream = UbertoothStream(self.__ubertooth)
         super().__init__()
 
     def open(self):
@@ -136,60 +147,94 @@ class UbertoothDevice(VirtualDevice):
         """
         if not self.__opened:
             raise WhadDeviceNotReady()
+        if self.__stream.disconnected:
+            raise WhadDeviceDisconnected()
         if self.__internal_state != UbertoothInternalState.NONE:
-            data = self._ubertooth_ctrl_transfer_in(UbertoothCommands.UBERTOOTH_POLL,512)
-            if len(data) > 0:
-                packet = Ubertooth_Hdr(data)
-                self.__channel = frequency_to_channel(2402+packet.channel)
-                if UBERTOOTH_PACKET_TYPES[packet.packet_type] == "LE_PACKET":
-                    timestamp = round(packet.clk_100ns/10) # convert into us timestamp
-                    rssi = packet.rssi_min - 54
-                    if self.__internal_state == UbertoothInternalState.ACCESS_ADDRESS_SNIFFING:
-                        access_address = packet[BTLE:].access_addr
-                        if is_access_address_valid(access_address):
-                            self._send_whad_ble_aa_disc(access_address, timestamp, rssi)
-                    else:
-                        btle_packet = packet[BTLE:]
-                        if self._filter(btle_packet):
-                            self._send_whad_ble_raw_pdu(btle_packet, timestamp, rssi)
-                        if (
-                                self.__internal_state == UbertoothInternalState.NEW_CONNECTION_SNIFFING and
-                                BTLE_CONNECT_REQ in btle_packet
-                        ):
-                            self.__access_address = btle_packet.AA
-                            self.__channel_map = btle_packet.chM
-                            self.__crc_init = btle_packet.crc_init
-                            self.__hop_interval = btle_packet.interval
-                            self.__hop_increment = btle_packet.hop
-                            self._send_whad_ble_synchronized()
-                elif BTLE_Promiscuous_Access_Address in packet:
-                    self.__crc_init = 0
-                    self.__channel_map = 0
-                    self.__hop_interval = 0
-                    self.__hop_increment = 0
-                    self.__access_address = packet.access_address
-                    self._send_whad_ble_synchronized()
-                elif BTLE_Promiscuous_CRCInit in packet:
-                    self.__crc_init = packet.crc_init
-                    self.__channel_map = 0
-                    self.__hop_interval = 0
-                    self.__hop_increment = 0
-                    self._send_whad_ble_synchronized()
-                elif BTLE_Promiscuous_Hop_Interval in packet:
-                    self.__channel_map = 0x1fffffffff
-                    self.__hop_interval = packet.hop_interval
-                    self.__hop_increment = 0
-                    self._send_whad_ble_synchronized()
-                elif BTLE_Promiscuous_Hop_Interval in packet:
-                    self.__hop_increment = packet.hop_increment
-                    self._send_whad_ble_synchronized()
-
-                else:
-                    print(data.hex())
-                    packet.show()
+            if not self.__stream.running:
+                self.__stream.start()
+            self._process_frames(self.__stream.read_frames(timeout=0.1))
+
+    def _process_frames(self, frames):
+        """Process a batch of frames received from the Ubertooth.
+        """
+        packets = [
+            split_le_packet(frame) if frame.packet_type == UbertoothPacketTypes.LE_PACKET
+            else None for frame in frames
+        ]
+        crc_init = self.__crc_init
+        crc_validity = check_crcs(packets, crc_init)
+
+        for index, frame in enumerate(frames):
+            # CRCInit may have been updated by a previous packet of this batch
+            if self.__crc_init != crc_init:
+                crc_init = self.__crc_init
+                crc_validity[index:] = check_crcs(packets[index:], crc_init)
+
+            self.__channel = frequency_to_channel((2402 + frame.channel) * 1000000)
+            if packets[index] is not None:
+                self._process_le_packet(frame, *packets[index], crc_validity[index])
+            elif frame.packet_type == UbertoothPacketTypes.LE_PROMISC:
+                self._process_promiscuous_frame(frame)
+            else:
+                logger.debug("[ubertooth] unsupported frame: %s", frame.raw.hex())
+
+    def _process_le_packet(self, frame, access_address, pdu, sniffed_crc, is_crc_valid):
+        """Process a BLE packet received from the Ubertooth.
+        """
+        timestamp = round(frame.clk_100ns/10) # convert into us timestamp
+        rssi = frame.rssi_min - 54
+        if self.__internal_state == UbertoothInternalState.ACCESS_ADDRESS_SNIFFING:
+            if is_access_address_valid(access_address):
+                self._send_whad_ble_aa_disc(access_address, timestamp, rssi)
+            return
+
+        if self._filter(access_address, pdu):
+            self._send_whad_ble_raw_pdu(access_address, pdu, sniffed_crc, is_crc_valid,
+                                        timestamp, rssi)
+
+        if (
+                self.__internal_state == UbertoothInternalState.NEW_CONNECTION_SNIFFING and
+                access_address == BLE_ADV_ACCESS_ADDRESS and (pdu[0] & 0x0F) == 0x05
+        ):
+            btle_packet = BTLE(pack("<I", access_address) + pdu + sniffed_crc)
+            if BTLE_CONNECT_REQ in btle_packet:
+                self.__access_address = btle_packet.AA
+                self.__channel_map = btle_packet.chM
+                self.__crc_init = btle_packet.crc_init
+                self.__hop_interval = btle_packet.interval
+                self.__hop_increment = btle_packet.hop
+                self._send_whad_ble_synchronized()
+
+    def _process_promiscuous_frame(self, frame):
+        """Process connection parameters recovered by the Ubertooth.
+        """
+        packet = Ubertooth_Hdr(frame.raw)
+        if BTLE_Promiscuous_Access_Address in packet:
+            self.__crc_init = 0
+            self.__channel_map = 0
+            self.__hop_interval = 0
+            self.__hop_increment = 0
+            self.__access_address = packet.access_address
+            self._send_whad_ble_synchronized()
+        elif BTLE_Promiscuous_CRCInit in packet:
+            self.__crc_init = packet.crc_init
+            self.__channel_map = 0
+            self.__hop_interval = 0
+            self.__hop_increment = 0
+            self._send_whad_ble_synchronized()
+        elif BTLE_Promiscuous_Hop_Interval in packet:
+            self.__channel_map = 0x1fffffffff
+            self.__hop_interval = packet.hop_interval
+            self.__hop_increment = 0
+            self._send_whad_ble_synchronized()
+        elif BTLE_Promiscuous_Hop_Increment in packet:
+            self.__hop_increment = packet.hop_increment
+            self._send_whad_ble_synchronized()
 
     def reset(self):
         self.__internal_state = UbertoothInternalState.NONE
+        self.__stream.stop()
+        self.__stream.clear()
         self.__ubertooth.reset()
 
         self._set_jam_mode(UbertoothJammingModes.JAM_NONE)
@@ -197,18 +242,13 @@ class UbertoothDevice(VirtualDevice):
         self._reset_clock()
 
     def close(self):
+        self.__stream.stop()
         self._soft_reset()
         super().close()
 
     # Virtual device whad message builder
-    def _send_whad_ble_raw_pdu(self, packet, timestamp=None, rssi=None):
-
-        access_address = packet.access_addr
-        pdu = raw(packet)[FieldsSize.ACCESS_ADDRESS_SIZE:-FieldsSize.CRC_SIZE]
-        sniffed_crc = raw(packet)[-FieldsSize.CRC_SIZE:]
-        calculated_crc = crc(pdu,init=self.__crc_init)
-        is_crc_valid = calculated_crc == sniffed_crc
-
+    def _send_whad_ble_raw_pdu(self, access_address, pdu, sniffed_crc, is_crc_valid,
+                               timestamp=None, rssi=None):
         # Create a RawPduReceived message
         msg = self.hub.ble.create_raw_pdu_received(
             Direction.UNKNOWN,
@@ -216,7 +256,7 @@ class UbertoothDevice(VirtualDevice):
             access_address,
             0,
             crc_validity=is_crc_valid,
-            crc=packet.crc,
+            crc=int.from_bytes(sniffed_crc, "big"),
             channel=self.__channel
         )
 
@@ -314,20 +354,22 @@ class UbertoothDevice(VirtualDevice):
             self._send_whad_command_result(CommandResult.ERROR)
 
     # Software implementation features
-    def _filter(self, packet):
-        if BTLE_DATA in packet and packet.len == 0 and not self.__show_empty_packets:
+    def _filter(self, access_address, pdu):
+        is_advertisement = access_address == BLE_ADV_ACCESS_ADDRESS
+        if not is_advertisement and pdu[1] == 0 and not self.__show_empty_packets:
             return False
-        
-        if BTLE_ADV in packet and not self.__show_advertisements:
+
+        if is_advertisement and not self.__show_advertisements:
             return False
-        
+
         # No filtering if address is FF:FF:FF:FF:FF:FF
         if self.__address_filter == b"\xFF\xFF\xFF\xFF\xFF\xFF":
             return True
-        
+
         # Ensure packet has the expected advertiser address.
-        if hasattr(packet, "AdvA"):
-            return packet.AdvA == self.__address_filter
+        offset = ADV_A_OFFSETS.get(pdu[0] & 0x0F) if is_advertisement else None
+        if offset is not None:
+            return pdu[offset:offset + 6] == self.__address_filter
 
         # Packet must be discarded.
         return False
@@ -408,6 +450,7 @@ class UbertoothDevice(VirtualDevice):
     def _stop(self):
         self.__internal_state = UbertoothInternalState.NONE
         self._ubertooth_ctrl_transfer_out(UbertoothCommands.UBERTOOTH_STOP)
+        self.__stream.clear()
 
     def _set_jam_mode(self, mode=UbertoothJammingModes.JAM_NONE):
         self._ubertooth_ctrl_transfer_out(UbertoothCommands.UBERTOOTH_JAM_MODE, mode)
@@ -24,6 +24,22 @@ class UbertoothTransfers(IntEnum):
     CTRL_IN                     = 0xC0
     CTRL_OUT                    = 0x40
 
+class UbertoothEndPoints(IntEnum):
+    """USB endpoints.
+    """
+    DATA_IN                     = 0x82
+    DATA_OUT                    = 0x05
+
+class UbertoothPacketTypes(IntEnum):
+    """Types of packets received from the Ubertooth.
+    """
+    BR_PACKET                   = 0
+    LE_PACKET                   = 1
+    MESSAGE                     = 2
+    KEEP_ALIVE                  = 3
+    SPECAN                      = 4
+    LE_PROMISC                  = 5
+    EGO_PACKET                  = 6
 
 class UbertoothModulations(IntEnum):
     """Supported modulations.
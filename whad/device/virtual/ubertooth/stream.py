@@ -0,0 +1,217 @@
+"""Ubertooth bulk streaming receive engine.
+
+While sniffing, the Ubertooth firmware streams every received packet on its
+bulk IN endpoint as a fixed-size 64-byte USB frame: a 14-byte header followed
+by 50 bytes of data. :class:`UbertoothStream` continuously reads these frames
+from a dedicated thread and stores them in a preallocated ring buffer, so
+that USB transfers are not delayed by the processing of previous packets.
+Frames are then fetched by batches, their header being parsed with `struct`.
+"""
+import logging
+from array import array
+from collections import namedtuple
+from struct import Struct
+from threading import Condition, Thread
+from time import sleep
+
+from usb.core import USBError, USBTimeoutError
+
+from whad.ble.utils.phy import crc, FieldsSize
+from whad.device.virtual.ubertooth.constants import UbertoothEndPoints
+
+logger = logging.getLogger(__name__)
+
+# USB frame size and header (usb_pkt_rx structure)
+UBERTOOTH_FRAME_SIZE = 64
+UBERTOOTH_HEADER = Struct("<BBBBIbbbB2x")
+UBERTOOTH_HEADER_SIZE = UBERTOOTH_HEADER.size
+
+UbertoothFrame = namedtuple("UbertoothFrame", [
+    "packet_type", "status", "channel", "clk_100ns", "rssi_min", "raw"
+])
+UbertoothFrame.__doc__ = """Frame received from an Ubertooth.
+
+`channel` is the offset in MHz from 2402 MHz, `raw` contains the whole
+64-byte frame (header included).
+"""
+
+def split_le_packet(frame: UbertoothFrame):
+    """Split the data of a LE_PACKET frame.
+
+    :param frame: Ubertooth frame
+    :type frame: UbertoothFrame
+    :return: access address, PDU (header included) and CRC bytes
+    :rtype: tuple
+    """
+    data = frame.raw[UBERTOOTH_HEADER_SIZE:]
+    pdu_end = FieldsSize.ACCESS_ADDRESS_SIZE + FieldsSize.HEADER_SIZE + data[5]
+    return (
+        int.from_bytes(data[:FieldsSize.ACCESS_ADDRESS_SIZE], "little"),
+        data[FieldsSize.ACCESS_ADDRESS_SIZE:pdu_end],
+        data[pdu_end:pdu_end + FieldsSize.CRC_SIZE]
+    )
+
+def check_crcs(packets, crc_init: int):
+    """Check the CRC of a batch of LE packets.
+
+    :param packets: Packets returned by :func:`split_le_packet`, `None` entries are ignored
+    :type packets: list
+    :param crc_init: CRC initial value
+    :type crc_init: int
+    :return: CRC validity of each packet, `None` for ignored entries
+    :rtype: list
+    """
+    return [
+        None if packet is None else crc(packet[1], crc_init) == packet[2]
+        for packet in packets
+    ]
+
+
+class UbertoothStream:
+    """Streaming receive engine reading frames from the Ubertooth bulk IN endpoint.
+
+    Frames received while the ring buffer is full are dropped and counted
+    in `overflows`. If the device is disconnected, the stream stops and
+    `disconnected` is set.
+    """
+
+    def __init__(self, device, endpoint: int = UbertoothEndPoints.DATA_IN,
+                 ring_size: int = 1024, frames_per_transfer: int = 1, timeout: int = 100):
+        """Create a streaming engine.
+
+        :param device: USB device
+        :type device: usb.core.Device
+        :param endpoint: Bulk IN endpoint
+        :type endpoint: int
+        :param ring_size: Number of frames the ring buffer can hold
+        :type ring_size: int
+        :param frames_per_transfer: Maximum number of frames read by each USB transfer
+        :type frames_per_transfer: int
+        :param timeout: USB transfer timeout in milliseconds
+        :type timeout: int
+        """
+        self.__device = device
+        self.__endpoint = endpoint
+        self.__timeout = timeout
+        self.__ring = bytearray(ring_size * UBERTOOTH_FRAME_SIZE)
+        self.__ring_size = ring_size
+        self.__buffer = array("B", bytes(frames_per_transfer * UBERTOOTH_FRAME_SIZE))
+        self.__head = 0
+        self.__tail = 0
+        self.__condition = Condition()
+        self.__thread = None
+        self.__running = False
+
+        self.transfers = 0
+        self.overflows = 0
+        self.errors = 0
+        self.disconnected = False
+
+    def __len__(self):
+        """Number of frames waiting in the ring buffer.
+        """
+        return self.__head - self.__tail
+
+    @property
+    def running(self) -> bool:
+        """`True` if frames are being read from the device.
+        """
+        return self.__running
+
+    def start(self):
+        """Start reading frames.
+        """
+        if self.__running:
+            return
+        self.__running = True
+        self.disconnected = False
+        self.__thread = Thread(target=self.__run, name="ubertooth-stream", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stop reading frames, frames already received are kept.
+        """
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join(2 * self.__timeout / 1000)
+            self.__thread = None
+        with self.__condition:
+            self.__condition.notify_all()
+
+    def clear(self):
+        """Drop every frame waiting in the ring buffer.
+        """
+        with self.__condition:
+            self.__tail = self.__head
+
+    def push(self, data, size: int = None):
+        """Store frames into the ring buffer.
+
+        :param data: Received data, made of consecutive frames
+        :type data: bytes
+        :param size: Size of received data, `len(data)` if not provided
+        :type size: int
+        """
+        size = len(data) if size is None else size
+        with self.__condition:
+            for offset in range(0, size - UBERTOOTH_FRAME_SIZE + 1, UBERTOOTH_FRAME_SIZE):
+                if self.__head - self.__tail >= self.__ring_size:
+                    self.overflows += 1
+                    continue
+                slot = (self.__head % self.__ring_size) * UBERTOOTH_FRAME_SIZE
+                self.__ring[slot:slot + UBERTOOTH_FRAME_SIZE] = \
+                    data[offset:offset + UBERTOOTH_FRAME_SIZE]
+                self.__head += 1
+            self.__condition.notify_all()
+
+    def read_frames(self, timeout: float = None, max_frames: int = None):
+        """Fetch the frames received so far.
+
+        :param timeout: Maximum time in seconds to wait for a frame if none is available
+        :type timeout: float
+        :param max_frames: Maximum number of frames to return
+        :type max_frames: int
+        :return: Received frames, in reception order
+        :rtype: list
+        """
+        frames = []
+        unpack_from = UBERTOOTH_HEADER.unpack_from
+        with self.__condition:
+            if self.__head == self.__tail and (timeout is None or timeout > 0):
+                self.__condition.wait(timeout)
+
+            end = self.__head
+            if max_frames is not None:
+                end = min(end, self.__tail + max_frames)
+            for index in range(self.__tail, end):
+                slot = (index % self.__ring_size) * UBERTOOTH_FRAME_SIZE
+                packet_type, status, channel, _, clk_100ns, _, rssi_min, _, _ = \
+                    unpack_from(self.__ring, slot)
+                frames.append(UbertoothFrame(
+                    packet_type, status, channel, clk_100ns, rssi_min,
+                    bytes(self.__ring[slot:slot + UBERTOOTH_FRAME_SIZE])
+                ))
+            self.__tail = end
+        return frames
+
+    def __run(self):
+        while self.__running:
+            try:
+                size = self.__device.read(self.__endpoint, self.__buffer, self.__timeout)
+            except USBTimeoutError:
+                continue
+            except USBError as err:
+                self.errors += 1
+                logger.error("[ubertooth] bulk transfer failed: %s", err)
+                if err.errno == 19:
+                    # Device has been disconnected, wake up any waiting reader
+                    with self.__condition:
+                        self.__running = False
+                        self.disconnected = True
+                        self.__condition.notify_all()
+                else:
+                    sleep(self.__timeout / 1000)
+                continue
+
+            self.transfers += 1
+            self.push(self.__buffer, size)
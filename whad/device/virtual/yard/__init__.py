@@ -3,12 +3,14 @@ Adaptation layer for the Yard Stick One.
 """
 import logging
 from struct import unpack, pack
-from time import time
+from threading import Lock
+from time import monotonic_ns
 
 from usb.core import find, USBError, USBTimeoutError
 from usb.util import get_string
 
-from whad.exceptions import WhadDeviceNotFound, WhadDeviceNotReady, WhadDeviceAccessDenied
+from whad.exceptions import WhadDeviceNotFound, WhadDeviceNotReady, WhadDeviceAccessDenied, \
+    WhadDeviceDisconnected
 from whad.device import VirtualDevice
 from whad.device.virtual.yard.constants import YardStickOneId, YardStickOneEndPoints, \
     YardApplications, YardSystemCommands, YardRadioStructure, YardRFStates, \
@@ -16,6 +18,7 @@ from whad.device.virtual.yard.constants import YardStickOneId, YardStickOneEndPo
     YardNICCommands, YardVCOType, YardRegistersMasks, YardModulations, YardEncodings, \
     POSSIBLE_CHANNEL_BANDWIDTHS, NUM_PREAMBLE_LOOKUP_TABLE, YardUSBProperties, \
     YardInternalStates
+from whad.device.virtual.yard.stream import YardStickOneStream
 from whad.hub.discovery import Domain, Capability
 from whad.hub.generic.cmdresult import CommandResult
 from whad.hub.phy import Commands, TxPower, Endianness as PhyEndianness, Modulation as PhyModulation
@@ -24,6 +27,9 @@ from whad.helpers import swap_bits
 
 logger = logging.getLogger(__name__)
 
+# Translation table reversing the bits of each byte
+SWAP_BITS_TABLE = bytes(swap_bits(i) for i in range(256))
+
 # Helpers functions
 def get_yardstickone(index=0,bus=None, address=None):
     '''
@@ -46,6 +52,9 @@ def get_yardstickone(index=0,bus=None, address=None):
 
 class YardStickOneDevice(VirtualDevice):
     """Yard Stick One virtual device.
+
+    Once opened, the IN endpoint is read by a :class:`YardStickOneStream`,
+    that queues received packets and routes command responses.
     """
 
     INTERFACE_NAME = "yardstickone"
@@ -97,10 +106,14 @@ class YardStickOneDevice(VirtualDevice):
         self.__endianness = Endianness.BIG
         self._rf_mode = 0
 
-        self.__start_time = time()*1000000
+        self.__start_time = monotonic_ns()
+        self.__rx_started = False
+        self.__rx_metadata = None
 
         self.__opened = False
         _, self.__yard = device
+        self.__stream = YardStickOneStream(self._yard_read_response)
+        self.__command_lock = Lock()
         super().__init__()
 
     @property
@@ -117,6 +130,9 @@ class YardStickOneDevice(VirtualDevice):
         self._strobe_idle_mode()
 
     def _restore_previous_mode(self):
+        # Radio configuration may have changed
+        self.__rx_metadata = None
+
         if self.__internal_state == YardInternalStates.YARD_MODE_RX:
             self._set_rx_mode()
             self._strobe_rx_mode()
@@ -174,6 +190,7 @@ class YardStickOneDevice(VirtualDevice):
     def _on_whad_phy_endianness(self, message):
         if message.endianness in (Endianness.BIG, Endianness.LITTLE):
             self.__endianness = message.endianness
+            self.__rx_metadata = None
             self._send_whad_command_result(CommandResult.SUCCESS)
         else:
             self._send_whad_command_result(CommandResult.PARAMETER_ERROR)
@@ -248,7 +265,7 @@ class YardStickOneDevice(VirtualDevice):
             self._set_forward_error_correction(enable=False)
             self._set_clear_channel_assessment(mode=YardCCA.NO_CCA)
             if self.__endianness == Endianness.LITTLE:
-                sync = bytes([swap_bits(i) for i in message.sync_word])[::-1]
+                sync = message.sync_word.translate(SWAP_BITS_TABLE)[::-1]
             else:
                 sync = message.sync_word
             self._set_sync_word(sync)
@@ -263,7 +280,7 @@ class YardStickOneDevice(VirtualDevice):
             self._set_forward_error_correction(enable=False)
             self._set_clear_channel_assessment(mode=YardCCA.NO_CCA)
             if self.__endianness == Endianness.LITTLE:
-                sync = bytes([swap_bits(i) for i in message.sync_word])[::-1]
+                sync = message.sync_word.translate(SWAP_BITS_TABLE)[::-1]
             else:
                 sync = message.sync_word
             self._set_sync_word(sync)
@@ -283,6 +300,7 @@ class YardStickOneDevice(VirtualDevice):
         if self.__internal_state == YardInternalStates.YARD_MODE_RX:
             self._set_rx_mode()
             self._strobe_rx_mode()
+            self.__rx_started = False
             self.__opened_stream = True
         self._send_whad_command_result(CommandResult.SUCCESS)
 
@@ -290,19 +308,36 @@ class YardStickOneDevice(VirtualDevice):
         #self._set_idle_mode()
         #self._strobe_idle_mode()
         self.__opened_stream = False
+        self.__rx_started = False
         self._send_whad_command_result(CommandResult.SUCCESS)
 
 
+    def _get_rx_metadata(self):
+        """Radio configuration reported with received packets, read from the
+        device once per configuration.
+        """
+        if self.__rx_metadata is None:
+            self.__rx_metadata = {
+                "frequency": self._get_frequency(),
+                "syncword": self._get_sync_word(),
+                "endianness": PhyEndianness.LITTLE if self.__endianness == Endianness.LITTLE \
+                    else PhyEndianness.BIG,
+                "deviation": int(self._get_deviation()),
+                "datarate": int(self._get_data_rate())
+            }
+        return self.__rx_metadata
+
     def _send_whad_phy_pdu(self, packet, timestamp=None):
+        metadata = self._get_rx_metadata()
+
         # Create a PacketReceived message
         msg = self.hub.phy.create_packet_received(
-            self._get_frequency(),
+            metadata["frequency"],
             packet,
-            syncword=self._get_sync_word(),
-            endianness=PhyEndianness.LITTLE if self.__endianness == Endianness.LITTLE \
-                else PhyEndianness.BIG,
-            deviation=int(self._get_deviation()),
-            datarate=int(self._get_data_rate())
+            syncword=metadata["syncword"],
+            endianness=metadata["endianness"],
+            deviation=metadata["deviation"],
+            datarate=metadata["datarate"]
         )
 
         # Set packet timestamp if available
@@ -354,6 +389,9 @@ class YardStickOneDevice(VirtualDevice):
         self._set_intermediate_frequency(44444)
         self._set_idle_mode()
 
+        # Read responses and packets from a dedicated thread
+        self.__stream.start()
+
         # Ask parent class to run a background I/O thread
         super().open()
         self.__opened_stream = False
@@ -368,28 +406,24 @@ class YardStickOneDevice(VirtualDevice):
         if not self.__opened:
             raise WhadDeviceNotReady()
 
+        if self.__stream.disconnected:
+            raise WhadDeviceDisconnected()
+
         if self.__opened_stream:
-            try:
+            if not self.__rx_started:
+                self.__stream.clear()
                 self._yard_send_command(YardApplications.NIC, YardNICCommands.SET_RECV_LARGE,
                                         pack("<H", 200))
-                data = self._yard_send_command(YardApplications.NIC,YardNICCommands.RECV)
-                while self.__opened_stream and self.__internal_state == YardInternalStates.YARD_MODE_RX:
-
-                    data = self._yard_read_response()
+                self._yard_write_command(YardApplications.NIC, YardNICCommands.RECV)
+                self.__rx_started = True
 
-                    if data[0] is not None and data[0] != 0xFF and not (len(data[2]) == 1 \
-                            and data[2] == b"\xC8"):
-                        if self.__endianness == Endianness.LITTLE:
-                            formatted_data = bytes([swap_bits(i) for i in data[2]])
-                        else:
-                            formatted_data = data[2]
-
-                        self._send_whad_phy_pdu(formatted_data, int(
-                            time()*1000000 - self.__start_time
-                            ))
-
-            except USBTimeoutError:
-                pass
+            for timestamp, data in self.__stream.read_packets(timeout=0.1):
+                if not self.__opened_stream or \
+                        self.__internal_state != YardInternalStates.YARD_MODE_RX:
+                    break
+                if self.__endianness == Endianness.LITTLE:
+                    data = data.translate(SWAP_BITS_TABLE)
+                self._send_whad_phy_pdu(data, (timestamp - self.__start_time) // 1000)
 
     def reset(self):
         self._yard_send_command(
@@ -402,6 +436,7 @@ class YardStickOneDevice(VirtualDevice):
         if self.__opened:
             self.__opened_stream = False
             self._set_idle_mode()
+            self.__stream.stop()
         super().close()
 
     # Yard Stick One low level communication primitives
@@ -423,10 +458,29 @@ class YardStickOneDevice(VirtualDevice):
             response = (None, None, None)
         return response
 
+    def _yard_write_command(self, app, command, data=b"", timeout=1000):
+        """Send a command without waiting for its response.
+        """
+        message = bytes([app, command]) + pack("<H", len(data)) + data
+        self.__yard.write(YardStickOneEndPoints.OUT_ENDPOINT, message, timeout=timeout)
+
     def _yard_send_command(self, app, command, data=b"", timeout=1000, no_response=False):
         message = bytes([app, command]) + pack("<H", len(data)) + data
-        if no_response:
+        if no_response or self.__stream.disconnected:
+            return None
+
+        # Responses are read by the stream once the device is opened
+        if self.__stream.running:
+            with self.__command_lock:
+                while self.__stream.running:
+                    self.__stream.expect(app, command)
+                    self.__yard.write(YardStickOneEndPoints.OUT_ENDPOINT, message,
+                                      timeout=timeout)
+                    response = self.__stream.wait_response(timeout/1000)
+                    if response is not None:
+                        return response
             return None
+
         recv_app, recv_verb, recv_data = None, None, None
         while (recv_app != app and recv_verb != command):
             self.__yard.write(YardStickOneEndPoints.OUT_ENDPOINT, message, timeout=timeout)
@@ -492,6 +546,7 @@ class YardStickOneDevice(VirtualDevice):
         self.__internal_state = YardInternalStates.YARD_MODE_TX
         opened_stream = self.__opened_stream
         self.__opened_stream = False
+        self.__rx_started = False
 
         self._set_idle_mode()
         self._strobe_idle_mode()
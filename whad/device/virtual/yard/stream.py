@@ -0,0 +1,178 @@
+"""YardStick One receive engine.
+
+Responses to commands and received packets are both sent by the YardStick One
+on the same USB IN endpoint. :class:`YardStickOneStream` reads this endpoint
+from a dedicated thread: packets are timestamped and queued as soon as they
+are received, while command responses are handed over to the command waiting
+for them. Packets are thus received continuously, without any command round-trip
+in the receive path.
+"""
+import logging
+from collections import deque
+from threading import Condition, Thread
+from time import monotonic_ns, sleep
+
+from usb.core import USBError, USBTimeoutError
+
+from whad.device.virtual.yard.constants import YardApplications, YardNICCommands
+
+logger = logging.getLogger(__name__)
+
+
+class YardStickOneStream:
+    """Dedicated reader of the YardStick One IN endpoint.
+
+    Packets received while the queue is full are dropped and counted in
+    `dropped`. If the device is disconnected, the stream stops and
+    `disconnected` is set.
+    """
+
+    def __init__(self, read_response, timeout: int = 100, max_packets: int = 4096):
+        """Create a receive engine.
+
+        :param read_response: Function reading a response from the IN endpoint, called
+                              with a timeout in milliseconds and returning a tuple
+                              (app, verb, data)
+        :type read_response: callable
+        :param timeout: USB read timeout in milliseconds
+        :type timeout: int
+        :param max_packets: Maximum number of received packets waiting to be processed
+        :type max_packets: int
+        """
+        self.__read_response = read_response
+        self.__timeout = timeout
+        self.__max_packets = max_packets
+        self.__packets = deque()
+        self.__expected = None
+        self.__response = None
+        self.__condition = Condition()
+        self.__thread = None
+        self.__running = False
+
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+        self.disconnected = False
+
+    def __len__(self):
+        """Number of received packets waiting to be processed.
+        """
+        return len(self.__packets)
+
+    @property
+    def running(self) -> bool:
+        """`True` if the IN endpoint is being read.
+        """
+        return self.__running
+
+    def start(self):
+        """Start reading the IN endpoint.
+        """
+        if self.__running:
+            return
+        self.__running = True
+        self.disconnected = False
+        self.__thread = Thread(target=self.__run, name="yardstickone-stream", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stop reading the IN endpoint.
+        """
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join(2 * self.__timeout / 1000)
+            self.__thread = None
+        with self.__condition:
+            self.__condition.notify_all()
+
+    def clear(self):
+        """Drop every received packet waiting to be processed.
+        """
+        with self.__condition:
+            self.__packets.clear()
+
+    def expect(self, app: int, verb: int):
+        """Wait for the response to a command, must be called before sending it.
+
+        :param app: Application of the expected response
+        :type app: int
+        :param verb: Verb of the expected response
+        :type verb: int
+        """
+        with self.__condition:
+            self.__expected = (app, verb)
+            self.__response = None
+
+    def wait_response(self, timeout: float = None) -> bytes:
+        """Wait for the response expected by :meth:`expect`.
+
+        :param timeout: Maximum time to wait in seconds, wait forever if `None`
+        :type timeout: float
+        :return: Response data, `None` on timeout
+        :rtype: bytes
+        """
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.__response is not None or not self.__running, timeout
+            )
+            response, self.__response = self.__response, None
+            self.__expected = None
+            return response
+
+    def read_packets(self, timeout: float = None):
+        """Fetch the packets received so far.
+
+        :param timeout: Maximum time in seconds to wait for a packet if none is available
+        :type timeout: float
+        :return: Received packets as tuples (timestamp in nanoseconds, data)
+        :rtype: list
+        """
+        with self.__condition:
+            if len(self.__packets) == 0 and (timeout is None or timeout > 0):
+                self.__condition.wait(timeout)
+            packets = list(self.__packets)
+            self.__packets.clear()
+        return packets
+
+    def __run(self):
+        while self.__running:
+            try:
+                response = self.__read_response(timeout=self.__timeout)
+            except USBTimeoutError:
+                continue
+            except USBError as err:
+                self.errors += 1
+                logger.error("[yardstickone] USB read failed: %s", err)
+                if err.errno == 19:
+                    # Device has been disconnected, wake up any waiting command
+                    with self.__condition:
+                        self.__running = False
+                        self.disconnected = True
+                        self.__condition.notify_all()
+                else:
+                    sleep(self.__timeout / 1000)
+                continue
+
+            if not isinstance(response, tuple) or response[0] is None:
+                continue
+
+            timestamp = monotonic_ns()
+            app, verb, data = response
+            with self.__condition:
+                if self.__expected == (app, verb):
+                    self.__expected = None
+                    self.__response = data
+                    self.__condition.notify_all()
+                elif app == YardApplications.NIC and verb == YardNICCommands.RECV:
+                    # Answer to the RECV command itself
+                    if data == b"\xC8":
+                        continue
+                    if len(self.__packets) >= self.__max_packets:
+                        self.dropped += 1
+                        continue
+                    self.received += 1
+                    self.__packets.append((timestamp, data))
+                    self.__condition.notify_all()
+                else:
+                    logger.debug("[yardstickone] unexpected response (app=0x%02x, verb=0x%02x)",
+                                 app, verb)
@@ -7,7 +7,7 @@ from whad.dot15d4.stack.mac.constants import MACScanType, MACConstants, MACAddre
     MACDeviceType, MACPowerSource, MACBeaconType, MACAssociationStatus
 from whad.dot15d4.stack.mac.network import Dot15d4PANNetwork
 from whad.dot15d4.stack.mac.energy import EDMeasurement
-from whad.common.stack import Layer, alias, source, state
+from whad.common.stack import Layer, alias, source, state, MessageQueue
 from scapy.layers.dot15d4 import Dot15d4Data, Dot15d4Beacon, Dot15d4Cmd, \
     Dot15d4Ack, Dot15d4, Dot15d4CmdAssocReq, Dot15d4CmdAssocResp
 from whad.exceptions import RequiredImplementation
@@ -819,7 +819,7 @@ class MACManager(Dot15d4Manager):
     def init(self):
         self.add_service("data", MACDataService(self))
         self.add_service("management", MACManagementService(self))
-        self.__ack_queue = Queue()
+        self.__ack_queue = MessageQueue()
         self.__pending_transactions = {}
         # Move it to connector ?
         #self.set_extended_address(self.database.get("macExtendedAddress"))
@@ -866,7 +866,7 @@ class MACManager(Dot15d4Manager):
             if pdu.fcf_frametype == 0x01 or Dot15d4Data in pdu:
                 self.get_service("data").on_data_pdu(pdu)
             elif pdu.fcf_frametype == 0x02 or Dot15d4Ack in pdu:
-                self.__ack_queue.put(pdu, block=True, timeout=None)
+                self.__ack_queue.put(pdu)
                 self.get_service("data").on_ack_pdu(pdu)
             elif pdu.fcf_frametype == 0x03 or Dot15d4Cmd in pdu:
                 self.get_service("management").on_cmd_pdu(pdu)
@@ -922,14 +922,10 @@ class MACManager(Dot15d4Manager):
         """
         if timeout is None:
             timeout = self.database.get("macAckTimeout")
-        start_time = time()
-        while (time() - start_time) < timeout:
-            try:
-                msg = self.__ack_queue.get(block=False,timeout=0.1)
-                return msg
-            except Empty:
-                pass
-        raise MACTimeoutException
+        try:
+            return self.__ack_queue.get(timeout=timeout)
+        except Empty:
+            raise MACTimeoutException
 
     def _choose_pan_id_compression(self, packet, destination_address_mode, source_address_mode):
         if packet.fcf_framever in (0, 1):
@@ -1,7 +1,7 @@
 from whad.dot15d4.exceptions import Dot15d4TimeoutException
 from functools import wraps
-from time import time
-from queue import Queue, Empty
+from queue import Empty
+from whad.common.stack import MessageQueue
 from inspect import signature
 import logging
 
@@ -16,7 +16,7 @@ class Dot15d4Service:
         self._manager = manager
         self._name = name if name is not None else self.__class__.__name__
         self._timeout_exception_class = timeout_exception_class
-        self._queue = Queue()
+        self._queue = MessageQueue()
 
     @property
     def name(self):
@@ -50,7 +50,7 @@ class Dot15d4Service:
         """
         Add an incoming packet to the queue.
         """
-        self._queue.put(packet, block=True, timeout=None)
+        self._queue.put(packet)
 
     def wait_for_packet(self, packet_filter, timeout=1.0):
         """Wait for a specific message type or error, other messages are dropped
@@ -58,15 +58,10 @@ class Dot15d4Service:
         :param type packet_filter: Filtering lambda
         :param float timeout: Timeout value (default: 1 second)
         """
-        start_time = time()
-        while (time() - start_time) < timeout:
-            try:
-                msg = self._queue.get(block=False,timeout=0.1)
-                if packet_filter(msg):
-                    return msg
-            except Empty:
-                pass
-        raise self._timeout_exception_class()
+        try:
+            return self._queue.get(packet_filter, timeout=timeout)
+        except Empty:
+            raise self._timeout_exception_class()
 
 
     # Services primitives decorator
@@ -26,11 +26,40 @@ class ProtocolHub(Registry):
     NAME = 'hub'
     VERSIONS = {}
 
+    # Packet metadata classes and their corresponding domain
+    PACKET_DOMAINS = {}
+
     def __init__(self, proto_version: int):
         """Instantiate a WHAD protocol hub for a specific version.
         """
         self.__version = proto_version
 
+        # Domain factories, created once
+        self.__factories = {}
+
+        # Message classes indexed by domain and message name
+        self.__dispatch = ProtocolHub.get_dispatch_table(proto_version)
+
+    @classmethod
+    def get_dispatch_table(cls, version: int) -> dict:
+        """Build a dispatch table mapping every (domain, message name) pair
+        supported by a protocol version to its message wrapper class.
+
+        Tables are cached in the registry cache, and therefore rebuilt if any
+        message class is registered afterwards.
+        """
+        key = (cls, 'dispatch', version)
+        if key not in Registry.CACHE:
+            dispatch = {}
+            for domain in cls.names(version):
+                domain_clazz = cls.bound(domain, version)
+                if not issubclass(domain_clazz, Registry):
+                    continue
+                for message_name in domain_clazz.names(version):
+                    dispatch[(domain, message_name)] = domain_clazz.bound(message_name, version)
+            Registry.CACHE[key] = dispatch
+        return Registry.CACHE[key]
+
     @property
     def version(self) -> int:
         return self.__version
@@ -64,7 +93,9 @@ class ProtocolHub(Registry):
         return self.get('unifying')
 
     def get(self, factory: str):
-        return ProtocolHub.bound(factory, self.__version)(self.__version)
+        if factory not in self.__factories:
+            self.__factories[factory] = ProtocolHub.bound(factory, self.__version)(self.__version)
+        return self.__factories[factory]
 
     def parse(self, data: Union[Message, bytes]):
         """Parse a serialized WHAD message into an associated object.
@@ -83,42 +114,45 @@ class ProtocolHub(Registry):
         else:
             return None
 
-        # Only process generic messages
-        return ProtocolHub.bound(
-            msg.WhichOneof('msg'),
-            self.__version).parse(self.__version, msg)
+        # Look for the corresponding message class in our dispatch table
+        domain = msg.WhichOneof('msg')
+        if domain is not None:
+            message_clazz = self.__dispatch.get(
+                (domain, getattr(msg, domain).WhichOneof('msg'))
+            )
+            if message_clazz is not None:
+                return message_clazz.parse(self.__version, msg)
+
+        # Not found, rely on the domain parser
+        return ProtocolHub.bound(domain, self.__version).parse(self.__version, msg)
 
     def convert_packet(self, packet):
         """Convert packet to the corresponding message.
         """
-        msg = None
-        # We dispatch packets based on their layers
-        if self.ble.is_packet_compat(packet):
-            logger.debug('[hub] convert_packet(): packet is BLE')
-            msg = self.ble.convert_packet(packet)
-        elif self.dot15d4.is_packet_compat(packet):
-            logger.debug('[hub] convert_packet(): packet is Dot15d4')
-            msg = self.dot15d4.convert_packet(packet)
-        elif self.esb.is_packet_compat(packet):
-            logger.debug('[hub] convert_packet(): packet is ESB')
-            msg = self.esb.convert_packet(packet)
-        elif self.phy.is_packet_compat(packet):
-            logger.debug('[hub] convert_packet(): packet is PHY')
-            msg = self.phy.convert_packet(packet)
-        elif self.unifying.is_packet_compat(packet):
-            logger.debug('[hub] convert_packet(): packet is Unifying')
-            msg = self.unifying.convert_packet(packet)
-        else:
+        # We dispatch packets based on their metadata
+        domain = ProtocolHub.PACKET_DOMAINS.get(type(getattr(packet, 'metadata', None)))
+        if domain is None:
             logger.error('[hub] convert_packet(): packet is unknown !')
+            return None
 
-        return msg
+        logger.debug('[hub] convert_packet(): packet is %s', domain)
+        return self.get(domain).convert_packet(packet)
 
 
 
 from .generic import Generic
 from .discovery import Discovery
-from .ble import BleDomain
-from .dot15d4 import Dot15d4Domain
-from .phy import PhyDomain
-from .esb import EsbDomain
-from .unifying import UnifyingDomain
+from .ble import BleDomain, BLEMetadata
+from .dot15d4 import Dot15d4Domain, Dot15d4Metadata
+from .phy import PhyDomain, PhyMetadata
+from .esb import EsbDomain, ESBMetadata
+from .unifying import UnifyingDomain, UnifyingMetadata
+
+# Packet metadata classes are unique to each domain
+ProtocolHub.PACKET_DOMAINS.update({
+    BLEMetadata: 'ble',
+    Dot15d4Metadata: 'dot15d4',
+    ESBMetadata: 'esb',
+    PhyMetadata: 'phy',
+    UnifyingMetadata: 'unifying',
+})
@@ -1,11 +1,18 @@
 """WHAD protocol message abstraction
 """
 from typing import Any
+from operator import attrgetter
 from whad.protocol.whad_pb2 import Message
 from whad.hub.registry import Registry
 
 class PbField(object):
     """Protocol Buffers field model
+
+    A field model is a descriptor: once declared as a class attribute of a
+    `PbMessageWrapper` subclass, reading or writing the corresponding instance
+    attribute gets or sets the value stored at `path` in the underlying
+    protobuf message. The dotted path is split and resolved once, when the
+    field is declared.
     """
 
     def __init__(self, path: str, field_type, optional=False):
@@ -13,6 +20,14 @@ class PbField(object):
         self.__type = field_type
         self.__optional = optional
 
+        # Pre-resolve accessors for the parent node and the final field
+        path_nodes = path.split('.')
+        self.__leaf = path_nodes[-1]
+        if len(path_nodes) > 1:
+            self.__parent = attrgetter('.'.join(path_nodes[:-1]))
+        else:
+            self.__parent = None
+
     @property
     def path(self):
         return self.__path
@@ -21,6 +36,12 @@ class PbField(object):
     def type(self):
         return self.__type
 
+    @property
+    def name(self):
+        """Name of the final field in the protobuf message
+        """
+        return self.__leaf
+
     def is_optional(self):
         """Determine if this field is optional
         """
@@ -31,6 +52,54 @@ class PbField(object):
         """
         pass
 
+    def get_parent_node(self, message: Message):
+        """Walk to the protobuf node holding this field.
+        """
+        if self.__parent is None:
+            return message
+        try:
+            return self.__parent(message)
+        except AttributeError as err:
+            raise IndexError() from err
+
+    def get_value(self, message: Message):
+        """Get this field value from a protobuf message.
+        """
+        root_node = self.get_parent_node(message)
+        try:
+            if self.__optional and not root_node.HasField(self.__leaf):
+                return None
+            return getattr(root_node, self.__leaf)
+        except (AttributeError, ValueError) as err:
+            raise IndexError() from err
+
+    def set_value(self, message: Message, value):
+        """Set this field value in a protobuf message.
+        """
+        root_node = self.get_parent_node(message)
+        if not hasattr(root_node, self.__leaf):
+            raise IndexError()
+
+        # If we are dealing with a PB array, we cannot set its value but
+        # need to call extend() to add our array items.
+        if isinstance(value, list):
+            getattr(root_node, self.__leaf).extend(value)
+        else:
+            setattr(root_node, self.__leaf, value)
+
+    def __get__(self, instance, owner=None):
+        """Read field value from a wrapper instance, or return the field
+        model itself when accessed from the wrapper class.
+        """
+        if instance is None:
+            return self
+        return self.get_value(instance.message)
+
+    def __set__(self, instance, value):
+        """Write field value into a wrapper instance.
+        """
+        self.set_value(instance.message, value)
+
 class PbFieldInt(PbField):
     """Protocol buffers integer field model
     """
@@ -76,6 +145,15 @@ class PbFieldMsg(PbField):
         """
         super().__init__(path, wrap_class, optional=optional)
 
+    def get_value(self, message: Message):
+        """Get this field value wrapped into its message class.
+        """
+        root_node = self.get_parent_node(message)
+        try:
+            return self.type(getattr(root_node, self.name))
+        except AttributeError as err:
+            raise IndexError() from err
+
 
 class HubMessage(object):
     """Main class from which any ProtocolHub message derives from.
@@ -93,45 +171,12 @@ class HubMessage(object):
     def set_field_value(self, field: PbField, value):
         """Set a message field value.
         """
-        path_nodes = field.path.split('.')
-        root_node = self.message
-        for node in path_nodes[:-1]:
-            root_node = getattr(root_node, node)
-
-        if hasattr(root_node, path_nodes[-1]):
-            # If we are dealing with a PB array, we cannot set its value but
-            # need to call extend() to add our array items.
-            if isinstance(value, list):
-                getattr(root_node, path_nodes[-1]).extend(value)
-            else:
-                setattr(root_node, path_nodes[-1], value)
-        else:
-            raise IndexError()
+        field.set_value(self.message, value)
 
     def get_field_value(self, field: PbField):
         """Get a message field value.
         """
-        # Walk to the penultimate field
-        path_nodes = field.path.split('.')
-        root_node = self.message
-
-        for node in path_nodes[:-1]:
-            if hasattr(root_node, node):
-                root_node = getattr(root_node, node)
-            else:
-                raise IndexError()
-
-        # Return the final field
-        if hasattr(root_node, path_nodes[-1]):
-            if isinstance(field, PbFieldMsg):
-                return field.type(getattr(root_node, path_nodes[-1]))
-            else:
-                if field.is_optional() and not root_node.HasField(path_nodes[-1]):
-                    return None
-                else:
-                    return getattr(root_node, path_nodes[-1])
-        else:
-            raise IndexError()
+        return field.get_value(self.message)
 
     @property
     def message(self):
@@ -167,61 +212,52 @@ class PbMessageWrapper(HubMessage):
     transparently access and updates these fields through simple parameters.
     """
 
-    def __init__(self, message: Message = None, **kwargs):
-        """Initialize a `PbMessageWrapper` object.
+    # PB fields declared by this class, indexed by name
+    _pb_fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """Register PB fields once for every subclass.
 
         This code goes through all the declared properties and finds out the
-        ones based on `PbField` and then automatically binds them to the
-        corresponding parameter name.
+        ones based on `PbField`, in order to bind them to the corresponding
+        parameter name.
         """
-        self.__pb_fields = {}
+        super().__init_subclass__(**kwargs)
+        pb_fields = {}
+        for prop in dir(cls):
+            if not prop.startswith('_'):
+                prop_obj = getattr(cls, prop, None)
+                if isinstance(prop_obj, PbField):
+                    pb_fields[prop] = prop_obj
+        cls._pb_fields = pb_fields
 
+    def __init__(self, message: Message = None, **kwargs):
+        """Initialize a `PbMessageWrapper` object.
+
+        Keyword arguments matching declared PB fields are used to set the
+        corresponding values in the underlying message.
+        """
         # Create our HubMessage
         super().__init__(message=message)
 
-        # Browse our properties and list PB fields
-        for prop in dir(self):
-            if not prop.startswith('_'):
-                try:
-                    prop_obj = getattr(self, prop)
-                    if not callable(prop_obj):
-                        # check field type
-                        if isinstance(prop_obj, PbField):
-                            self.__pb_fields[prop] = prop_obj
-                except AttributeError:
-                    pass
-
         # Override message values with keyword arguments
-        for message_field in kwargs:
-            if message_field in self.__pb_fields:
-                self.set_field_value(self.__pb_fields[message_field], kwargs[message_field])
-
-    def __getattribute__(self, name):
-        """Override the class __getattribute__ function to allow transparent
-        access to protocol buffers fields for the given message and corresponding
-        field paths.
-        """
-        if name.startswith('_'):
-            return object.__getattribute__(self, name)
-        elif name in self.__pb_fields:
-            return self.get_field_value(self.__pb_fields[name])
-        else:
-            return object.__getattribute__(self, name)
+        pb_fields = self._pb_fields
+        for message_field, value in kwargs.items():
+            if message_field in pb_fields:
+                pb_fields[message_field].set_value(self.message, value)
 
     def __setattr__(self, name, value):
         """Set underlying message fields given their paths with a given value.
         """
-        if name.startswith('_'):
-            self.__dict__[name] = value
-        elif name in self.__pb_fields:
-            self.set_field_value(self.__pb_fields[name], value)
+        if name.startswith('_') or name in self._pb_fields:
+            object.__setattr__(self, name, value)
 
     def __repr__(self):
         """Generate a string representation of our message
         """
         fields = []
-        for prop_name in self.__pb_fields:
-            value = self.get_field_value(self.__pb_fields[prop_name])
+        for prop_name, field in self._pb_fields.items():
+            value = field.get_value(self.message)
             if value is not None:
                 fields.append((prop_name, value))
 
@@ -11,6 +11,10 @@ class Registry(object):
 
     VERSIONS = {}
 
+    # Resolved node classes, shared by every registry and flushed each time
+    # a new node class is registered.
+    CACHE = {}
+
     @classmethod
     def add_node_version(parent_class, version: int, name: str, clazz):
         """Add a specific class `clazz` to our message registry for version
@@ -23,21 +27,45 @@ class Registry(object):
         # Add clazz based on provided alias for this version
         parent_class.VERSIONS[version][name] = clazz
 
+        # Resolved classes may have changed
+        Registry.CACHE.clear()
+
     @classmethod
     def bound(parent_class, name: str = None, version: int = 1):
         """Retrieve the given node class `name` for version `version`.
 
         If there is no defined class for version N, look for a corresponding
-        class in version N-1, N-2 until 0.
+        class in version N-1, N-2 until 0. Resolved classes are memoized.
         """
-        # Look for node class from given name and version
-        if version in parent_class.VERSIONS:
+        key = (parent_class, name, version)
+        try:
+            return Registry.CACHE[key]
+        except KeyError:
+            pass
+
+        # Look for node class from given name and version, or in version N-1
+        # if not found for version N
+        for node_version in range(version, 0, -1):
+            nodes = parent_class.VERSIONS.get(node_version)
+            if nodes is not None and name in nodes:
+                Registry.CACHE[key] = nodes[name]
+                return nodes[name]
+
+        # Version 0 (or lower) is only looked up if directly requested
+        if version < 1 and version in parent_class.VERSIONS:
             if name in parent_class.VERSIONS[version]:
                 return parent_class.VERSIONS[version][name]
 
-        if version > 1:
-            # If not found for version N, look for node class in version N-1
-            return parent_class.bound(name, version - 1)
-
         # If not found, raise exception
         raise UnsupportedVersionException(name, version)
+
+    @classmethod
+    def names(parent_class, version: int = 1) -> set:
+        """List the node names available for version `version`, including
+        those inherited from previous versions.
+        """
+        names = set()
+        for node_version, nodes in parent_class.VERSIONS.items():
+            if node_version <= version:
+                names.update(nodes.keys())
+        return names
@@ -18,8 +18,9 @@ from whad.cli.app import CommandLineApp, run_app
 from whad.device.unix import  UnixSocketConnector, UnixConnector, UnixSocketServerDevice
 from whad.device import Bridge
 from whad.hub import ProtocolHub
-from whad.cli.ui import error, success, info, display_packet, format_analyzer_output
+from whad.cli.ui import error, success, info, warning, display_packet, format_analyzer_output
 from whad.tools.utils import get_analyzers
+from whad.common.pipeline import PipelineStage
 
 
 logger = logging.getLogger(__name__)
@@ -73,8 +74,16 @@ def display_analyzers(analyzers: dict):
 class WhadAnalyzeApp(CommandLineApp):
     """
     Main `wanalyze` CLI application class.
+
+    Unless packets are forwarded to another tool, analyzers run in a
+    processing stage with its own thread, so that slow analyzers do not
+    delay the reception of packets. Up to `ANALYSIS_QUEUE_SIZE` packets can
+    wait to be analyzed, then reception waits for the analyzers: packets come
+    from a piped tool, which keeps them until they are read.
     """
 
+    ANALYSIS_QUEUE_SIZE = 65536
+
     def __init__(self):
         """Application uses an interface and has commands.
         """
@@ -155,16 +164,34 @@ class WhadAnalyzeApp(CommandLineApp):
         self.provided_analyzers = []
         self.provided_parameters = {}
         self.selected_analyzers = {}
+        self.analysis_stage = None
 
     def on_packet(self, pkt: Packet, piped: bool = False) -> Union[List[Packet], None]:
         """
         Packet processing callback.
 
+        Packets are queued in the analysis stage if any, or analyzed right away.
+
         :param pkt: Packet to process.
         :type pkt: Packet
         :param piped: `True` if packet comes from a pipe, `False` otherwise.
         :type piped: bool, optional
         """
+        if self.analysis_stage is not None and not piped:
+            self.analysis_stage.put(pkt)
+            return None
+        return self.analyze_packet(pkt, piped=piped)
+
+    def analyze_packet(self, pkt: Packet, piped: bool = False) -> Union[List[Packet], None]:
+        """
+        Process a packet with every selected analyzer, and display their output.
+
+        :param pkt: Packet to process.
+        :type pkt: Packet
+        :param piped: `True` if packet comes from a pipe, `False` otherwise.
+        :type piped: bool, optional
+        :return: Packets marked by a completed analyzer, if piped and `--packets` is set.
+        """
         for analyzer_name, analyzer in self.selected_analyzers.items():
             analyzer.process_packet(pkt)
 
@@ -330,16 +357,29 @@ class WhadAnalyzeApp(CommandLineApp):
                     logger.info("[wanalyze] Starting our output pipe")
                     _ = WhadAnalyzePipe(connector, unix_server, self.on_packet)
                 else:
+                    self.analysis_stage = PipelineStage(
+                        self.analyze_packet,
+                        maxsize=self.ANALYSIS_QUEUE_SIZE,
+                        block=True,
+                        name="wanalyze-analysis"
+                    )
                     connector.on_packet = self.on_packet
                     connector.unlock()
 
                 while interface.opened:
                     sleep(.1)
 
+                # Let analyzers process the remaining packets
+                if self.analysis_stage is not None:
+                    self.analysis_stage.join()
+
         except KeyboardInterrupt:
             # Launch post-run tasks
             self.post_run()
 
+        if self.analysis_stage is not None and self.analysis_stage.dropped > 0:
+            warning(f"{self.analysis_stage.dropped} packets dropped, analyzers too slow")
+
 
 def wanalyze_main():
     """Launcher for wanalyze CLI application.
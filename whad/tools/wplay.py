@@ -40,6 +40,46 @@ class WhadPlayApp(WhadSniffApp):
 
         )
 
+        self.add_argument(
+            "--speed",
+            dest="replay_speed",
+            type=float,
+            default=None,
+            help="Replay speed multiplier"
+        )
+
+        self.add_argument(
+            "--start-time",
+            dest="replay_start_time",
+            type=float,
+            default=None,
+            help="Start replay at this time offset (in seconds) from the first packet"
+        )
+
+        self.add_argument(
+            "--stop-time",
+            dest="replay_stop_time",
+            type=float,
+            default=None,
+            help="Stop replay at this time offset (in seconds) from the first packet"
+        )
+
+        self.add_argument(
+            "--start-packet",
+            dest="replay_start_packet",
+            type=int,
+            default=None,
+            help="Start replay at this packet position (starting from 0)"
+        )
+
+        self.add_argument(
+            "--stop-packet",
+            dest="replay_stop_packet",
+            type=int,
+            default=None,
+            help="Stop replay after this packet position"
+        )
+
         # Initialize PCAP file path.
         self.pcap_file = None
 
@@ -75,7 +115,20 @@ class WhadPlayApp(WhadSniffApp):
     def build_device_path(self):
         """Create our device path based on provided parameters.
         """
-        return "pcap:" + ("flush:" if self.args.flush else "") + self.args.pcap
+        options = []
+        if self.args.flush:
+            options.append("flush")
+        if self.args.replay_speed is not None:
+            options.append(f"speed={self.args.replay_speed}")
+        if self.args.replay_start_time is not None:
+            options.append(f"start={self.args.replay_start_time}")
+        if self.args.replay_stop_time is not None:
+            options.append(f"stop={self.args.replay_stop_time}")
+        if self.args.replay_start_packet is not None or self.args.replay_stop_packet is not None:
+            first = self.args.replay_start_packet or 0
+            last = "" if self.args.replay_stop_packet is None else self.args.replay_stop_packet
+            options.append(f"range={first}-{last}")
+        return "pcap:" + "".join(option + ":" for option in options) + self.args.pcap
 
     def pre_run(self):
         """Pre-run operations: configure scapy theme.
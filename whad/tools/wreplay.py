@@ -266,6 +266,14 @@ class WhadReplayApp(CommandLineApp):
             help='Specify the stop position in the PCAP file'
         )
 
+        self.add_argument(
+            '--start-time',
+            dest='start_time',
+            default=None,
+            type=float,
+            help='Specify the start time in the PCAP file, in seconds from the first packet'
+        )
+
         self.add_argument(
             '-x',
             '--exclude',
@@ -457,18 +465,23 @@ class WhadReplayApp(CommandLineApp):
                         # Prepare the replay instance
                         if replay.prepare(configuration):
                             # Now we can feed our replay instance with packets
+                            # PCAPReader will send back packets in a timely manner,
+                            # according to PCAP timestamps.
+                            reader = PCAPReader(self.args.pcapfile)
+                            start_pos = self.args.start_pos
+                            if self.args.start_time is not None:
+                                start_pos = reader.find(self.args.start_time)
+
                             if self.args.stop_pos >= 0:
-                                count = self.args.stop_pos - self.args.start_pos + 1
+                                count = self.args.stop_pos - start_pos + 1
                             else:
                                 count = None
 
-                            # PCAPReader will send back packets in a timely manner,
-                            # according to PCAP timestamps.
-                            reader = PCAPReader(self.args.pcapfile)
-                            for packet in reader.packets(start=self.args.start_pos, count=count,
+                            for packet in reader.packets(start=start_pos, count=count,
                                                         offset=self.args.offset/1000.,
                                                         exclude=self.args.exclude):
                                 replay.send_packet(packet)
+                            reader.close()
 
                         # Stop our replay instance
                         replay.stop()
@@ -212,6 +212,7 @@ class WhadSniffApp(CommandLineApp):
                         # Stop unix server
                         logger.debug('wsniff: closing device')
                         unix_server.device.close()
+                        self.report_dropped_packets(sniffer)
 
                     else:
                         # Start the sniffer
@@ -223,6 +224,7 @@ class WhadSniffApp(CommandLineApp):
                                 show_metadata = self.args.metadata,
                                 format = self.args.format
                             )
+                        self.report_dropped_packets(sniffer)
 
 
                 else:
@@ -240,12 +242,20 @@ class WhadSniffApp(CommandLineApp):
             self.error("WHAD interface doesn't support the requested frequency.")
         except KeyboardInterrupt:
             self.warning("sniffer stopped (CTRL-C)")
+            self.report_dropped_packets(sniffer)
             sniffer.stop()
             sniffer.close()
             for monitor in monitors:
                 monitor.close()
             sys.exit(1)
 
+    def report_dropped_packets(self, sniffer):
+        """Warn the user if the sniffer dropped some packets.
+        """
+        dropped = getattr(sniffer, "dropped_packets", 0)
+        if dropped > 0:
+            self.warning(f"{dropped} packets dropped, packet processing too slow")
+
     def build_subparsers(self, subparsers):
         """
         Generate the subparsers argument according to the environment.
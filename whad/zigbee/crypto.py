@@ -1,5 +1,8 @@
+from functools import lru_cache
 from whad.zigbee.exceptions import MissingNetworkSecurityHeader
 from Cryptodome.Cipher import AES
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESCCM
 from scapy.layers.dot15d4 import Dot15d4,Dot15d4FCS
 from scapy.layers.zigbee import ZigbeeSecurityHeader,ZigbeeNWK, ZigbeeAppCommandPayload, \
     ZigbeeAppDataPayload, ZigbeeNWKCommandPayload
@@ -18,34 +21,27 @@ def e(key, plaintext):
     return output
 
 def hash(input):
-    output = b"\x00"*16
-    M = input
-    M += b"\x80"
-    while len(M) % 16 != 0:
-        M += b"\x00"
-    M = M[:-2] + bytes([(0xFF & (len(input)*8 >> 8)),(0xFF & (len(input)*8 >> 0))])
-    i = 0
-    while i < len(M):
+    """Matyas-Meyer-Oseas hash function (Zigbee Specification, B.6)
+    """
+    # Pad message with a one bit and zeros, the last two bytes holding its bit length
+    padding = (-(len(input) + 3)) % 16
+    M = input + b"\x80" + b"\x00"*padding + pack(">H", (len(input)*8) & 0xFFFF)
+
+    output = 0
+    for i in range(0, len(M), 16):
         bloc = M[i:i+16]
-        ciphertext = e(bloc,output)
-        output = b""
-        for j in range(len(bloc)):
-            output += bytes([ciphertext[j] ^ bloc[j]])
-        i+=16
-    return output
+        ciphertext = AES.new(output.to_bytes(16, "big"), AES.MODE_ECB).encrypt(bloc)
+        output = int.from_bytes(ciphertext, "big") ^ int.from_bytes(bloc, "big")
+    return output.to_bytes(16, "big")
 
+@lru_cache(maxsize=256)
 def hash_key(key, input):
-    ipad = 0x36
-    opad = 0x5c
-
-    hash_in = hash_out = b""
-    for i in key:
-        hash_in += bytes([opad ^ i])
-        hash_out += bytes([ipad ^ i])
-
-    hash_out += bytes([input])
-    hash_in += hash(hash_out)
-    return hash(hash_in)
+    """Keyed hash function used to derive keys from a link key (Zigbee
+    Specification, B.1.4). Derived keys are cached.
+    """
+    ipad = bytes([0x36 ^ i for i in key])
+    opad = bytes([0x5c ^ i for i in key])
+    return hash(opad + hash(ipad + bytes([input])))
 
 
 class CryptoManager:
@@ -243,9 +239,87 @@ class ApplicationSubLayerCryptoManager(CryptoManager):
         super().__init__(generated_key)
         self.base_class = ZigbeeAppDataPayload
 
+class SecuredFrame:
+    """Secured NWK or APS frame, parsed once from raw bytes so that it can be
+    decrypted with many candidate keys without dissecting or building it again.
+
+    Parsing and CCM* parameters follow :class:`CryptoManager`, including the
+    security level patch (see wireshark source code for details).
+    """
+
+    def __init__(self, packet):
+        # raise MissingNetworkSecurityHeader exception if no security header is found
+        if ZigbeeSecurityHeader not in packet:
+            raise MissingNetworkSecurityHeader()
+
+        security_header = packet[ZigbeeSecurityHeader]
+        self.layer = security_header.underlayer.__class__
+
+        # FCS is not part of the secured layer
+        frame = raw(security_header.underlayer)
+        offset = len(frame) - len(raw(security_header))
+
+        control = frame[offset]
+        self.key_type = (control >> 3) & 0x03
+        self.fc = frame[offset + 1:offset + 5]
+        self.source = frame[offset + 5:offset + 13]
+        self.key_seqnum = security_header.key_seqnum if self.key_type == 1 else None
+        header_length = 5 + (8 if (control >> 5) & 0x01 else 0) + (1 if self.key_type == 1 else 0)
+
+        if control & 0x07 == 0:
+            # Patched security header: MIC-ENC-32
+            control |= 0x05
+        level = CryptoManager.SECURITY_LEVELS[control & 0x07]
+        self.M = level["M"]
+        self.encryption = level["encryption"]
+
+        self.nonce = self.source + self.fc + bytes([control])
+        header = frame[:offset] + bytes([control]) + frame[offset + 1:offset + header_length]
+        payload = frame[offset + header_length:]
+        if self.encryption:
+            self.auth = header
+            self.payload = payload
+        else:
+            self.auth = header + payload[:-self.M]
+            self.payload = payload[-self.M:]
+
+    @property
+    def source_key(self):
+        """Identifier of the key used by the sender of this frame.
+        """
+        return (self.layer, self.source, self.key_type, self.key_seqnum)
+
+    def decrypt(self, cipher):
+        """Decrypt and verify this frame.
+
+        :param cipher: AES-CCM context created with the candidate key and a tag length of M
+        :type cipher: :class:`cryptography.hazmat.primitives.ciphers.aead.AESCCM`
+        :return: Decrypted payload, `None` if integrity check failed.
+        """
+        try:
+            return cipher.decrypt(self.nonce, self.payload, self.auth)
+        except InvalidTag:
+            return None
+
 class ZigbeeDecryptor:
+    """Zigbee NWK and APS decryptor.
+
+    Keys derived from each key (APS key-transport and key-load keys) and AES-CCM
+    contexts are computed once, and the key that decrypted the last frame of a
+    sender is tried first on the following ones.
+    """
+
+    # APS key derivation inputs, key identifier of the security header first
+    APS_KEY_INPUTS = {
+        0: (None, 1, 0, 2),
+        2: (0, 1, 2),
+        3: (2, 1, 0),
+    }
+
     def __init__(self, *keys):
         self.keys = list(keys)
+        self.__ciphers = {}
+        self.__selected_keys = {}
 
     def add_key(self, key):
         if isinstance(key, str):
@@ -265,64 +339,62 @@ class ZigbeeDecryptor:
             return True
         return False
 
+    def __get_cipher(self, key, M):
+        """Return the cached AES-CCM context of a key.
+        """
+        if (key, M) not in self.__ciphers:
+            self.__ciphers[(key, M)] = AESCCM(key, tag_length=M)
+        return self.__ciphers[(key, M)]
+
+    def __candidate_keys(self, frame):
+        """Enumerate keys that may have been used to secure a frame.
+        """
+        if frame.layer == ZigbeeNWK:
+            yield from self.keys
+        else:
+            inputs = self.APS_KEY_INPUTS.get(frame.key_type, (1, 0, 2))
+            for key in self.keys:
+                for input in inputs:
+                    yield key if input is None else hash_key(key, input)
+
+    def __decrypt_frame(self, frame):
+        """Decrypt a secured frame, starting with the key previously used by
+        its sender.
+        """
+        selected = self.__selected_keys.get(frame.source_key)
+        if selected is not None:
+            plaintext = frame.decrypt(self.__get_cipher(selected, frame.M))
+            if plaintext is not None:
+                return plaintext
+
+        for key in self.__candidate_keys(frame):
+            if key == selected:
+                continue
+            plaintext = frame.decrypt(self.__get_cipher(key, frame.M))
+            if plaintext is not None:
+                self.__selected_keys[frame.source_key] = key
+                return plaintext
+        return None
+
     def attempt_to_decrypt(self, packet):
 
-        if ZigbeeSecurityHeader not in packet:
-            raise MissingNetworkSecurityHeader()
+        frame = SecuredFrame(packet)
 
-        if packet[ZigbeeSecurityHeader].underlayer.__class__ == ZigbeeNWK:
-            for key in self.keys:
-                manager = NetworkLayerCryptoManager(key)
-                decrypted, success = manager.decrypt(packet)
-                if success:
-                    if packet.frametype == 0:
-                        return ZigbeeAppDataPayload(decrypted.data), True
-                    elif packet.frametype == 1:
-                        return ZigbeeNWKCommandPayload(decrypted.data), True
-                    else:
-                        return decrypted.data, True
-        else:
-            for key in self.keys:
-                manager = ApplicationSubLayerCryptoManager(key, 1)
-                decrypted, success = manager.decrypt(packet)
-                if success:
-                    if packet.frametype == 0:
-                        if packet.aps_frametype == 0:
-                            return ZigbeeAppDataPayload(decrypted.data), True
-                        else:
-                            return ZigbeeAppCommandPayload(decrypted.data), True
-                    elif packet.frametype == 1:
-                        return ZigbeeNWKCommandPayload(decrypted.data), True
-                    else:
-                        return decrypted.data, True
-
-                manager = ApplicationSubLayerCryptoManager(key, 0)
-                decrypted, success = manager.decrypt(packet)
-                if success:
-                    if packet.frametype == 0:
-                        if packet.aps_frametype == 0:
-                            return ZigbeeAppDataPayload(decrypted.data), True
-                        else:
-                            return ZigbeeAppCommandPayload(decrypted.data), True
-                    elif packet.frametype == 1:
-                        return ZigbeeNWKCommandPayload(decrypted.data), True
-                    else:
-                        return decrypted.data, True
-
-                manager = ApplicationSubLayerCryptoManager(key, 2)
-                decrypted, success = manager.decrypt(packet)
-                if success:
-                    if packet.frametype == 0:
-                        if packet.aps_frametype == 0:
-                            return ZigbeeAppDataPayload(decrypted.data), True
-                        else:
-                            return ZigbeeAppCommandPayload(decrypted.data), True
-                    elif packet.frametype == 1:
-                        return ZigbeeNWKCommandPayload(decrypted.data), True
-                    else:
-                        return decrypted.data, True
-
-        return packet, False
+        # Key cannot be checked without MIC
+        if frame.M == 0:
+            return packet, False
+
+        plaintext = self.__decrypt_frame(frame)
+        if plaintext is None:
+            return packet, False
+
+        if packet.frametype == 0:
+            if frame.layer == ZigbeeNWK or packet.aps_frametype == 0:
+                return ZigbeeAppDataPayload(plaintext), True
+            return ZigbeeAppCommandPayload(plaintext), True
+        elif packet.frametype == 1:
+            return ZigbeeNWKCommandPayload(plaintext), True
+        return plaintext, True
 
 
 ZIGBEE_ZLL_KEYS = {